@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 import os
 import glob
+import argparse
 import numpy as np
+import pandas as pd
 import xarray as xr
 
+from common.netcdf_stream_writer import NetCDFStreamWriter
+from common.streaming_aggregator import TimeBinAccumulator, month_bin
+from common.domain import get_domain
+
 # Constants
-LON_MIN, LON_MAX = 6, 20
-LAT_MIN, LAT_MAX = 32, 49
+DOMAIN = get_domain()
+LON_MIN, LON_MAX = DOMAIN.lon_min, DOMAIN.lon_max
+LAT_MIN, LAT_MAX = DOMAIN.lat_min, DOMAIN.lat_max
 NEW_RESOLUTION_LAT = 0.1
 NEW_RESOLUTION_LON = 0.1
 
@@ -15,6 +22,7 @@ SUBSET_DIR = "./data/CMSAF_SAL_daily_subset"
 OUTPUT_DIR = "./data/CMSAF_SAL_Monthly"
 OUTPUT_FILE = "SAL_IT_2011_2023_Monthly_CMSAF.nc"
 VARS_TO_KEEP = ['time', 'lon', 'lat', 'black_sky_albedo_all_mean', 'black_sky_albedo_all_std']
+DATA_VARS = ['black_sky_albedo_all_mean', 'black_sky_albedo_all_std']
 
 
 def find_nearest_index(coord_array, value):
@@ -22,8 +30,8 @@ def find_nearest_index(coord_array, value):
     return int(np.abs(coord_array - value).argmin())
 
 
-def subset_dataset(ds, input_file):
-    """Subsets the dataset and saves the subset to SUBSET_DIR."""
+def subset_dataset(ds, input_file, write_subset=False):
+    """Subsets the dataset and, if requested, saves the subset to SUBSET_DIR."""
     lats = ds['lat'].values
     lons = ds['lon'].values
 
@@ -40,10 +48,11 @@ def subset_dataset(ds, input_file):
 
     ds_subset = ds_subset[VARS_TO_KEEP]
 
-    subset_filename = os.path.basename(input_file).replace(".nc", "_subset.nc")
-    subset_filepath = os.path.join(SUBSET_DIR, subset_filename)
-    ds_subset.to_netcdf(subset_filepath)
-    print(f"Subset file created: {subset_filepath}")
+    if write_subset:
+        subset_filename = os.path.basename(input_file).replace(".nc", "_subset.nc")
+        subset_filepath = os.path.join(SUBSET_DIR, subset_filename)
+        ds_subset.to_netcdf(subset_filepath)
+        print(f"Subset file created: {subset_filepath}")
 
     return ds_subset
 
@@ -60,12 +69,12 @@ def interpolate_dataset(ds):
     return ds_regrid
 
 
-def process_file(input_file):
+def process_file(input_file, write_subset=False):
     """Opens, subsets, and interpolates a NetCDF file."""
     print(f"Processing file: {input_file}")
     try:
         ds = xr.open_dataset(os.path.join(DATA_DIR, input_file))
-        ds_subset = subset_dataset(ds, input_file)
+        ds_subset = subset_dataset(ds, input_file, write_subset)
         ds_regrid = interpolate_dataset(ds_subset)
         ds.close()  # Close the original dataset after subsetting
         return ds_regrid
@@ -76,36 +85,62 @@ def process_file(input_file):
         return None
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Subset, regrid and stream CMSAF SAL files into one NetCDF.')
+    parser.add_argument('--monthly', action='store_true',
+                        help='Reduce the input time steps to monthly means before writing')
+    parser.add_argument('--write-subsets', action='store_true',
+                        help=f'Also save the spatial subset of every input file to {SUBSET_DIR}')
+    return parser.parse_args()
+
+
 def main():
     """Main processing function."""
-    os.makedirs(SUBSET_DIR, exist_ok=True)
+    args = parse_args()
+    if args.write_subsets:
+        os.makedirs(SUBSET_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    interpolated_datasets = []
+    output_filepath = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
+    writer = NetCDFStreamWriter(output_filepath, variables=DATA_VARS)
+    accumulator = TimeBinAccumulator(variables=DATA_VARS, bin_func=month_bin) if args.monthly else None
 
-    for input_file in glob.glob(os.path.join(DATA_DIR, "*.nc")):
-        input_file = os.path.basename(input_file)
-        interpolated_ds = process_file(input_file)
-        if interpolated_ds is not None:
-            interpolated_datasets.append(interpolated_ds)
+    # Input files are named by date, so sorting them keeps the appended time axis ordered.
+    # Each regridded file is written (or folded into its month) and released before the next one is opened.
+    try:
+        for input_file in sorted(glob.glob(os.path.join(DATA_DIR, "*.nc"))):
+            input_file = os.path.basename(input_file)
+            interpolated_ds = process_file(input_file, args.write_subsets)
+            if interpolated_ds is None:
+                continue
+
+            if accumulator is None:
+                writer.append(interpolated_ds)
+            else:
+                # Months before the earliest one in this file can no longer receive data: flush them
+                first_bin = month_bin(pd.Timestamp(interpolated_ds['time'].values.min()))
+                completed = [label for label in accumulator.labels() if label < first_bin]
+                if completed:
+                    writer.append(accumulator.pop(completed))
+                accumulator.add(interpolated_ds)
+            interpolated_ds.close()
+
+        if accumulator is not None and accumulator.labels():
+            writer.append(accumulator.pop(accumulator.labels()))
+    except Exception as e:
+        print(f"Error streaming to {output_filepath}: {e}")
+        writer.abort()
+        return
 
-    if interpolated_datasets:
-        try:
-            ds_concat = xr.concat(interpolated_datasets, dim='time')
-            output_filepath = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-            ds_concat.to_netcdf(output_filepath)
-            ds_concat.close()
+    if writer.n_times == 0:
+        writer.abort()
+        print("No files to write found or errors occurred during processing.")
+        return
 
-            print(f"Output file created: {output_filepath}")
-            print(f"Output file size: {os.path.getsize(output_filepath)} bytes")
-        except Exception as e:
-            print(f"Error concatenating and saving: {e}")
-        finally:  # Ensure datasets are closed even if concatenation fails
-            for ds in interpolated_datasets:
-                ds.close()
-    else:
-        print("No files to concatenate found or errors occurred during processing.")
+    writer.close()
+    print(f"Output file created: {output_filepath} ({writer.n_times} time steps)")
+    print(f"Output file size: {os.path.getsize(output_filepath)} bytes")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,7 @@
 import  os
-import cdsapi
+
+from common.domain import get_domain
+from common.download_manager import download_split, merge_netcdf_parts
 
 OUTPUT_DIR = "./data/ERA5_SAL_Monthly"
 OUTPUT_FILE = "SAL_IT_2011_2023_Monthly_ERA5.nc"
@@ -9,18 +11,13 @@ ERA5_END_YEAR = 2024
 ERA5_MONTHS = ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12']
 ERA5_ID = "reanalysis-era5-land-monthly-means"
 
-LON_MIN = 6
-LON_MAX = 20
-LAT_MIN = 32
-LAT_MAX =49
-
-def get_cdsapi_client():
-    client = cdsapi.Client()
-    return client
+DOMAIN = get_domain()
+LON_MIN = DOMAIN.lon_min
+LON_MAX = DOMAIN.lon_max
+LAT_MIN = DOMAIN.lat_min
+LAT_MAX = DOMAIN.lat_max
 
 def download_era5(target_file: str):
-    client = get_cdsapi_client()
-
     request = {
         'product_type': 'monthly_averaged_reanalysis',
         'variable': ['forecast_albedo'],
@@ -31,7 +28,8 @@ def download_era5(target_file: str):
         "data_format": "netcdf",
         "download_format": "unarchived",
     }
-    client.retrieve(ERA5_ID, request, target_file)
+    # One request per variable and year, submitted concurrently and merged back into one file
+    download_split(ERA5_ID, request, target_file, merge=merge_netcdf_parts)
 
 if __name__ == "__main__":
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -4,6 +4,8 @@ import xarray as xr
 import numpy as np
 from datetime import datetime, timezone
 
+from common.cf_update import CFUpdatePlan, apply_cf_update
+
 # File paths
 INPUT_FILE = "./data/SAL_Monthly_2011-2023/SAL_IT_2011-2023_Monthly_CMSAF_ERA5.nc"
 OUTPUT_DIR = "./data/SAL_Monthly_2011-2023_CF_Compliant"
@@ -140,11 +142,13 @@ def process_to_cf_compliant(input_file, output_path):
     """
     Open dataset, make CF-1.8 compliant, and save
     """
+    renames = {"lat": 'latitude', "lon": 'longitude'}
+
     # Open dataset
-    ds = xr.open_dataset(input_file, decode_cf=True)
+    source_ds = xr.open_dataset(input_file, decode_cf=True)
 
     # Rename lat and lon
-    ds = ds.rename({"lat": 'latitude', "lon": 'longitude'})
+    ds = source_ds.rename({k: v for k, v in renames.items() if k in source_ds.variables})
 
     # Make CF-1.8 compliant
     ds_cf = make_cf_compliant(ds)
@@ -152,10 +156,18 @@ def process_to_cf_compliant(input_file, output_path):
     # Create output directory if needed
     os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
-    encoding = {var: {"zlib": True, "complevel": 4} for var in ds.data_vars}
+    # Attribute-only changes are applied to a copy of the file; a dtype or time encoding change forces a rewrite
+    plan = CFUpdatePlan.from_dataset(
+        ds_cf,
+        renames=renames,
+        time_encoding={k: ds_cf['time'].encoding[k] for k in ('units', 'calendar', 'dtype')},
+        dtypes={coord: ds_cf[coord].encoding['dtype'] for coord in ('latitude', 'longitude')},
+        compression={"zlib": True, "complevel": 4},
+    )
+    source_ds.close()
 
-    # Save CF-compliant dataset
-    ds_cf.to_netcdf(output_path, encoding=encoding)
+    report = apply_cf_update(input_file, output_path, plan)
+    print(report)
 
     print(f"Successfully created CF-1.8 compliant file: {output_path}")
     print(f"Time coverage: {ds_cf.time.min().values} to {ds_cf.time.max().values}")
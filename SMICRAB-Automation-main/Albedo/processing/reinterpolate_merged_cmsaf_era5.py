@@ -4,6 +4,8 @@ import numpy as np
 import xarray as xr
 import pandas as pd
 
+from common.zarr_store import export_zarr
+
 # File paths
 INPUT_FILE = "./data/SAL_Monthly_2011-2023_CF_Compliant/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8.nc"
 OUTPUT_DIR = "./data/SAL_Monthly_2011-2023_CF_Compliant"
@@ -18,6 +20,7 @@ def reinterpolate(input_file, output_file):
 
     filled_ds = ds.interpolate_na(dim="time", method="linear")
     filled_ds.to_netcdf(output_file)
+    export_zarr(output_file)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ SKIP_ERA5_DOWNLOAD=false
 SKIP_CMSAF_DOWNLOAD=false
 GENERATE_CSV=false # Default: do not generate CSV
 PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"  # Get project root
+RUN_OPTIONS="$*"  # Options of the run, recorded in the run manifest
 ALBEDO_DIR="$PROJECT_ROOT/Albedo"
 DATA_DIR="$ALBEDO_DIR/data"  # Data directory under Albedo
 LOG_DIR="$ALBEDO_DIR/logs"   # Log directory under Albedo
@@ -73,11 +74,41 @@ check_file() {
     fi
 }
 
-# Function to check missing values in NetCDF files
+# Run a step through the stage cache (common/stage_cache.py), which skips it when its inputs,
+# code and parameters are unchanged since it wrote its outputs; SMICRAB_STAGE_CACHE=off always runs
+# Usage: run_stage <name> [--input PATH]... [--output PATH]... -- <command>
+run_stage() {
+    local name="$1"
+    shift
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.stage_cache \
+        --cache "$DATA_DIR/stage_cache.json" --name "$name" \
+        --manifest "$DATA_DIR/run_manifest.json" "$@"
+}
+
+# Start the run manifest, data/run_manifest.json (common/run_manifest.py): the stages run through
+# run_stage add their timings, peak memory and file hashes to it, and it is closed with the exit
+# status of the script
+start_run_manifest() {
+    if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest begin "$DATA_DIR/run_manifest.json" \
+            --pipeline Albedo --param "options=$RUN_OPTIONS"; then
+        log "WARNING: Could not start the run manifest"
+    fi
+    trap 'finish_run_manifest $?' EXIT
+}
+
+finish_run_manifest() {
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest finish "$DATA_DIR/run_manifest.json" \
+        --exit-code "$1" | tee -a "$LOG_DIR/albedo_processing.log"
+}
+
+# Function to check missing values in NetCDF files; the QC reports (common/qc_census.py) are
+# written to data/qc/<file>.qc.json and <file>.qc.nc
 check_missing_values() {
     local file_path="$1"
     log "Checking missing values in $file_path"
-    if ! python3 "$ALBEDO_DIR/processing/check_missing_values.py" "$file_path" | tee -a "$LOG_DIR/albedo_processing.log"; then
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.qc_census --qc-dir "$DATA_DIR/qc" \
+        "$file_path" | tee -a "$LOG_DIR/albedo_processing.log"
+    if [ "${PIPESTATUS[0]}" -ne 0 ]; then
         log "ERROR: Failed to check missing values in $file_path"
         exit 1
     fi
@@ -89,6 +120,7 @@ main() {
     touch "$LOG_DIR/albedo_processing.log"
 
     log "Starting Albedo Data Processing Workflow"
+    start_run_manifest
 
     # Step 1: Add CDSAPI config if not exists in home directory
     log "Checking CDSAPI configuration in $HOME/.cdsapirc"
@@ -112,7 +144,9 @@ main() {
     if [ "$SKIP_ERA5_DOWNLOAD" = false ]; then
         log "Starting ERA5 Download"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$ALBEDO_DIR/processing/era5_sal_download.py"; then
+        if ! run_stage era5_download \
+                --output "$DATA_DIR/ERA5_SAL_Monthly/SAL_IT_2011_2023_Monthly_ERA5.nc" \
+                -- python3 "$ALBEDO_DIR/processing/era5_sal_download.py"; then
             log "ERROR: ERA5 Download failed"
             exit 1
         fi
@@ -155,9 +189,9 @@ main() {
             log "Directory $CMSAF_EXTRACT_DIR already exists. Skipping creation."
         fi
 
-        # Extract CMSAF zip file with progress
+        # Extract the NetCDF members that are missing or changed
         log "Starting CMSAF Zip File Extraction..."
-        if ! unzip -o "$CMSAF_ZIP_FILE" -d "$CMSAF_EXTRACT_DIR"; then
+        if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.zip_extract "$CMSAF_ZIP_FILE" "$CMSAF_EXTRACT_DIR"; then
             log "ERROR: Failed to extract CMSAF zip file to $CMSAF_EXTRACT_DIR"
             exit 1
         fi
@@ -172,7 +206,11 @@ main() {
 
     # Step 6: Run CMSAF Processing Script
     log "Starting CMSAF Processing Script"
-    if ! python3 "$ALBEDO_DIR/processing/cmsaf_sal_processing.py"; then
+    export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+    if ! run_stage cmsaf_processing \
+            --input "$DATA_DIR/CMSAF_SAL_daily" \
+            --output "$DATA_DIR/CMSAF_SAL_Monthly/SAL_IT_2011_2023_Monthly_CMSAF.nc" \
+            -- python3 "$ALBEDO_DIR/processing/cmsaf_sal_processing.py"; then
         log "ERROR: CMSAF Processing failed"
         exit 1
     fi
@@ -187,16 +225,24 @@ main() {
 
     # Step 8: Run Merge Script
     log "Starting Albedo Datasets Merging"
-    if ! python3 "$ALBEDO_DIR/processing/merge_cmsaf_with_era5_sal.py"; then
+    if ! run_stage merge \
+            --input "$DATA_DIR/CMSAF_SAL_Monthly/SAL_IT_2011_2023_Monthly_CMSAF.nc" \
+            --input "$DATA_DIR/ERA5_SAL_Monthly/SAL_IT_2011_2023_Monthly_ERA5.nc" \
+            --output "$DATA_DIR/SAL_Monthly_2011-2023/SAL_IT_2011-2023_Monthly_CMSAF_ERA5.nc" \
+            -- python3 "$ALBEDO_DIR/processing/merge_cmsaf_with_era5_sal.py"; then
         log "ERROR: Albedo Datasets Merging failed"
         exit 1
     fi
     log "Albedo Datasets Merging completed successfully"
-    check_file "$DATA_DIR/SAL_Monthly_2011-2023/SAL_IT_2011-2023_Monthly_CMSAF_ERA5.nc"
+    # No check_file of the merged file: run_stage fails a step that did not write its outputs,
+    # and data directories from older runs may only have its CF-1.8 copy
 
     # Step 9: Run CF Compliance Script
     log "Starting CF-1.8 Compliance Processing"
-    if ! python3 "$ALBEDO_DIR/processing/make_sal_cf_compliant.py"; then
+    if ! run_stage cf_compliance \
+            --input "$DATA_DIR/SAL_Monthly_2011-2023/SAL_IT_2011-2023_Monthly_CMSAF_ERA5.nc" \
+            --output "$DATA_DIR/SAL_Monthly_2011-2023_CF_Compliant/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8.nc" \
+            -- python3 "$ALBEDO_DIR/processing/make_sal_cf_compliant.py"; then
         log "ERROR: CF-1.8 Compliance Processing failed"
         exit 1
     fi
@@ -206,7 +252,10 @@ main() {
 
     # Step 10: Run Reinterpolation Script
     log "Starting Reinterpolation Processing"
-    if ! python3 "$ALBEDO_DIR/processing/reinterpolate_merged_cmsaf_era5.py"; then
+    if ! run_stage reinterpolation \
+            --input "$DATA_DIR/SAL_Monthly_2011-2023_CF_Compliant/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8.nc" \
+            --output "$DATA_DIR/SAL_Monthly_2011-2023_CF_Compliant/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8_Reinterpolated.nc" \
+            -- python3 "$ALBEDO_DIR/processing/reinterpolate_merged_cmsaf_era5.py"; then
         log "ERROR: Reinterpolation Processing failed"
         exit 1
     fi
@@ -217,7 +266,10 @@ main() {
     if [ "$GENERATE_CSV" = true ]; then
         log "Starting CSV Generation from processed data"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$ALBEDO_DIR/processing/albedo_generate_csv.py"; then # Assuming albedo_generate_csv.py exists
+        if ! run_stage csv \
+                --input "$DATA_DIR/SAL_Monthly_2011-2023_CF_Compliant/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8_Reinterpolated.nc" \
+                --output "$DATA_DIR/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8_Reinterpolated.csv" \
+                -- python3 "$ALBEDO_DIR/processing/albedo_generate_csv.py"; then # Assuming albedo_generate_csv.py exists
             log "ERROR: CSV Generation failed"
             exit 1
         fi
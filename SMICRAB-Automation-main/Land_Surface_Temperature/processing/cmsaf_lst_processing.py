@@ -5,10 +5,13 @@ import numpy as np
 import xarray as xr
 from scipy.ndimage import distance_transform_edt, zoom
 
+from common.domain import get_domain
+
 
 # Constants
-LON_MIN, LON_MAX = 6, 20
-LAT_MIN, LAT_MAX = 32, 49
+DOMAIN = get_domain()
+LON_MIN, LON_MAX = DOMAIN.lon_min, DOMAIN.lon_max
+LAT_MIN, LAT_MAX = DOMAIN.lat_min, DOMAIN.lat_max
 NEW_RESOLUTION_LAT = 0.1
 NEW_RESOLUTION_LON = 0.1
 
@@ -1,13 +1,16 @@
 import os
 import glob
 import numpy as np
-import pandas as pd
 import xarray as xr
 from scipy.ndimage import distance_transform_edt, zoom
 
+from common.streaming_aggregator import TimeBinAccumulator, month_hour_bin
+from common.domain import get_domain
+
 # Constants
-LON_MIN, LON_MAX = 6, 20
-LAT_MIN, LAT_MAX = 32, 49
+DOMAIN = get_domain()
+LON_MIN, LON_MAX = DOMAIN.lon_min, DOMAIN.lon_max
+LAT_MIN, LAT_MAX = DOMAIN.lat_min, DOMAIN.lat_max
 NEW_RESOLUTION_LAT = 0.1
 NEW_RESOLUTION_LON = 0.1
 
@@ -150,62 +153,49 @@ def main():
     os.makedirs(SUBSET_HOURLY_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    interpolated_datasets = []
-    for input_file in glob.glob(os.path.join(DATA_DIR, "*.nc")):
+    # Fold every hourly file into running (year, month, hour) sum/count grids as soon as it
+    # is interpolated, so memory stays O(grid x 24 x months) instead of O(all hourly fields).
+    accumulator = TimeBinAccumulator(variables=['LST'], bin_func=month_hour_bin)
+    for input_file in sorted(glob.glob(os.path.join(DATA_DIR, "*.nc"))):
         input_file = os.path.basename(input_file)
         interpolated_ds = process_file(input_file)
         if interpolated_ds is not None:
-            interpolated_datasets.append(interpolated_ds)
-
-    if interpolated_datasets:
-        try:
-            # Concatenate along time and sort chronologically
-            ds_concat = xr.concat(interpolated_datasets, dim='time')
-            ds_concat = ds_concat.sortby('time')
-
-            # -----------------------------------------------------------
-            # Create a new time coordinate: For each timestamp, create a new datetime
-            # with the same year and month, day fixed to 01, and the original hour (minute/second = 00)
-            # This new time coordinate represents the monthly mean for that hour.
-            # -----------------------------------------------------------
-            time_index = pd.to_datetime(ds_concat.time.values)
-            new_times = [np.datetime64(pd.Timestamp(t.year, t.month, 1, t.hour, 0, 0))
-                         for t in time_index]
-            ds_concat = ds_concat.assign_coords(new_time=("time", new_times))
-
-            # Group by the new time coordinate and compute the mean over the original time dimension.
-            ds_agg = ds_concat.groupby("new_time").mean("time", skipna=True).rename({"new_time": "time"})
-            ds_agg = ds_agg.sortby("time")
-
-            # Fill missing on land only
-            ds_filled = fill_missing_on_land_only(ds_agg)
-
-            # -----------------------------------------------------------
-            # Optional: Rebase the time coordinate to "seconds since 1970-01-01" if required
-            # -----------------------------------------------------------
-            original_times = ds_filled['time'].values.astype('datetime64[s]')
-            reference_time = np.datetime64('1970-01-01T00:00:00')
-            time_seconds = (original_times - reference_time).astype('float64')
-            ds_filled['time'] = ('time', time_seconds)
-            ds_filled['time'].attrs.update({
-                'units': 'seconds since 1970-01-01 00:00:00',
-                'calendar': 'standard'
-            })
-
-
-            # Save the aggregated dataset
-            output_filepath = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-            ds_filled.to_netcdf(output_filepath)
-            ds_filled.close()
-
-            print(f"Monthly per hour aggregated file created: {output_filepath}")
-        except Exception as e:
-            print(f"Error aggregating and saving: {e}")
-        finally:
-            for ds in interpolated_datasets:
-                ds.close()
-    else:
-        print("No files to concatenate found.")
+            accumulator.add(interpolated_ds)
+            interpolated_ds.close()
+
+    if accumulator.n_slices == 0:
+        print("No files to aggregate found.")
+        return
+
+    try:
+        # Each bin is stamped with the same year and month, day fixed to 01, and the original
+        # hour: it represents the monthly mean for that hour.
+        ds_agg = accumulator.to_dataset()
+
+        # Fill missing on land only
+        ds_filled = fill_missing_on_land_only(ds_agg)
+
+        # -----------------------------------------------------------
+        # Optional: Rebase the time coordinate to "seconds since 1970-01-01" if required
+        # -----------------------------------------------------------
+        original_times = ds_filled['time'].values.astype('datetime64[s]')
+        reference_time = np.datetime64('1970-01-01T00:00:00')
+        time_seconds = (original_times - reference_time).astype('float64')
+        ds_filled['time'] = ('time', time_seconds)
+        ds_filled['time'].attrs.update({
+            'units': 'seconds since 1970-01-01 00:00:00',
+            'calendar': 'standard'
+        })
+
+        # Save the aggregated dataset
+        output_filepath = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
+        ds_filled.to_netcdf(output_filepath)
+        ds_filled.close()
+
+        print(f"Aggregated {accumulator.n_slices} hourly fields into {len(accumulator.labels())} monthly-per-hour steps")
+        print(f"Monthly per hour aggregated file created: {output_filepath}")
+    except Exception as e:
+        print(f"Error aggregating and saving: {e}")
 
 if __name__ == "__main__":
     main()
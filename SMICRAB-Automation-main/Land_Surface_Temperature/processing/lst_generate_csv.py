@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import os
-import xarray as xr
+import sys
+import argparse
+
+from common.csv_export import export_csv
 
 # Constants
 INPUT_FILE = "./data/LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.nc"
@@ -10,24 +13,23 @@ OUTPUT_FILE = "LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.csv"
 
 def main():
     """Main function for Generating CSV File."""
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    output_file = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-
-    ds = xr.open_dataset(INPUT_FILE)
+    parser = argparse.ArgumentParser(description='Export the product to CSV, sorted by longitude, latitude and time.')
+    parser.add_argument('--gzip', action='store_true', help='Write a gzip-compressed .csv.gz file instead')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes formatting rows')
+    args = parser.parse_args()
 
-    # Convert to DataFrame - this creates a row for each combination
-    df = ds.to_dataframe().reset_index()
-
-    # Reorder the columns and sort values to match your desired structure
-    df = df[['time', 'latitude', 'longitude'] + [v for v in ds.data_vars]]
-    df = df.sort_values(['longitude', 'latitude', 'time'])
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, OUTPUT_FILE) + (".gz" if args.gzip else "")
 
-    # Save to CSV
-    df.to_csv(output_file, index=False)
+    # Streamed a block of longitudes at a time, in the (longitude, latitude, time) order
+    try:
+        export_csv(INPUT_FILE, output_file, workers=args.workers)
+    except Exception as e:
+        print(f"Error generating {output_file}: {str(e)}")
+        sys.exit(1)
 
     print(f'CSV files Saved in {output_file}')
 
 
-
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,6 +3,9 @@ import xarray as xr
 import numpy as np
 from datetime import datetime, timezone
 
+from common.cf_update import CFUpdatePlan, apply_cf_update
+from common.zarr_store import export_zarr
+
 INPUT_FILE = "./data/LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour.nc"
 OUTPUT_DIR = "./data/LST_Monthly_Per_Hour_2011-2023"
 OUTPUT_FILE = "LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.nc"
@@ -144,11 +147,13 @@ def process_to_cf_compliant(input_file, output_path):
     """
     Open dataset, make CF-1.8 compliant, and save
     """
+    renames = {"lat": 'latitude', "lon": 'longitude'}
+
     # Open dataset
-    ds = xr.open_dataset(input_file)
+    source_ds = xr.open_dataset(input_file)
 
     # Rename lat and lon
-    ds = ds.rename({"lat": 'latitude', "lon": 'longitude'})
+    ds = source_ds.rename({k: v for k, v in renames.items() if k in source_ds.variables})
 
     # Make CF-1.8 compliant
     ds_cf = make_cf_compliant(ds)
@@ -156,11 +161,20 @@ def process_to_cf_compliant(input_file, output_path):
     # Create output directory if needed
     os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
-    encoding = {var: {"zlib": True, "complevel": 4} for var in ds.data_vars}
-    # Save CF-compliant dataset
-    ds_cf.to_netcdf(output_path, encoding=encoding)
+    # Attribute-only changes are applied to a copy of the file; a dtype or time encoding change forces a rewrite
+    plan = CFUpdatePlan.from_dataset(
+        ds_cf,
+        renames=renames,
+        time_encoding={k: ds_cf['time'].encoding[k] for k in ('units', 'calendar', 'dtype')},
+        dtypes={coord: ds_cf[coord].encoding['dtype'] for coord in ('latitude', 'longitude')},
+        compression={"zlib": True, "complevel": 4},
+    )
+    source_ds.close()
+    report = apply_cf_update(input_file, output_path, plan)
+    print(report)
 
     print(f"Successfully created CF-1.8 compliant file: {output_path}")
+    export_zarr(output_path)
     # print(f"Time coverage: {ds_cf.time.min().values} to {ds_cf.time.max().values}")
 
 if __name__ == "__main__":
@@ -4,6 +4,8 @@
 SKIP_EUMETSAT_DOWNLOAD=false
 SKIP_CMSAF_DOWNLOAD=false
 GENERATE_CSV=false # Default: do not generate CSV
+PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"  # Get project root
+RUN_OPTIONS="$*"  # Options of the run, recorded in the run manifest
 DATA_DIR="data"  # Define the data directory
 LOG_DIR="logs"  # Log directory inside the data directory
 
@@ -71,12 +73,40 @@ check_file() {
     fi
 }
 
+# Run a step through the stage cache (common/stage_cache.py), which skips it when its inputs,
+# code and parameters are unchanged since it wrote its outputs; SMICRAB_STAGE_CACHE=off always runs
+# Usage: run_stage <name> [--input PATH]... [--output PATH]... -- <command>
+run_stage() {
+    local name="$1"
+    shift
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.stage_cache \
+        --cache "$DATA_DIR/stage_cache.json" --name "$name" \
+        --manifest "$DATA_DIR/run_manifest.json" "$@"
+}
+
+# Start the run manifest, data/run_manifest.json (common/run_manifest.py): the stages run through
+# run_stage add their timings, peak memory and file hashes to it, and it is closed with the exit
+# status of the script
+start_run_manifest() {
+    if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest begin "$DATA_DIR/run_manifest.json" \
+            --pipeline Land_Surface_Temperature --param "options=$RUN_OPTIONS"; then
+        log "WARNING: Could not start the run manifest"
+    fi
+    trap 'finish_run_manifest $?' EXIT
+}
+
+finish_run_manifest() {
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest finish "$DATA_DIR/run_manifest.json" \
+        --exit-code "$1" | tee -a "$LOG_DIR/processing.log"
+}
+
 # Main processing script
 main() {
     # Create log file
     touch "$LOG_DIR/processing.log"
 
     log "Starting Land Surface Temperature Data Processing Workflow"
+    start_run_manifest
 
     # Step 1: Download CMSAF LST zip file (optional)
     if [ "$SKIP_CMSAF_DOWNLOAD" = false ]; then
@@ -111,9 +141,9 @@ main() {
             log "Directory $CMSAF_LST_EXTRACT_DIR already exists. Skipping creation."
         fi
 
-        # Extract CMSAF LST zip file with progress
+        # Extract the NetCDF members that are missing or changed
         log "Starting CMSAF LST Zip File Extraction..."
-        if ! unzip -o "$CMSAF_LST_ZIP_FILE" -d "$CMSAF_LST_EXTRACT_DIR"; then
+        if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.zip_extract "$CMSAF_LST_ZIP_FILE" "$CMSAF_LST_EXTRACT_DIR"; then
             log "ERROR: Failed to extract CMSAF LST zip file to $CMSAF_LST_EXTRACT_DIR"
             exit 1
         fi
@@ -127,7 +157,12 @@ main() {
 
     # Step 4: Run CMSAF Processing Script
     log "Starting CMSAF Processing Script"
-    python3 ./processing/cmsaf_lst_processing.py
+    export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+    run_stage cmsaf_processing \
+            --input "$DATA_DIR/CMSAF_LST_daily" \
+            --input "./processing/land_mask.npy" \
+            --output "$DATA_DIR/CMSAF_Monthly_Per_Hour/LST_IT_2011_2020_agg_monthly_per_hour.nc" \
+            -- python3 ./processing/cmsaf_lst_processing.py
     if [ $? -eq 0 ]; then
         log "CMSAF Processing completed successfully"
     else
@@ -154,7 +189,12 @@ main() {
 
     # Step 7: Run EUMETSAT Processing Script
     log "Starting EUMETSAT Processing Script"
-    python3 ./processing/eumetsat_lst_processing.py
+    export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+    run_stage eumetsat_processing \
+            --input "$DATA_DIR/EUMETSAT_LST_hourly" \
+            --input "./processing/land_mask.npy" \
+            --output "$DATA_DIR/EUMETSAT_Monthly_Per_Hour/LST_IT_2021_2023_agg_monthly_per_hour.nc" \
+            -- python3 ./processing/eumetsat_lst_processing.py
     if [ $? -eq 0 ]; then
         log "EUMETSAT Processing completed successfully"
     else
@@ -168,7 +208,11 @@ main() {
 
     # Step 9: Run Merge Script
     log "Starting LST Datasets Merging"
-    python3 ./processing/merge_lst_datasets.py
+    run_stage merge \
+            --input "$DATA_DIR/CMSAF_Monthly_Per_Hour/LST_IT_2011_2020_agg_monthly_per_hour.nc" \
+            --input "$DATA_DIR/EUMETSAT_Monthly_Per_Hour/LST_IT_2021_2023_agg_monthly_per_hour.nc" \
+            --output "$DATA_DIR/LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour.nc" \
+            -- python3 ./processing/merge_lst_datasets.py
     if [ $? -eq 0 ]; then
         log "LST Datasets Merging completed successfully"
     else
@@ -176,12 +220,15 @@ main() {
         exit 1
     fi
 
-    # Step 10: Check merged file exists
-    check_file "LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour.nc"
+    # Step 10: No check_file of the merged file: run_stage fails a step that did not write its
+    # outputs, and data directories from older runs may only have its CF-1.8 copy
 
     # Step 11: Run CF Compliance Script
     log "Starting CF-1.8 Compliance Processing"
-    python3 ./processing/make_lst_cf_compliant.py
+    run_stage cf_compliance \
+            --input "$DATA_DIR/LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour.nc" \
+            --output "$DATA_DIR/LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.nc" \
+            -- python3 ./processing/make_lst_cf_compliant.py
     if [ $? -eq 0 ]; then
         check_file "LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.nc"
         log "CF-1.8 Compliance Processing completed successfully"
@@ -193,7 +240,10 @@ main() {
     # Step 12: Generate CSV files if requested
     if [ "$GENERATE_CSV" = true ]; then
         log "Starting CSV Generation from processed data"
-        if ! python3 ./processing/lst_generate_csv.py; then # Assuming lst_generate_csv.py exists in processing dir
+        if ! run_stage csv \
+                --input "$DATA_DIR/LST_Monthly_Per_Hour_2011-2023/LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.nc" \
+                --output "$DATA_DIR/LST_IT_2011_2023_agg_Monthly_per_hour_grid_0.1_CF-1.8.csv" \
+                -- python3 ./processing/lst_generate_csv.py; then # Assuming lst_generate_csv.py exists in processing dir
             log "ERROR: CSV Generation failed"
             exit 1
         fi
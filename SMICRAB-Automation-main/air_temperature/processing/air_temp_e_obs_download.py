@@ -1,24 +1,21 @@
 import  os
-import cdsapi
+
+from common.domain import get_domain
+from common.download_manager import download_split, merge_zip_parts
 
 
 E_OBS_ID = "insitu-gridded-observations-europe"
 
-LON_MIN = 6
-LON_MAX = 20
-LAT_MIN = 32
-LAT_MAX =49
+DOMAIN = get_domain()
+LON_MIN = DOMAIN.lon_min
+LON_MAX = DOMAIN.lon_max
+LAT_MIN = DOMAIN.lat_min
+LAT_MAX = DOMAIN.lat_max
 
 OUTPUT_DIR = "./data"
 OUTPUT_FILE = "air_temp_2011_2023_Daily_E_OBS.zip"
 
-def get_cdsapi_client():
-    client = cdsapi.Client()
-    return client
-
 def download_era5(target_file: str):
-    client = get_cdsapi_client()
-
     request = {
         "product_type": "ensemble_mean",
         "variable": ["mean_temperature", "minimum_temperature", "maximum_temperature"],
@@ -27,7 +24,9 @@ def download_era5(target_file: str):
         "version": ["29_0e"]
     }
 
-    client.retrieve(E_OBS_ID, request, target_file)
+    # One request per variable, submitted concurrently and merged back into one zip
+    download_split(E_OBS_ID, request, target_file, merge=merge_zip_parts,
+                   split_keys=("variable",), extension=".zip")
 
 if __name__ == "__main__":
     os.makedirs(OUTPUT_DIR, exist_ok=True)
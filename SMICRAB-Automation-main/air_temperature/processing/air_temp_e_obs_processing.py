@@ -1,19 +1,29 @@
 #!/usr/bin/env python3
 import os
+import sys
 import glob
+import argparse
 import numpy as np
 import xarray as xr
 import pandas as pd
 import  warnings
 
+from common.chunk_index import open_subset
+from common.domain import get_domain
+from common.incremental import append_new_months
+
 # Constants
-LON_MIN, LON_MAX = 6, 20
-LAT_MIN, LAT_MAX = 32, 49
+DOMAIN = get_domain()
+LON_MIN, LON_MAX = DOMAIN.lon_min, DOMAIN.lon_max
+LAT_MIN, LAT_MAX = DOMAIN.lat_min, DOMAIN.lat_max
 NEW_RESOLUTION_LAT = 0.1
 NEW_RESOLUTION_LON = 0.1
 DATA_DIR = "./data/E_OBS_air_temp_Daily"  # Input data directory
 SUBSET_DIR = "./data/E_OBS_air_temp_Daily_subset"  # Directory for subsetted files
 OUTPUT_DIR = "./data/E_OBS_air_temp_Monthly"  # Directory for aggregated monthly files
+# Monthly file of each temperature variable after the CF-1.8 step, extended in place by --append
+CF_FILES = {temp_var: os.path.join(OUTPUT_DIR, f"{temp_var}_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc")
+            for temp_var in ("tg", "tn", "tx")}
 
 
 def convert_time_units(ds):
@@ -43,35 +53,18 @@ def convert_time_units(ds):
     return ds
 
 
-def find_nearest_index(coord_array, value):
-    """Finds the index of the element in coord_array closest to value."""
-    return int(np.abs(coord_array - value).argmin())
-
-
 def get_temp_var_from_filename(filename):
     """Extracts temperature variable from filename (tg, tn, or tx)."""
     basename = os.path.basename(filename)
     return basename.split('_')[0]  # Filename format: tg_ens_mean_0.1deg_reg_2011-2023_v29.0e.nc
 
 
-def subset_dataset(ds, input_file, temp_var):
-    """Subsets the dataset to Italy region."""
+def subset_dataset(input_file, temp_var):
+    """Subsets the dataset to Italy region, reading only the chunks that intersect it."""
     print(f"  Subsetting {temp_var} to Italy region...")
-    lats = ds['latitude'].values
-    lons = ds['longitude'].values
-
-    lat_start = find_nearest_index(lats, LAT_MIN)
-    lat_end = find_nearest_index(lats, LAT_MAX)
-    lon_start = find_nearest_index(lons, LON_MIN)
-    lon_end = find_nearest_index(lons, LON_MAX)
-
-    lat_start, lat_end = min(lat_start, lat_end), max(lat_start, lat_end)
-    lon_start, lon_end = min(lon_start, lon_end), max(lon_start, lon_end)
-
     vars_to_keep = ['time', 'longitude', 'latitude', temp_var]
-    ds_subset = ds.isel(latitude=slice(lat_start, lat_end + 1),
-                        longitude=slice(lon_start, lon_end + 1))
-    ds_subset = ds_subset[vars_to_keep]
+    ds_subset = open_subset(os.path.join(DATA_DIR, input_file), vars_to_keep,
+                            lat_bounds=(LAT_MIN, LAT_MAX), lon_bounds=(LON_MIN, LON_MAX))
 
     subset_filename = os.path.basename(input_file).replace(".nc", "_subset.nc")
     subset_filepath = os.path.join(SUBSET_DIR, subset_filename)
@@ -130,15 +123,14 @@ def process_file(input_file):
         output_filename = os.path.basename(input_file).replace(".nc", "_monthly.nc")
         output_file = os.path.join(OUTPUT_DIR, output_filename)
 
-        ds = xr.open_dataset(os.path.join(DATA_DIR, input_file))
-        ds_subset = subset_dataset(ds, input_file, temp_var)
+        ds_subset = subset_dataset(input_file, temp_var)
         ds_kelvin = convert_to_kelvin(ds_subset, temp_var)
 
         # ds_interp = interpolate_dataset(ds_subset, input_file, temp_var)
         ds_aggregated = aggregate_to_monthly(ds_kelvin, temp_var)
 
         converted_ds = convert_time_units(ds_aggregated)
-        converted_ds.to_netcdf(output_file)
+        converted_ds.to_netcdf(output_file, unlimited_dims=["time"])
 
         print(f"  Saved monthly data to {output_file}")
         return converted_ds
@@ -147,12 +139,43 @@ def process_file(input_file):
         return None
 
 
+def append_file(input_file):
+    """Aggregates the complete months of input_file newer than its CF-1.8 file and appends them to it."""
+    temp_var = get_temp_var_from_filename(input_file)
+    print(f"\nAppending new months of {temp_var} from {input_file}...")
+    try:
+        return append_new_months(CF_FILES[temp_var], os.path.join(DATA_DIR, input_file),
+                                 ['time', 'longitude', 'latitude', temp_var],
+                                 lat_bounds=(LAT_MIN, LAT_MAX), lon_bounds=(LON_MIN, LON_MAX),
+                                 aggregate=lambda ds: convert_time_units(
+                                     aggregate_to_monthly(convert_to_kelvin(ds, temp_var), temp_var)))
+    except Exception as e:
+        print(f"Error appending {input_file}: {str(e)}")
+        return None
+
+
 def main():
     """Main processing function."""
+    parser = argparse.ArgumentParser(description='Aggregate daily E-OBS air temperature to monthly.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only append the complete months newer than the CF-1.8 monthly files to them')
+    args = parser.parse_args()
+
     os.makedirs(SUBSET_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    input_files = glob.glob(os.path.join(DATA_DIR, "*.nc"))
+    input_files = sorted(glob.glob(os.path.join(DATA_DIR, "*.nc")))
+
+    if args.append:
+        missing = [path for path in CF_FILES.values() if not os.path.exists(path)]
+        if missing:
+            print(f"Error: {', '.join(missing)} not found, run a full aggregation first")
+            sys.exit(1)
+        results = [append_file(os.path.basename(input_file)) for input_file in input_files]
+        if None in results:
+            sys.exit(1)
+        print(f"\n=== Appended {sum(results)} months of temperature ===")
+        return
 
     for input_file in input_files:
         input_file = os.path.basename(input_file)
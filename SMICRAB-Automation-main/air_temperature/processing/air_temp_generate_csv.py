@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import os
-import xarray as xr
+import sys
+import argparse
+
+from common.csv_export import export_csv
 
 # Constants
 INPUT_DIR = "./data/air_temp_IT_2011_2023_Monthly"
@@ -8,33 +11,35 @@ OUTPUT_DIR = "./data"
 VARIABLES = ['tg', 'tn', 'tx']  # The three subvariables to process
 
 
-def process_variable(variable):
+def process_variable(variable, gzip=False, workers=1):
     """Process a single air temperature variable and save to CSV."""
     input_file = os.path.join(INPUT_DIR, f"{variable}_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc")
     output_file = os.path.join(OUTPUT_DIR, f"{variable}_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.csv")
+    if gzip:
+        output_file += ".gz"
 
-    ds = xr.open_dataset(input_file)
-
-    # Convert to DataFrame - this creates a row for each combination
-    df = ds.to_dataframe().reset_index()
-
-    # Reorder the columns and sort values to match your desired structure
-    df = df[['time', 'latitude', 'longitude'] + [v for v in ds.data_vars]]
-    df = df.sort_values(['longitude', 'latitude', 'time'])
-
-    # Save to CSV
-    df.to_csv(output_file, index=False)
+    # Streamed a block of longitudes at a time, in the (longitude, latitude, time) order
+    export_csv(input_file, output_file, workers=workers)
     print(f'CSV file saved: {output_file}')
 
 
 def main():
     """Main function for Generating CSV File for air temperature variables."""
+    parser = argparse.ArgumentParser(description='Export the air temperature products to CSV, sorted by longitude, latitude and time.')
+    parser.add_argument('--gzip', action='store_true', help='Write gzip-compressed .csv.gz files instead')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes formatting rows')
+    args = parser.parse_args()
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     for variable in VARIABLES:
         print(f'Generating CSV for {variable} variable...')
-        process_variable(variable)
+        try:
+            process_variable(variable, args.gzip, args.workers)
+        except Exception as e:
+            print(f"Error generating CSV for {variable}: {str(e)}")
+            sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,12 +2,16 @@
 import os
 import xarray as xr
 
+from common.cf_update import CFUpdatePlan, apply_cf_update
+from common.domain import get_domain
+
 # Constants
 INPUT_DIR = "./data/E_OBS_air_temp_Monthly"
 OUTPUT_DIR = "./data/E_OBS_air_temp_Monthly"
 
-LON_MIN = 6
-LAT_MIN = 32
+DOMAIN = get_domain()
+LON_MIN = DOMAIN.lon_min
+LAT_MIN = DOMAIN.lat_min
 
 # File patterns
 FILES_TO_PROCESS = {
@@ -22,13 +26,10 @@ def fix_shift_coords(ds):
     lon_shift = lon0 - LON_MIN
     lat_shift = lat0 - LAT_MIN
 
+    # Only the coordinate values move: every grid value stays on the same index, so the
+    # data variables never have to be read or rewritten
     ds = ds.assign_coords(longitude=ds.longitude - lon_shift)
     ds = ds.assign_coords(latitude=ds.latitude - lat_shift)
-    ds = ds.interp(
-        longitude=ds.longitude,
-        latitude= ds.latitude,
-        method='nearest'
-    )
     return ds
 
 def make_cf_compliant(ds, var_name):
@@ -101,14 +102,16 @@ def process_file(var_name, input_file, output_file):
     try:
         shifted_ds = fix_shift_coords(ds)
         ds_cf = make_cf_compliant(shifted_ds, var_name)
-        encoding = {
-            "time": {"dtype": "float64"},
-            f"{var_name}": {"dtype": "float32", "zlib": True, "complevel": 4},
-            f"{var_name}_std": {"dtype": "float32", "zlib": True,
-                                        "complevel": 4} if f"{var_name}_std" in ds.variables else None
-        }
-
-        ds_cf.to_netcdf(output_file, encoding={k: v for k, v in encoding.items() if v is not None})
+        plan = CFUpdatePlan.from_dataset(
+            ds_cf,
+            time_encoding={"dtype": "float64"},
+            dtypes={f"{var_name}": "float32", f"{var_name}_std": "float32"},
+            compression={"zlib": True, "complevel": 4},  # Only used if the file has to be rewritten
+        )
+        ds.close()
+
+        report = apply_cf_update(input_file, output_file, plan)
+        print(f"  {report}")
         print(f"  Saved CF-compliant file to {output_file}")
     except Exception as e:
         print(f"Error processing {input_file} for CF compliance: {str(e)}")
@@ -125,7 +128,7 @@ def main():
         input_path = os.path.join(INPUT_DIR, input_file)
         output_path = os.path.join(OUTPUT_DIR, input_file.replace(".nc", "_CF-1.8.nc"))
 
-        if os.path.exists(input_path):
+        if os.path.exists(input_path) or os.path.exists(output_path):
             process_file(var_name, input_path, output_path)
         else:
             print(f"Warning: Input file not found: {input_path}")
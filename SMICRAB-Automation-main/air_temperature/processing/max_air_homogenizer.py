@@ -1,10 +1,11 @@
 import xarray as xr
 import logging
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from common.dataset_dto import DatasetDTO
 from common.base_homogenization import BaseHomogenization
+from common.tiling import GridWindow
 from common.homogenization_result import BasicHomogenizationResult
 
 logger = logging.getLogger(__name__)
@@ -15,16 +16,18 @@ class MaxAirHomogenization(BaseHomogenization):
     adjustment derived from homogenized mean air temperature.
     """
 
+    cost_model = "adjustment"
+
     def __init__(
         self,
         eobs_file: str,
         era5_file: str,
         mean_homo_file: str,
         variable_name: str = "maximum_air_temperature",
-        homo_variable_name: str = "mean_air_temperature"
-
+        homo_variable_name: str = "mean_air_temperature",
+        window: Optional[GridWindow] = None
     ):
-        super().__init__(eobs_file, era5_file)
+        super().__init__(eobs_file, era5_file, window)
         self.variable_name = variable_name
         self.homo_variable_name = homo_variable_name
         self.mean_homo_file = mean_homo_file
@@ -56,6 +59,8 @@ class MaxAirHomogenization(BaseHomogenization):
         """Read in the already‐homogenized mean‐air‐temperature NetCDF."""
         logger.info("Loading homogenized mean‐air‐temperature file: %s", self.mean_homo_file)
         ds = xr.open_dataset(self.mean_homo_file, engine="netcdf4")
+        if self.window is not None:
+            ds = self.window.select(ds)
         # assume your mean‐temp file has two vars: original and adjusted
         self.mean_orig = ds[f"{self.homo_variable_name}"].transpose("time","latitude","longitude").values
         self.mean_adj = ds[f"{self.homo_variable_name}_adjusted"].transpose("time","latitude","longitude").values
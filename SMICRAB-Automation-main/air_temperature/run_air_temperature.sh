@@ -4,8 +4,10 @@
 SKIP_E_OBS_DOWNLOAD=false
 SKIP_ERA5_DOWNLOAD=false
 SKIP_UNZIP=false
+APPEND=false
 GENERATE_CSV=false
 PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+RUN_OPTIONS="$*"  # Options of the run, recorded in the run manifest
 AP_DIR="$PROJECT_ROOT/air_temperature"
 DATA_DIR="$AP_DIR/data"     # Data directory under air_temperature
 LOG_DIR="$AP_DIR/logs"     # Log directory under air_temperature
@@ -33,6 +35,10 @@ while [[ "$#" -gt 0 ]]; do
             GENERATE_CSV=true
             shift
             ;;
+        --append)
+            APPEND=true
+            shift
+            ;;
         -h|--help)
             echo "Usage: $0 [OPTIONS]"
             echo "Options:"
@@ -40,6 +46,7 @@ while [[ "$#" -gt 0 ]]; do
             echo "  --skip-era5-download    Skip the ERA5 download step"
             echo "  --skip-unzip            Skip the extraction of E-OBS zip file"
             echo "  --generate-csv          Generate CSV files from processed data"
+            echo "  --append                Only add the months newer than the existing monthly files"
             echo "  -h, --help              Show this help message"
             exit 0
             ;;
@@ -76,11 +83,39 @@ check_file() {
     fi
 }
 
+# Run a step through the stage cache (common/stage_cache.py), which skips it when its inputs,
+# code and parameters are unchanged since it wrote its outputs; SMICRAB_STAGE_CACHE=off always runs
+# Usage: run_stage <name> [--input PATH]... [--output PATH]... -- <command>
+run_stage() {
+    local name="$1"
+    shift
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.stage_cache \
+        --cache "$DATA_DIR/stage_cache.json" --name "$name" \
+        --manifest "$DATA_DIR/run_manifest.json" "$@"
+}
+
+# Start the run manifest, data/run_manifest.json (common/run_manifest.py): the stages run through
+# run_stage add their timings, peak memory and file hashes to it, and it is closed with the exit
+# status of the script
+start_run_manifest() {
+    if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest begin "$DATA_DIR/run_manifest.json" \
+            --pipeline air_temperature --param "options=$RUN_OPTIONS"; then
+        log "WARNING: Could not start the run manifest"
+    fi
+    trap 'finish_run_manifest $?' EXIT
+}
+
+finish_run_manifest() {
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest finish "$DATA_DIR/run_manifest.json" \
+        --exit-code "$1" | tee -a "$LOG_DIR/air_temperature_processing.log"
+}
+
 # Main processing script
 main() {
     # Create (or touch) the log file
     touch "$LOG_DIR/air_temperature_processing.log"
     log "Starting Air_Temperature Data Processing Workflow"
+    start_run_manifest
 
     # Step 1: CDSAPI Configuration Check
     log "Checking CDSAPI configuration in \$HOME/.cdsapirc"
@@ -100,10 +135,21 @@ main() {
     fi
 
     # Step 2: Download ERA5 dataset (if not skipped)
-    if [ "$SKIP_ERA5_DOWNLOAD" = false ]; then
+    if [ "$SKIP_ERA5_DOWNLOAD" = false ] && [ "$APPEND" = true ]; then
+        # Download only the months after the last one in the ERA5 file and append them to it
+        log "Starting ERA5 Download of the new months"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+        if ! python3 "$AP_DIR/processing/2m_temp_era5_download.py" --append; then
+            log "ERROR: ERA5 Download failed"
+            exit 1
+        fi
+        log "ERA5 Download completed successfully"
+    elif [ "$SKIP_ERA5_DOWNLOAD" = false ]; then
         log "Starting ERA5 Download"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$AP_DIR/processing/2m_temp_era5_download.py"; then
+        if ! run_stage era5_download \
+                --output "$DATA_DIR/ERA5_air_temp_Monthly/air_temp_IT_2011_2023_Monthly_ERA5.nc" \
+                -- python3 "$AP_DIR/processing/2m_temp_era5_download.py"; then
             log "ERROR: ERA5 Download failed"
             exit 1
         fi
@@ -117,7 +163,9 @@ main() {
     if [ "$SKIP_E_OBS_DOWNLOAD" = false ]; then
         log "Starting Air_Temperature (E‑OBS) Download"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$AP_DIR/processing/air_temp_e_obs_download.py"; then
+        if ! run_stage eobs_download \
+                --output "$DATA_DIR/air_temp_2011_2023_Daily_E_OBS.zip" \
+                -- python3 "$AP_DIR/processing/air_temp_e_obs_download.py"; then
             log "ERROR: Air_Temperature (E‑OBS) Download failed"
             exit 1
         fi
@@ -145,44 +193,73 @@ main() {
             mkdir -p "$TARGET_FOLDER"
         fi
 
-        # Extract the zip file with progress
+        # Extract the NetCDF members that are missing or changed
         log "Starting extraction..."
-        if ! unzip -o "$ZIP_FILE" -d "$TARGET_FOLDER" | awk 'BEGIN {ORS=" "} {if(NR%10==0)print "."}'; then
+        if ! run_stage unzip --input "$ZIP_FILE" --output "$TARGET_FOLDER" \
+                -- python3 -m common.zip_extract "$ZIP_FILE" "$TARGET_FOLDER"; then
             log "ERROR: Extraction failed for $ZIP_FILE"
             exit 1
         fi
-        echo ""  # Add newline after progress dots
         log "Extraction of Air_Temperature dataset completed successfully"
     else
         log "Extraction step skipped"
     fi
 
     # Step 5: Run Aggregation Script for E-OBS Air_Temperature
-    log "Starting Air_Temperature E-OBS Dataset Aggregation"
-    if ! python3 "$AP_DIR/processing/air_temp_e_obs_processing.py"; then
-        log "ERROR: Air_Temperature Aggregation failed"
-        exit 1
-    fi
-    log "Air_Temperature Aggregation completed successfully"
-    check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc"
-    check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc"
-    check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc"
-
-    # Step 6: Make Air_Temperature E-OBS CF-Compliant
-    log "Starting Air_Temperature E-OBS Dataset CF Compliance Conversion"
-    if ! python3 "$AP_DIR/processing/air_temp_make_cf_compliant.py"; then
-        log "ERROR: Air_Temperature CF Compliance Conversion failed"
-        exit 1
+    if [ "$APPEND" = true ]; then
+        # Only the complete months newer than the CF-1.8 monthly file are aggregated and appended
+        # to it; the steps below that read it then rerun on the extended file
+        log "Appending new months to the Air_Temperature E-OBS CF-1.8 monthly file"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+        if ! python3 "$AP_DIR/processing/air_temp_e_obs_processing.py" --append; then
+            log "ERROR: Air_Temperature Append failed"
+            exit 1
+        fi
+        log "Air_Temperature Append completed successfully"
+    else
+        log "Starting Air_Temperature E-OBS Dataset Aggregation"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+        if ! run_stage aggregation \
+                --input "$DATA_DIR/E_OBS_air_temp_Daily" \
+                --output "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --output "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --output "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                -- python3 "$AP_DIR/processing/air_temp_e_obs_processing.py"; then
+            log "ERROR: Air_Temperature Aggregation failed"
+            exit 1
+        fi
+        log "Air_Temperature Aggregation completed successfully"
+        # No check_file of the monthly files: run_stage fails a step that did not write its outputs,
+        # and data directories from older runs may only have their CF-1.8 copies
+
+        # Step 6: Make Air_Temperature E-OBS CF-Compliant
+        log "Starting Air_Temperature E-OBS Dataset CF Compliance Conversion"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+        if ! run_stage cf_compliance \
+                --input "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --input "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --input "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --output "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+                --output "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+                --output "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+                -- python3 "$AP_DIR/processing/air_temp_make_cf_compliant.py"; then
+            log "ERROR: Air_Temperature CF Compliance Conversion failed"
+            exit 1
+        fi
+        log "Air_Temperature CF Compliance Conversion completed successfully"
+        check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
+        check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
+        check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
     fi
-    log "Air_Temperature CF Compliance Conversion completed successfully"
-    check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
-    check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
-    check_file "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
 
     # Step 7: Run Homogenization Script for Aggregated Mean Air_Temperature
     log "Starting Mean Air_Temperature Homogenization"
     export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
-    if ! python3 "$AP_DIR/processing/tg_homogenization.py"; then
+    if ! run_stage tg_homogenization \
+            --input "$DATA_DIR/E_OBS_air_temp_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+            --input "$DATA_DIR/ERA5_air_temp_Monthly/air_temp_IT_2011_2023_Monthly_ERA5.nc" \
+            --output "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+            -- python3 "$AP_DIR/processing/tg_homogenization.py"; then
         log "ERROR: Mean Air_Temperature Homogenization failed"
         exit 1
     fi
@@ -192,7 +269,12 @@ main() {
     # Step 8: Run Homogenization Script for Aggregated Min Air_Temperature
     log "Starting Minimum Air_Temperature Homogenization"
     export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
-    if ! python3 "$AP_DIR/processing/tn_homogenization.py"; then
+    if ! run_stage tn_homogenization \
+            --input "$DATA_DIR/E_OBS_air_temp_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+            --input "$DATA_DIR/ERA5_air_temp_Monthly/air_temp_IT_2011_2023_Monthly_ERA5.nc" \
+            --input "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+            --output "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+            -- python3 "$AP_DIR/processing/tn_homogenization.py"; then
         log "ERROR: Minimum Air_Temperature Homogenization failed"
         exit 1
     fi
@@ -202,7 +284,12 @@ main() {
     # Step 9: Run Homogenization Script for Aggregated Max Air_Temperature
     log "Starting Maximum Air_Temperature Homogenization"
     export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
-    if ! python3 "$AP_DIR/processing/tx_homogenization.py"; then
+    if ! run_stage tx_homogenization \
+            --input "$DATA_DIR/E_OBS_air_temp_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+            --input "$DATA_DIR/ERA5_air_temp_Monthly/air_temp_IT_2011_2023_Monthly_ERA5.nc" \
+            --input "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+            --output "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+            -- python3 "$AP_DIR/processing/tx_homogenization.py"; then
         log "ERROR: Maximum Air_Temperature Homogenization failed"
         exit 1
     fi
@@ -213,7 +300,14 @@ main() {
     if [ "$GENERATE_CSV" = true ]; then
         log "Starting CSV Generation from processed data"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$AP_DIR/processing/air_temp_generate_csv.py"; then
+        if ! run_stage csv \
+                --input "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+                --input "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+                --input "$DATA_DIR/air_temp_IT_2011_2023_Monthly/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+                --output "$DATA_DIR/tg_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.csv" \
+                --output "$DATA_DIR/tn_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.csv" \
+                --output "$DATA_DIR/tx_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.csv" \
+                -- python3 "$AP_DIR/processing/air_temp_generate_csv.py"; then
             log "ERROR: CSV Generation failed"
             exit 1
         fi
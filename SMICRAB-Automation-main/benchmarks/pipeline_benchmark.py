@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the variable pipelines on synthetic raw inputs.
+
+The raw files each pipeline starts from once its downloads are extracted are fabricated in a
+scratch directory: daily E-OBS-like files, monthly ERA5-like files, CMSAF SAL and LST files
+and hourly EUMETSAT-like LST files, on a box anchored at the south-west corner of the domain
+(plus a margin cut by the subset steps). The E-OBS series carry a step change half way
+through, so the homogenizations have something to correct. The steps of common/pipelines.py
+then run on them one at a time, without network and with the cell cache off, and each step
+is measured: wall time, peak resident memory of its largest process, bytes read and written
+through system calls and the part of them that reached the disk (/proc/self/io, which
+includes every child process once it has exited).
+
+Each run is appended to a JSON-lines history, and with --csv to a CSV file with one row per
+step, together with the scale, the host and the git commit. The table printed at the end
+compares every step with its last run at the same scale and tiling on a machine with as many
+cores. The homogenizations also record their runs to a run history of the planner
+(common/run_planner.py), logs/pipeline_benchmark_runs.jsonl by default, which calibrates its
+models on them; with --tile-size the homogenizations run in tiles.
+
+Usage (from the project root):
+    PYTHONPATH=. python3 benchmarks/pipeline_benchmark.py                   # all pipelines, small scale
+    PYTHONPATH=. python3 benchmarks/pipeline_benchmark.py relative_humidity wind_speed --scale medium
+    PYTHONPATH=. python3 benchmarks/pipeline_benchmark.py --years 5 --grid 80x60 --csv logs/pipeline_benchmark.csv
+    PYTHONPATH=. python3 benchmarks/pipeline_benchmark.py wind_speed --scale medium --tile-size 16
+    SMICRAB_RUN_HISTORY=logs/pipeline_benchmark_runs.jsonl PYTHONPATH=. python3 -m common.run_planner --history
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from common.chunk_index import nearest_bounds
+from common.domain import get_domain
+from common.orchestrator import Step, resolve_dependencies
+from common.pipelines import PIPELINES, E_OBS_VERSION, build_steps
+from common.run_manifest import git_commit
+from common.run_planner import RUN_HISTORY_ENV_VAR
+from common.stage_cache import PROJECT_ROOT
+
+DOMAIN = get_domain()
+START = pd.Timestamp("2011-01-01")
+E_OBS_RESOLUTION = 0.1
+# Grids of the CMSAF and ERA5 albedo inputs and of the EUMETSAT LST, regridded by their pipelines
+CMSAF_RESOLUTION = 0.25
+EUMETSAT_RESOLUTION = 0.05
+# Cells of the raw grids outside the domain on each side
+MARGIN_CELLS = 5
+DEFAULT_HISTORY = os.path.join(PROJECT_ROOT, "logs", "pipeline_benchmark.jsonl")
+# Tiling of the homogenizations of runs recorded without one
+WHOLE_GRID = {"tile_size": None, "workers": 1}
+# Run history of the planner the homogenizations of the benchmark record to
+DEFAULT_RUN_HISTORY = os.path.join(PROJECT_ROOT, "logs", "pipeline_benchmark_runs.jsonl")
+# Every step starts cold; only the homogenization runs are recorded, to the run history given to run_step
+BENCHMARK_ENV = {"SMICRAB_CELL_CACHE": "off", "SMICRAB_DASK_SCHEDULER": "off"}
+
+
+@dataclass(frozen=True)
+class Scale:
+    """
+    Size of the synthetic inputs.
+
+    Attributes:
+        years: Years of monthly data from 2011; the LST years are split between CMSAF and EUMETSAT
+        n_lat, n_lon: Cells of the 0.1 degree grid inside the domain (at most the whole domain)
+        hourly_days: Days of hourly EUMETSAT files per month
+    """
+    years: int
+    n_lat: int
+    n_lon: int
+    hourly_days: int
+
+
+SCALES = {
+    "small": Scale(years=2, n_lat=24, n_lon=20, hourly_days=1),
+    "medium": Scale(years=4, n_lat=60, n_lon=50, hourly_days=2),
+    # The whole domain over the full period
+    "full": Scale(years=13, n_lat=171, n_lon=141, hourly_days=7),
+}
+
+
+@dataclass(frozen=True)
+class SyntheticVariable:
+    """Daily E-OBS variable: seasonal mean, amplitude and noise, size of its inhomogeneity, packing."""
+    mean: float
+    amplitude: float
+    noise: float
+    shift: float
+    scale_factor: float
+    minimum: Optional[float] = None
+
+
+E_OBS_VARIABLES = {
+    "rr": SyntheticVariable(2.5, 1.0, 2.0, 0.8, 0.1, minimum=0.0),
+    "tg": SyntheticVariable(14.0, 8.0, 2.0, 1.0, 0.01),
+    "tn": SyntheticVariable(9.0, 7.0, 2.0, 1.0, 0.01),
+    "tx": SyntheticVariable(19.0, 9.0, 2.0, 1.0, 0.01),
+    "hu": SyntheticVariable(70.0, 10.0, 5.0, 6.0, 0.1, minimum=0.0),
+    "pp": SyntheticVariable(1013.0, 4.0, 6.0, 2.0, 0.1),
+    "qq": SyntheticVariable(170.0, 110.0, 30.0, 10.0, 0.1, minimum=0.0),
+    "fg": SyntheticVariable(3.5, 0.8, 1.2, 0.6, 0.01, minimum=0.0),
+}
+
+FG_VERSION = "2011-2024_v30.0e"
+# Pipeline -> (E-OBS directory name, {variable: file version}, ERA5 file under data/ or None)
+E_OBS_PIPELINES = {
+    "accumulated_precipitation": ("rr", {"rr": E_OBS_VERSION}, "ERA5_rr_Monthly/rr_IT_2011_2023_Monthly_ERA5.nc"),
+    "air_temperature": ("air_temp", {v: E_OBS_VERSION for v in ("tg", "tn", "tx")},
+                        "ERA5_air_temp_Monthly/air_temp_IT_2011_2023_Monthly_ERA5.nc"),
+    "relative_humidity": ("hu", {"hu": E_OBS_VERSION}, "ERA5_hu_Monthly/hu_IT_2011_2023_Monthly_ERA5.nc"),
+    "sea_level_pressure": ("pp", {"pp": E_OBS_VERSION}, None),
+    "solar_irradiance": ("qq", {"qq": E_OBS_VERSION}, None),
+    "wind_speed": ("fg", {"fg": FG_VERSION}, "ERA5_fg_Monthly/fg_IT_2011_2023_Monthly_ERA5.nc"),
+}
+
+
+@dataclass
+class StageMeasurement:
+    pipeline: str
+    step: str
+    status: str  # "ok", "failed", "blocked" (an upstream step failed)
+    seconds: float = 0.0
+    peak_memory_gb: float = 0.0
+    read_bytes: int = 0
+    written_bytes: int = 0
+    disk_read_bytes: int = 0
+    disk_written_bytes: int = 0
+    message: str = ""
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.pipeline}.{self.step}"
+
+
+def io_counters() -> Dict[str, int]:
+    """I/O counters of this process and of the children it has waited for, from /proc/self/io."""
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def _axis(low: float, high: float, extent: float, resolution: float, pad: bool) -> np.ndarray:
+    """
+    Cell centres from low over extent degrees, with MARGIN_CELLS more below low, and above
+    high when the extent reaches it (or always, with pad).
+    """
+    cells = int(round(min(extent, high - low) / resolution))
+    if pad or low + extent >= high:
+        cells += MARGIN_CELLS
+    return np.round(low + np.arange(-MARGIN_CELLS, cells) * resolution, 3)
+
+
+def raw_axes(scale: Scale, resolution: float, pad: bool = True):
+    """
+    Latitudes and longitudes of a raw grid covering the benchmark box. Without pad the grid
+    ends with the box inside the domain, so the E-OBS subset keeps n_lat x n_lon cells.
+    """
+    return (_axis(DOMAIN.lat_min, DOMAIN.lat_max, scale.n_lat * E_OBS_RESOLUTION, resolution, pad),
+            _axis(DOMAIN.lon_min, DOMAIN.lon_max, scale.n_lon * E_OBS_RESOLUTION, resolution, pad))
+
+
+def seasonal_field(rng: np.random.Generator, times: pd.DatetimeIndex, lat: np.ndarray, lon: np.ndarray,
+                   mean: float, amplitude: float, noise: float) -> np.ndarray:
+    """Seasonal cycle, decreasing northwards, plus noise, as a (time, lat, lon) float32 array."""
+    phase = 2 * np.pi * (times.dayofyear.values - 105) / 365.25
+    field = np.full((len(times), len(lat), len(lon)), mean, dtype=np.float32)
+    field += (amplitude * np.sin(phase)).astype(np.float32)[:, None, None]
+    field -= (0.1 * amplitude * (lat - lat.mean())).astype(np.float32)[None, :, None]
+    field += (noise * rng.standard_normal(field.shape)).astype(np.float32)
+    return field
+
+
+def monthly_means(daily: np.ndarray, days: pd.DatetimeIndex) -> np.ndarray:
+    months = days.to_period("M")
+    _, starts = np.unique(months.asi8, return_index=True)
+    counts = np.diff(np.append(starts, len(days)))
+    return np.add.reduceat(daily, starts, axis=0) / counts[:, None, None]
+
+
+def write_e_obs_daily(path: str, var: str, data: np.ndarray, days: pd.DatetimeIndex, lat: np.ndarray,
+                      lon: np.ndarray) -> None:
+    """Daily E-OBS-like file: int16 packed, zlib and shuffle, one chunk per day."""
+    spec = E_OBS_VARIABLES[var]
+    ds = xr.Dataset({var: (("time", "latitude", "longitude"), data)},
+                    coords={"time": days, "latitude": lat, "longitude": lon})
+    encoding = {var: {"dtype": "int16", "scale_factor": spec.scale_factor, "_FillValue": -9999, "zlib": True,
+                      "shuffle": True, "chunksizes": (1, len(lat), len(lon))},
+                "time": {"units": "days since 1950-01-01 00:00", "dtype": "float64"}}
+    ds.to_netcdf(path, encoding=encoding)
+
+
+def write_era5_monthly(path: str, fields: Dict[str, np.ndarray], months: pd.DatetimeIndex, lat: np.ndarray,
+                       lon: np.ndarray) -> None:
+    """Monthly ERA5-like file: valid_time in seconds, latitudes north to south."""
+    ds = xr.Dataset({name: (("valid_time", "latitude", "longitude"), data[:, ::-1, :].astype(np.float32))
+                     for name, data in fields.items()},
+                    coords={"valid_time": months, "latitude": lat[::-1], "longitude": lon})
+    encoding = {name: {"zlib": True} for name in fields}
+    encoding["valid_time"] = {"units": "seconds since 1970-01-01", "dtype": "int64"}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ds.to_netcdf(path, encoding=encoding)
+
+
+def era5_fields(var: str, monthly: Dict[str, np.ndarray], rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """ERA5 variables of the reference of var, from the monthly means of its homogeneous series."""
+    if var == "rr":
+        return {"tp": monthly["rr"] / 1000}
+    if var == "air_temp":
+        return {"t2m": monthly["tg"] + 273.15}
+    if var == "hu":
+        # Dew point giving back the relative humidity through the Wexler formula of
+        # common/derived_reference.py
+        rh = np.clip(monthly["hu"], 1, 100)
+        t2m = np.full_like(rh, 288.15) + rng.uniform(-5, 5, rh.shape[1:])
+        a = np.log(rh / 100) / 17.27 + t2m / (t2m + 237.3)
+        return {"t2m": t2m, "d2m": 237.3 * a / (1 - a)}
+    if var == "fg":
+        direction = rng.uniform(0, 2 * np.pi, monthly["fg"].shape[1:])[None]
+        return {"u10": monthly["fg"] * np.cos(direction), "v10": monthly["fg"] * np.sin(direction)}
+    raise ValueError(f"No ERA5 reference for {var}")
+
+
+def fabricate_e_obs(pipeline: str, data_dir: str, scale: Scale, rng: np.random.Generator) -> None:
+    var, versions, era5_file = E_OBS_PIPELINES[pipeline]
+    lat, lon = raw_axes(scale, E_OBS_RESOLUTION, pad=False)
+    days = pd.date_range(START, START + pd.DateOffset(years=scale.years) - pd.Timedelta(days=1), freq="D")
+    # The cells the subset steps keep, on which ERA5 is given
+    lat_slice = nearest_bounds(lat, DOMAIN.lat_min, DOMAIN.lat_max)
+    lon_slice = nearest_bounds(lon, DOMAIN.lon_min, DOMAIN.lon_max)
+    i, j = np.meshgrid(np.arange(len(lat)), np.arange(len(lon)), indexing="ij")
+    sea = i + j < min(len(lat), len(lon)) // 3
+
+    daily_dir = os.path.join(data_dir, f"E_OBS_{var}_Daily")
+    os.makedirs(daily_dir, exist_ok=True)
+    monthly = {}
+    for v, version in versions.items():
+        spec = E_OBS_VARIABLES[v]
+        truth = seasonal_field(rng, days, lat, lon, spec.mean, spec.amplitude, spec.noise)
+        if spec.minimum is not None:
+            np.maximum(truth, spec.minimum, out=truth)
+        monthly[v] = monthly_means(truth[:, lat_slice, lon_slice], days)
+        # A station change in the eastern half of the grid half way through the period
+        truth[len(days) // 2:, :, len(lon) // 2:] += spec.shift
+        truth[:, sea] = np.nan
+        write_e_obs_daily(os.path.join(daily_dir, f"{v}_ens_mean_0.1deg_reg_{version}.nc"), v, truth, days, lat, lon)
+        del truth
+
+    if era5_file:
+        months = pd.date_range(START, periods=12 * scale.years, freq="MS")
+        write_era5_monthly(os.path.join(data_dir, era5_file), era5_fields(var, monthly, rng), months,
+                           lat[lat_slice], lon[lon_slice])
+
+
+def fabricate_albedo(data_dir: str, scale: Scale, rng: np.random.Generator) -> None:
+    lat, lon = raw_axes(scale, CMSAF_RESOLUTION)
+    months = pd.date_range(START, periods=12 * scale.years, freq="MS")
+    albedo = seasonal_field(rng, months, lat, lon, 15.0, 4.0, 2.0)
+    daily_dir = os.path.join(data_dir, "CMSAF_SAL_daily")
+    os.makedirs(daily_dir, exist_ok=True)
+    for k, month in enumerate(months):
+        mean = albedo[k:k + 1].copy()
+        # Gaps (clouds, snow) filled from ERA5 by the merge
+        mean[0][rng.random(mean.shape[1:]) < 0.1] = np.nan
+        ds = xr.Dataset({"black_sky_albedo_all_mean": (("time", "lat", "lon"), mean),
+                         "black_sky_albedo_all_std": (("time", "lat", "lon"), np.abs(mean) * 0.1)},
+                        coords={"time": [month], "lat": lat, "lon": lon})
+        ds.to_netcdf(os.path.join(daily_dir, f"SAL_{month:%Y%m}.nc"))
+    write_era5_monthly(os.path.join(data_dir, "ERA5_SAL_Monthly", "SAL_IT_2011_2023_Monthly_ERA5.nc"),
+                       {"fal": albedo / 100}, months, lat, lon)
+
+
+def fabricate_lst(data_dir: str, scale: Scale, rng: np.random.Generator) -> None:
+    # The first years from CMSAF (monthly means per hour), the rest hourly from EUMETSAT
+    eumetsat_years = max(1, round(scale.years * 3 / 13))
+    cmsaf_years = max(1, scale.years - eumetsat_years)
+    hours = np.arange(24)
+    diurnal = (8 * np.sin(2 * np.pi * (hours - 8) / 24)).astype(np.float32)
+
+    lat, lon = raw_axes(scale, CMSAF_RESOLUTION)
+    cmsaf_dir = os.path.join(data_dir, "CMSAF_LST_daily")
+    os.makedirs(cmsaf_dir, exist_ok=True)
+    for month in pd.date_range(START, periods=12 * cmsaf_years, freq="MS"):
+        times = month + pd.to_timedelta(hours, unit="h")
+        lst = seasonal_field(rng, times, lat, lon, 290.0, 10.0, 1.5) + diurnal[:, None, None]
+        lst[rng.random(lst.shape) < 0.15] = np.nan
+        ds = xr.Dataset({"LST_PMW": (("time", "lat", "lon"), lst),
+                         "LSTERROR_PMW": (("time", "lat", "lon"), np.full(lst.shape, 2.0, dtype=np.float32))},
+                        coords={"time": times, "lat": lat, "lon": lon})
+        ds.to_netcdf(os.path.join(cmsaf_dir, f"LST_{month:%Y%m}.nc"))
+
+    lat, lon = raw_axes(scale, EUMETSAT_RESOLUTION)
+    hourly_dir = os.path.join(data_dir, "EUMETSAT_LST_hourly")
+    os.makedirs(hourly_dir, exist_ok=True)
+    eumetsat_start = START + pd.DateOffset(years=cmsaf_years)
+    for month in pd.date_range(eumetsat_start, periods=12 * eumetsat_years, freq="MS"):
+        for day in range(min(scale.hourly_days, month.days_in_month)):
+            times = month + pd.Timedelta(days=day) + pd.to_timedelta(hours, unit="h")
+            lst = seasonal_field(rng, times, lat, lon, 17.0, 10.0, 1.5) + diurnal[:, None, None]
+            lst[rng.random(lst.shape) < 0.3] = np.nan  # clouds
+            for h, timestamp in enumerate(times):
+                ds = xr.Dataset({"LST": (("time", "lat", "lon"), lst[h:h + 1], {"units": "degC"})},
+                                coords={"time": [timestamp], "lat": lat, "lon": lon})
+                ds.to_netcdf(os.path.join(hourly_dir, f"LST_{timestamp:%Y%m%d%H%M}.nc"))
+
+
+def fabricate_inputs(pipeline: str, var_dir: str, scale: Scale, seed: int) -> None:
+    """Write the raw inputs of pipeline under var_dir/data and link its processing scripts."""
+    data_dir = os.path.join(var_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    os.symlink(os.path.join(PROJECT_ROOT, pipeline, "processing"), os.path.join(var_dir, "processing"))
+    rng = np.random.default_rng(seed)
+    if pipeline in E_OBS_PIPELINES:
+        fabricate_e_obs(pipeline, data_dir, scale, rng)
+    elif pipeline == "Albedo":
+        fabricate_albedo(data_dir, scale, rng)
+    elif pipeline == "Land_Surface_Temperature":
+        fabricate_lst(data_dir, scale, rng)
+    else:
+        raise ValueError(f"No synthetic inputs for pipeline '{pipeline}'")
+
+
+def directory_size(path: str):
+    """Number of files and bytes under path."""
+    files, size = 0, 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+def benchmark_steps(pipelines: List[str], root: str, tile_size: Optional[int] = None,
+                    workers: int = 1) -> List[Step]:
+    """
+    Steps of the pipelines after their downloads and extraction, moved from PROJECT_ROOT to root;
+    with tile_size, the homogenizations run in tiles with that many workers.
+    """
+    tiling = [] if tile_size is None else ["--tile-size", str(tile_size), "--workers", str(workers)]
+    steps = []
+    for step in build_steps(pipelines, generate_csv=True, downloads=False, extract=False):
+        var_dir = os.path.join(PROJECT_ROOT, step.pipeline)
+
+        def rebase(path: str) -> str:
+            if path == var_dir or path.startswith(var_dir + os.sep):
+                return os.path.join(root, step.pipeline, os.path.relpath(path, var_dir))
+            return path
+
+        command = [rebase(arg) for arg in step.command]
+        if step.name.endswith("homogenization"):
+            command += tiling
+        steps.append(replace(step, command=command, cwd=rebase(step.cwd),
+                             inputs=[rebase(p) for p in step.inputs], outputs=[rebase(p) for p in step.outputs]))
+    return steps
+
+
+def execution_order(steps: List[Step]) -> List[Step]:
+    """Steps in dependency order, otherwise in pipeline order."""
+    dependencies = resolve_dependencies(steps)
+    ordered, done = [], set()
+    while len(ordered) < len(steps):
+        for step in steps:
+            if step.full_name not in done and all(dep in done for dep in dependencies[step.full_name]):
+                ordered.append(step)
+                done.add(step.full_name)
+                break
+    return ordered
+
+
+def run_step(step: Step, log_dir: str, run_history: str = "off") -> StageMeasurement:
+    """Run step alone and measure it; homogenizations record their run to run_history ("off" for none)."""
+    log_path = os.path.join(log_dir, step.pipeline, f"{step.name}.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    env = dict(os.environ, **BENCHMARK_ENV)
+    env[RUN_HISTORY_ENV_VAR] = run_history
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")]))
+
+    before = io_counters()
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(step.command, cwd=step.cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # The usage wait4 returns covers the processes the step itself waited for (e.g. a pool)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    after = io_counters()
+
+    measurement = StageMeasurement(
+        step.pipeline, step.name, "ok", seconds,
+        # ru_maxrss is in kB on Linux
+        peak_memory_gb=usage.ru_maxrss / 1024 ** 2,
+        read_bytes=after.get("rchar", 0) - before.get("rchar", 0),
+        written_bytes=after.get("wchar", 0) - before.get("wchar", 0),
+        disk_read_bytes=after.get("read_bytes", 0) - before.get("read_bytes", 0),
+        disk_written_bytes=after.get("write_bytes", 0) - before.get("write_bytes", 0))
+    missing = [p for p in step.outputs if not os.path.exists(p)]
+    if process.returncode != 0:
+        measurement.status, measurement.message = "failed", f"exit code {process.returncode}, see {log_path}"
+    elif missing:
+        measurement.status, measurement.message = "failed", f"missing outputs: {', '.join(missing)}"
+    return measurement
+
+
+def run_benchmark(pipelines: List[str], scale: Scale, work_dir: str, seed: int = 0,
+                  run_history: str = "off", tile_size: Optional[int] = None, workers: int = 1) -> dict:
+    """
+    Fabricate the inputs of pipelines under work_dir, run their steps and return the run record.
+    The homogenizations run in tiles of tile_size (the whole grid if None) and record their
+    runs to the planner's run_history ("off" for none).
+    """
+    input_files, input_bytes = 0, 0
+    for pipeline in pipelines:
+        start = time.perf_counter()
+        fabricate_inputs(pipeline, os.path.join(work_dir, pipeline), scale, seed)
+        files, size = directory_size(os.path.join(work_dir, pipeline, "data"))
+        input_files, input_bytes = input_files + files, input_bytes + size
+        print(f"{pipeline}: {files} synthetic input files, {size / 1e6:.1f} MB "
+              f"({time.perf_counter() - start:.1f} s)")
+
+    steps = execution_order(benchmark_steps(pipelines, work_dir, tile_size, workers))
+    dependencies = resolve_dependencies(steps)
+    log_dir = os.path.join(work_dir, "logs")
+    results: Dict[str, StageMeasurement] = {}
+    start = time.perf_counter()
+    for step in steps:
+        if any(results[dep].status != "ok" for dep in dependencies[step.full_name]):
+            result = StageMeasurement(step.pipeline, step.name, "blocked", message="an upstream step failed")
+        else:
+            result = run_step(step, log_dir, run_history)
+        results[step.full_name] = result
+        detail = f" ({result.message})" if result.message else ""
+        print(f"[{result.status:>7}] {step.full_name} {result.seconds:8.1f} s{detail}", flush=True)
+
+    return {
+        "finished": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": {"cpus": os.cpu_count(), "machine": platform.machine(), "python": platform.python_version()},
+        "scale": asdict(scale),
+        "tiling": {"tile_size": tile_size, "workers": workers},
+        "inputs": {"files": input_files, "bytes": input_bytes},
+        "seconds": time.perf_counter() - start,
+        "stages": [asdict(results[step.full_name]) for step in steps],
+    }
+
+
+def read_history(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_stages(history: List[dict], record: dict) -> Dict[str, dict]:
+    """Last successful run of each step at the same scale and tiling on a machine with as many cores."""
+    previous = {}
+    for past in history:
+        if (past["scale"] == record["scale"] and past.get("tiling", WHOLE_GRID) == record["tiling"]
+                and past["host"]["cpus"] == record["host"]["cpus"]):
+            for stage in past["stages"]:
+                if stage["status"] == "ok":
+                    previous[f"{stage['pipeline']}.{stage['step']}"] = stage
+    return previous
+
+
+def report(record: dict, previous: Dict[str, dict]) -> str:
+    lines = [f"{'step':<45} {'status':<8} {'seconds':>9} {'vs last':>8} {'peak GB':>8} "
+             f"{'read MB':>9} {'written MB':>11} {'disk r/w MB':>14}"]
+    for stage in record["stages"]:
+        name = f"{stage['pipeline']}.{stage['step']}"
+        change = "-"
+        if name in previous and stage["status"] == "ok" and previous[name]["seconds"] > 0:
+            change = f"{100 * (stage['seconds'] / previous[name]['seconds'] - 1):+.0f}%"
+        disk = f"{stage['disk_read_bytes'] / 1e6:.1f}/{stage['disk_written_bytes'] / 1e6:.1f}"
+        lines.append(f"{name:<45} {stage['status']:<8} {stage['seconds']:9.1f} {change:>8} "
+                     f"{stage['peak_memory_gb']:8.2f} {stage['read_bytes'] / 1e6:9.1f} "
+                     f"{stage['written_bytes'] / 1e6:11.1f} {disk:>14}")
+    scale, tiling = record["scale"], record["tiling"]
+    layout = ("whole grids" if tiling["tile_size"] is None
+              else f"tiles of {tiling['tile_size']}, {tiling['workers']} workers")
+    lines.append(f"{scale['years']} years, {scale['n_lat']}x{scale['n_lon']} cells, {scale['hourly_days']} hourly "
+                 f"days per month, homogenized as {layout}; {record['inputs']['bytes'] / 1e6:.1f} MB of inputs; "
+                 f"step time {record['seconds']:.1f} s")
+    return "\n".join(lines)
+
+
+def append_history(path: str, record: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def append_csv(path: str, record: dict) -> None:
+    """One row per step, with the run it belongs to."""
+    run = {"finished": record["finished"], "commit": record["commit"], "cpus": record["host"]["cpus"],
+           **record["scale"]}
+    rows = [{**run, **stage} for stage in record["stages"]]
+    new_file = not os.path.exists(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_grid(value: str):
+    try:
+        n_lat, n_lon = (int(n) for n in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Grid '{value}' is not LATxLON")
+    return n_lat, n_lon
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the variable pipelines end to end on synthetic raw inputs '
+                                                 'and record the time, memory and I/O of every step.')
+    parser.add_argument('pipelines', nargs='*', help=f'Pipelines to run (default: all): {", ".join(PIPELINES)}')
+    parser.add_argument('--scale', choices=SCALES, default="small", help='Size of the inputs (default: small)')
+    parser.add_argument('--years', type=int, default=None, help='Years of data, overriding the scale')
+    parser.add_argument('--grid', type=parse_grid, default=None, help='LATxLON cells, overriding the scale')
+    parser.add_argument('--hourly-days', type=int, default=None,
+                        help='Days of hourly EUMETSAT files per month, overriding the scale')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help='Run the homogenizations in tiles of this many cells per side (default: whole grid)')
+    parser.add_argument('--workers', type=int, default=1, help='Tiles homogenized in parallel with --tile-size')
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help=f'JSON-lines history (default: {DEFAULT_HISTORY})')
+    parser.add_argument('--csv', default=None, help='Also append one row per step to this CSV file')
+    parser.add_argument('--run-history', default=DEFAULT_RUN_HISTORY,
+                        help=f'Run history of the planner the homogenizations record to, or "off" '
+                             f'(default: {DEFAULT_RUN_HISTORY})')
+    parser.add_argument('--work-dir', default=None,
+                        help='Directory of the inputs, outputs and step logs, kept after the run '
+                             '(default: a temporary directory)')
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    if args.years:
+        scale = replace(scale, years=args.years)
+    if args.grid:
+        scale = replace(scale, n_lat=args.grid[0], n_lon=args.grid[1])
+    if args.hourly_days:
+        scale = replace(scale, hourly_days=args.hourly_days)
+    pipelines = args.pipelines or list(PIPELINES)
+    unknown = [p for p in pipelines if p not in PIPELINES]
+    if unknown:
+        print(f"Error: unknown pipelines {', '.join(unknown)}, expected: {', '.join(PIPELINES)}")
+        sys.exit(1)
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        if os.listdir(args.work_dir):
+            print(f"Error: {args.work_dir} is not empty")
+            sys.exit(1)
+    # The steps run in their own directories
+    run_history = "off" if args.run_history.lower() == "off" else os.path.abspath(args.run_history)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="smicrab_benchmark_")
+    try:
+        record = run_benchmark(pipelines, scale, work_dir, args.seed, run_history, args.tile_size, args.workers)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print(report(record, previous_stages(read_history(args.history), record)))
+    append_history(args.history, record)
+    if args.csv:
+        append_csv(args.csv, record)
+    print(f"Recorded in {args.history}" + (f" and {args.csv}" if args.csv else ""))
+    if run_history != "off":
+        print(f"Homogenization runs recorded in {run_history}")
+    sys.exit(0 if all(stage["status"] == "ok" for stage in record["stages"]) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Regression check of the run_*.sh scripts: a second run with nothing changed must succeed and
+skip every step.
+
+The project code is copied to a scratch directory, the synthetic raw inputs of the pipeline
+benchmark (benchmarks/pipeline_benchmark.py) are written to the data directory of each
+pipeline there, and its run script is run twice from its directory, with the downloads and
+the extraction skipped and the cell cache and run history off. The check fails when either
+run exits with an error, when a step of the second run is not skipped by the stage cache, or
+when an output differs between the two runs. Both runs are read from the run manifests they
+write (common/run_manifest.py); the script logs are kept in the scratch directory.
+
+Usage:
+    PYTHONPATH=. python3 benchmarks/rerun_check.py                       # all pipelines
+    PYTHONPATH=. python3 benchmarks/rerun_check.py relative_humidity --work-dir /tmp/rerun
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import List
+
+from benchmarks.pipeline_benchmark import BENCHMARK_ENV, SCALES, fabricate_inputs
+from common.pipelines import PIPELINES
+from common.run_manifest import compare, load_manifest, manifest_path
+from common.run_planner import RUN_HISTORY_ENV_VAR
+from common.stage_cache import PROJECT_ROOT
+
+# Run script of each pipeline and its options without network and extraction
+SHELL_RUNS = {
+    "accumulated_precipitation": ("run_precipitation.sh", ["--skip-eobs-download", "--skip-era5-download",
+                                                           "--skip-unzip", "--generate-csv"]),
+    "air_temperature": ("run_air_temperature.sh", ["--skip-eobs-download", "--skip-era5-download", "--skip-unzip",
+                                                   "--generate-csv"]),
+    "Albedo": ("run_SAL.sh", ["--skip-era5-download", "--skip-cmsaf-download", "--generate-csv"]),
+    "Land_Surface_Temperature": ("run_LST.sh", ["--skip-eumetsat-download", "--skip-cmsaf-download",
+                                                "--generate-csv"]),
+    "relative_humidity": ("run_relative_humidity.sh", ["--skip-eobs-download", "--skip-era5-download",
+                                                       "--skip-unzip", "--generate-csv"]),
+    "sea_level_pressure": ("run_pressure.sh", ["--skip-eobs-download", "--skip-unzip"]),
+    "solar_irradiance": ("run_solar_irradiance.sh", ["--skip-eobs-download", "--skip-unzip", "--generate-csv"]),
+    "wind_speed": ("run_wind_speed.sh", ["--skip-eobs-download", "--skip-era5-download", "--skip-unzip",
+                                         "--generate-csv"]),
+}
+# Left out of the copy of the project
+IGNORED = shutil.ignore_patterns(".git", "data", "logs", "__pycache__", "*.pyc")
+
+
+def copy_project(root: str, pipelines: List[str]) -> None:
+    """Copy the shared code and the scripts of pipelines, without data or logs, to root."""
+    for name in ["common"] + pipelines:
+        shutil.copytree(os.path.join(PROJECT_ROOT, name), os.path.join(root, name), ignore=IGNORED)
+
+
+def run_script(var_dir: str, script: str, options: List[str], env: dict, log_path: str) -> int:
+    with open(log_path, "w") as log:
+        return subprocess.run(["bash", script] + options, cwd=var_dir, env=env, stdout=log,
+                              stderr=subprocess.STDOUT).returncode
+
+
+def check_pipeline(pipeline: str, root: str, seed: int = 0) -> List[str]:
+    """Run the script of pipeline twice under root; returns the problems found."""
+    var_dir = os.path.join(root, pipeline)
+    inputs_dir = os.path.join(root, "inputs", pipeline)
+    fabricate_inputs(pipeline, inputs_dir, SCALES["small"], seed)
+    shutil.move(os.path.join(inputs_dir, "data"), os.path.join(var_dir, "data"))
+
+    # The scripts only look for the CDS configuration; no step contacts the CDS
+    home = os.path.join(root, "home")
+    os.makedirs(home, exist_ok=True)
+    open(os.path.join(home, ".cdsapirc"), "a").close()
+    env = dict(os.environ, **BENCHMARK_ENV, HOME=home)
+    env[RUN_HISTORY_ENV_VAR] = "off"
+
+    script, options = SHELL_RUNS[pipeline]
+    manifests, problems = [], []
+    for run in (1, 2):
+        log_path = os.path.join(root, f"{pipeline}_run{run}.log")
+        returncode = run_script(var_dir, script, options, env, log_path)
+        if returncode != 0:
+            return problems + [f"run {run} exited with {returncode}, see {log_path}"]
+        manifests.append(load_manifest(manifest_path(var_dir)))
+
+    first, second = manifests
+    problems.extend(f"step {s.name} was not skipped on the second run ({s.status})"
+                    for s in second.stages if s.status != "cached")
+    problems.extend(line for line in compare(first, second) if line.startswith("output"))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that rerunning the run_*.sh scripts with nothing changed '
+                                                 'succeeds and skips every step.')
+    parser.add_argument('pipelines', nargs='*', help=f'Pipelines to check (default: all): {", ".join(PIPELINES)}')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+    parser.add_argument('--work-dir', default=None,
+                        help='Empty directory for the project copy, the data and the logs, kept after the check '
+                             '(default: a temporary directory)')
+    args = parser.parse_args()
+
+    pipelines = args.pipelines or list(SHELL_RUNS)
+    unknown = [p for p in pipelines if p not in SHELL_RUNS]
+    if unknown:
+        print(f"Error: unknown pipelines {', '.join(unknown)}, expected: {', '.join(SHELL_RUNS)}")
+        sys.exit(1)
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        if os.listdir(args.work_dir):
+            print(f"Error: {args.work_dir} is not empty")
+            sys.exit(1)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="smicrab_rerun_")
+    failed = False
+    try:
+        copy_project(work_dir, pipelines)
+        for pipeline in pipelines:
+            problems = check_pipeline(pipeline, work_dir, args.seed)
+            print(f"[{'failed' if problems else 'ok':>6}] {pipeline}", flush=True)
+            for problem in problems:
+                print(f"         {problem}")
+            failed = failed or bool(problems)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
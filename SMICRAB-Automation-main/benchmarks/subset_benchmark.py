@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import os
+import time
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from common.chunk_index import ChunkIndex, open_subset, nearest_bounds, INDEX_SUFFIX
+
+# Same Italy box as the E-OBS processing scripts
+LON_MIN, LON_MAX = 6, 20
+LAT_MIN, LAT_MAX = 32, 49
+
+
+def io_counters():
+    """Bytes requested through read syscalls (rchar) and fetched from storage (read_bytes) so far."""
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters.get("rchar", 0), counters.get("read_bytes", 0)
+
+
+def measure(func):
+    rchar, read_bytes = io_counters()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    rchar_end, read_bytes_end = io_counters()
+    return result, elapsed, rchar_end - rchar, read_bytes_end - read_bytes
+
+
+def subset_with_xarray(path, variables):
+    """Current approach: open the full file lazily with xarray and isel the Italy box."""
+    with xr.open_dataset(path) as ds:
+        ds_subset = ds.isel(latitude=nearest_bounds(ds['latitude'].values, LAT_MIN, LAT_MAX),
+                            longitude=nearest_bounds(ds['longitude'].values, LON_MIN, LON_MAX))
+        return ds_subset[variables].load()
+
+
+def make_synthetic_file(path, n_days, chunks):
+    """Write an E-OBS-like 0.1 degree European file (int16 packed, zlib + shuffle)."""
+    lat = np.round(np.arange(25.05, 71.5, 0.1), 2)
+    lon = np.round(np.arange(-24.95, 45.5, 0.1), 2)
+    times = pd.date_range("2011-01-01", periods=n_days, freq="D")
+    rng = np.random.default_rng(0)
+    data = (10 + 5 * rng.standard_normal((n_days, len(lat), len(lon)))).astype("float32")
+    ds = xr.Dataset({"rr": (("time", "latitude", "longitude"), data, {"units": "mm"})},
+                    coords={"time": times, "latitude": lat, "longitude": lon})
+    encoding = {"rr": {"dtype": "int16", "scale_factor": 0.1, "_FillValue": -9999,
+                       "zlib": True, "shuffle": True, "chunksizes": chunks}}
+    ds.to_netcdf(path, encoding=encoding)
+
+
+def run(path, variable, repeat):
+    variables = ["time", "longitude", "latitude", variable]
+    print(f"\n{path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    if os.path.exists(path + INDEX_SUFFIX):
+        os.remove(path + INDEX_SUFFIX)
+    _, elapsed, rchar, _ = measure(lambda: ChunkIndex.load(path))
+    print(f"  index build (one-off): {elapsed:8.3f} s  {rchar / 1e6:10.2f} MB read")
+
+    rows = []
+    for _ in range(repeat):
+        reference, elapsed, rchar, read_bytes = measure(lambda: subset_with_xarray(path, variables))
+        rows.append(("xarray isel", elapsed, rchar, read_bytes, None))
+
+        index = ChunkIndex.load(path)
+        subset, elapsed, rchar, read_bytes = measure(
+            lambda: open_subset(path, variables, (LAT_MIN, LAT_MAX), (LON_MIN, LON_MAX), index=index))
+        rows.append(("chunk index", elapsed, rchar, read_bytes, index.bytes_read))
+
+        xr.testing.assert_allclose(reference, subset)
+
+    print(f"  {'method':<12} {'wall [s]':>9} {'rchar [MB]':>11} {'disk [MB]':>10} {'chunks [MB]':>12}")
+    for method in ("xarray isel", "chunk index"):
+        selected = [row for row in rows if row[0] == method]
+        elapsed = np.median([row[1] for row in selected])
+        rchar = np.median([row[2] for row in selected])
+        read_bytes = np.median([row[3] for row in selected])
+        chunk_bytes = selected[0][4]
+        chunk_text = f"{chunk_bytes / 1e6:12.2f}" if chunk_bytes is not None else f"{'-':>12}"
+        print(f"  {method:<12} {elapsed:9.3f} {rchar / 1e6:11.2f} {read_bytes / 1e6:10.2f} {chunk_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare bytes read and wall time of the E-OBS Italy subset '
+                                                 'with xarray and with the chunk byte-range index.')
+    parser.add_argument('files', nargs='*', help='NetCDF files to subset (e.g. data/E_OBS_rr_Daily/*.nc)')
+    parser.add_argument('--variable', default='rr', help='Data variable to subset (default: rr)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per method; the median is reported')
+    parser.add_argument('--synthetic-days', type=int, default=365,
+                        help='Days in the synthetic file used when no files are given')
+    args = parser.parse_args()
+
+    if args.files:
+        for path in args.files:
+            run(path, args.variable, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for chunks in [(1, 465, 705), (1, 100, 100), (30, 50, 50)]:
+            path = os.path.join(tmp_dir, f"rr_synthetic_{'x'.join(map(str, chunks))}.nc")
+            make_synthetic_file(path, args.synthetic_days, chunks)
+            run(path, "rr", args.repeat)
+
+
+if __name__ == "__main__":
+    main()
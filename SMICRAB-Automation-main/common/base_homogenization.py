@@ -1,19 +1,55 @@
+import os
 import abc
+import time
 import xarray as xr
 import pandas as pd
 import numpy as np
 from statsmodels.nonparametric.smoothers_lowess import lowess
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 from common.dataset_dto import DatasetDTO
+from common.neighbor_index import NeighborIndex, neighbor_mean, radius_cells
+from common.reference_series import DEFAULT_TOP_K, correlation_references, reference_method
+from common.cube_store import attach_cubes
+from common.cell_cache import CellCache, cell_cache_dir, code_fingerprint
+from common.breakpoint_catalog import BreakpointCatalog, catalog_path
+from common.run_planner import features_from_data, peak_memory_gb, record_run
+from common.derived_reference import open_reference
+from common.output_layout import get_output_profile, derived_significant_digit
+from common.zarr_store import export_zarr
+from common.pyramid import build_pyramid, pyramid_levels
 from common.homogenization_result import SNHTHomogenizationResult, PairwiseHomogenizationResult, BasicHomogenizationResult
+from common.tiling import GridWindow
 
 
 class BaseHomogenization(abc.ABC):
 
-    def __init__(self, eobs_file: str, era5_file: str):
-        self.eobs_ds: xr.Dataset = xr.open_dataset(eobs_file, decode_times=False)
-        self.era5_ds: xr.Dataset = xr.open_dataset(era5_file, decode_times=False)
+    # Neighbourhood (in grid cells) each cell's homogenization reads; the halo needed for tiling
+    neighbor_radius: int = 0
+    # Neighbours of a cell in the references: the valid cells within neighbor_radius_km, or the
+    # neighbor_count nearest ones (common/neighbor_index.py), averaged with inverse-distance
+    # weights of power neighbor_weighting (None for a plain mean)
+    neighbor_radius_km: Optional[float] = None
+    neighbor_count: Optional[int] = None
+    neighbor_weighting: Optional[float] = None
+    # Neighbours kept per cell in correlation-weighted references (SMICRAB_REFERENCE=correlation)
+    reference_top_k: int = DEFAULT_TOP_K
+    # ERA5-derived reference (common/derived_reference.py) compared against E-OBS, if any
+    derived_reference: Optional[str] = None
+    # Cost model of the run planner (common/run_planner.py): snht, pairwise or adjustment
+    cost_model: str = "snht"
+
+    def __init__(self, eobs_file: str, era5_file: str, window: Optional[GridWindow] = None):
+        self._started = time.perf_counter()
+        # With SMICRAB_CUBE_STORE set, the gridded variables are memory-mapped from decoded
+        # copies (common/cube_store.py) and .values no longer decompresses them
+        self.eobs_ds: xr.Dataset = attach_cubes(xr.open_dataset(eobs_file, decode_times=False), eobs_file)
+        self.era5_ds: xr.Dataset = attach_cubes(xr.open_dataset(era5_file, decode_times=False), era5_file)
+        self.era5_file = era5_file
+        self.window = window
+        if window is not None:
+            self.eobs_ds = window.select(self.eobs_ds)
+            self.era5_ds = window.select(self.era5_ds)
         # self.era5_ds = self.era5_ds.isel(longitude=slice(20, 141))
         # self.era5_ds = self.era5_ds.isel(valid_time=slice(0, 150), longitude=slice(20, 141))
         # self.eobs_ds = self.eobs_ds.isel(longitude=slice(20, 141))
@@ -30,6 +66,10 @@ class BaseHomogenization(abc.ABC):
         self.uncertainty_var_name = "combined_uncertainty"
         self.epoch = pd.Timestamp('1970-01-01')
         self.base_date = pd.Timestamp('2011-01-01')
+        self._neighbor_lists: dict = {}
+        self.reference_series: Optional[np.ndarray] = None
+        # (lat_idx, lon_idx, breakpoints, innovations) of every cell, saved as the breakpoint catalog
+        self.breakpoint_cells: Optional[list] = None
         self.results: SNHTHomogenizationResult | PairwiseHomogenizationResult | BasicHomogenizationResult | None = None
 
         self._align_eobs_times()
@@ -52,6 +92,81 @@ class BaseHomogenization(abc.ABC):
     def execute(self, monthly_span: List[float], output_path: str, uncertainty_var_name: Optional[str]):
         pass
 
+    @classmethod
+    def halo_cells(cls, lats: np.ndarray, lons: np.ndarray) -> int:
+        """Halo (in grid cells) a tile of the grid lats x lons needs to see every neighbour of its core."""
+        if cls.neighbor_radius_km is None:
+            return cls.neighbor_radius
+        return max(cls.neighbor_radius, radius_cells(cls.neighbor_radius_km, lats, lons))
+
+    def get_neighbor_lists(self, data: DatasetDTO) -> tuple:
+        """
+        Neighbour lists of the cells of data and its values as a (time, cells) array, built
+        once per data array.
+        """
+        key = id(data.data)
+        if key not in self._neighbor_lists:
+            index = NeighborIndex.from_data(data.lats, data.lons, data.data)
+            lists = index.neighbors(self.neighbor_radius_km, self.neighbor_count)
+            columns = np.ascontiguousarray(data.data).reshape(data.data.shape[0], -1)
+            # The array is kept with its lists so that its id is not reused
+            self._neighbor_lists[key] = (data.data, lists, columns)
+        return self._neighbor_lists[key][1:]
+
+    def get_neighbor_average_series(self, data: DatasetDTO, lon_idx: int, lat_idx: int) -> np.ndarray:
+        """
+        Calculate the neighbour-averaged time series of a cell of a (time, lat, lon) dataset.
+
+        Args:
+            data (DatasetDTO): Dataset whose lats and lons match the axes of data.data
+            lon_idx (int): Longitude index (0-based)
+            lat_idx (int): Latitude index (0-based)
+
+        Returns:
+            np.ndarray: 1D time series of neighbour averages
+        """
+        lists, columns = self.get_neighbor_lists(data)
+        indices, _ = lists.cell(lat_idx, lon_idx)
+        weights = None if self.neighbor_weighting is None else lists.weights(lat_idx, lon_idx, self.neighbor_weighting)
+        return neighbor_mean(columns, indices, weights)
+
+    def prepare_references(self, eobs_data: DatasetDTO, era5_data: DatasetDTO) -> None:
+        """
+        Build the references of all cells at once when SMICRAB_REFERENCE=correlation.
+
+        The candidates are the E-OBS series filled with ERA5, as homogenized, correlated with
+        their ERA5 neighbours (see common/reference_series.py). With the default mean method
+        nothing is precomputed and get_reference_series() averages the neighbours cell by cell.
+        """
+        if reference_method() != "correlation":
+            return
+        candidates = eobs_data.data
+        if len(era5_data.lats) > 1 and (era5_data.lats[0] > era5_data.lats[-1]) != (eobs_data.lats[0] > eobs_data.lats[-1]):
+            candidates = candidates[:, ::-1, :]
+        candidates = self.fill_missing_values(candidates, era5_data.data)
+        lists, _ = self.get_neighbor_lists(era5_data)
+        self.reference_series = correlation_references(candidates, era5_data.data, lists, self.reference_top_k)
+
+    def get_reference_series(self, data: DatasetDTO, lon_idx: int, lat_idx: int) -> np.ndarray:
+        """Reference series of a cell of data: precomputed by prepare_references(), or the neighbour mean."""
+        if self.reference_series is not None:
+            return self.reference_series[:, lat_idx, lon_idx]
+        return self.get_neighbor_average_series(data, lon_idx, lat_idx)
+
+    def collect_breakpoints(self, cells) -> None:
+        """
+        Keep the breakpoints of the cells, given as (lat_idx, lon_idx, breakpoints, innovations)
+        on the E-OBS grid, to be saved with the results as a breakpoint catalog.
+        """
+        self.breakpoint_cells = list(cells)
+
+    def load_derived_reference(self) -> np.ndarray:
+        """Values of the cached derived_reference of the ERA5 file, on the same grid and window as era5_ds."""
+        reference_ds = open_reference(self.era5_file, self.derived_reference)
+        if self.window is not None:
+            reference_ds = self.window.select(reference_ds)
+        return reference_ds[self.derived_reference].values
+
     def load_eobs(self, eobs_ds: xr.Dataset, variable_name: str) -> DatasetDTO:
         lons = eobs_ds['longitude'].values
         lats = eobs_ds['latitude'].values
@@ -119,11 +234,32 @@ class BaseHomogenization(abc.ABC):
         global_attributes : dict, optional
             Global dataset attributes
         compress : bool
-            Enable NetCDF compression (default: True)
+            Enable NetCDF compression and shuffle (default: True); the chunk layout
+            follows the SMICRAB_OUTPUT_PROFILE profile (see common/output_layout.py),
+            also used for the Zarr copy written when SMICRAB_ZARR_FORMAT is set
         homogenization_method : str
             Homogenization method used (default: "SNHT")
         """
 
+        uncertainty_data = self.uncertainty_data
+        catalog = None
+        if self.breakpoint_cells is not None:
+            catalog = BreakpointCatalog.from_cells(
+                self.breakpoint_cells, coordinates["latitude"][1], coordinates["longitude"][1],
+                coordinates["time"][1],
+                attrs={"variable": variable_name, "method": homogenization_method,
+                       **({"units": variable_attributes["units"]}
+                          if variable_attributes and "units" in variable_attributes else {})})
+        if self.window is not None:
+            # Only the tile core is saved; the halo cells were loaded as neighbours
+            original_data = self.window.crop(original_data)
+            adjusted_data = self.window.crop(adjusted_data)
+            coordinates = self.window.crop_coordinates(coordinates)
+            if uncertainty_data is not None:
+                uncertainty_data = self.window.crop(uncertainty_data)
+            if catalog is not None:
+                catalog = catalog.crop(self.window.core_lat, self.window.core_lon)
+
         # 1. Initialize Dataset with Coordinates
         dataset = xr.Dataset(coords=coordinates)
 
@@ -153,9 +289,9 @@ class BaseHomogenization(abc.ABC):
             "processing": f"{homogenization_method} homogenization with ERA5 reference"
         })
 
-        if self.uncertainty_data is not None:
+        if uncertainty_data is not None:
             uncertainty_var = self.uncertainty_var_name
-            dataset[uncertainty_var] = (("time", "latitude", "longitude"), self.uncertainty_data)
+            dataset[uncertainty_var] = (("time", "latitude", "longitude"), uncertainty_data)
             dataset[uncertainty_var].attrs.update({
                 'units': variable_attributes.get('units', '') if variable_attributes else '',
                 'long_name': f"Combined uncertainty of {variable_name}_adjusted using LOESS residuals"
@@ -172,27 +308,19 @@ class BaseHomogenization(abc.ABC):
             default_globals.update(global_attributes)
         dataset.attrs.update(default_globals)
 
-        # 6. Configure Encoding
+        # 6. Configure Encoding (chunking from SMICRAB_OUTPUT_PROFILE; the derived uncertainty
+        # field is optionally quantized to SMICRAB_DERIVED_DIGITS decimal digits)
+        profile = get_output_profile()
+        shape = original_data.shape
         encoding = {
-            original_var: {
-                "zlib": compress,
-                "complevel": 4 if compress else 0,
-                "_FillValue": np.nan
-            },
-            adjusted_var: {
-                "zlib": compress,
-                "complevel": 4 if compress else 0,
-                "_FillValue": np.nan
-            }
+            original_var: profile.encoding(shape, compress),
+            adjusted_var: profile.encoding(shape, compress),
         }
 
         # Add encoding for uncertainty if it exists
-        if self.uncertainty_data is not None:
-            encoding[self.uncertainty_var_name] = {
-                "zlib": compress,
-                "complevel": 4 if compress else 0,
-                "_FillValue": np.nan
-            }
+        if uncertainty_data is not None:
+            encoding[self.uncertainty_var_name] = profile.encoding(
+                shape, compress, least_significant_digit=derived_significant_digit())
 
         # Coordinate encoding
         for coord in coordinates:
@@ -202,6 +330,26 @@ class BaseHomogenization(abc.ABC):
         dataset.to_netcdf(output_path, encoding=encoding)
         print(f"Saved homogenized {variable_name} to: {output_path}")
 
+        # 8. Breakpoints of every cell, next to the output (common/breakpoint_catalog.py)
+        if catalog is not None:
+            catalog.write(catalog_path(output_path))
+            print(f"Saved {len(catalog)} breakpoints to: {catalog_path(output_path)}")
+
+        # 9. Zarr copy and coarse overviews when SMICRAB_ZARR_FORMAT / SMICRAB_PYRAMID are set
+        # (tiled runs build them once the tiles are stitched)
+        if self.window is None:
+            export_zarr(output_path)
+            if pyramid_levels():
+                build_pyramid(output_path)
+
+        # 10. Wall time and peak memory of the run, next to what the run planner predicted
+        # (tiled runs are recorded as a whole by run_tiled)
+        if self.window is None:
+            lats, lons = coordinates["latitude"][1], coordinates["longitude"][1]
+            features = features_from_data(self.cost_model, lats, lons, original_data, original_data.shape[0],
+                                          self.neighbor_radius_km, self.neighbor_count, self.halo_cells(lats, lons))
+            record_run(features, "whole", None, 1, time.perf_counter() - self._started, peak_memory_gb())
+
 
     def get_cf_coordinates(self, lon, lat, time, time_units="seconds since 1970-01-01 00:00:00"):
         """
@@ -343,4 +491,47 @@ class BaseHomogenization(abc.ABC):
     def print_homo_progress(self, index, total):
         if index % 20 == 0:
             lons = self.eobs_data.lons
-            print(f'homogenization for lat [{np.round(lons[index], 1)} - {np.round(lons[min(total-1, index + 20)])}]')
\ No newline at end of file
+            print(f'homogenization for lat [{np.round(lons[index], 1)} - {np.round(lons[min(total-1, index + 20)])}]')
+
+
+class CellCacheHomogenization(abc.ABC):
+    """
+    Homogenization of independent cells whose results are kept in the cell cache
+    (common/cell_cache.py). Mixed into the BaseHomogenization subclasses that homogenize
+    cell by cell, before BaseHomogenization in their bases.
+    """
+
+    # Attributes and classes the per-cell results depend on, besides the cell's inputs; part of
+    # the keys of the cell cache with the source of the subclass
+    cell_cache_parameters: Tuple[str, ...] = ()
+    cell_cache_code: tuple = ()
+
+    def open_cell_cache(self) -> Optional[CellCache]:
+        """Cache of this homogenization's per-cell results, or None when SMICRAB_CELL_CACHE is off."""
+        cache_dir = cell_cache_dir()
+        if cache_dir is None:
+            return None
+        name = type(self).__name__
+        namespace = {
+            "class": name,
+            "parameters": {attr: getattr(self, attr, None) for attr in self.cell_cache_parameters},
+            "code": code_fingerprint((type(self), BaseHomogenization, CellCacheHomogenization)
+                                     + tuple(self.cell_cache_code)),
+        }
+        return CellCache(os.path.join(cache_dir, f"{name}.sqlite"), namespace)
+
+    @abc.abstractmethod
+    def homogenize_cell(self, *inputs: np.ndarray) -> dict:
+        """Homogenize one cell from its input series, as a dict of picklable results."""
+        pass
+
+    def homogenize_cell_cached(self, cell_cache: Optional[CellCache], *inputs: np.ndarray) -> dict:
+        """homogenize_cell(*inputs), read from cell_cache when a cell with the same inputs was homogenized before."""
+        if cell_cache is None:
+            return self.homogenize_cell(*inputs)
+        key = cell_cache.key(*inputs)
+        result = cell_cache.get(key)
+        if result is None:
+            result = self.homogenize_cell(*inputs)
+            cell_cache.put(key, result)
+        return result
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Catalog of the breakpoints detected by a homogenization.
+
+The homogenized NetCDF holds the corrected series but not where they were corrected, so
+quality checks (where did SNHT find breaks, in which years, how large were the
+adjustments) had to rerun the detection. Each homogenization now also writes the
+breakpoints of every cell to a small sidecar next to its output:
+
+    <output stem>_breakpoints.nc
+
+as a ragged table along a "breakpoint" dimension: the grid indices of the cell, the time
+index of the breakpoint and the innovation (the adjustment applied to the product for the
+segment ending at the breakpoint), sorted by cell and time, with the latitude, longitude
+and time coordinates of the grid. The artificial breakpoint the detections put at the
+start of a series is not listed. Tiled runs merge the catalogs of their tiles.
+
+The whole table is read at once (a few bytes per breakpoint), so maps and histograms are
+computed in milliseconds with BreakpointCatalog:
+
+    catalog = BreakpointCatalog.read("data/.../hu_..._homogenized_breakpoints.nc")
+    catalog.count_map()                      # breakpoints per cell, (lat, lon)
+    catalog.select(start="2015").histogram("year")
+
+Usage:
+    PYTHONPATH=.. python3 -m common.breakpoint_catalog data/E_OBS_hu_Monthly/hu_..._breakpoints.nc --by year
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import netCDF4
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+TIME_UNITS = "seconds since 1970-01-01 00:00:00"
+INDEX_VARIABLES = ("lat_index", "lon_index", "time_index")
+INNOVATION_STATISTICS = ("sum", "mean", "max_abs")
+HISTOGRAM_BINS = ("year", "month", "time")
+
+
+def catalog_path(output_path: str) -> str:
+    """Path of the breakpoint catalog of the homogenized file output_path."""
+    return f"{os.path.splitext(output_path)[0]}_breakpoints.nc"
+
+
+@dataclass
+class BreakpointCatalog:
+    """
+    Breakpoints of the cells of a (latitude, longitude) grid, one entry per breakpoint.
+
+    Attributes:
+        latitude, longitude: Coordinates of the grid rows and columns
+        time: Time steps of the series, in seconds since 1970-01-01
+        lat_index, lon_index, time_index: Cell and time step of each breakpoint
+        innovation: Adjustment applied for the segment ending at each breakpoint
+        attrs: Global attributes (source file, variable, method)
+    """
+    latitude: np.ndarray
+    longitude: np.ndarray
+    time: np.ndarray
+    lat_index: np.ndarray
+    lon_index: np.ndarray
+    time_index: np.ndarray
+    innovation: np.ndarray
+    attrs: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_cells(cls, cells: Iterable[Tuple[int, int, Sequence[int], Sequence[float]]], latitude: np.ndarray,
+                   longitude: np.ndarray, time: np.ndarray, attrs: Optional[dict] = None) -> "BreakpointCatalog":
+        """
+        Catalog of per-cell results.
+
+        Args:
+            cells: (lat_idx, lon_idx, breakpoints, innovations) of each cell, with the
+                breakpoints as time indices and the innovations aligned with them
+            latitude, longitude, time: Coordinates of the grid and of the time steps
+            attrs: Global attributes
+        """
+        lat_index, lon_index, time_index, innovation = [], [], [], []
+        for lat_idx, lon_idx, breakpoints, innovations in cells:
+            breakpoints = np.asarray(breakpoints, dtype=np.int64)
+            keep = (breakpoints > 0) & (breakpoints < len(time))
+            if not keep.any():
+                continue
+            lat_index.append(np.full(keep.sum(), lat_idx))
+            lon_index.append(np.full(keep.sum(), lon_idx))
+            time_index.append(breakpoints[keep])
+            innovation.append(np.asarray(innovations, dtype=np.float64)[keep])
+
+        def _join(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        catalog = cls(np.asarray(latitude), np.asarray(longitude), np.asarray(time),
+                      _join(lat_index, np.int32), _join(lon_index, np.int32), _join(time_index, np.int32),
+                      _join(innovation, np.float32), dict(attrs or {}))
+        return catalog._sorted()
+
+    @classmethod
+    def merge(cls, catalogs: List["BreakpointCatalog"]) -> "BreakpointCatalog":
+        """
+        One catalog of the catalogs of disjoint parts (tiles) of a grid with the same time steps.
+
+        The grid of the result is the union of their grids; indices are remapped onto it.
+        """
+        latitude = np.unique(np.concatenate([c.latitude for c in catalogs]))
+        longitude = np.unique(np.concatenate([c.longitude for c in catalogs]))
+        time = catalogs[0].time
+        for catalog in catalogs[1:]:
+            if not np.array_equal(catalog.time, time):
+                raise ValueError("Catalogs with different time steps cannot be merged")
+        merged = cls(
+            latitude, longitude, time,
+            np.concatenate([np.searchsorted(latitude, c.latitude[c.lat_index]) for c in catalogs]).astype(np.int32),
+            np.concatenate([np.searchsorted(longitude, c.longitude[c.lon_index]) for c in catalogs]).astype(np.int32),
+            np.concatenate([c.time_index for c in catalogs]).astype(np.int32),
+            np.concatenate([c.innovation for c in catalogs]).astype(np.float32),
+            dict(catalogs[0].attrs),
+        )
+        return merged._sorted()
+
+    @classmethod
+    def read(cls, path: str) -> "BreakpointCatalog":
+        with netCDF4.Dataset(path) as nc:
+            values = {name: np.asarray(nc.variables[name][:]) for name in
+                      ("latitude", "longitude", "time") + INDEX_VARIABLES + ("innovation",)}
+            attrs = {k: nc.getncattr(k) for k in nc.ncattrs()}
+        return cls(**values, attrs=attrs)
+
+    def write(self, path: str) -> None:
+        """Write the catalog to path, through a .part file."""
+        tmp_path = f"{path}.part"
+        with netCDF4.Dataset(tmp_path, "w", format="NETCDF4") as nc:
+            nc.setncatts({"Conventions": "CF-1.8", "history": f"Created on {np.datetime64('now')}", **self.attrs,
+                          "title": "Breakpoints detected by the homogenization"})
+            for name, values in (("latitude", self.latitude), ("longitude", self.longitude), ("time", self.time)):
+                nc.createDimension(name, len(values))
+                coord = nc.createVariable(name, np.float64, (name,))
+                coord[:] = values
+            nc.variables["latitude"].setncatts({"standard_name": "latitude", "units": "degrees_north"})
+            nc.variables["longitude"].setncatts({"standard_name": "longitude", "units": "degrees_east"})
+            nc.variables["time"].setncatts({"standard_name": "time", "units": TIME_UNITS, "calendar": "standard"})
+
+            nc.createDimension("breakpoint", len(self))
+            for name, dim in zip(INDEX_VARIABLES, ("latitude", "longitude", "time")):
+                var = nc.createVariable(name, np.int32, ("breakpoint",), zlib=True)
+                var.long_name = f"Index along {dim} of the breakpoint"
+                var[:] = getattr(self, name)
+            var = nc.createVariable("innovation", np.float32, ("breakpoint",), zlib=True)
+            var.long_name = "Adjustment applied for the segment ending at the breakpoint"
+            if "units" in self.attrs:
+                var.units = self.attrs["units"]
+            var[:] = self.innovation
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.time_index)
+
+    def _sorted(self) -> "BreakpointCatalog":
+        order = np.lexsort((self.time_index, self.lon_index, self.lat_index))
+        return self._take(order)
+
+    def _take(self, entries: np.ndarray) -> "BreakpointCatalog":
+        return BreakpointCatalog(self.latitude, self.longitude, self.time, self.lat_index[entries],
+                                 self.lon_index[entries], self.time_index[entries], self.innovation[entries],
+                                 self.attrs)
+
+    def crop(self, lat: slice, lon: slice) -> "BreakpointCatalog":
+        """The breakpoints of the cells of a sub-grid, given as index slices of the grid."""
+        lat_range = range(len(self.latitude))[lat]
+        lon_range = range(len(self.longitude))[lon]
+        inside = ((self.lat_index >= lat_range.start) & (self.lat_index < lat_range.stop)
+                  & (self.lon_index >= lon_range.start) & (self.lon_index < lon_range.stop))
+        return BreakpointCatalog(self.latitude[lat], self.longitude[lon], self.time,
+                                 (self.lat_index[inside] - lat_range.start).astype(np.int32),
+                                 (self.lon_index[inside] - lon_range.start).astype(np.int32),
+                                 self.time_index[inside], self.innovation[inside], self.attrs)
+
+    def select(self, start: Optional[str] = None, end: Optional[str] = None,
+               min_innovation: Optional[float] = None) -> "BreakpointCatalog":
+        """
+        The breakpoints between the dates start and end (inclusive, e.g. "2015" or
+        "2016-06-30") and with an absolute innovation of at least min_innovation.
+        """
+        seconds = self.time[self.time_index]
+        keep = np.ones(len(self), dtype=bool)
+        if start is not None:
+            keep &= seconds >= (pd.Timestamp(start) - pd.Timestamp("1970-01-01")).total_seconds()
+        if end is not None:
+            # A date names its whole period: "2016" ends where "2017" starts
+            end_period = pd.Period(end)
+            keep &= seconds < ((end_period + 1).start_time - pd.Timestamp("1970-01-01")).total_seconds()
+        if min_innovation is not None:
+            keep &= np.abs(self.innovation) >= min_innovation
+        return self._take(np.flatnonzero(keep))
+
+    def _flat_cells(self) -> np.ndarray:
+        return self.lat_index.astype(np.int64) * len(self.longitude) + self.lon_index
+
+    def count_map(self) -> np.ndarray:
+        """Number of breakpoints of every cell, as a (lat, lon) array."""
+        shape = (len(self.latitude), len(self.longitude))
+        return np.bincount(self._flat_cells(), minlength=shape[0] * shape[1]).reshape(shape)
+
+    def innovation_map(self, statistic: str = "sum") -> np.ndarray:
+        """
+        Innovations of every cell, as a (lat, lon) array: their sum, mean or the one with the
+        largest absolute value (max_abs); NaN where a cell has no breakpoint.
+        """
+        if statistic not in INNOVATION_STATISTICS:
+            raise ValueError(f"Unknown statistic '{statistic}'. Available: {', '.join(INNOVATION_STATISTICS)}")
+        shape = (len(self.latitude), len(self.longitude))
+        cells = self._flat_cells()
+        counts = np.bincount(cells, minlength=shape[0] * shape[1])
+        values = np.full(shape[0] * shape[1], np.nan)
+        if statistic == "max_abs":
+            # Entries sorted by increasing |innovation|: the last one written per cell is kept
+            order = np.argsort(np.abs(self.innovation), kind="stable")
+            values[cells[order]] = self.innovation[order]
+        else:
+            sums = np.bincount(cells, weights=self.innovation.astype(np.float64), minlength=len(values))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.where(counts > 0, sums / counts if statistic == "mean" else sums, np.nan)
+        return values.reshape(shape)
+
+    def histogram(self, by: str = "year") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Number of breakpoints per year, calendar month (1-12) or time step.
+
+        Returns:
+            (labels, counts); for time steps, every step of the series is listed
+        """
+        if by not in HISTOGRAM_BINS:
+            raise ValueError(f"Unknown histogram '{by}'. Available: {', '.join(HISTOGRAM_BINS)}")
+        if by == "time":
+            return pd.to_datetime(self.time, unit="s").values, np.bincount(self.time_index, minlength=len(self.time))
+        dates = pd.to_datetime(self.time[self.time_index], unit="s")
+        return np.unique(dates.year if by == "year" else dates.month, return_counts=True)
+
+    def cell(self, lat: float, lon: float) -> pd.DataFrame:
+        """Breakpoints of the grid cell nearest to (lat, lon)."""
+        i = int(np.abs(self.latitude - lat).argmin())
+        j = int(np.abs(self.longitude - lon).argmin())
+        return self._take(np.flatnonzero((self.lat_index == i) & (self.lon_index == j))).to_frame()
+
+    def to_frame(self) -> pd.DataFrame:
+        """The catalog as a table with the coordinates and date of every breakpoint."""
+        return pd.DataFrame({
+            "latitude": self.latitude[self.lat_index],
+            "longitude": self.longitude[self.lon_index],
+            "time": pd.to_datetime(self.time[self.time_index], unit="s"),
+            "innovation": self.innovation,
+        })
+
+
+def merge_catalogs(paths: List[str], output_path: str) -> Optional[str]:
+    """Merge the catalogs at paths (e.g. of tiles) into output_path; None if there are none."""
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        return None
+    BreakpointCatalog.merge([BreakpointCatalog.read(path) for path in paths]).write(output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the breakpoint catalog of a homogenization.')
+    parser.add_argument('catalog', help='Breakpoint catalog (<output stem>_breakpoints.nc)')
+    parser.add_argument('--by', choices=HISTOGRAM_BINS[:2], default='year', help='Histogram bins (default: year)')
+    parser.add_argument('--start', default=None, help='Only breakpoints from this date, e.g. 2015 or 2015-06')
+    parser.add_argument('--end', default=None, help='Only breakpoints up to this date')
+    parser.add_argument('--min-innovation', type=float, default=None,
+                        help='Only breakpoints with at least this absolute innovation')
+    parser.add_argument('--cell', nargs=2, type=float, metavar=('LAT', 'LON'), default=None,
+                        help='List the breakpoints of the cell nearest to LAT LON')
+    args = parser.parse_args()
+
+    try:
+        catalog = BreakpointCatalog.read(args.catalog).select(args.start, args.end, args.min_innovation)
+    except Exception as e:
+        print(f"Error reading {args.catalog}: {str(e)}")
+        sys.exit(1)
+
+    if args.cell:
+        print(catalog.cell(*args.cell).to_string(index=False))
+        return
+    counts = catalog.count_map()
+    print(f"{len(catalog)} breakpoints in {np.count_nonzero(counts)} of {counts.size} cells "
+          f"(at most {counts.max() if counts.size else 0} per cell)")
+    for label, count in zip(*catalog.histogram(args.by)):
+        print(f"{label:>6}: {count}")
+
+
+if __name__ == "__main__":
+    main()
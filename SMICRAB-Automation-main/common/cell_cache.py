@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of per-cell homogenization results.
+
+Most reruns of a homogenization change nothing for most cells: the E-OBS and ERA5 inputs
+and the parameters are the same. Each cell's result is stored under the SHA-256 of its
+inputs (the filled series and its reference), the parameters of the homogenization and
+the source code of the classes computing it, so unchanged cells are read back instead of
+recomputed, in whole-grid and tiled runs alike, and any change to the inputs, parameters
+or code of a cell makes it a miss.
+
+Results are kept in one SQLite file per homogenization class, <cache dir>/<class>.sqlite,
+as compressed .npz blobs (corrected series, breakpoints and diagnostics). The cache is on
+by default in ./data/cell_cache of the variable directory; SMICRAB_CELL_CACHE selects
+another directory, or "off" disables it. Hits and misses are printed at the end of each
+homogenization and added to the run report of the orchestrator.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.cell_cache data/cell_cache            # entries and size of each cache
+    PYTHONPATH=.. python3 -m common.cell_cache data/cell_cache --clear
+"""
+import io
+import os
+import sys
+import glob
+import json
+import inspect
+import sqlite3
+import hashlib
+import argparse
+import numpy as np
+from typing import Dict, Optional, Sequence
+
+from common.stage_cache import add_step_stats
+
+CELL_CACHE_ENV_VAR = "SMICRAB_CELL_CACHE"
+DEFAULT_CACHE_DIR = "./data/cell_cache"
+# Results written to the database per transaction
+WRITE_BATCH = 1000
+
+
+def cell_cache_dir() -> Optional[str]:
+    """Cache directory selected by SMICRAB_CELL_CACHE, or None when the cache is off."""
+    value = os.environ.get(CELL_CACHE_ENV_VAR, "").strip()
+    if value.lower() in ("0", "off", "no", "false"):
+        return None
+    if value.lower() in ("", "1", "on", "yes", "true"):
+        return DEFAULT_CACHE_DIR
+    return value
+
+
+def code_fingerprint(objects: Sequence) -> str:
+    """SHA-256 of the source files defining objects (classes, functions or modules)."""
+    digest = hashlib.sha256()
+    for path in sorted({os.path.abspath(inspect.getsourcefile(obj)) for obj in objects}):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _pack(result: Dict) -> bytes:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **{name: np.asarray(value) for name, value in result.items()})
+    return buffer.getvalue()
+
+
+def _unpack(blob: bytes) -> Dict:
+    with np.load(io.BytesIO(blob), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+class CellCache:
+    """
+    Per-cell results of one homogenization, keyed by their inputs.
+
+    Args:
+        path: SQLite file of the cache
+        namespace: Identifies the homogenization: class, parameters and code fingerprint;
+            part of every key
+    """
+
+    def __init__(self, path: str, namespace: Dict):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._prefix = hashlib.sha256(json.dumps(namespace, sort_keys=True, default=str).encode()).digest()
+        # Tiles running in parallel share the file; WAL lets them read while one writes
+        self._db = sqlite3.connect(path, timeout=300)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cells (key BLOB PRIMARY KEY, value BLOB NOT NULL)")
+        self._db.commit()
+        self._pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *arrays: np.ndarray) -> bytes:
+        """Key of a cell with the given input arrays."""
+        digest = hashlib.sha256(self._prefix)
+        for array in arrays:
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        """Cached result of key, or None (counted as a hit or a miss)."""
+        row = self._db.execute("SELECT value FROM cells WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _unpack(row[0])
+
+    def put(self, key: bytes, result: Dict) -> None:
+        """Store the result (a dict of arrays or scalars) of key."""
+        self._pending.append((key, _pack(result)))
+        if len(self._pending) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO cells (key, value) VALUES (?, ?)", self._pending)
+            self._pending = []
+
+    def close(self) -> None:
+        """Write pending results, print the hit rate and add it to the step statistics."""
+        self.flush()
+        self._db.close()
+        total = self.hits + self.misses
+        if total:
+            print(f"Cell cache: {self.hits} of {total} cells reused ({self.hits / total:.1%}), "
+                  f"{self.misses} computed")
+        add_step_stats("cell_cache", {"hits": self.hits, "misses": self.misses})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or clear the per-cell homogenization caches.')
+    parser.add_argument('cache_dir', nargs='?', default=None,
+                        help=f'Cache directory (default: {CELL_CACHE_ENV_VAR}, or {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--clear', action='store_true', help='Delete the caches')
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or cell_cache_dir() or DEFAULT_CACHE_DIR
+    for path in sorted(glob.glob(os.path.join(cache_dir, "*.sqlite"))):
+        try:
+            if args.clear:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+                print(f"Removed {path}")
+                continue
+            with sqlite3.connect(path) as db:
+                count = db.execute("SELECT COUNT(*) FROM cells").fetchone()[0]
+            print(f"{os.path.basename(path)}: {count} cells, {os.path.getsize(path) / 1e6:.1f} MB")
+        except Exception as e:
+            print(f"Error reading {path}: {str(e)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import os
+import shutil
+import numpy as np
+import xarray as xr
+import netCDF4
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+# Source encoding carried over to rewritten variables that get no explicit compression
+_KEPT_ENCODING = ('dtype', 'zlib', 'complevel', 'shuffle', '_FillValue', 'scale_factor', 'add_offset')
+
+
+@dataclass
+class CFUpdatePlan:
+    """
+    Declarative description of the changes a CF-compliance stage makes to a NetCDF file.
+
+    Variable names in attrs, default_attrs, coord_values, dtypes and transforms refer to the names after renames have been applied. Entries for variables
+    that are not in the file are ignored.
+
+    Attributes:
+        renames: Variables and dimensions to rename (old name -> new name)
+        attrs: Attributes to set on each variable, overwriting existing values
+        default_attrs: Attributes to set on each variable only when they are missing
+        global_attrs: Global attributes to set, overwriting existing values
+        default_global_attrs: Global attributes to set only when they are missing
+        coord_values: Replacement values for 1-D coordinate variables (e.g. a grid shift)
+        dtypes: Required on-disk dtype of each variable
+        time_encoding: Target 'units', 'calendar' and/or 'dtype' of the time variable
+        transforms: Functions applied to the values of a variable (e.g. unit conversions)
+        compression: Encoding applied to every data variable when the file is rewritten
+    """
+    renames: Dict[str, str] = field(default_factory=dict)
+    attrs: Dict[str, dict] = field(default_factory=dict)
+    default_attrs: Dict[str, dict] = field(default_factory=dict)
+    global_attrs: dict = field(default_factory=dict)
+    default_global_attrs: dict = field(default_factory=dict)
+    coord_values: Dict[str, np.ndarray] = field(default_factory=dict)
+    dtypes: Dict[str, str] = field(default_factory=dict)
+    time_encoding: dict = field(default_factory=dict)
+    transforms: Dict[str, Callable[[xr.DataArray], xr.DataArray]] = field(default_factory=dict)
+    compression: Optional[dict] = None
+
+    @classmethod
+    def from_dataset(cls, ds: xr.Dataset, **kwargs) -> "CFUpdatePlan":
+        """
+        Plan that gives a file the attributes and 1-D coordinate values of ds.
+
+        ds is the file opened lazily with xarray and edited by a make_cf_compliant function;
+        only its metadata and coordinates are read, never its data variables. Any other plan
+        field (renames, dtypes, time_encoding, ...) can be passed as a keyword argument.
+
+        A time_encoding without units gets the units to_netcdf would choose for the decoded
+        time of ds (e.g. days since its first date), as when the file was rewritten with it.
+        """
+        attrs = {name: dict(var.attrs) for name, var in ds.variables.items()}
+        coord_values = {name: ds[name].values for name in ds.dims
+                        if name in ds.coords and np.issubdtype(ds[name].dtype, np.number)}
+        time_encoding = dict(kwargs.pop('time_encoding', {}))
+        if time_encoding and 'units' not in time_encoding and 'time' in ds.coords \
+                and np.issubdtype(ds['time'].dtype, np.datetime64):
+            time_encoding['units'] = xr.coding.times.infer_datetime_units(ds['time'].values)
+            time_encoding.setdefault('calendar', 'proleptic_gregorian')
+        return cls(attrs=attrs, global_attrs=dict(ds.attrs), coord_values=coord_values,
+                   time_encoding=time_encoding, **kwargs)
+
+
+@dataclass
+class CFUpdateReport:
+    """Outcome of apply_cf_update: which path was taken and why."""
+    output_path: str
+    method: str  # "metadata" or "rewrite"
+    reasons: List[str]
+
+    def __str__(self):
+        if self.method == "metadata":
+            return f"CF update applied to the metadata of a byte copy, data not re-encoded: {self.output_path}"
+        return f"CF update required a streaming rewrite ({'; '.join(self.reasons)}): {self.output_path}"
+
+
+def rewrite_reasons(nc: netCDF4.Dataset, plan: CFUpdatePlan) -> List[str]:
+    """List the parts of plan that cannot be applied to nc through attribute and 1-D coordinate edits."""
+    reasons = []
+    renamed = {plan.renames.get(name, name): var for name, var in nc.variables.items()}
+
+    for name in plan.transforms:
+        if name in renamed:
+            reasons.append(f"values of {name} are transformed")
+
+    for name, dtype in plan.dtypes.items():
+        if name in renamed and renamed[name].dtype != np.dtype(dtype):
+            reasons.append(f"{name} is stored as {renamed[name].dtype}, {dtype} required")
+
+    for name, values in plan.coord_values.items():
+        if name not in renamed:
+            continue
+        var = renamed[name]
+        if var.ndim != 1 or var.shape != np.shape(values):
+            reasons.append(f"new {name} values do not match the stored shape {var.shape}")
+        elif not np.can_cast(np.asarray(values).dtype, var.dtype, casting='same_kind'):
+            reasons.append(f"new {name} values cannot be stored as {var.dtype}")
+
+    time_dtype = plan.time_encoding.get('dtype')
+    if time_dtype and 'time' in renamed and renamed['time'].dtype != np.dtype(time_dtype):
+        reasons.append(f"time is stored as {renamed['time'].dtype}, {time_dtype} required")
+
+    return reasons
+
+
+def _set_attrs(var, attrs: dict, overwrite: bool) -> None:
+    existing = var.ncattrs()
+    for key, value in attrs.items():
+        if overwrite or key not in existing:
+            var.setncattr(key, value)
+
+
+def _update_in_place(path: str, plan: CFUpdatePlan) -> None:
+    # netCDF-C loses the values of a coordinate variable renamed together with its dimension,
+    # and they can only be written back after the file has been closed once
+    coord_values = {}
+    with netCDF4.Dataset(path, 'a') as nc:
+        for old, new in plan.renames.items():
+            if old in nc.variables and old in nc.dimensions:
+                coord_values[new] = nc.variables[old][:]
+            if old in nc.dimensions:
+                nc.renameDimension(old, new)
+            if old in nc.variables:
+                nc.renameVariable(old, new)
+    coord_values.update(plan.coord_values)
+
+    with netCDF4.Dataset(path, 'a') as nc:
+        for name, values in coord_values.items():
+            if name in nc.variables:
+                nc.variables[name][:] = values
+
+        time_units = plan.time_encoding.get('units')
+        time_calendar = plan.time_encoding.get('calendar')
+        if 'time' in nc.variables and (time_units or time_calendar):
+            time_var = nc.variables['time']
+            old_units = time_var.getncattr('units')
+            old_calendar = time_var.getncattr('calendar') if 'calendar' in time_var.ncattrs() else 'standard'
+            new_units = time_units or old_units
+            new_calendar = time_calendar or old_calendar
+            if (new_units, new_calendar) != (old_units, old_calendar):
+                dates = netCDF4.num2date(time_var[:], old_units, old_calendar)
+                values = netCDF4.date2num(dates, new_units, new_calendar)
+                if np.issubdtype(time_var.dtype, np.integer):
+                    values = np.round(values)
+                time_var[:] = np.asarray(values).astype(time_var.dtype)
+                time_var.setncatts({'units': new_units, 'calendar': new_calendar})
+
+        for name, attrs in plan.attrs.items():
+            if name in nc.variables:
+                _set_attrs(nc.variables[name], attrs, overwrite=True)
+        for name, attrs in plan.default_attrs.items():
+            if name in nc.variables:
+                _set_attrs(nc.variables[name], attrs, overwrite=False)
+
+        _set_attrs(nc, plan.global_attrs, overwrite=True)
+        _set_attrs(nc, plan.default_global_attrs, overwrite=False)
+
+
+def _rewrite(input_path: str, output_path: str, plan: CFUpdatePlan, chunk_size: int) -> None:
+    """Apply plan by streaming input_path to output_path in time chunks of chunk_size steps."""
+    tmp_path = f"{output_path}.part"
+    with xr.open_dataset(input_path) as ds:
+        time_dim = plan.renames.get('time', 'time')
+        ds = ds.rename({k: v for k, v in plan.renames.items() if k in ds.variables or k in ds.dims})
+        if time_dim in ds.dims:
+            ds = ds.chunk({time_dim: chunk_size})
+
+        for name, transform in plan.transforms.items():
+            if name in ds.variables:
+                ds[name] = transform(ds[name]).assign_attrs(ds[name].attrs)
+        for name, values in plan.coord_values.items():
+            if name in ds.variables:
+                ds = ds.assign_coords({name: (ds[name].dims, values, ds[name].attrs)})
+
+        for name, attrs in plan.attrs.items():
+            if name in ds.variables:
+                ds[name].attrs.update(attrs)
+        for name, attrs in plan.default_attrs.items():
+            if name in ds.variables:
+                for key, value in attrs.items():
+                    ds[name].attrs.setdefault(key, value)
+        ds.attrs.update(plan.global_attrs)
+        for key, value in plan.default_global_attrs.items():
+            ds.attrs.setdefault(key, value)
+
+        encoding = {}
+        for name in ds.data_vars:
+            if plan.compression is not None or name in plan.dtypes:
+                if plan.compression is not None:
+                    encoding[name] = dict(plan.compression)
+                else:
+                    encoding[name] = {k: v for k, v in ds[name].encoding.items() if k in _KEPT_ENCODING}
+                if name in plan.dtypes:
+                    encoding[name]['dtype'] = plan.dtypes[name]
+        for name in ds.coords:
+            if name == time_dim and plan.time_encoding:
+                encoding[name] = dict(plan.time_encoding)
+            elif name in plan.dtypes:
+                encoding[name] = {'dtype': plan.dtypes[name]}
+
+        # Keep time unlimited so the monthly files can still be extended in place (common/incremental.py)
+        ds.to_netcdf(tmp_path, encoding=encoding, unlimited_dims=[time_dim] if time_dim in ds.dims else None)
+    os.replace(tmp_path, output_path)
+
+
+def apply_cf_update(input_path: str, output_path: str, plan: CFUpdatePlan, chunk_size: int = 12) -> CFUpdateReport:
+    """
+    Apply plan to input_path and write the result to output_path; input_path is left untouched.
+
+    When the plan only touches metadata and 1-D coordinate values, the file is copied byte for
+    byte to output_path and the copy is edited through netCDF4 append mode: output_path is still
+    a full second copy of the data, but the data variables are never decoded or re-encoded.
+    Otherwise the dataset is streamed to a new file in chunks of chunk_size time steps. Either
+    way the result is written under a ".part" name first.
+
+    Returns:
+        CFUpdateReport saying which path was taken and, for rewrites, why
+    """
+    with netCDF4.Dataset(input_path, 'r') as nc:
+        reasons = rewrite_reasons(nc, plan)
+
+    if reasons:
+        _rewrite(input_path, output_path, plan, chunk_size)
+        return CFUpdateReport(output_path=output_path, method="rewrite", reasons=reasons)
+
+    tmp_path = f"{output_path}.part"
+    shutil.copyfile(input_path, tmp_path)
+    _update_in_place(tmp_path, plan)
+    os.replace(tmp_path, output_path)
+    return CFUpdateReport(output_path=output_path, method="metadata", reasons=[])
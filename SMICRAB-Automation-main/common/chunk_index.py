@@ -0,0 +1,295 @@
+import os
+import json
+import zlib
+import itertools
+import numpy as np
+import xarray as xr
+import netCDF4
+import h5py
+from typing import Dict, List, Optional, Sequence, Tuple
+
+INDEX_SUFFIX = ".chunkindex.json"
+INDEX_VERSION = 1
+
+# HDF5 filter ids this module can decode itself; any other filter falls back to netCDF4 reads
+H5Z_FILTER_DEFLATE = 1
+H5Z_FILTER_SHUFFLE = 2
+H5Z_FILTER_FLETCHER32 = 3
+SUPPORTED_FILTERS = {H5Z_FILTER_DEFLATE: "deflate", H5Z_FILTER_SHUFFLE: "shuffle", H5Z_FILTER_FLETCHER32: "fletcher32"}
+
+
+def _to_json(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, np.ndarray):
+        return [_to_json(v) for v in value.tolist()]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _variable_layout(dset: h5py.Dataset) -> dict:
+    """Storage layout of one HDF5 dataset: chunk table and filter pipeline, or contiguous offset."""
+    dcpl = dset.id.get_create_plist()
+    filters = [dcpl.get_filter(i)[0] for i in range(dcpl.get_nfilters())]
+    if any(f not in SUPPORTED_FILTERS for f in filters):
+        return {"layout": "unsupported"}
+
+    if dset.chunks is None:
+        offset = dset.id.get_offset()
+        if filters or offset is None:
+            return {"layout": "unsupported"}
+        return {"layout": "contiguous", "offset": int(offset)}
+
+    chunk_table = []
+
+    def add_chunk(info):
+        chunk_table.append([list(info.chunk_offset), int(info.byte_offset), int(info.size), int(info.filter_mask)])
+
+    if hasattr(dset.id, "chunk_iter"):
+        dset.id.chunk_iter(add_chunk)
+    else:
+        for i in range(dset.id.get_num_chunks()):
+            add_chunk(dset.id.get_chunk_info(i))
+
+    return {
+        "layout": "chunked",
+        "chunks": list(dset.chunks),
+        "filters": [SUPPORTED_FILTERS[f] for f in filters],
+        "chunk_table": chunk_table,
+    }
+
+
+def build_chunk_index(path: str) -> dict:
+    """
+    Record dimensions, attributes, coordinate values and the byte location of every chunk of path.
+
+    Only metadata is read: coordinate variables (1-D variables named after their dimension)
+    are stored by value, data variables by their chunk table.
+    """
+    stat = os.stat(path)
+    index = {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "dimensions": {},
+        "attrs": {},
+        "variables": {},
+    }
+    with netCDF4.Dataset(path, "r") as nc, h5py.File(path, "r") as h5:
+        nc.set_auto_maskandscale(False)
+        index["dimensions"] = {name: len(dim) for name, dim in nc.dimensions.items()}
+        index["attrs"] = {k: _to_json(nc.getncattr(k)) for k in nc.ncattrs()}
+        for name, var in nc.variables.items():
+            dset = h5[name]
+            entry = {
+                "dims": list(var.dimensions),
+                "shape": list(var.shape),
+                "dtype": dset.dtype.str,
+                "attrs": {k: _to_json(var.getncattr(k)) for k in var.ncattrs()},
+            }
+            if var.dimensions == (name,):
+                entry["values"] = _to_json(var[:])
+            else:
+                entry.update(_variable_layout(dset))
+            index["variables"][name] = entry
+    return index
+
+
+class ChunkIndex:
+    """
+    Reads hyperslabs of a NetCDF-4/HDF5 file chunk by chunk, using a sidecar index of byte offsets.
+
+    The index is built once per input file (kerchunk-style) and stored next to it as
+    <file>.chunkindex.json; it is rebuilt automatically when the file size or mtime change.
+    A subset then reads and decompresses only the chunks that intersect it.
+
+    Args:
+        path: Path of the NetCDF file
+        index: Index as returned by build_chunk_index
+    """
+
+    def __init__(self, path: str, index: dict):
+        self.path = path
+        self.index = index
+        self.bytes_read = 0
+        self.chunks_read = 0
+        self._tables: Dict[str, Dict[Tuple[int, ...], Tuple[int, int, int]]] = {}
+
+    @classmethod
+    def load(cls, path: str, rebuild: bool = False) -> "ChunkIndex":
+        """Load the sidecar index of path, building (and saving, if possible) it when missing or stale."""
+        index_path = path + INDEX_SUFFIX
+        stat = os.stat(path)
+        if not rebuild and os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if (index.get("version") == INDEX_VERSION and index.get("size") == stat.st_size
+                    and index.get("mtime_ns") == stat.st_mtime_ns):
+                return cls(path, index)
+
+        index = build_chunk_index(path)
+        try:
+            tmp_path = index_path + ".part"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"Could not save chunk index {index_path}: {e}")
+        return cls(path, index)
+
+    def coordinate(self, name: str) -> np.ndarray:
+        entry = self.index["variables"][name]
+        return np.asarray(entry["values"], dtype=np.dtype(entry["dtype"]).newbyteorder("="))
+
+    def decoded_coordinate(self, name: str) -> np.ndarray:
+        """Coordinate values after CF decoding (e.g. time as datetime64)."""
+        entry = self.index["variables"][name]
+        variable = xr.Variable((name,), self.coordinate(name), entry["attrs"])
+        return xr.decode_cf(xr.Dataset({name: variable}))[name].values
+
+    def read(self, name: str, slices: Sequence[slice]) -> np.ndarray:
+        """Raw (still CF-encoded) values of variable name over the given per-dimension slices."""
+        entry = self.index["variables"][name]
+        if "values" in entry:
+            return self.coordinate(name)[tuple(slices)]
+        layout = entry.get("layout")
+        if layout == "chunked":
+            return self._read_chunked(name, entry, slices)
+        if layout == "contiguous":
+            return self._read_contiguous(entry, slices)
+        return self._read_netcdf(name, slices)
+
+    def _chunk_table(self, name: str, entry: dict) -> Dict[Tuple[int, ...], Tuple[int, int, int]]:
+        if name not in self._tables:
+            self._tables[name] = {tuple(origin): (offset, size, mask)
+                                  for origin, offset, size, mask in entry["chunk_table"]}
+        return self._tables[name]
+
+    def _decode_chunk(self, raw: bytes, entry: dict, mask: int, dtype: np.dtype) -> np.ndarray:
+        # Filters were applied in pipeline order on write, so undo them in reverse
+        for i, name in reversed(list(enumerate(entry["filters"]))):
+            if mask & (1 << i):
+                continue
+            if name == "deflate":
+                raw = zlib.decompress(raw)
+            elif name == "shuffle":
+                raw = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+            elif name == "fletcher32":
+                raw = raw[:-4]
+        return np.frombuffer(raw, dtype=dtype).reshape(entry["chunks"])
+
+    def _read_chunked(self, name: str, entry: dict, slices: Sequence[slice]) -> np.ndarray:
+        dtype = np.dtype(entry["dtype"])
+        chunks = entry["chunks"]
+        fill_value = entry["attrs"].get("_FillValue", 0)
+        out = np.full([s.stop - s.start for s in slices], fill_value, dtype=dtype)
+        table = self._chunk_table(name, entry)
+
+        chunk_ranges = [range(s.start // c, (s.stop - 1) // c + 1) for s, c in zip(slices, chunks)]
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            for chunk_idx in itertools.product(*chunk_ranges):
+                origin = tuple(i * c for i, c in zip(chunk_idx, chunks))
+                if origin not in table:
+                    continue  # never written: stays at the fill value
+                offset, size, mask = table[origin]
+                raw = os.pread(fd, size, offset)
+                self.bytes_read += size
+                self.chunks_read += 1
+                block = self._decode_chunk(raw, entry, mask, dtype)
+
+                src = tuple(slice(max(s.start, o) - o, min(s.stop, o + c) - o)
+                            for s, o, c in zip(slices, origin, chunks))
+                dst = tuple(slice(max(s.start, o) - s.start, min(s.stop, o + c) - s.start)
+                            for s, o, c in zip(slices, origin, chunks))
+                out[dst] = block[src]
+        finally:
+            os.close(fd)
+        return out.astype(dtype.newbyteorder("="), copy=False)
+
+    def _read_contiguous(self, entry: dict, slices: Sequence[slice]) -> np.ndarray:
+        dtype = np.dtype(entry["dtype"])
+        data = np.memmap(self.path, dtype=dtype, mode="r", offset=entry["offset"], shape=tuple(entry["shape"]))
+        out = np.array(data[tuple(slices)])
+        self.bytes_read += out.nbytes
+        return out.astype(dtype.newbyteorder("="), copy=False)
+
+    def _read_netcdf(self, name: str, slices: Sequence[slice]) -> np.ndarray:
+        with netCDF4.Dataset(self.path, "r") as nc:
+            nc.set_auto_maskandscale(False)
+            out = np.asarray(nc.variables[name][tuple(slices)])
+        self.bytes_read += out.nbytes
+        return out
+
+    def isel(self, variables: List[str], **indexers: slice) -> xr.Dataset:
+        """
+        Equivalent of xr.open_dataset(path)[variables].isel(**indexers).load() that only reads
+        the chunks intersecting the selection. Names in variables that are dimensions are kept
+        as coordinates; the result is CF-decoded.
+        """
+        dims = self.index["dimensions"]
+        wanted = [v for v in variables if v not in dims]
+        used_dims = {d for v in wanted for d in self.index["variables"][v]["dims"]} | \
+                    {v for v in variables if v in dims}
+
+        def slices_for(var_dims):
+            return [indexers.get(d, slice(0, dims[d])) for d in var_dims]
+
+        data_vars = {}
+        for name in list(wanted) + [d for d in used_dims if d in self.index["variables"]]:
+            entry = self.index["variables"][name]
+            values = self.read(name, [slice(*s.indices(dims[d])[:2]) for s, d in
+                                      zip(slices_for(entry["dims"]), entry["dims"])])
+            data_vars[name] = xr.Variable(entry["dims"], values, entry["attrs"])
+
+        ds = xr.decode_cf(xr.Dataset(data_vars, attrs=self.index["attrs"]))
+        for name in wanted:
+            entry = self.index["variables"][name]
+            if "deflate" in entry.get("filters", []):
+                ds[name].encoding.update({"zlib": True, "shuffle": "shuffle" in entry["filters"]})
+        return ds
+
+
+def nearest_bounds(coord: np.ndarray, low: float, high: float) -> slice:
+    """Index slice from the coordinate nearest to low to the one nearest to high, inclusive."""
+    start = int(np.abs(coord - low).argmin())
+    end = int(np.abs(coord - high).argmin())
+    start, end = min(start, end), max(start, end)
+    return slice(start, end + 1)
+
+
+def open_subset(path: str, variables: List[str], lat_bounds: Tuple[float, float], lon_bounds: Tuple[float, float],
+                time_bounds: Optional[Tuple[Optional[np.datetime64], Optional[np.datetime64]]] = None,
+                lat_name: str = "latitude", lon_name: str = "longitude", time_name: str = "time",
+                index: Optional[ChunkIndex] = None) -> xr.Dataset:
+    """
+    Read the (lat, lon[, time]) box of path through its chunk index.
+
+    Latitude and longitude bounds are snapped to the nearest grid points, like the subset
+    step of the processing scripts; time bounds are inclusive, and None leaves that end open. Files that are not HDF5
+    (e.g. NetCDF-3) have no chunks to index and are read with xarray instead.
+    """
+    if index is None and not h5py.is_hdf5(path):
+        with xr.open_dataset(path) as ds:
+            indexers = {
+                lat_name: nearest_bounds(ds[lat_name].values, *lat_bounds),
+                lon_name: nearest_bounds(ds[lon_name].values, *lon_bounds),
+            }
+            ds_subset = ds[variables].isel(**indexers)
+            if time_bounds is not None:
+                ds_subset = ds_subset.sel({time_name: slice(*time_bounds)})
+            return ds_subset.load()
+
+    index = index or ChunkIndex.load(path)
+    indexers = {
+        lat_name: nearest_bounds(index.coordinate(lat_name), *lat_bounds),
+        lon_name: nearest_bounds(index.coordinate(lon_name), *lon_bounds),
+    }
+    if time_bounds is not None:
+        times = index.decoded_coordinate(time_name)
+        start, end = time_bounds
+        indexers[time_name] = slice(
+            None if start is None else int(np.searchsorted(times, np.datetime64(start), side="left")),
+            None if end is None else int(np.searchsorted(times, np.datetime64(end), side="right")))
+    return index.isel(variables, **indexers)
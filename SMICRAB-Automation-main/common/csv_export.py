@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Streaming CSV export of (time, latitude, longitude) products.
+
+Writes the same CSV as ds.to_dataframe().reset_index() sorted by longitude, latitude and
+time (one row per cell and time step, columns time, latitude, longitude and the data
+variables), without building the whole table: the grid is read a block of longitudes at a
+time, in sort order, and each block is formatted and written before the next is read, so
+memory stays bounded by the block size whatever the length of the record. Blocks can be
+formatted in parallel processes and are written in order.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.csv_export data/rr_IT_2011_2023_Monthly/rr_..._corrected.nc data/rr_..._corrected.csv.gz
+"""
+import os
+import sys
+import gzip
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import List, Optional
+
+CUBE_DIMS = ("time", "latitude", "longitude")
+# Rows formatted and written at once
+DEFAULT_BLOCK_ROWS = 250_000
+
+
+def _format_column(values: np.ndarray) -> np.ndarray:
+    # Coordinates are small: format them with pandas itself so dates and floats are written
+    # exactly as DataFrame.to_csv writes them (e.g. date-only times when all are at midnight)
+    text = pd.DataFrame({"value": values}).to_csv(index=False, header=False, lineterminator="\n")
+    return np.array(text.splitlines(), dtype=object)
+
+
+def _format_values(values: np.ndarray) -> List[str]:
+    # Shortest round-trip representation, as pandas writes floats; missing values are left
+    # empty without being formatted (sea cells are a large share of the grid)
+    if values.dtype.kind != "f":
+        return values.astype(str).tolist()
+    text = np.full(values.shape, "", dtype=object)
+    valid = ~np.isnan(values)
+    if values.dtype == np.float64:
+        # Python's float repr is the same shortest representation, and faster than astype(str)
+        text[valid] = list(map(repr, values[valid].tolist()))
+    else:
+        text[valid] = values[valid].astype(str)
+    return text.tolist()
+
+
+def _cube(var: xr.DataArray) -> xr.DataArray:
+    extra = [dim for dim in var.dims if dim not in CUBE_DIMS]
+    if extra:
+        raise ValueError(f"{var.name} has dimensions {', '.join(extra)} besides {', '.join(CUBE_DIMS)}")
+    return var.expand_dims([dim for dim in CUBE_DIMS if dim not in var.dims]).transpose(*CUBE_DIMS)
+
+
+def _format_block(input_file: str, variables: List[str], time_order: np.ndarray, lat_order: np.ndarray,
+                  lon_index: np.ndarray, times: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> str:
+    """CSV rows of a block of longitudes; rows run over longitude, then latitude, then time."""
+    n_time, n_lat, n_lon = len(times), len(lats), len(lon_index)
+    columns = [np.tile(times, n_lat * n_lon).tolist(), np.tile(np.repeat(lats, n_time), n_lon).tolist(),
+               np.repeat(lons, n_time * n_lat).tolist()]
+    with xr.open_dataset(input_file) as ds:
+        block = ds[variables].isel(time=time_order, latitude=lat_order, longitude=lon_index)
+        for name in variables:
+            values = np.broadcast_to(_cube(block[name]).values, (n_time, n_lat, n_lon))
+            columns.append(_format_values(values.transpose(2, 1, 0).ravel()))
+    return "\n".join(map(",".join, zip(*columns))) + "\n"
+
+
+def _open_output(path: str, compress: bool):
+    if compress:
+        return gzip.open(path, "wt", compresslevel=6, newline="")
+    return open(path, "w", newline="")
+
+
+def export_csv(input_file: str, output_file: str, variables: Optional[List[str]] = None,
+               block_rows: int = DEFAULT_BLOCK_ROWS, workers: int = 1) -> int:
+    """
+    Write the data variables of input_file to output_file as CSV, sorted by longitude,
+    latitude and time.
+
+    Blocks are formatted in workers processes and written in order as they complete; at most
+    2 x workers blocks are in flight, so memory does not grow with the size of the product.
+
+    Args:
+        input_file: NetCDF file with (time, latitude, longitude) variables; variables on a
+            subset of these dimensions are repeated along the others, as in to_dataframe()
+        output_file: CSV file to write; gzip-compressed when the name ends with .gz
+        variables: Data variables to write (default: all, in file order)
+        block_rows: Approximate number of rows formatted at once
+        workers: Number of processes formatting blocks
+
+    Returns:
+        Number of rows written
+    """
+    with xr.open_dataset(input_file) as ds:
+        variables = list(variables or ds.data_vars)
+        time_order = np.argsort(ds["time"].values, kind="stable")
+        lat_order = np.argsort(ds["latitude"].values, kind="stable")
+        lon_order = np.argsort(ds["longitude"].values, kind="stable")
+        times = _format_column(ds["time"].values[time_order])
+        lats = _format_column(ds["latitude"].values[lat_order])
+        lons = _format_column(ds["longitude"].values[lon_order])
+    block_lons = max(1, block_rows // max(1, len(times) * len(lats)))
+    blocks = [(input_file, variables, time_order, lat_order, lon_order[start:start + block_lons],
+               times, lats, lons[start:start + block_lons]) for start in range(0, len(lon_order), block_lons)]
+
+    tmp_path = f"{output_file}.part"
+    with _open_output(tmp_path, output_file.endswith(".gz")) as f:
+        f.write(",".join(list(CUBE_DIMS) + variables) + "\n")
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for block in blocks:
+                    pending.append(executor.submit(_format_block, *block))
+                    if len(pending) >= 2 * workers:
+                        f.write(pending.popleft().result())
+                while pending:
+                    f.write(pending.popleft().result())
+        else:
+            for block in blocks:
+                f.write(_format_block(*block))
+    os.replace(tmp_path, output_file)
+    return len(times) * len(lats) * len(lon_order)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a (time, latitude, longitude) NetCDF product to CSV.')
+    parser.add_argument('input_file', help='NetCDF file to export')
+    parser.add_argument('output_file', help='CSV file to write (gzip-compressed if it ends with .gz)')
+    parser.add_argument('--variables', nargs='+', default=None, help='Data variables to export (default: all)')
+    parser.add_argument('--block-rows', type=int, default=DEFAULT_BLOCK_ROWS,
+                        help='Approximate number of rows formatted at once')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes formatting blocks')
+    args = parser.parse_args()
+
+    try:
+        n_rows = export_csv(args.input_file, args.output_file, args.variables, args.block_rows, args.workers)
+    except Exception as e:
+        print(f"Error exporting {args.input_file}: {str(e)}")
+        sys.exit(1)
+    print(f"Wrote {n_rows} rows to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
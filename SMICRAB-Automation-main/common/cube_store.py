@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped store of decoded input cubes.
+
+The homogenizations read their E-OBS and ERA5 inputs whole. Decoding a compressed NetCDF
+cube costs seconds to minutes and a private copy of the data in every process; with the
+cube store enabled each input is decoded once into uncompressed .npy files, and every later
+run (or every tile of a tiled run) maps them read-only, so the data is shared through the
+OS page cache and only the pages a run touches are read.
+
+Layout, one directory per input file:
+
+    <store>/<input stem>/header.json   source path, size, mtime and SHA-256, grid and times,
+                                       and the shape and dtype of each variable
+    <store>/<input stem>/<variable>.npy decoded values (masked and scaled as xarray reads them)
+
+A cube is rebuilt when its source file changes. The store is enabled with
+SMICRAB_CUBE_STORE: a directory, or "on" for ./data/cube_store of the variable directory.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.cube_store data/E_OBS_rr_Monthly/rr_..._CF-1.8.nc data/ERA5_rr_Monthly/rr_IT_2011_2023_Monthly_ERA5.nc
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import Dict, Optional
+
+from common.stage_cache import _file_state, _sha256
+
+CUBE_STORE_ENV_VAR = "SMICRAB_CUBE_STORE"
+DEFAULT_STORE_DIR = "./data/cube_store"
+HEADER_NAME = "header.json"
+# Time steps decoded at once while building a cube
+TIME_BLOCK = 12
+
+
+def cube_store_dir() -> Optional[str]:
+    """Store directory selected by SMICRAB_CUBE_STORE, or None when the store is off."""
+    value = os.environ.get(CUBE_STORE_ENV_VAR, "").strip()
+    if value.lower() in ("", "0", "off", "no", "false"):
+        return None
+    if value.lower() in ("1", "on", "yes", "true"):
+        return DEFAULT_STORE_DIR
+    return value
+
+
+def _cube_variables(ds: xr.Dataset) -> list:
+    # Numeric gridded variables; scalars and strings (e.g. the ERA5 expver) stay in the NetCDF
+    return [name for name, var in ds.data_vars.items() if var.ndim >= 2 and var.dtype.kind in "fiu"]
+
+
+class CubeStore:
+    """Decoded, memory-mappable copies of NetCDF inputs under root."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def cube_dir(self, nc_path: str) -> str:
+        return os.path.join(self.root, os.path.splitext(os.path.basename(nc_path))[0])
+
+    def header(self, nc_path: str) -> Optional[dict]:
+        """Header of the cube of nc_path if it is complete and matches the current file, else None."""
+        header_path = os.path.join(self.cube_dir(nc_path), HEADER_NAME)
+        try:
+            with open(header_path) as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if header.get("source") != os.path.abspath(nc_path):
+            return None
+        state = _file_state(nc_path)
+        if header.get("source_state") != state:
+            # Touched or copied: still valid if the content is the same
+            if header.get("source_sha256") != _sha256(nc_path):
+                return None
+            header["source_state"] = state
+            self._write_header(nc_path, header)
+        return header
+
+    def _write_header(self, nc_path: str, header: dict) -> None:
+        header_path = os.path.join(self.cube_dir(nc_path), HEADER_NAME)
+        tmp_path = f"{header_path}.{os.getpid()}.part"
+        with open(tmp_path, "w") as f:
+            json.dump(header, f, indent=2)
+        os.replace(tmp_path, header_path)
+
+    def build(self, nc_path: str) -> dict:
+        """
+        Decode the gridded variables of nc_path into the store, TIME_BLOCK steps at a time.
+
+        Files are written under temporary names and renamed, and the header last, so runs
+        building the same cube concurrently never expose a partial one.
+        """
+        cube_dir = self.cube_dir(nc_path)
+        os.makedirs(cube_dir, exist_ok=True)
+        header = {
+            "source": os.path.abspath(nc_path),
+            "source_state": _file_state(nc_path),
+            "source_sha256": _sha256(nc_path),
+            "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+            "coords": {},
+            "variables": {},
+        }
+        with xr.open_dataset(nc_path, decode_times=False) as ds:
+            for name in ds.dims:
+                if name in ds.coords:
+                    header["coords"][name] = ds[name].values.tolist()
+            for name in _cube_variables(ds):
+                var = ds[name]
+                path = os.path.join(cube_dir, f"{name}.npy")
+                tmp_path = f"{path}.{os.getpid()}.part"
+                out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=var.dtype, shape=var.shape)
+                lead = var.dims[0]
+                for start in range(0, var.shape[0], TIME_BLOCK):
+                    block = slice(start, start + TIME_BLOCK)
+                    out[block] = var.isel({lead: block}).values
+                out.flush()
+                del out
+                os.replace(tmp_path, path)
+                header["variables"][name] = {"dims": list(var.dims), "shape": list(var.shape),
+                                             "dtype": var.dtype.str, "file": os.path.basename(path)}
+        self._write_header(nc_path, header)
+        print(f"Decoded {len(header['variables'])} variables of {os.path.basename(nc_path)} into {cube_dir}")
+        return header
+
+    def open(self, nc_path: str) -> Dict[str, np.ndarray]:
+        """Read-only memory maps of the gridded variables of nc_path, building the cube if needed."""
+        header = self.header(nc_path) or self.build(nc_path)
+        cube_dir = self.cube_dir(nc_path)
+        return {name: np.load(os.path.join(cube_dir, entry["file"]), mmap_mode="r")
+                for name, entry in header["variables"].items()}
+
+    def attach(self, ds: xr.Dataset, nc_path: str) -> xr.Dataset:
+        """
+        Back the gridded variables of ds (opened from nc_path) with the memory maps.
+
+        Attributes and encoding are kept; .values then returns the mapped array without
+        decoding or copying, and slicing (e.g. a tile window) returns views of it.
+        """
+        arrays = self.open(nc_path)
+        for name, array in arrays.items():
+            var = ds[name]
+            if var.shape != array.shape:
+                raise ValueError(f"Cube of {name} has shape {array.shape}, expected {var.shape}")
+            ds[name] = xr.Variable(var.dims, array, var.attrs, var.encoding)
+        return ds
+
+
+def attach_cubes(ds: xr.Dataset, nc_path: str) -> xr.Dataset:
+    """Back ds with the cube store when SMICRAB_CUBE_STORE is set; otherwise return it unchanged."""
+    root = cube_store_dir()
+    return CubeStore(root).attach(ds, nc_path) if root else ds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode NetCDF inputs into the memory-mapped cube store.')
+    parser.add_argument('files', nargs='+', help='NetCDF files to decode')
+    parser.add_argument('--store', default=None,
+                        help=f'Store directory (default: {CUBE_STORE_ENV_VAR}, or {DEFAULT_STORE_DIR})')
+    args = parser.parse_args()
+
+    store = CubeStore(args.store or cube_store_dir() or DEFAULT_STORE_DIR)
+    for path in args.files:
+        try:
+            if store.header(path) is None:
+                store.build(path)
+            else:
+                print(f"{os.path.basename(path)} is up to date in {store.cube_dir(path)}")
+        except Exception as e:
+            print(f"Error decoding {path}: {str(e)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tiled homogenizations on a dask.distributed cluster.
+
+run_tiled() processes the tiles of a grid in a local process pool. With
+SMICRAB_DASK_SCHEDULER set, the tiles are submitted to a dask.distributed cluster
+instead, so a homogenization can use several nodes:
+
+    SMICRAB_DASK_SCHEDULER=tcp://scheduler:8786   an existing cluster
+    SMICRAB_DASK_SCHEDULER=local                  a LocalCluster of --workers processes
+
+The input files (E-OBS, ERA5 and the derived ERA5 reference, if any) are read once and
+scattered to every worker, which writes them to its local temporary directory the first
+time, so the nodes do not need the data directory. Each task homogenizes one tile
+(core plus halo) there and returns the tile file and its breakpoint catalog; they are
+written to <output>_tiles/ as they arrive and stitched, as in a local run, into the
+chunked NetCDF and Zarr outputs. A failing tile is retried TILE_RETRIES times, on any
+worker, before it is reported as failed.
+
+The SMICRAB_* settings of the submitting process are applied on the workers, which must
+run single-threaded (e.g. dask worker --nthreads 1) with the project root and the
+variable's processing/ directory on their PYTHONPATH. Requires the distributed package (pip install distributed); nothing here
+imports it unless SMICRAB_DASK_SCHEDULER is set.
+
+Usage:
+    SMICRAB_DASK_SCHEDULER=local python3 processing/hu_homogenization.py --tile-size 32 --workers 4
+"""
+import os
+import hashlib
+import tempfile
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from common.breakpoint_catalog import catalog_path
+from common.derived_reference import ensure_reference, reference_path
+from common.stage_cache import STEP_STATS_ENV_VAR
+
+DASK_SCHEDULER_ENV_VAR = "SMICRAB_DASK_SCHEDULER"
+# Attempts of a tile after the first before it counts as failed
+TILE_RETRIES = 2
+# Settings of the submitting process that only make sense on its own machine
+LOCAL_SETTINGS = (DASK_SCHEDULER_ENV_VAR, STEP_STATS_ENV_VAR)
+# Inputs received from the client, under the worker's temporary directory
+WORKER_INPUT_DIR = "smicrab_dask_inputs"
+
+
+def dask_scheduler() -> Optional[str]:
+    """Scheduler address selected by SMICRAB_DASK_SCHEDULER ("local" for a LocalCluster), or None."""
+    value = os.environ.get(DASK_SCHEDULER_ENV_VAR, "").strip()
+    if value.lower() in ("", "0", "off", "no", "false"):
+        return None
+    return value
+
+
+@dataclass(frozen=True)
+class InputFile:
+    """Content of an input file, sent to the workers."""
+    name: str
+    sha256: str
+    content: bytes
+
+    @classmethod
+    def read(cls, path: str) -> "InputFile":
+        with open(path, "rb") as f:
+            content = f.read()
+        return cls(os.path.basename(path), hashlib.sha256(content).hexdigest(), content)
+
+    def write(self, path: str) -> str:
+        """Write the file to path unless it is already there (written by another task of the worker)."""
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(self.content)
+            os.replace(tmp_path, path)
+        return path
+
+
+@dataclass(frozen=True)
+class TileInputs:
+    """
+    The inputs of a homogenization, scattered once to every worker.
+
+    Attributes:
+        files: Input files by constructor argument (eobs_file, era5_file)
+        references: Derived ERA5 references by name
+    """
+    files: Dict[str, InputFile]
+    references: Dict[str, InputFile]
+
+    def materialize(self, root: str) -> Dict[str, str]:
+        """
+        Write the inputs under root, each in a directory named after its content, and return
+        their local paths by constructor argument. Derived references are written where
+        derived_reference.reference_path() looks for them next to the local ERA5 file.
+        """
+        paths = {arg: f.write(os.path.join(root, f.sha256[:16], f.name)) for arg, f in self.files.items()}
+        for name, f in self.references.items():
+            f.write(reference_path(paths["era5_file"], name))
+        return paths
+
+
+def _run_tile_on_worker(run_tile: Callable, homogenization_cls, init_kwargs: dict, execute_kwargs: dict,
+                        tile, inputs: TileInputs, settings: Dict[str, str]) -> dict:
+    os.environ.update(settings)
+    paths = inputs.materialize(os.path.join(tempfile.gettempdir(), WORKER_INPUT_DIR))
+    with tempfile.TemporaryDirectory(prefix=f"{tile.name}_") as work_dir:
+        tile_path = os.path.join(work_dir, f"{tile.name}.nc")
+        run_tile(homogenization_cls, {**init_kwargs, **paths}, execute_kwargs, tile, tile_path)
+        with open(tile_path, "rb") as f:
+            result = {"tile": f.read(), "catalog": None}
+        if os.path.exists(catalog_path(tile_path)):
+            with open(catalog_path(tile_path), "rb") as f:
+                result["catalog"] = f.read()
+    return result
+
+
+def _save_tile(result: dict, tile_path: str) -> None:
+    # The catalog first: an existing tile file marks the tile as done
+    for content, path in ((result["catalog"], catalog_path(tile_path)), (result["tile"], tile_path)):
+        if content is not None:
+            tmp_path = f"{path}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+
+def run_tiles_dask(run_tile: Callable, homogenization_cls, init_kwargs: dict, execute_kwargs: dict,
+                   tiles: list, tile_paths: Dict[str, str], scheduler: str, workers: int = 1) -> List[str]:
+    """
+    Homogenize tiles on the dask cluster at scheduler and write them to tile_paths.
+
+    Args:
+        run_tile: Function homogenizing one tile into a file (tiling._run_tile)
+        homogenization_cls: BaseHomogenization subclass to run
+        init_kwargs: Constructor arguments (without window)
+        execute_kwargs: Arguments of execute() (without output_path)
+        tiles: Tiles to process
+        tile_paths: Output file of every tile, by tile name
+        scheduler: Scheduler address, or "local" for a LocalCluster
+        workers: Number of worker processes of a LocalCluster
+
+    Returns:
+        Names of the tiles that failed
+    """
+    if not tiles:
+        return []
+    from distributed import Client, LocalCluster, as_completed
+
+    references = {}
+    if homogenization_cls.derived_reference:
+        name = homogenization_cls.derived_reference
+        references[name] = InputFile.read(ensure_reference(init_kwargs["era5_file"], name))
+    inputs = TileInputs({arg: InputFile.read(init_kwargs[arg]) for arg in ("eobs_file", "era5_file")}, references)
+    settings = {k: v for k, v in os.environ.items() if k.startswith("SMICRAB_") and k not in LOCAL_SETTINGS}
+
+    cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True) \
+        if scheduler.lower() == "local" else None
+    failed = []
+    try:
+        with Client(cluster if cluster is not None else scheduler) as client:
+            print(f"Submitting {len(tiles)} tiles to {client.scheduler.address} "
+                  f"({len(client.scheduler_info()['workers'])} workers)")
+            scattered = client.scatter(inputs, broadcast=True)
+            futures = {client.submit(_run_tile_on_worker, run_tile, homogenization_cls, init_kwargs,
+                                     execute_kwargs, tile, scattered, settings, retries=TILE_RETRIES,
+                                     pure=False): tile.name for tile in tiles}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    _save_tile(future.result(), tile_paths[name])
+                    print(f"Tile {name} completed")
+                except Exception as e:
+                    print(f"Error processing tile {name}: {str(e)}")
+                    failed.append(name)
+                future.release()
+    finally:
+        if cluster is not None:
+            cluster.close()
+    return failed
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+ERA5-derived reference fields, computed once and cached.
+
+Some homogenizations compare E-OBS against a field derived from ERA5 variables rather than
+an ERA5 variable itself (relative humidity from the 2 m dew point and temperature, wind
+speed from the 10 m wind components). The derivation runs a block of time steps at a time,
+in float64 with in-place operations so that a block needs two buffers whatever the
+expression, and the result is saved next to the ERA5 file:
+
+    <ERA5 dir>/derived/<ERA5 stem>_<reference>.nc
+
+The file records the SHA-256, size and modification time of the ERA5 file it was derived
+from and the version of the derivation; it is reused as long as both are unchanged, so a
+homogenization starts by loading a ready reference.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.derived_reference data/ERA5_hu_Monthly/hu_IT_2011_2023_Monthly_ERA5.nc relative_humidity
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import netCDF4
+import xarray as xr
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+from common.cube_store import attach_cubes
+from common.stage_cache import _file_state, _sha256
+
+# Time steps derived at once
+TIME_BLOCK = 12
+
+
+def relative_humidity_wexler(d2m: np.ndarray, t2m: np.ndarray) -> np.ndarray:
+    """
+    100 * e(d2m) / e(t2m) with e(T) = 610.78 * exp(17.27 T / (T + 237.3)).
+
+    The ratio of the two exponentials is computed as one exponential of the difference of
+    their exponents, in two float64 buffers.
+    """
+    rh = np.add(d2m, 237.3, dtype=np.float64)
+    np.divide(d2m, rh, out=rh)
+    t_term = np.add(t2m, 237.3, dtype=np.float64)
+    np.divide(t2m, t_term, out=t_term)
+    np.subtract(rh, t_term, out=rh)
+    rh *= 17.27
+    np.exp(rh, out=rh)
+    rh *= 100
+    return rh
+
+
+def wind_speed(u10: np.ndarray, v10: np.ndarray) -> np.ndarray:
+    """Wind speed from its components, sqrt(u10^2 + v10^2), without squared temporaries."""
+    return np.hypot(u10, v10, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class Derivation:
+    """
+    A reference field derived from ERA5 variables.
+
+    Attributes:
+        inputs: ERA5 variables passed to compute, in order
+        compute: Function of the input blocks returning the derived block
+        attrs: Attributes of the derived variable
+        version: Bumped when compute changes, so cached references are rebuilt
+    """
+    inputs: Tuple[str, ...]
+    compute: Callable[..., np.ndarray]
+    attrs: dict = field(default_factory=dict)
+    version: int = 1
+
+
+DERIVATIONS = {
+    "relative_humidity": Derivation(("d2m", "t2m"), relative_humidity_wexler,
+                                    {"long_name": "Relative humidity (Wexler) from d2m and t2m", "units": "%"}),
+    "wind_speed": Derivation(("u10", "v10"), wind_speed,
+                             {"long_name": "10 m wind speed from u10 and v10", "units": "m s**-1"}),
+}
+
+
+def reference_path(era5_file: str, name: str) -> str:
+    """Path of the cached reference name derived from era5_file."""
+    stem = os.path.splitext(os.path.basename(era5_file))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(era5_file)), "derived", f"{stem}_{name}.nc")
+
+
+def _is_fresh(path: str, era5_file: str, derivation: Derivation) -> bool:
+    try:
+        with netCDF4.Dataset(path) as nc:
+            attrs = {k: nc.getncattr(k) for k in nc.ncattrs()}
+    except OSError:
+        return False
+    if attrs.get("derivation_version") != derivation.version:
+        return False
+    if attrs.get("source_state") == json.dumps(_file_state(era5_file), sort_keys=True):
+        return True
+    return attrs.get("source_sha256") == _sha256(era5_file)
+
+
+def derive(era5_file: str, name: str, output_path: Optional[str] = None) -> str:
+    """
+    Compute the reference name from era5_file, TIME_BLOCK time steps at a time, and save it.
+
+    The output keeps the dimensions, coordinates and order of the ERA5 input variables.
+    """
+    derivation = DERIVATIONS[name]
+    output_path = output_path or reference_path(era5_file, name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.part"
+    with netCDF4.Dataset(era5_file) as src, netCDF4.Dataset(tmp_path, "w", format="NETCDF4") as out:
+        inputs = [src.variables[v] for v in derivation.inputs]
+        dims = inputs[0].dimensions
+        dtype = np.result_type(*[var.dtype for var in inputs], np.float32)
+        for dim in dims:
+            out.createDimension(dim, len(src.dimensions[dim]))
+            if dim in src.variables:
+                coord = out.createVariable(dim, src.variables[dim].dtype, (dim,))
+                coord.setncatts({k: src.variables[dim].getncattr(k) for k in src.variables[dim].ncattrs()
+                                 if k != "_FillValue"})
+                coord[:] = src.variables[dim][:]
+        var = out.createVariable(name, dtype, dims, fill_value=np.nan)
+        var.setncatts(derivation.attrs)
+
+        for start in range(0, inputs[0].shape[0], TIME_BLOCK):
+            block = slice(start, start + TIME_BLOCK)
+            values = [np.ma.filled(v[block].astype(np.float64), np.nan) for v in inputs]
+            var[block] = derivation.compute(*values)
+
+        out.setncatts({
+            "title": f"{name} derived from {os.path.basename(era5_file)}",
+            "source_file": os.path.abspath(era5_file),
+            "source_sha256": _sha256(era5_file),
+            "source_state": json.dumps(_file_state(era5_file), sort_keys=True),
+            "derivation_version": derivation.version,
+        })
+    os.replace(tmp_path, output_path)
+    print(f"Derived {name} from {os.path.basename(era5_file)} into {output_path}")
+    return output_path
+
+
+def ensure_reference(era5_file: str, name: str) -> str:
+    """Path of the reference name of era5_file, derived now if missing or stale."""
+    path = reference_path(era5_file, name)
+    if not _is_fresh(path, era5_file, DERIVATIONS[name]):
+        derive(era5_file, name, path)
+    return path
+
+
+def open_reference(era5_file: str, name: str) -> xr.Dataset:
+    """Open the reference name of era5_file (memory-mapped when SMICRAB_CUBE_STORE is set)."""
+    path = ensure_reference(era5_file, name)
+    return attach_cubes(xr.open_dataset(path, decode_times=False), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Derive and cache a reference field from an ERA5 file.')
+    parser.add_argument('era5_file', help='ERA5 NetCDF file')
+    parser.add_argument('references', nargs='+', choices=list(DERIVATIONS), help='References to derive')
+    parser.add_argument('--force', action='store_true', help='Derive even if the cached reference is up to date')
+    args = parser.parse_args()
+
+    for name in args.references:
+        try:
+            if args.force:
+                derive(args.era5_file, name)
+            else:
+                print(f"{name}: {ensure_reference(args.era5_file, name)}")
+        except Exception as e:
+            print(f"Error deriving {name} from {args.era5_file}: {str(e)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
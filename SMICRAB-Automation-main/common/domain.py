@@ -0,0 +1,46 @@
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+DOMAIN_ENV_VAR = "SMICRAB_DOMAIN"
+DEFAULT_DOMAIN = "italy"
+
+
+@dataclass(frozen=True)
+class Domain:
+    """
+    Bounding box processed by the download, subset and regridding scripts.
+
+    Attributes:
+        name: Domain name, as used in SMICRAB_DOMAIN
+        lon_min, lon_max: Longitude bounds (degrees_east)
+        lat_min, lat_max: Latitude bounds (degrees_north)
+    """
+    name: str
+    lon_min: float
+    lon_max: float
+    lat_min: float
+    lat_max: float
+
+    @property
+    def area(self) -> List[float]:
+        """Bounds in the order expected by the CDS API 'area' keyword: N, W, S, E."""
+        return [self.lat_max, self.lon_min, self.lat_min, self.lon_max]
+
+
+DOMAINS = {
+    "italy": Domain("italy", lon_min=6, lon_max=20, lat_min=32, lat_max=49),
+    # Full E-OBS 0.1 degree regular grid
+    "europe": Domain("europe", lon_min=-25, lon_max=45.5, lat_min=25, lat_max=71.5),
+}
+
+
+def get_domain(name: Optional[str] = None) -> Domain:
+    """
+    Return the domain called name, or the one selected by the SMICRAB_DOMAIN environment
+    variable (default: italy).
+    """
+    name = (name or os.environ.get(DOMAIN_ENV_VAR) or DEFAULT_DOMAIN).lower()
+    if name not in DOMAINS:
+        raise ValueError(f"Unknown domain '{name}', expected one of: {', '.join(DOMAINS)}")
+    return DOMAINS[name]
@@ -0,0 +1,316 @@
+import os
+import abc
+import copy
+import glob
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import itertools
+import threading
+import xarray as xr
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+MANIFEST_NAME = "download_manifest.json"
+CONCURRENCY_ENV_VAR = "SMICRAB_DOWNLOAD_CONCURRENCY"
+LOCAL_DIR_ENV_VAR = "SMICRAB_CDS_LOCAL_DIR"
+DEFAULT_CONCURRENCY = 4
+CHUNK_SIZE = 1 << 20
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadClient(abc.ABC):
+    """Source of dataset downloads; retrieve() must append to a partially downloaded target when it can."""
+
+    @abc.abstractmethod
+    def retrieve(self, dataset: str, request: dict, target_path: str) -> None:
+        pass
+
+
+class CDSAPIClient(DownloadClient):
+    """
+    Downloads from the Copernicus Climate Data Store through cdsapi.
+
+    The request is submitted and queued by cdsapi; the result is then fetched over HTTP with
+    a Range request from the end of any partial file, guarded by If-Range on the ETag saved
+    next to it, so an interrupted transfer continues instead of restarting.
+    """
+
+    def __init__(self, timeout: int = 60):
+        import cdsapi
+        import requests
+        self.client = cdsapi.Client()
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def retrieve(self, dataset: str, request: dict, target_path: str) -> None:
+        result = self.client.retrieve(dataset, request)
+        url = getattr(result, "location", None)
+        if not url:
+            result.download(target_path)
+            return
+
+        meta_path = f"{target_path}.meta"
+        headers = {}
+        offset = os.path.getsize(target_path) if os.path.exists(target_path) else 0
+        if offset and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("url") == url and meta.get("etag"):
+                headers = {"Range": f"bytes={offset}-", "If-Range": meta["etag"]}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            append = response.status_code == 206
+            with open(meta_path, "w") as f:
+                json.dump({"url": url, "etag": response.headers.get("ETag")}, f)
+            with open(target_path, "ab" if append else "wb") as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        os.remove(meta_path)
+
+
+class LocalDirectoryClient(DownloadClient):
+    """
+    Stand-in for the CDS that serves requests from files in a local directory.
+
+    The file for a request is <root>/<dataset>/<part_filename(request)> with any extension,
+    the same name the split parts get. max_bytes_per_call interrupts every transfer after that
+    many bytes, to exercise resuming.
+    """
+
+    def __init__(self, root: str, max_bytes_per_call: Optional[int] = None):
+        self.root = root
+        self.max_bytes_per_call = max_bytes_per_call
+        self.calls = 0
+
+    def retrieve(self, dataset: str, request: dict, target_path: str) -> None:
+        self.calls += 1
+        pattern = os.path.join(self.root, dataset, part_filename(request, extension=".*"))
+        matches = glob.glob(pattern)
+        if not matches:
+            raise DownloadError(f"No local file for request: {pattern}")
+        source = matches[0]
+
+        offset = os.path.getsize(target_path) if os.path.exists(target_path) else 0
+        remaining = os.path.getsize(source) - offset
+        if self.max_bytes_per_call is not None:
+            remaining = min(remaining, self.max_bytes_per_call)
+        with open(source, "rb") as src, open(target_path, "ab") as dst:
+            src.seek(offset)
+            dst.write(src.read(remaining))
+        if os.path.getsize(target_path) < os.path.getsize(source):
+            raise ConnectionError(f"Transfer of {source} interrupted at {os.path.getsize(target_path)} bytes")
+
+
+def get_client() -> DownloadClient:
+    """LocalDirectoryClient on SMICRAB_CDS_LOCAL_DIR if set, else the CDS."""
+    local_dir = os.environ.get(LOCAL_DIR_ENV_VAR)
+    if local_dir:
+        return LocalDirectoryClient(local_dir)
+    return CDSAPIClient()
+
+
+@dataclass
+class DownloadTask:
+    dataset: str
+    request: dict
+    target_path: str
+
+
+def part_filename(request: dict, extension: str = ".nc", split_keys: Sequence[str] = ("variable", "year")) -> str:
+    """Deterministic file name of a split request, e.g. 2m_temperature_2011.nc."""
+    values = []
+    for key in split_keys:
+        value = request.get(key)
+        if isinstance(value, (list, tuple)):
+            value = "-".join(map(str, value))
+        if value is not None:
+            values.append(str(value))
+    return "_".join(values) + extension
+
+
+def split_request(dataset: str, request: dict, target_dir: str, split_keys: Sequence[str] = ("variable", "year"),
+                  extension: str = ".nc") -> List[DownloadTask]:
+    """One task per combination of the values of split_keys (keys missing from request are not split)."""
+    keys = [key for key in split_keys if isinstance(request.get(key), (list, tuple))]
+    tasks = []
+    for values in itertools.product(*(request[key] for key in keys)):
+        sub_request = copy.deepcopy(request)
+        for key, value in zip(keys, values):
+            sub_request[key] = [value]
+        tasks.append(DownloadTask(dataset, sub_request,
+                                  os.path.join(target_dir, part_filename(sub_request, extension, keys))))
+    return tasks
+
+
+def sha256sum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """
+    JSON record of the files in a directory: size, sha256 and the request that produced them.
+
+    A file is valid when it exists and its size, checksum and request still match its record.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_valid(self, file_path: str, request: dict) -> bool:
+        entry = self.entries.get(os.path.basename(file_path))
+        if entry is None or not os.path.exists(file_path) or entry["request"] != request:
+            return False
+        return os.path.getsize(file_path) == entry["size"] and sha256sum(file_path) == entry["sha256"]
+
+    def record(self, file_path: str, dataset: str, request: dict) -> None:
+        entry = {"dataset": dataset, "request": request, "size": os.path.getsize(file_path),
+                 "sha256": sha256sum(file_path)}
+        with self.lock:
+            self.entries[os.path.basename(file_path)] = entry
+            tmp_path = f"{self.path}.part"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class DownloadManager:
+    """
+    Runs download tasks concurrently, skipping files the manifest of their directory vouches for.
+
+    Each file is downloaded to <file>.part, which is kept across failures so the next attempt
+    (or the next run) resumes it, and only renamed once complete.
+
+    Args:
+        client: Download source; defaults to get_client()
+        max_concurrent: Maximum simultaneous requests; defaults to SMICRAB_DOWNLOAD_CONCURRENCY or 4
+        retries: Attempts per task before giving up
+        retry_wait: Seconds to wait between attempts
+    """
+
+    def __init__(self, client: Optional[DownloadClient] = None, max_concurrent: Optional[int] = None,
+                 retries: int = 3, retry_wait: float = 30):
+        self.client = client or get_client()
+        self.max_concurrent = max_concurrent or int(os.environ.get(CONCURRENCY_ENV_VAR, DEFAULT_CONCURRENCY))
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self._manifests: Dict[str, DownloadManifest] = {}
+        self._manifests_lock = threading.Lock()
+
+    def manifest_for(self, file_path: str) -> DownloadManifest:
+        path = os.path.join(os.path.dirname(os.path.abspath(file_path)), MANIFEST_NAME)
+        with self._manifests_lock:
+            if path not in self._manifests:
+                self._manifests[path] = DownloadManifest(path)
+            return self._manifests[path]
+
+    def _download(self, task: DownloadTask) -> str:
+        manifest = self.manifest_for(task.target_path)
+        name = os.path.basename(task.target_path)
+        if manifest.is_valid(task.target_path, task.request):
+            print(f"  {name}: already downloaded, skipping")
+            return task.target_path
+
+        os.makedirs(os.path.dirname(os.path.abspath(task.target_path)), exist_ok=True)
+        tmp_path = f"{task.target_path}.part"
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.client.retrieve(task.dataset, task.request, tmp_path)
+                break
+            except Exception as e:
+                print(f"  {name}: attempt {attempt}/{self.retries} failed: {str(e)}")
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retry_wait)
+
+        os.replace(tmp_path, task.target_path)
+        manifest.record(task.target_path, task.dataset, task.request)
+        print(f"  {name}: downloaded")
+        return task.target_path
+
+    def run(self, tasks: List[DownloadTask]) -> List[str]:
+        """Download every task; raises DownloadError listing the tasks that still failed after retries."""
+        print(f"Downloading {len(tasks)} files with up to {self.max_concurrent} concurrent requests...")
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            futures = {executor.submit(self._download, task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(f"{os.path.basename(futures[future].target_path)} ({str(e)})")
+        if failed:
+            raise DownloadError(f"{len(failed)} downloads failed: {'; '.join(failed)}")
+        return [task.target_path for task in tasks]
+
+
+def merge_netcdf_parts(part_paths: List[str], output_path: str) -> None:
+    """Combine per-variable/per-year NetCDF parts into one file (times are decoded, as parts may use different units)."""
+    datasets = [xr.open_dataset(path) for path in part_paths]
+    try:
+        merged = xr.combine_by_coords(datasets, combine_attrs="override")
+        tmp_path = f"{output_path}.part"
+        merged.to_netcdf(tmp_path)
+    finally:
+        for ds in datasets:
+            ds.close()
+    os.replace(tmp_path, output_path)
+
+
+def merge_zip_parts(part_paths: List[str], output_path: str) -> None:
+    """Copy the members of several zip archives into one, streaming each member."""
+    tmp_path = f"{output_path}.part"
+    with zipfile.ZipFile(tmp_path, "w") as dst:
+        for path in part_paths:
+            with zipfile.ZipFile(path) as src:
+                for info in src.infolist():
+                    with src.open(info) as fsrc, dst.open(info, "w") as fdst:
+                        shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+    os.replace(tmp_path, output_path)
+
+
+def download_split(dataset: str, request: dict, output_path: str,
+                   merge: Callable[[List[str], str], None] = merge_netcdf_parts,
+                   split_keys: Sequence[str] = ("variable", "year"), extension: str = ".nc",
+                   manager: Optional[DownloadManager] = None) -> str:
+    """
+    Download request as concurrent per-variable/per-year parts and merge them into output_path.
+
+    Parts are kept under <output dir>/.parts/<output name>/ with their manifest, so reruns only
+    fetch parts that are missing or changed; the merge is skipped when neither the parts nor
+    the merged file changed.
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    parts_dir = os.path.join(output_dir, ".parts", os.path.splitext(os.path.basename(output_path))[0])
+    tasks = split_request(dataset, request, parts_dir, split_keys, extension)
+    manager = manager or DownloadManager()
+    part_paths = manager.run(tasks)
+
+    parts_manifest = manager.manifest_for(part_paths[0])
+    merged_request = {"parts": {os.path.basename(p): parts_manifest.entries[os.path.basename(p)]["sha256"]
+                                for p in part_paths}}
+    output_manifest = manager.manifest_for(output_path)
+    if output_manifest.is_valid(output_path, merged_request):
+        print(f"{os.path.basename(output_path)} is up to date")
+        return output_path
+
+    print(f"Merging {len(part_paths)} parts into {output_path}...")
+    merge(part_paths, output_path)
+    output_manifest.record(output_path, dataset, merged_request)
+    return output_path
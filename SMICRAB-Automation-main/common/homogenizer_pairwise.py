@@ -1,7 +1,7 @@
 import numpy as np
 from typing import List, Union
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,6 +15,8 @@ class PairwiseResult:
     original_series: np.ndarray
     neighbor_means: np.ndarray
     breakpoints: List[int]
+    # Adjustment added to the segment ending at each breakpoint
+    innovations: List[float] = field(default_factory=list)
 
 
 class PairwiseHomogenizer:
@@ -70,7 +72,7 @@ class PairwiseHomogenizer:
         breakpoints = self._identify_breakpoints(series, neighbor_means)
         
         # Apply corrections based on breakpoints
-        corrected_series, corrections = self._apply_corrections(
+        corrected_series, corrections, innovations = self._apply_corrections(
             series, neighbor_means, breakpoints
         )
         
@@ -80,7 +82,8 @@ class PairwiseHomogenizer:
             corrected_series=corrected_series,
             original_series=series,
             neighbor_means=neighbor_means,
-            breakpoints=breakpoints
+            breakpoints=breakpoints,
+            innovations=innovations
         )
         
         # self.logger.info(f"Homogenization complete. Found {len(breakpoints)} breakpoints.")
@@ -236,10 +239,11 @@ class PairwiseHomogenizer:
         Returns:
         --------
         tuple
-            (corrected_series, corrections)
+            (corrected_series, corrections, innovations)
         """
         n = len(series)
         corrected_series = series.copy()
+        innovations = [0.0] * len(breakpoints)
         
         if len(breakpoints) > 1:
             # Process breakpoints from end to beginning
@@ -254,9 +258,10 @@ class PairwiseHomogenizer:
                 
                 # Apply correction
                 corrected_series[correction_slice] += innovation
+                innovations[i] = float(innovation)
         
         corrections = corrected_series - series
-        return corrected_series, corrections
+        return corrected_series, corrections, innovations
     
     def _calculate_innovation(self,
                              series: np.ndarray, 
@@ -1,6 +1,6 @@
 import numpy as np
 from typing import List, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class SnhtResult:
@@ -12,11 +12,13 @@ class SnhtResult:
         original: Original input time series
         reference: Reference series used for correction
         breakpoints: 1-based indices of detected breakpoints
+        innovations: Adjustment added to the segment ending at each breakpoint
     """
     corrected: np.ndarray
     original: np.ndarray
     reference: np.ndarray
     breakpoints: List[int]
+    innovations: List[float] = field(default_factory=list)
 
 
 class SnhtHomogenizer:
@@ -90,14 +92,16 @@ class SnhtHomogenizer:
         breakpoints = original_idx[bps_valid].tolist() if bps_valid.size > 0 else []
 
         corrected = ts_data.copy()
+        innovations = []
         if breakpoints:
-            corrected = self._apply_corrections(corrected, ref_data, breakpoints)
+            corrected, innovations = self._apply_corrections(corrected, ref_data, breakpoints)
 
         return SnhtResult(
             corrected=corrected,
             original=ts_data,
             reference=ref_data,
-            breakpoints=breakpoints
+            breakpoints=breakpoints,
+            innovations=innovations
         )
 
 
@@ -140,9 +144,10 @@ class SnhtHomogenizer:
             ts_data: np.ndarray,
             ref_data: np.ndarray,
             breakpoints: List[int],
-    ) -> np.ndarray:
+    ) -> Tuple[np.ndarray, List[float]]:
         corrected = ts_data.copy()
         bps0 = [bp for bp in breakpoints]
+        innovations = [0.0] * len(bps0)
 
         for i in range(len(bps0) - 1, -1, -1):
             bp = bps0[i]
@@ -157,8 +162,9 @@ class SnhtHomogenizer:
             # print(f"Before correction: {corrected[prev:bp + 1]}")
 
             corrected[prev:bp + 1] += innov
+            innovations[i] = float(innov)
 
-        return corrected
+        return corrected, innovations
 
 
     def _calculate_innovation(
@@ -0,0 +1,202 @@
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+from typing import Callable, List, Optional, Tuple
+
+from common.chunk_index import open_subset
+from common.download_manager import download_split, merge_netcdf_parts
+
+# Encoding kept when a file is rewritten with an unlimited time dimension
+_KEPT_ENCODING = ('dtype', 'zlib', 'complevel', 'shuffle', '_FillValue', 'scale_factor', 'add_offset')
+
+
+def last_time(path: str, time_name: str = "time") -> Optional[pd.Timestamp]:
+    """Last time step of a NetCDF file, or None if the file has no time steps."""
+    with netCDF4.Dataset(path) as nc:
+        time_var = nc.variables[time_name]
+        if time_var.shape[0] == 0:
+            return None
+        calendar = time_var.calendar if 'calendar' in time_var.ncattrs() else 'standard'
+        last = netCDF4.num2date(time_var[-1], time_var.units, calendar, only_use_cftime_datetimes=False)
+    return pd.Timestamp(last.isoformat())
+
+
+def next_month(timestamp: pd.Timestamp) -> pd.Timestamp:
+    """First day of the month after timestamp."""
+    return pd.Timestamp(timestamp.year, timestamp.month, 1) + pd.DateOffset(months=1)
+
+
+def months_after(timestamp: pd.Timestamp, until: Optional[pd.Timestamp] = None) -> List[pd.Timestamp]:
+    """
+    First days of the months after the month of timestamp, up to the last complete month.
+
+    Args:
+        timestamp: Last time step already processed
+        until: Date of the newest data available (default: today)
+    """
+    until = pd.Timestamp.today() if until is None else pd.Timestamp(until)
+    last_complete = pd.Timestamp(until.year, until.month, 1) - pd.DateOffset(months=1)
+    return list(pd.date_range(next_month(timestamp), last_complete, freq="MS"))
+
+
+def complete_months(ds: xr.Dataset, time_name: str = "time") -> xr.Dataset:
+    """Drop the trailing month of a daily dataset when its last day is missing (a month still in progress)."""
+    if ds.sizes[time_name] == 0:
+        return ds
+    times = pd.to_datetime(ds[time_name].values)
+    last = times[-1]
+    if last.day == last.days_in_month:
+        return ds
+    return ds.isel({time_name: times < pd.Timestamp(last.year, last.month, 1)})
+
+
+def _decoded_times(ds: xr.Dataset, time_name: str) -> list:
+    time_var = ds[time_name]
+    if np.issubdtype(time_var.dtype, np.datetime64):
+        return list(pd.to_datetime(time_var.values).to_pydatetime())
+    # Numeric times, e.g. seconds since 1970 as written by convert_time_units
+    dates = netCDF4.num2date(time_var.values, time_var.attrs['units'], time_var.attrs.get('calendar', 'standard'),
+                             only_use_cftime_datetimes=False)
+    return [pd.Timestamp(d.isoformat()).to_pydatetime() for d in np.atleast_1d(dates)]
+
+
+def ensure_unlimited_time(path: str, time_name: str = "time", chunk_size: int = 12) -> bool:
+    """
+    Make the time dimension of path unlimited so that time steps can be appended in place.
+
+    Files written before the time dimension was declared unlimited are rewritten once,
+    streaming chunk_size time steps at a time. Returns whether the file was rewritten.
+    """
+    with netCDF4.Dataset(path) as nc:
+        if nc.dimensions[time_name].isunlimited():
+            return False
+
+    print(f"  Rewriting {os.path.basename(path)} with an unlimited {time_name} dimension...")
+    tmp_path = f"{path}.part"
+    with xr.open_dataset(path, decode_times=False, chunks={time_name: chunk_size}) as ds:
+        encoding = {}
+        for name, var in ds.variables.items():
+            encoding[name] = {k: v for k, v in var.encoding.items() if k in _KEPT_ENCODING}
+            if var.ndim > 1 and var.dims[0] == time_name:
+                encoding[name]['chunksizes'] = (1,) + var.shape[1:]
+        ds.to_netcdf(tmp_path, encoding=encoding, unlimited_dims=[time_name])
+    os.replace(tmp_path, path)
+    return True
+
+
+def append_netcdf(path: str, ds: xr.Dataset, time_name: str = "time") -> int:
+    """
+    Append the time steps of ds that are newer than the last time step of path, in place.
+
+    Every variable of path along time_name must be in ds, on the same grid; values are written
+    by position, so coordinate edits made to path (e.g. the CF-1.8 grid shift) are kept.
+    Times are encoded with the units and calendar of path. Returns the number of time steps
+    appended.
+    """
+    ensure_unlimited_time(path, time_name)
+    last = last_time(path, time_name)
+    times = _decoded_times(ds, time_name)
+    new = [i for i, t in enumerate(times) if last is None or pd.Timestamp(t) > last]
+    if not new:
+        return 0
+
+    with netCDF4.Dataset(path, 'a') as nc:
+        time_var = nc.variables[time_name]
+        calendar = time_var.calendar if 'calendar' in time_var.ncattrs() else 'standard'
+        start = time_var.shape[0]
+        end = start + len(new)
+
+        variables = [name for name, var in nc.variables.items()
+                     if name != time_name and time_name in var.dimensions]
+        missing = [name for name in variables if name not in ds.variables]
+        if missing:
+            raise ValueError(f"Cannot append to {path}: {', '.join(missing)} missing from the new data")
+
+        for name in variables:
+            nc_var = nc.variables[name]
+            var = ds[name].isel({time_name: new})
+            values = var.transpose(*[dim for dim in nc_var.dimensions if dim in var.dims]).values
+            if nc_var.dtype == np.dtype('S1') and values.ndim == nc_var.ndim - 1:
+                # Strings stored as character arrays (e.g. the ERA5 expver)
+                values = netCDF4.stringtochar(values.astype(f"S{nc_var.shape[-1]}"))
+            if values.shape[1:] != nc_var.shape[1:]:
+                raise ValueError(f"Cannot append to {path}: {name} has shape {values.shape[1:]}, "
+                                 f"expected {nc_var.shape[1:]}")
+            nc_var[start:end] = values
+
+        values = netCDF4.date2num([times[i] for i in new], time_var.units, calendar)
+        if np.issubdtype(time_var.dtype, np.integer):
+            values = np.round(values)
+        time_var[start:end] = np.asarray(values).astype(time_var.dtype)
+
+        history = nc.getncattr('history') if 'history' in nc.ncattrs() else ""
+        appended = f"{pd.Timestamp(times[new[0]]):%Y-%m} to {pd.Timestamp(times[new[-1]]):%Y-%m}"
+        nc.setncattr('history', f"{history}\n{pd.Timestamp.now():%Y-%m-%d %H:%M:%S}: appended {appended}".strip())
+    return len(new)
+
+
+def append_new_months(target_file: str, daily_file: str, variables: List[str],
+                      lat_bounds: Tuple[float, float], lon_bounds: Tuple[float, float],
+                      aggregate: Callable[[xr.Dataset], xr.Dataset]) -> int:
+    """
+    Aggregate the complete months of daily_file newer than target_file and append them to it.
+
+    Only the days after the last month of target_file are read (through the chunk index), so
+    an update costs the new months rather than the whole record.
+
+    Args:
+        target_file: Monthly NetCDF file to extend (the CF-1.8 file of the variable)
+        daily_file: Daily E-OBS file
+        variables: Variables to read from daily_file, as in the subset step
+        lat_bounds, lon_bounds: Domain box, as in the subset step
+        aggregate: The aggregation of the processing script, daily subset -> monthly dataset
+
+    Returns:
+        Number of months appended
+    """
+    last = last_time(target_file)
+    since = None if last is None else next_month(last)
+    ds_new = complete_months(open_subset(daily_file, variables, lat_bounds=lat_bounds, lon_bounds=lon_bounds,
+                                         time_bounds=(since, None)))
+    if ds_new.sizes['time'] == 0:
+        print(f"  No new complete months in {os.path.basename(daily_file)}")
+        return 0
+
+    n_months = append_netcdf(target_file, aggregate(ds_new))
+    print(f"  Appended {n_months} months to {target_file}")
+    return n_months
+
+
+def append_era5_months(dataset: str, request: dict, target_file: str, time_name: str = "valid_time",
+                       until: Optional[pd.Timestamp] = None) -> int:
+    """
+    Download the months after the last one in target_file and append them to it.
+
+    request is the full request of the download script; its year and month lists are replaced
+    by the missing months, one request per year. The downloads are kept under
+    <target dir>/updates/ so an interrupted update resumes like a full download.
+
+    Returns:
+        Number of months appended
+    """
+    months = months_after(last_time(target_file, time_name), until)
+    if not months:
+        print(f"{os.path.basename(target_file)} is up to date")
+        return 0
+
+    updates_dir = os.path.join(os.path.dirname(os.path.abspath(target_file)), "updates")
+    stem = os.path.splitext(os.path.basename(target_file))[0]
+    n_months = 0
+    for year, group in itertools.groupby(months, key=lambda month: month.year):
+        group = list(group)
+        year_request = dict(request, year=[str(year)], month=[f"{month.month:02d}" for month in group])
+        update_file = os.path.join(updates_dir, f"{stem}_{year}_{group[0].month:02d}-{group[-1].month:02d}.nc")
+        print(f"Downloading {year} months {', '.join(year_request['month'])}...")
+        download_split(dataset, year_request, update_file, merge=merge_netcdf_parts)
+        with xr.open_dataset(update_file) as ds:
+            n_months += append_netcdf(target_file, ds, time_name)
+    print(f"Appended {n_months} months to {target_file}")
+    return n_months
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Compare the output chunking profiles of common/output_layout.py on a homogenized product.
+
+Each (time, latitude, longitude) variable of the input file is written once per profile,
+and the script reports the file size, the write time and the time of the two access
+patterns of the downstream users: reading whole maps (one time step, e.g. a layer of rast()
+in R) and reading the full series of single pixels. Reads go through netCDF4 with the HDF5
+chunk cache disabled, so every read pays for the chunks it touches.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.layout_benchmark data/rr_IT_2011_2023_Monthly/rr_..._corrected.nc
+    PYTHONPATH=.. python3 -m common.layout_benchmark --synthetic 156x170x140 --digits 3
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+import xarray as xr
+import netCDF4
+
+from common.output_layout import PROFILES, OutputProfile
+
+CUBE_DIMS = ("time", "latitude", "longitude")
+
+
+def synthetic_dataset(n_time: int, n_lat: int, n_lon: int, seed: int = 0) -> xr.Dataset:
+    """Smooth field plus noise with a NaN sea mask, shaped like a homogenized product."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_time)[:, None, None]
+    y = np.linspace(0, 1, n_lat)[None, :, None]
+    x = np.linspace(0, 1, n_lon)[None, None, :]
+    field = 15 + 10 * np.sin(2 * np.pi * t / 12) - 8 * y + 2 * x + rng.normal(0, 0.5, (n_time, n_lat, n_lon))
+    sea = np.broadcast_to((x + y < 0.3) | (x - y > 0.8), field.shape)
+    field = np.where(sea, np.nan, field)
+    uncertainty = np.where(sea, np.nan, np.abs(rng.normal(0.3, 0.1, field.shape)))
+    coords = {"time": np.arange(n_time) * 2629800.0, "latitude": 36 + 0.1 * np.arange(n_lat),
+              "longitude": 6 + 0.1 * np.arange(n_lon)}
+    return xr.Dataset({"variable": (CUBE_DIMS, field), "variable_adjusted": (CUBE_DIMS, field + 0.1),
+                       "variable_uncertainty": (CUBE_DIMS, uncertainty)}, coords=coords)
+
+
+def write_profile(ds: xr.Dataset, path: str, profile: OutputProfile, derived: List[str],
+                  digits: Optional[int]) -> float:
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if var.dims == CUBE_DIMS:
+            encoding[name] = profile.encoding(var.shape, least_significant_digit=digits if name in derived else None)
+    start = time.perf_counter()
+    ds.to_netcdf(path, encoding=encoding)
+    return time.perf_counter() - start
+
+
+def time_reads(path: str, variable: str, n_reads: int, pattern: str, seed: int = 0) -> float:
+    """Mean seconds per read of a whole map ("map") or a whole pixel series ("series")."""
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(path) as nc:
+        var = nc.variables[variable]
+        var.set_var_chunk_cache(size=0, nelems=0)
+        n_time, n_lat, n_lon = var.shape
+        start = time.perf_counter()
+        for _ in range(n_reads):
+            if pattern == "map":
+                var[rng.integers(n_time), :, :]
+            else:
+                var[:, rng.integers(n_lat), rng.integers(n_lon)]
+        return (time.perf_counter() - start) / n_reads
+
+
+def run_benchmark(ds: xr.Dataset, profiles: List[str], n_reads: int, derived: List[str],
+                  digits: Optional[int], work_dir: str) -> List[dict]:
+    variable = next(name for name, var in ds.data_vars.items() if var.dims == CUBE_DIMS)
+    results = []
+    for name in profiles:
+        profile = PROFILES[name]
+        path = os.path.join(work_dir, f"{name}.nc")
+        write_seconds = write_profile(ds, path, profile, derived, digits)
+        results.append({
+            "profile": name,
+            "chunks": list(profile.chunk_shape(ds[variable].shape)),
+            "size_mb": os.path.getsize(path) / 1e6,
+            "write_s": write_seconds,
+            "map_read_ms": 1000 * time_reads(path, variable, n_reads, "map"),
+            "series_read_ms": 1000 * time_reads(path, variable, n_reads, "series"),
+        })
+        os.remove(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the output chunking profiles on a homogenized product.')
+    parser.add_argument('input_file', nargs='?', help='NetCDF file with (time, latitude, longitude) variables')
+    parser.add_argument('--synthetic', default=None, metavar='TxYxX',
+                        help='Benchmark a synthetic product of this shape instead, e.g. 156x170x140')
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES),
+                        help='Profiles to compare (default: all)')
+    parser.add_argument('--reads', type=int, default=50, help='Reads timed per access pattern')
+    parser.add_argument('--digits', type=int, default=None,
+                        help='least_significant_digit applied to the derived variables')
+    parser.add_argument('--derived', nargs='*', default=None,
+                        help='Derived variables to quantize (default: those with "uncertainty" in the name)')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        ds = synthetic_dataset(*(int(n) for n in args.synthetic.lower().split("x")))
+    elif args.input_file:
+        ds = xr.open_dataset(args.input_file, decode_times=False).load()
+    else:
+        parser.error("an input file or --synthetic is required")
+    derived = args.derived if args.derived is not None else [name for name in ds.data_vars if "uncertainty" in name]
+
+    work_dir = tempfile.mkdtemp(prefix="layout_benchmark_")
+    try:
+        results = run_benchmark(ds, args.profiles, args.reads, derived, args.digits, work_dir)
+    except Exception as e:
+        print(f"Error running the benchmark: {str(e)}")
+        sys.exit(1)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    shape = "x".join(str(n) for n in ds[next(iter(ds.data_vars))].shape)
+    quantized = f", {', '.join(derived)} quantized to {args.digits} digits" if args.digits is not None and derived else ""
+    print(f"Grid {shape}, {args.reads} reads per pattern{quantized}")
+    print(f"{'profile':<10} {'chunks':<16} {'size MB':>9} {'write s':>8} {'map ms':>8} {'series ms':>10}")
+    for r in results:
+        chunks = "x".join(str(n) for n in r["chunks"])
+        print(f"{r['profile']:<10} {chunks:<16} {r['size_mb']:9.2f} {r['write_s']:8.2f} "
+              f"{r['map_read_ms']:8.2f} {r['series_read_ms']:10.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"shape": shape, "digits": args.digits, "derived": derived, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Distance-based neighbourhoods of grid cells.
+
+The references of the homogenizations are built from the neighbours of each cell. Instead
+of a square window of grid cells, whose extent in km shrinks with latitude along the
+longitude axis, neighbours are the valid cells within a radius in km (great-circle
+distance) or the k nearest ones. A KD-tree over the valid cell centres (as points on the
+unit sphere) is built once per grid and the neighbour lists of all cells are queried at
+once and kept as sparse (CSR) arrays, so a homogenization looks them up cell by cell
+instead of scanning a window.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.neighbor_index data/ERA5_hu_Monthly/derived/hu_IT_2011_2023_Monthly_ERA5_relative_humidity.nc --radius-km 165
+"""
+import sys
+import argparse
+import numpy as np
+import xarray as xr
+from dataclasses import dataclass
+from scipy.spatial import cKDTree
+from typing import Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+def _unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lat, lon = np.radians(lats), np.radians(lons)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_km(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _km_to_chord(km: float) -> float:
+    return 2 * np.sin(min(km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+
+def radius_cells(radius_km: float, lats: np.ndarray, lons: np.ndarray) -> int:
+    """Number of grid cells spanning radius_km along both axes everywhere on the grid (a tiling halo)."""
+    lat_step = np.abs(np.diff(lats)).min() if len(lats) > 1 else 180.0
+    lon_step = np.abs(np.diff(lons)).min() if len(lons) > 1 else 360.0
+    min_cos = max(np.cos(np.radians(np.abs(lats).max())), 1e-6)
+    return int(np.ceil(max(radius_km / (lat_step * KM_PER_DEGREE), radius_km / (lon_step * KM_PER_DEGREE * min_cos))))
+
+
+@dataclass
+class NeighborLists:
+    """
+    Neighbours of every cell of a (lat, lon) grid, in CSR form.
+
+    The neighbours of the cell with flat index c = lat_idx * n_lon + lon_idx are the flat
+    indices indices[indptr[c]:indptr[c + 1]], nearest first, at distances_km of the same slice.
+    """
+    shape: Tuple[int, int]
+    indptr: np.ndarray
+    indices: np.ndarray
+    distances_km: np.ndarray
+
+    def cell(self, lat_idx: int, lon_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Flat indices and distances in km of the neighbours of a cell."""
+        c = lat_idx * self.shape[1] + lon_idx
+        span = slice(self.indptr[c], self.indptr[c + 1])
+        return self.indices[span], self.distances_km[span]
+
+    def weights(self, lat_idx: int, lon_idx: int, power: float = 1.0) -> np.ndarray:
+        """Inverse-distance weights (1 / d^power, summing to 1) of the neighbours of a cell."""
+        _, distances = self.cell(lat_idx, lon_idx)
+        weights = 1.0 / np.maximum(distances, 1e-3) ** power
+        return weights / weights.sum() if len(weights) else weights
+
+    def counts(self) -> np.ndarray:
+        """Number of neighbours of every cell, as a (lat, lon) array."""
+        return np.diff(self.indptr).reshape(self.shape)
+
+
+class NeighborIndex:
+    """KD-tree over the valid cell centres of a regular (lat, lon) grid."""
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, valid: Optional[np.ndarray] = None):
+        """
+        Args:
+            lats: Latitudes of the grid rows, in any order
+            lons: Longitudes of the grid columns
+            valid: (lat, lon) mask of the cells that can be neighbours (default: all)
+        """
+        self.shape = (len(lats), len(lons))
+        lat2d, lon2d = np.meshgrid(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64),
+                                   indexing="ij")
+        self.points = _unit_vectors(lat2d.ravel(), lon2d.ravel())
+        mask = np.ones(self.shape, dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+        self.valid_cells = np.flatnonzero(mask.ravel())
+        self.tree = cKDTree(self.points[self.valid_cells])
+        self._lists = {}
+
+    @classmethod
+    def from_data(cls, lats: np.ndarray, lons: np.ndarray, data: np.ndarray) -> "NeighborIndex":
+        """Index of the cells of a (time, lat, lon) array with at least one value."""
+        return cls(lats, lons, ~np.isnan(data).all(axis=0))
+
+    def neighbors(self, radius_km: Optional[float] = None, k: Optional[int] = None) -> NeighborLists:
+        """
+        Neighbour lists of all cells: the valid cells within radius_km, or the k nearest valid
+        cells (within radius_km if both are given). A cell is never its own neighbour.
+        Computed once per (radius_km, k) and cached.
+        """
+        if radius_km is None and k is None:
+            raise ValueError("Give a radius in km, a number of neighbours, or both")
+        key = (radius_km, k)
+        if key not in self._lists:
+            self._lists[key] = self._query(radius_km, k)
+        return self._lists[key]
+
+    def _query(self, radius_km: Optional[float], k: Optional[int]) -> NeighborLists:
+        n_cells = len(self.points)
+        bound = np.inf if radius_km is None else _km_to_chord(radius_km)
+        if k is not None:
+            # One extra for the cell itself, dropped below
+            n_query = min(k + 1, len(self.valid_cells))
+            found = self.tree.query(self.points, k=n_query, distance_upper_bound=bound)[1].reshape(n_cells, -1)
+            lists = [found[c][found[c] < len(self.valid_cells)] for c in range(n_cells)]
+        else:
+            lists = self.tree.query_ball_point(self.points, r=bound, return_sorted=True)
+
+        indptr = np.zeros(n_cells + 1, dtype=np.int64)
+        indices, distances = [], []
+        for c, found in enumerate(lists):
+            cells = self.valid_cells[np.asarray(found, dtype=np.int64)]
+            cells = cells[cells != c]
+            chord = np.linalg.norm(self.points[cells] - self.points[c], axis=1)
+            order = np.argsort(chord, kind="stable")
+            if k is not None:
+                order = order[:k]
+            indices.append(cells[order].astype(np.int32))
+            distances.append(_chord_to_km(chord[order]).astype(np.float32))
+            indptr[c + 1] = indptr[c] + len(order)
+        return NeighborLists(self.shape, indptr, np.concatenate(indices), np.concatenate(distances))
+
+
+def neighbor_mean(data_2d: np.ndarray, indices: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Mean of the neighbour columns of a (time, cells) array at every time step, ignoring missing
+    values; weighted when weights are given. NaN where no neighbour has a value.
+    """
+    n_time = data_2d.shape[0]
+    if len(indices) == 0:
+        return np.full(n_time, np.nan)
+    columns = data_2d[:, indices]
+    valid = ~np.isnan(columns)
+    if weights is None:
+        weights = np.ones(len(indices))
+    sums = np.where(valid, columns, 0.0) @ weights
+    totals = valid @ weights
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(totals > 0, sums / totals, np.nan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the neighbourhoods of the cells of a gridded file.')
+    parser.add_argument('nc_file', help='NetCDF file with a (time, latitude, longitude) variable')
+    parser.add_argument('--variable', default=None, help='Variable whose valid cells are neighbours (default: first)')
+    parser.add_argument('--radius-km', type=float, default=None, help='Neighbourhood radius in km')
+    parser.add_argument('--k', type=int, default=None, help='Number of nearest neighbours')
+    args = parser.parse_args()
+
+    try:
+        with xr.open_dataset(args.nc_file) as ds:
+            name = args.variable or next(n for n, v in ds.data_vars.items() if v.ndim == 3)
+            index = NeighborIndex.from_data(ds["latitude"].values, ds["longitude"].values, ds[name].values)
+            lists = index.neighbors(args.radius_km, args.k)
+            if args.radius_km:
+                halo = radius_cells(args.radius_km, ds["latitude"].values, ds["longitude"].values)
+                print(f"A {args.radius_km:g} km radius spans {halo} grid cells")
+    except Exception as e:
+        print(f"Error indexing {args.nc_file}: {str(e)}")
+        sys.exit(1)
+    counts = lists.counts()
+    print(f"{len(index.valid_cells)} valid cells of {counts.size}; neighbours per cell: "
+          f"min {counts.min()}, median {int(np.median(counts))}, max {counts.max()}")
+
+
+if __name__ == "__main__":
+    main()
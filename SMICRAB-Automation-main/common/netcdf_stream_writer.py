@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+from typing import List, Optional, Tuple
+
+
+class NetCDFStreamWriter:
+    """
+    Appends gridded time slices to a NetCDF file with an unlimited time dimension.
+
+    Datasets are written as they are produced, so the full time series never has to be
+    held in memory. Each variable is chunked as (1, lat, lon), one map per chunk, which
+    matches the append pattern. The file is written under a ".part" name and only moved to
+    its final path by close(), so an interrupted run never leaves a truncated output behind.
+
+    Args:
+        output_path: Final path of the NetCDF file
+        variables: Names of the data variables to write
+        spatial_dims: Names of the (y, x) dimensions of every written variable
+        time_units: CF units of the time coordinate
+        calendar: CF calendar of the time coordinate
+        complevel: zlib compression level (0 disables compression)
+        global_attributes: Attributes to set on the file; defaults to those of the first dataset
+    """
+
+    def __init__(self, output_path: str, variables: List[str], spatial_dims: Tuple[str, str] = ('lat', 'lon'),
+                 time_units: str = "seconds since 1970-01-01 00:00:00", calendar: str = "proleptic_gregorian",
+                 complevel: int = 4, global_attributes: Optional[dict] = None):
+        self.output_path = output_path
+        self.tmp_path = f"{output_path}.part"
+        self.variables = variables
+        self.spatial_dims = spatial_dims
+        self.time_units = time_units
+        self.calendar = calendar
+        self.complevel = complevel
+        self.global_attributes = global_attributes
+        self.nc: Optional[netCDF4.Dataset] = None
+        self.n_times = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _create(self, ds: xr.Dataset) -> None:
+        y_dim, x_dim = self.spatial_dims
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.nc = netCDF4.Dataset(self.tmp_path, 'w', format='NETCDF4')
+
+        self.nc.createDimension('time', None)
+        time_var = self.nc.createVariable('time', 'f8', ('time',))
+        time_var.setncatts({'standard_name': 'time', 'units': self.time_units,
+                            'calendar': self.calendar, 'axis': 'T'})
+
+        for dim in (y_dim, x_dim):
+            values = ds[dim].values
+            self.nc.createDimension(dim, len(values))
+            coord_var = self.nc.createVariable(dim, values.dtype, (dim,))
+            coord_var[:] = values
+            coord_var.setncatts(ds[dim].attrs)
+
+        chunks = (1, ds.sizes[y_dim], ds.sizes[x_dim])
+        for var in self.variables:
+            dtype = ds[var].dtype
+            fill_value = np.array(np.nan, dtype=dtype) if np.issubdtype(dtype, np.floating) else None
+            nc_var = self.nc.createVariable(var, dtype, ('time', y_dim, x_dim),
+                                            zlib=self.complevel > 0, complevel=self.complevel,
+                                            chunksizes=chunks, fill_value=fill_value)
+            nc_var.setncatts({k: v for k, v in ds[var].attrs.items() if k != '_FillValue'})
+
+        attrs = ds.attrs if self.global_attributes is None else self.global_attributes
+        self.nc.setncatts(attrs)
+
+    def append(self, ds: xr.Dataset) -> None:
+        """Write every time step of ds after the ones already in the file."""
+        if self.nc is None:
+            self._create(ds)
+
+        times = pd.to_datetime(ds['time'].values).to_pydatetime()
+        start, end = self.n_times, self.n_times + len(times)
+        self.nc.variables['time'][start:end] = netCDF4.date2num(times, self.time_units, self.calendar)
+        for var in self.variables:
+            values = ds[var].transpose('time', *self.spatial_dims).values
+            self.nc.variables[var][start:end, :, :] = values
+        self.n_times = end
+
+    def close(self) -> None:
+        """Flush the file and move it to its final path."""
+        if self.nc is None:
+            return
+        self.nc.close()
+        self.nc = None
+        os.replace(self.tmp_path, self.output_path)
+
+    def abort(self) -> None:
+        """Close and discard the partially written file."""
+        if self.nc is not None:
+            self.nc.close()
+            self.nc = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
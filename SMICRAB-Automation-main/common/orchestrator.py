@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from common.run_manifest import RunManifest, StageRecord, manifest_path, now, publish_manifest
+from common.stage_cache import (ProcessUsage, StageCache, failure_message, read_step_stats, run_measured, PROJECT_ROOT,
+                                STEP_STATS_ENV_VAR)
+
+
+@dataclass
+class Step:
+    """
+    One step of a pipeline: a command with the files it reads and writes.
+
+    A step depends on the steps that produce its inputs, plus the steps listed in after.
+    Inputs without a producer in the run (e.g. downloads that were skipped) must exist.
+
+    Attributes:
+        pipeline: Pipeline (variable directory) the step belongs to
+        name: Step name, unique within the pipeline; also its stage cache name
+        command: Command line, run from cwd
+        cwd: Working directory (the variable directory, as for the run_*.sh scripts)
+        inputs, outputs: Files or directories read and written
+        after: Full names (pipeline.name) of steps that must finish first without sharing a file
+        cpus, memory_gb: Estimated cores and peak memory, counted against the run budgets
+        network: Whether the step downloads, counted against the network budget
+        cached: Whether the step goes through the stage cache
+    """
+    pipeline: str
+    name: str
+    command: List[str]
+    cwd: str
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    after: List[str] = field(default_factory=list)
+    cpus: float = 1
+    memory_gb: float = 1
+    network: bool = False
+    cached: bool = True
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.pipeline}.{self.name}"
+
+    @property
+    def cache_path(self) -> str:
+        return os.path.join(self.cwd, "data", "stage_cache.json")
+
+
+@dataclass
+class StepResult:
+    step: str
+    status: str  # "ok", "cached", "failed", "blocked" (an upstream step failed)
+    seconds: float = 0.0
+    log_path: Optional[str] = None
+    message: str = ""
+    # Counters reported by the step itself (e.g. cell cache hits), by section
+    stats: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    # CPU time and peak memory of the command, when it ran
+    cpu_seconds: Optional[float] = None
+    peak_memory_gb: Optional[float] = None
+
+    def stats_summary(self) -> str:
+        return "; ".join(f"{section}: " + ", ".join(f"{count} {name}" for name, count in counts.items())
+                         for section, counts in self.stats.items())
+
+
+@dataclass
+class Budget:
+    """Resources shared by the steps running at the same time."""
+    cpus: float
+    memory_gb: float
+    network: int
+
+    @classmethod
+    def from_system(cls, network: int = 2) -> "Budget":
+        return cls(cpus=float(os.cpu_count() or 1), memory_gb=available_memory_gb(), network=network)
+
+    def fits(self, step: Step, used: "Budget") -> bool:
+        # A step larger than the whole budget still runs, alone
+        idle = used.cpus == 0 and used.memory_gb == 0 and used.network == 0
+        return idle or (used.cpus + step.cpus <= self.cpus
+                        and used.memory_gb + step.memory_gb <= self.memory_gb
+                        and used.network + step.network <= self.network)
+
+
+def available_memory_gb() -> float:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return 8.0
+
+
+def resolve_dependencies(steps: List[Step]) -> Dict[str, List[str]]:
+    """Map each step to the steps it waits for: the producers of its inputs and its after list."""
+    producers = {}
+    for step in steps:
+        for path in step.outputs:
+            producers[os.path.abspath(path)] = step.full_name
+    names = {step.full_name for step in steps}
+
+    dependencies = {}
+    for step in steps:
+        deps = {producers[os.path.abspath(p)] for p in step.inputs if os.path.abspath(p) in producers}
+        deps.update(name for name in step.after if name in names)
+        deps.discard(step.full_name)
+        dependencies[step.full_name] = sorted(deps)
+
+    # Reject cycles before starting anything
+    visiting, done = set(), set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in dependencies[name]:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for name in dependencies:
+        visit(name, [])
+    return dependencies
+
+
+class Orchestrator:
+    """
+    Runs the steps of one or more pipelines as a DAG.
+
+    Ready steps (all dependencies done) start as soon as they fit in the CPU, memory and
+    network budgets, so independent pipelines, and independent steps within a pipeline (ERA5
+    and E-OBS downloads, tg/tn/tx homogenizations), run concurrently. Each step writes its
+    output to its own log file. A step fails if its command fails or any declared output is
+    missing afterwards; the steps downstream of it are reported as blocked while the rest of
+    the DAG continues.
+
+    Args:
+        steps: Steps of all pipelines to run
+        budget: Resource budgets; defaults to the machine's cores and available memory
+        log_dir: Directory of the per-step logs and of the run report
+    """
+
+    def __init__(self, steps: List[Step], budget: Optional[Budget] = None,
+                 log_dir: str = os.path.join(PROJECT_ROOT, "logs")):
+        self.steps = {step.full_name: step for step in steps}
+        self.dependencies = resolve_dependencies(steps)
+        self.budget = budget or Budget.from_system()
+        self.log_dir = log_dir
+        self.results: Dict[str, StepResult] = {}
+        self.started: Optional[str] = None
+        self._condition = threading.Condition()
+        self._used = Budget(0, 0, 0)
+
+    def _missing_inputs(self, step: Step) -> List[str]:
+        produced = {os.path.abspath(p) for s in self.steps.values() for p in s.outputs}
+        return [p for p in step.inputs if os.path.abspath(p) not in produced and not os.path.exists(p)]
+
+    def _run_step(self, step: Step) -> StepResult:
+        log_path = os.path.join(self.log_dir, step.pipeline, f"{step.name}.log")
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        start = time.perf_counter()
+
+        cache = StageCache(step.cache_path) if step.cached else None
+        fingerprint = None
+        if cache is not None:
+            fingerprint = cache.begin(step.name, step.command, step.inputs, cwd=step.cwd)
+            if fingerprint is None:
+                return StepResult(step.full_name, "cached", time.perf_counter() - start)
+
+        stats_path = f"{os.path.splitext(log_path)[0]}.stats.json"
+        if os.path.exists(stats_path):
+            os.remove(stats_path)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")])))
+        env[STEP_STATS_ENV_VAR] = stats_path
+        with open(log_path, "w") as log:
+            log.write(f"$ {' '.join(step.command)}\n")
+            log.flush()
+            usage = run_measured(step.command, cwd=step.cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        seconds = time.perf_counter() - start
+        stats = read_step_stats(stats_path)
+        if cache is not None:
+            message = cache.finish(step.name, fingerprint, usage.returncode, step.outputs)
+        else:
+            message = failure_message(usage.returncode, step.outputs)
+        return StepResult(step.full_name, "failed" if message else "ok", seconds, log_path, message, stats,
+                          usage.cpu_seconds, usage.peak_memory_gb)
+
+    def _worker(self, step: Step) -> None:
+        try:
+            result = self._run_step(step)
+        except Exception as e:
+            result = StepResult(step.full_name, "failed", message=str(e))
+        with self._condition:
+            self._used.cpus -= step.cpus
+            self._used.memory_gb -= step.memory_gb
+            self._used.network -= step.network
+            detail = f" ({result.message})" if result.message else ""
+            print(f"[{result.status:>7}] {step.full_name} {result.seconds:8.1f} s{detail}", flush=True)
+            self.results[step.full_name] = result
+            self._condition.notify_all()
+
+    def run(self) -> Dict[str, StepResult]:
+        """Run every step; returns the result of each step."""
+        self.started = now()
+        for name, step in self.steps.items():
+            missing = self._missing_inputs(step)
+            if missing:
+                self.results[name] = StepResult(name, "failed", message=f"missing inputs: {', '.join(missing)}")
+                print(f"[ failed] {name} (missing inputs: {', '.join(missing)})")
+
+        pending = [name for name in self.steps if name not in self.results]
+        running = set()
+        with self._condition:
+            while pending or running:
+                running -= set(self.results)
+                started = False
+                for name in list(pending):
+                    deps = self.dependencies[name]
+                    if any(self.results.get(dep) and self.results[dep].status in ("failed", "blocked") for dep in deps):
+                        self.results[name] = StepResult(name, "blocked", message="an upstream step failed")
+                        pending.remove(name)
+                        started = True
+                        print(f"[blocked] {name}")
+                        continue
+                    if not all(dep in self.results for dep in deps):
+                        continue
+                    step = self.steps[name]
+                    if not self.budget.fits(step, self._used):
+                        continue
+                    self._used.cpus += step.cpus
+                    self._used.memory_gb += step.memory_gb
+                    self._used.network += step.network
+                    pending.remove(name)
+                    running.add(name)
+                    started = True
+                    threading.Thread(target=self._worker, args=(step,), daemon=True).start()
+                if not started and (pending or running):
+                    self._condition.wait()
+        return self.results
+
+    def report(self, wall_seconds: float) -> str:
+        """Text summary of the run, also written with the step timings to <log_dir>/run_report.json."""
+        lines = [f"{'step':<45} {'status':<8} {'seconds':>9}  log"]
+        for name in self.steps:
+            result = self.results[name]
+            log_path = os.path.relpath(result.log_path, self.log_dir) if result.log_path else "-"
+            line = f"{name:<45} {result.status:<8} {result.seconds:9.1f}  {log_path}"
+            if result.stats:
+                line += f"  ({result.stats_summary()})"
+            lines.append(line)
+        counts = {}
+        for result in self.results.values():
+            counts[result.status] = counts.get(result.status, 0) + 1
+        lines.append(f"Wall time {wall_seconds:.1f} s, step time {sum(r.seconds for r in self.results.values()):.1f} s; "
+                     + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(os.path.join(self.log_dir, "run_report.json"), "w") as f:
+            json.dump({"wall_seconds": wall_seconds,
+                       "steps": [vars(self.results[name]) for name in self.steps]}, f, indent=2)
+        return "\n".join(lines)
+
+    def write_manifests(self, parameters: Optional[Dict[str, object]] = None) -> List[str]:
+        """
+        Write the run manifest (common/run_manifest.py) of every pipeline of the run next to
+        its outputs, in <pipeline>/data/run_manifest.json.
+
+        Args:
+            parameters: Options the run was started with
+
+        Returns:
+            Paths of the manifests written
+        """
+        paths = []
+        for pipeline in dict.fromkeys(step.pipeline for step in self.steps.values()):
+            steps = [step for step in self.steps.values() if step.pipeline == pipeline]
+            manifest = RunManifest.new(pipeline, parameters)
+            manifest.started = self.started or manifest.started
+            path = manifest_path(steps[0].cwd)
+            cache = StageCache(steps[0].cache_path)
+            for step in steps:
+                result = self.results[step.full_name]
+                usage = None if result.cpu_seconds is None else \
+                    ProcessUsage(0, result.cpu_seconds, result.peak_memory_gb)
+                manifest.add_stage(StageRecord.build(step.name, result.status, step.command, step.inputs,
+                                                     step.outputs, step.cwd, cache, result.seconds, usage,
+                                                     stats=result.stats, message=result.message))
+            failed = any(self.results[step.full_name].status in ("failed", "blocked") for step in steps)
+            manifest.finish(1 if failed else 0)
+            cache.remember_hashes()
+            publish_manifest(path, manifest)
+            paths.append(path)
+        return paths
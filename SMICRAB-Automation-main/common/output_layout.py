@@ -0,0 +1,88 @@
+import os
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+OUTPUT_PROFILE_ENV_VAR = "SMICRAB_OUTPUT_PROFILE"
+DERIVED_DIGITS_ENV_VAR = "SMICRAB_DERIVED_DIGITS"
+DEFAULT_PROFILE = "balanced"
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """
+    Chunking and compression of the (time, latitude, longitude) variables of an output file.
+
+    Attributes:
+        name: Profile name, as used in SMICRAB_OUTPUT_PROFILE
+        time_chunk: Time steps per chunk (None: the whole series)
+        space_chunk: Latitude and longitude cells per chunk side (None: the whole grid)
+        complevel: zlib compression level (0 disables compression)
+        shuffle: Apply the HDF5 shuffle filter before compressing, which usually shrinks
+            floating point fields noticeably at no read cost
+    """
+    name: str
+    time_chunk: Optional[int]
+    space_chunk: Optional[int]
+    complevel: int = 4
+    shuffle: bool = True
+
+    def chunk_shape(self, shape: Sequence[int]) -> Tuple[int, int, int]:
+        """Chunk sizes for a (time, lat, lon) variable of the given shape."""
+        n_time, n_lat, n_lon = shape
+        return (max(1, min(self.time_chunk or n_time, n_time)),
+                max(1, min(self.space_chunk or n_lat, n_lat)),
+                max(1, min(self.space_chunk or n_lon, n_lon)))
+
+    def encoding(self, shape: Sequence[int], compress: bool = True,
+                 least_significant_digit: Optional[int] = None) -> dict:
+        """
+        xarray/netCDF4 encoding of a (time, lat, lon) variable.
+
+        Args:
+            shape: Shape of the variable
+            compress: Enable compression (and shuffle)
+            least_significant_digit: Quantize values to this many decimal digits before
+                compressing (lossy, for derived fields only); None keeps full precision
+        """
+        encoding = {
+            "zlib": compress and self.complevel > 0,
+            "complevel": self.complevel if compress else 0,
+            "shuffle": compress and self.shuffle,
+            "chunksizes": self.chunk_shape(shape),
+            "_FillValue": np.nan,
+        }
+        if least_significant_digit is not None:
+            encoding["least_significant_digit"] = least_significant_digit
+        return encoding
+
+
+PROFILES = {
+    # One map per chunk: reading a time step (e.g. a layer of rast() in R) touches one chunk
+    "map": OutputProfile("map", time_chunk=1, space_chunk=None),
+    # Whole series of 16 x 16 cell blocks: reading a pixel's series touches one chunk
+    "series": OutputProfile("series", time_chunk=None, space_chunk=16),
+    # A year of 64 x 64 cell blocks: reasonable for both access patterns
+    "balanced": OutputProfile("balanced", time_chunk=12, space_chunk=64),
+}
+
+
+def get_output_profile(name: Optional[str] = None) -> OutputProfile:
+    """
+    Return the profile called name, or the one selected by the SMICRAB_OUTPUT_PROFILE
+    environment variable (default: balanced).
+    """
+    name = (name or os.environ.get(OUTPUT_PROFILE_ENV_VAR) or DEFAULT_PROFILE).lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown output profile '{name}', expected one of: {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+def derived_significant_digit() -> Optional[int]:
+    """
+    Decimal digits kept in derived fields (e.g. the uncertainty cube), from the
+    SMICRAB_DERIVED_DIGITS environment variable; None (the default) keeps full precision.
+    """
+    value = os.environ.get(DERIVED_DIGITS_ENV_VAR)
+    return int(value) if value not in (None, "") else None
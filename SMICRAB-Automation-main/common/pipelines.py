@@ -0,0 +1,270 @@
+"""
+Steps of the eight variable pipelines, as run by run_all.py.
+
+These mirror the run_*.sh scripts step for step, with the same stage cache names and
+command lines, so a step cached by one is also cached for the other.
+"""
+import os
+from typing import Dict, List, Tuple
+
+from common.orchestrator import Step
+from common.qc_census import qc_paths
+from common.stage_cache import PROJECT_ROOT
+
+E_OBS_VERSION = "2011-2023_v29.0e"
+# Peak memory estimates (GB) used for scheduling
+AGGREGATION_MEMORY_GB = 2
+HOMOGENIZATION_MEMORY_GB = 4
+
+
+def _python(var_dir: str, script: str) -> List[str]:
+    return ["python3", os.path.join(var_dir, "processing", script)]
+
+
+def _download(pipeline: str, var_dir: str, name: str, command: List[str], outputs: List[str]) -> Step:
+    return Step(pipeline, name, command, var_dir, outputs=outputs, cpus=0.25, memory_gb=0.5, network=True)
+
+
+def _unzip(pipeline: str, var_dir: str, zip_file: str, target: str) -> Step:
+    command = ["python3", "-m", "common.zip_extract", zip_file, target]
+    return Step(pipeline, "unzip", command, var_dir, inputs=[zip_file], outputs=[target], cpus=2, memory_gb=0.5)
+
+
+def _qc(pipeline: str, var_dir: str, name: str, path: str, after: List[str] = None) -> Step:
+    # Missing-value census of path, reported to data/qc/ (common/qc_census.py)
+    qc_dir = os.path.join(var_dir, "data", "qc")
+    command = ["python3", "-m", "common.qc_census", "--qc-dir", qc_dir, path]
+    return Step(pipeline, name, command, var_dir, inputs=[path], outputs=list(qc_paths(path, qc_dir)),
+                after=after or [], memory_gb=0.5)
+
+
+def e_obs_pipeline(pipeline: str, var: str, script_prefix: str = None, versions: Dict[str, str] = None,
+                   era5_download: str = None, era5_file: str = None,
+                   homogenizations: Dict[str, Tuple[str, str, List[str]]] = None,
+                   csv_outputs: List[str] = None, csv_inputs: List[str] = None, e_obs_vars: List[str] = None,
+                   generate_csv: bool = False, downloads: bool = True, extract: bool = True,
+                   append: bool = False) -> List[Step]:
+    """
+    Steps of an E-OBS variable: CDS downloads, unzip, monthly aggregation, CF-1.8 compliance,
+    homogenization against ERA5 (if any) and CSV export.
+
+    In append mode the ERA5 download and the aggregation only add the months newer than the
+    existing files to them, in place; they always run, and the CF-1.8 step is not needed.
+
+    Args:
+        pipeline: Variable directory name
+        var: E-OBS file prefix of the zip and daily/monthly directories (e.g. rr, air_temp)
+        script_prefix: Prefix of the processing scripts (default: var)
+        versions: E-OBS monthly file version per variable, default E_OBS_VERSION
+        era5_download: ERA5 download script, if the variable is homogenized
+        era5_file: ERA5 monthly file written by era5_download, relative to data/
+        homogenizations: Homogenization script -> (step name, output, E-OBS inputs), paths relative to data/
+        csv_outputs, csv_inputs: CSV files written by the CSV step and files it reads, relative to data/
+        e_obs_vars: E-OBS variables aggregated from the daily files (default [var])
+        generate_csv: Include the CSV step
+        downloads: Include the download steps
+        extract: Include the unzip step
+        append: Append the new months to the existing monthly files instead of rebuilding them
+    """
+    var_dir = os.path.join(PROJECT_ROOT, pipeline)
+    data = os.path.join(var_dir, "data")
+    script_prefix = script_prefix or var
+    e_obs_vars = e_obs_vars or [var]
+    versions = versions or {}
+
+    def monthly(v, suffix=""):
+        return os.path.join(data, f"E_OBS_{var}_Monthly",
+                            f"{v}_ens_mean_0.1deg_reg_{versions.get(v, E_OBS_VERSION)}_monthly{suffix}.nc")
+
+    zip_file = os.path.join(data, f"{var}_2011_2023_Daily_E_OBS.zip")
+    daily_dir = os.path.join(data, f"E_OBS_{var}_Daily")
+    steps = []
+    if downloads:
+        if era5_download:
+            era5_step = _download(pipeline, var_dir, "era5_download", _python(var_dir, era5_download),
+                                  [os.path.join(data, era5_file)])
+            if append:
+                era5_step.command.append("--append")
+                era5_step.cached = False
+            steps.append(era5_step)
+        steps.append(_download(pipeline, var_dir, "eobs_download",
+                               _python(var_dir, f"{script_prefix}_e_obs_download.py"), [zip_file]))
+    if extract:
+        steps.append(_unzip(pipeline, var_dir, zip_file, daily_dir))
+    if append:
+        steps.append(Step(pipeline, "append", _python(var_dir, f"{script_prefix}_e_obs_processing.py") + ["--append"],
+                          var_dir, inputs=[daily_dir], outputs=[monthly(v, "_CF-1.8") for v in e_obs_vars],
+                          cached=False))
+    else:
+        steps.append(Step(pipeline, "aggregation", _python(var_dir, f"{script_prefix}_e_obs_processing.py"), var_dir,
+                          inputs=[daily_dir], outputs=[monthly(v) for v in e_obs_vars],
+                          memory_gb=AGGREGATION_MEMORY_GB))
+        steps.append(Step(pipeline, "cf_compliance", _python(var_dir, f"{script_prefix}_make_cf_compliant.py"),
+                          var_dir, inputs=[monthly(v) for v in e_obs_vars],
+                          outputs=[monthly(v, "_CF-1.8") for v in e_obs_vars]))
+
+    for script, (name, output, extra_inputs) in (homogenizations or {}).items():
+        steps.append(Step(pipeline, name, _python(var_dir, script), var_dir,
+                          inputs=[os.path.join(data, p) for p in extra_inputs] + [os.path.join(data, era5_file)],
+                          outputs=[os.path.join(data, output)], memory_gb=HOMOGENIZATION_MEMORY_GB))
+
+    if generate_csv:
+        steps.append(Step(pipeline, "csv", _python(var_dir, f"{script_prefix}_generate_csv.py"), var_dir,
+                          inputs=[os.path.join(data, p) for p in csv_inputs],
+                          outputs=[os.path.join(data, p) for p in csv_outputs]))
+    return steps
+
+
+def _monthly_cf(var, v, version=E_OBS_VERSION):
+    return f"E_OBS_{var}_Monthly/{v}_ens_mean_0.1deg_reg_{version}_monthly_CF-1.8.nc"
+
+
+def _corrected(directory, v, version=E_OBS_VERSION):
+    return f"{directory}/{v}_ens_mean_0.1deg_reg_{version}_monthly_CF-1.8_corrected.nc"
+
+
+def single_variable_pipeline(pipeline: str, var: str, version: str = E_OBS_VERSION,
+                             corrected_version: str = None, **kwargs) -> List[Step]:
+    """E-OBS pipeline of one variable homogenized against ERA5 (rr, hu, fg)."""
+    corrected = _corrected(f"{var}_IT_2011_2023_Monthly", var, corrected_version or version)
+    return e_obs_pipeline(
+        pipeline, var, versions={var: version},
+        era5_download=f"{var}_era5_download.py", era5_file=f"ERA5_{var}_Monthly/{var}_IT_2011_2023_Monthly_ERA5.nc",
+        homogenizations={f"{var}_homogenization.py": ("homogenization", corrected, [_monthly_cf(var, var, version)])},
+        csv_inputs=[corrected], csv_outputs=[os.path.basename(corrected).replace(".nc", ".csv")], **kwargs)
+
+
+def air_temperature_pipeline(**kwargs) -> List[Step]:
+    directory = "air_temp_IT_2011_2023_Monthly"
+    homogenizations = {"tg_homogenization.py": ("tg_homogenization", _corrected(directory, "tg"),
+                                                [_monthly_cf("air_temp", "tg")])}
+    for v in ("tn", "tx"):
+        # Min and max temperature are corrected with the homogenized mean temperature
+        homogenizations[f"{v}_homogenization.py"] = (f"{v}_homogenization", _corrected(directory, v),
+                                                     [_monthly_cf("air_temp", v), _corrected(directory, "tg")])
+    return e_obs_pipeline(
+        "air_temperature", "air_temp", e_obs_vars=["tg", "tn", "tx"],
+        era5_download="2m_temp_era5_download.py",
+        era5_file="ERA5_air_temp_Monthly/air_temp_IT_2011_2023_Monthly_ERA5.nc",
+        homogenizations=homogenizations,
+        csv_inputs=[_corrected(directory, v) for v in ("tg", "tn", "tx")],
+        csv_outputs=[os.path.basename(_corrected(directory, v)).replace(".nc", ".csv") for v in ("tg", "tn", "tx")],
+        **kwargs)
+
+
+def e_obs_only_pipeline(pipeline: str, var: str, **kwargs) -> List[Step]:
+    """E-OBS pipeline without homogenization (pp, qq); the CSV is written next to the CF file."""
+    cf_file = _monthly_cf(var, var)
+    return e_obs_pipeline(pipeline, var, csv_inputs=[cf_file], csv_outputs=[cf_file.replace(".nc", ".csv")],
+                          **kwargs)
+
+
+def albedo_pipeline(generate_csv: bool = False, downloads: bool = True, extract: bool = True) -> List[Step]:
+    pipeline = "Albedo"
+    var_dir = os.path.join(PROJECT_ROOT, pipeline)
+    data = os.path.join(var_dir, "data")
+    era5_file = os.path.join(data, "ERA5_SAL_Monthly", "SAL_IT_2011_2023_Monthly_ERA5.nc")
+    zip_file = os.path.join(data, "Albedo_CMSAF_2011_2023.zip")
+    daily_dir = os.path.join(data, "CMSAF_SAL_daily")
+    cmsaf_monthly = os.path.join(data, "CMSAF_SAL_Monthly", "SAL_IT_2011_2023_Monthly_CMSAF.nc")
+    merged = os.path.join(data, "SAL_Monthly_2011-2023", "SAL_IT_2011-2023_Monthly_CMSAF_ERA5.nc")
+    cf_file = os.path.join(data, "SAL_Monthly_2011-2023_CF_Compliant", "SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8.nc")
+    reinterpolated = cf_file.replace(".nc", "_Reinterpolated.nc")
+
+    steps = []
+    if downloads:
+        steps.append(_download(pipeline, var_dir, "era5_download", _python(var_dir, "era5_sal_download.py"),
+                               [era5_file]))
+        steps.append(_download(pipeline, var_dir, "cmsaf_download", _python(var_dir, "cmsaf_sal_download.py") + [data],
+                               [zip_file]))
+    if extract:
+        steps.append(_unzip(pipeline, var_dir, zip_file, daily_dir))
+    steps += [
+        Step(pipeline, "cmsaf_processing", _python(var_dir, "cmsaf_sal_processing.py"), var_dir,
+             inputs=[daily_dir], outputs=[cmsaf_monthly], memory_gb=AGGREGATION_MEMORY_GB),
+        Step(pipeline, "merge", _python(var_dir, "merge_cmsaf_with_era5_sal.py"), var_dir,
+             inputs=[cmsaf_monthly, era5_file], outputs=[merged]),
+        Step(pipeline, "cf_compliance", _python(var_dir, "make_sal_cf_compliant.py"), var_dir,
+             inputs=[merged], outputs=[cf_file]),
+        Step(pipeline, "reinterpolation", _python(var_dir, "reinterpolate_merged_cmsaf_era5.py"), var_dir,
+             inputs=[cf_file], outputs=[reinterpolated]),
+    ]
+    if generate_csv:
+        steps.append(Step(pipeline, "csv", _python(var_dir, "albedo_generate_csv.py"), var_dir,
+                          inputs=[reinterpolated],
+                          outputs=[os.path.join(data, os.path.basename(reinterpolated).replace(".nc", ".csv"))]))
+    for name, path in (("cmsaf_missing_values", cmsaf_monthly), ("cf_missing_values", cf_file),
+                       ("reinterpolated_missing_values", reinterpolated)):
+        steps.append(_qc(pipeline, var_dir, name, path, after=[f"{pipeline}.reinterpolation"]))
+    return steps
+
+
+def lst_pipeline(generate_csv: bool = False, downloads: bool = True, extract: bool = True) -> List[Step]:
+    # run_LST.sh calls its scripts relative to the variable directory
+    pipeline = "Land_Surface_Temperature"
+    var_dir = os.path.join(PROJECT_ROOT, pipeline)
+    data = os.path.join(var_dir, "data")
+    land_mask = "./processing/land_mask.npy"
+    cmsaf_zip = os.path.join(data, "LST_CMSAF_2011_2020.zip")
+    cmsaf_daily = os.path.join(data, "CMSAF_LST_daily")
+    eumetsat_hourly = os.path.join(data, "EUMETSAT_LST_hourly")
+    cmsaf_monthly = os.path.join(data, "CMSAF_Monthly_Per_Hour", "LST_IT_2011_2020_agg_monthly_per_hour.nc")
+    eumetsat_monthly = os.path.join(data, "EUMETSAT_Monthly_Per_Hour", "LST_IT_2021_2023_agg_monthly_per_hour.nc")
+    merged = os.path.join(data, "LST_Monthly_Per_Hour_2011-2023", "LST_IT_2011_2023_agg_Monthly_per_hour.nc")
+    cf_file = merged.replace(".nc", "_grid_0.1_CF-1.8.nc")
+
+    steps = []
+    if downloads:
+        steps.append(_download(pipeline, var_dir, "cmsaf_download",
+                               ["python3", "./processing/cmsaf_lst_download.py", data], [cmsaf_zip]))
+        steps.append(_download(pipeline, var_dir, "eumetsat_download", ["./processing/download_eumetsat.sh"],
+                               [eumetsat_hourly]))
+    if extract:
+        steps.append(_unzip(pipeline, var_dir, cmsaf_zip, cmsaf_daily))
+    steps += [
+        Step(pipeline, "cmsaf_processing", ["python3", "./processing/cmsaf_lst_processing.py"], var_dir,
+             inputs=[cmsaf_daily, os.path.join(var_dir, land_mask)], outputs=[cmsaf_monthly],
+             memory_gb=AGGREGATION_MEMORY_GB),
+        Step(pipeline, "eumetsat_processing", ["python3", "./processing/eumetsat_lst_processing.py"], var_dir,
+             inputs=[eumetsat_hourly, os.path.join(var_dir, land_mask)], outputs=[eumetsat_monthly],
+             memory_gb=AGGREGATION_MEMORY_GB),
+        Step(pipeline, "merge", ["python3", "./processing/merge_lst_datasets.py"], var_dir,
+             inputs=[cmsaf_monthly, eumetsat_monthly], outputs=[merged]),
+        Step(pipeline, "cf_compliance", ["python3", "./processing/make_lst_cf_compliant.py"], var_dir,
+             inputs=[merged], outputs=[cf_file]),
+    ]
+    if generate_csv:
+        steps.append(Step(pipeline, "csv", ["python3", "./processing/lst_generate_csv.py"], var_dir,
+                          inputs=[cf_file], outputs=[os.path.join(data, os.path.basename(cf_file).replace(".nc", ".csv"))]))
+    return steps
+
+
+PIPELINES = {
+    "accumulated_precipitation": lambda **kw: single_variable_pipeline("accumulated_precipitation", "rr", **kw),
+    "air_temperature": air_temperature_pipeline,
+    "Albedo": albedo_pipeline,
+    "Land_Surface_Temperature": lst_pipeline,
+    "relative_humidity": lambda **kw: single_variable_pipeline("relative_humidity", "hu", **kw),
+    "sea_level_pressure": lambda **kw: e_obs_only_pipeline("sea_level_pressure", "pp", **kw),
+    "solar_irradiance": lambda **kw: e_obs_only_pipeline("solar_irradiance", "qq", **kw),
+    "wind_speed": lambda **kw: single_variable_pipeline("wind_speed", "fg", version="2011-2024_v30.0e",
+                                                        corrected_version="2011-2023_v30.0e", **kw),
+}
+
+
+# Pipelines without an append mode; they go through their usual (cached) steps
+NO_APPEND_PIPELINES = ("Albedo", "Land_Surface_Temperature")
+
+
+def build_steps(pipelines: List[str] = None, generate_csv: bool = False, downloads: bool = True,
+                extract: bool = True, append: bool = False) -> List[Step]:
+    """Steps of the selected pipelines (default: all)."""
+    steps = []
+    for name in pipelines or PIPELINES:
+        if name not in PIPELINES:
+            raise ValueError(f"Unknown pipeline '{name}', expected one of: {', '.join(PIPELINES)}")
+        kwargs = dict(generate_csv=generate_csv, downloads=downloads, extract=extract)
+        if append and name not in NO_APPEND_PIPELINES:
+            kwargs["append"] = True
+        steps.extend(PIPELINES[name](**kwargs))
+    return steps
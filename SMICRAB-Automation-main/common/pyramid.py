@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Coarse overviews of the homogenized products.
+
+When SMICRAB_PYRAMID is set, every homogenized product <name>.nc gets a sidecar
+<name>_pyramid.nc holding its (time, latitude, longitude) variables averaged onto coarser
+grids, one CF-1.8 group per level (res_0.2, res_0.5, res_1 by default). A coarse cell
+is the mean of the valid 0.1 degree cells inside it, and missing only when all of them
+are, so coastlines and gaps do not spread. Previews and overview maps can read a level
+instead of the full-resolution cube:
+
+    xr.open_dataset("..._corrected_pyramid.nc", group="res_0.5")
+
+SMICRAB_PYRAMID=on builds the default levels; a comma-separated list of resolutions in
+degrees (e.g. 0.25,1.0) builds those instead.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.pyramid data/rr_IT_2011_2023_Monthly/rr_..._corrected.nc --levels 0.2 0.5 1.0
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import netCDF4
+from typing import List, Optional, Sequence, Tuple
+
+PYRAMID_ENV_VAR = "SMICRAB_PYRAMID"
+DEFAULT_LEVELS = (0.2, 0.5, 1.0)
+CUBE_DIMS = ("time", "latitude", "longitude")
+# Time steps averaged at once
+TIME_BLOCK = 12
+
+
+def pyramid_levels() -> Optional[List[float]]:
+    """Resolutions selected by SMICRAB_PYRAMID, or None when no pyramid is built."""
+    value = os.environ.get(PYRAMID_ENV_VAR, "").strip().lower()
+    if value in ("", "0", "off", "no", "false"):
+        return None
+    if value in ("1", "on", "yes", "true"):
+        return list(DEFAULT_LEVELS)
+    return [float(level) for level in value.split(",")]
+
+
+def pyramid_path(nc_path: str) -> str:
+    """Path of the pyramid file kept next to a product."""
+    return f"{os.path.splitext(nc_path)[0]}_pyramid.nc"
+
+
+def level_group(resolution: float) -> str:
+    """Group name of a level, e.g. res_0.5."""
+    return f"res_{resolution:g}"
+
+
+def coarse_bins(centers: np.ndarray, resolution: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group fine cells into the coarse cells of resolution containing their centers.
+
+    Coarse cells are aligned on multiples of resolution. Returns the index where each
+    group of fine cells starts (for np.add.reduceat) and the coarse cell centers.
+    """
+    index = np.floor(np.asarray(centers, dtype=np.float64) / resolution + 1e-9).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    return starts, (index[starts] + 0.5) * resolution
+
+
+def coarsen_mean(data: np.ndarray, lat_starts: np.ndarray, lon_starts: np.ndarray) -> np.ndarray:
+    """
+    NaN-aware block mean of a (..., lat, lon) array: the mean of the valid cells of each block,
+    NaN where a block has none.
+    """
+    valid = ~np.isnan(data)
+    sums = np.add.reduceat(np.add.reduceat(np.where(valid, data, 0.0), lat_starts, axis=-2), lon_starts, axis=-1)
+    counts = np.add.reduceat(np.add.reduceat(valid.astype(np.int32), lat_starts, axis=-2), lon_starts, axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _copy_attrs(src, dst, skip: Sequence[str] = ("_FillValue",)) -> None:
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs() if k not in skip})
+
+
+def _write_axis(group, name: str, centers: np.ndarray, resolution: float, src_var) -> None:
+    var = group.createVariable(name, "f8", (name,))
+    _copy_attrs(src_var, var, skip=("_FillValue", "bounds", "valid_min", "valid_max"))
+    var.bounds = f"{name}_bnds"
+    var[:] = centers
+    bounds = group.createVariable(f"{name}_bnds", "f8", (name, "bnds"))
+    bounds[:] = np.stack([centers - resolution / 2, centers + resolution / 2], axis=1)
+
+
+def build_pyramid(nc_path: str, levels: Optional[Sequence[float]] = None,
+                  output_path: Optional[str] = None) -> str:
+    """
+    Write the coarse levels of the (time, latitude, longitude) variables of nc_path.
+
+    The product is read TIME_BLOCK time steps at a time and every level is computed from
+    the full-resolution values, so the means are exact whatever the level.
+
+    Args:
+        nc_path: Product to summarize
+        levels: Resolutions in degrees (default: SMICRAB_PYRAMID, or 0.2, 0.5 and 1.0)
+        output_path: Pyramid file (default: <name>_pyramid.nc)
+
+    Returns:
+        Path of the pyramid file
+    """
+    levels = sorted(levels or pyramid_levels() or DEFAULT_LEVELS)
+    output_path = output_path or pyramid_path(nc_path)
+    tmp_path = f"{output_path}.part"
+    with netCDF4.Dataset(nc_path) as src, netCDF4.Dataset(tmp_path, "w", format="NETCDF4") as out:
+        _copy_attrs(src, out)
+        out.setncattr("Conventions", "CF-1.8")
+        out.setncattr("source_file", os.path.basename(nc_path))
+        out.setncattr("pyramid_levels", ", ".join(level_group(level) for level in levels))
+        cubes = [name for name, var in src.variables.items() if var.dimensions == CUBE_DIMS]
+        src_lat, src_lon = src.variables["latitude"], src.variables["longitude"]
+        n_time = len(src.dimensions["time"])
+
+        groups = []
+        for resolution in levels:
+            lat_starts, lat_centers = coarse_bins(src_lat[:], resolution)
+            lon_starts, lon_centers = coarse_bins(src_lon[:], resolution)
+            group = out.createGroup(level_group(resolution))
+            group.setncatts({"geospatial_lat_resolution": f"{resolution:g} degree",
+                             "geospatial_lon_resolution": f"{resolution:g} degree"})
+            group.createDimension("time", None)
+            group.createDimension("latitude", len(lat_centers))
+            group.createDimension("longitude", len(lon_centers))
+            group.createDimension("bnds", 2)
+            time_var = group.createVariable("time", src.variables["time"].dtype, ("time",))
+            _copy_attrs(src.variables["time"], time_var)
+            time_var[:] = src.variables["time"][:]
+            _write_axis(group, "latitude", lat_centers, resolution, src_lat)
+            _write_axis(group, "longitude", lon_centers, resolution, src_lon)
+            for name in cubes:
+                var = group.createVariable(name, src.variables[name].dtype, CUBE_DIMS, zlib=True, complevel=4,
+                                           shuffle=True, fill_value=np.nan,
+                                           chunksizes=(1, len(lat_centers), len(lon_centers)))
+                _copy_attrs(src.variables[name], var)
+                var.cell_methods = (f"latitude: longitude: mean (comment: mean of the valid source cells "
+                                   f"in each {resolution:g} degree cell)")
+            groups.append((group, lat_starts, lon_starts))
+
+        for start in range(0, n_time, TIME_BLOCK):
+            stop = min(start + TIME_BLOCK, n_time)
+            for name in cubes:
+                data = np.ma.filled(src.variables[name][start:stop].astype(np.float64), np.nan)
+                for group, lat_starts, lon_starts in groups:
+                    group.variables[name][start:stop] = coarsen_mean(data, lat_starts, lon_starts)
+    os.replace(tmp_path, output_path)
+    print(f"Saved {len(levels)}-level pyramid to: {output_path}")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the coarse overview levels of a product.')
+    parser.add_argument('nc_file', help='Product with (time, latitude, longitude) variables')
+    parser.add_argument('--levels', type=float, nargs='+', default=None,
+                        help=f'Resolutions in degrees (default: {PYRAMID_ENV_VAR}, or '
+                             f'{" ".join(f"{level:g}" for level in DEFAULT_LEVELS)})')
+    parser.add_argument('--output', default=None, help='Pyramid file (default: <name>_pyramid.nc)')
+    args = parser.parse_args()
+
+    try:
+        build_pyramid(args.nc_file, args.levels, args.output)
+    except Exception as e:
+        print(f"Error building the pyramid of {args.nc_file}: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
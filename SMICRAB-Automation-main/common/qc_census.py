@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Missing-value census of a NetCDF product.
+
+Counts the missing values (NaN, or masked by _FillValue / missing_value) of every variable
+per variable, per time step and per grid cell, in one pass over the file that reads a
+block of time steps at a time. The results are written as a QC report next to each other
+in the QC directory:
+
+    <stem>.qc.json  totals, missing values per time step, fully missing time steps and
+                    cell statistics of every variable
+    <stem>.qc.nc    number of missing time steps per grid cell (<variable>_missing)
+
+With --max-missing-fraction the census doubles as a gate: it exits with an error when a
+variable has a larger share of missing values, so a pipeline stops at the stage that
+produced the gap.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.qc_census data/SAL_Monthly_2011-2023_CF_Compliant/SAL_IT_2011-2023_Monthly_CMSAF_ERA5_CF-1.8.nc
+    PYTHONPATH=.. python3 -m common.qc_census data/E_OBS_rr_Monthly/*_CF-1.8.nc --max-missing-fraction 0.6
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import netCDF4
+from typing import Dict, List, Optional
+
+DEFAULT_QC_DIR = "./data/qc"
+TIME_NAMES = ("time", "valid_time")
+# Time steps read at once when the file does not chunk along time
+DEFAULT_TIME_BLOCK = 12
+
+
+def qc_paths(nc_path: str, qc_dir: str = DEFAULT_QC_DIR) -> tuple:
+    """Paths of the JSON and NetCDF QC reports of nc_path."""
+    stem = os.path.splitext(os.path.basename(nc_path))[0]
+    return os.path.join(qc_dir, f"{stem}.qc.json"), os.path.join(qc_dir, f"{stem}.qc.nc")
+
+
+def _missing(values) -> np.ndarray:
+    mask = np.ma.getmaskarray(values)
+    data = np.ma.getdata(values)
+    if data.dtype.kind == "f":
+        mask = mask | np.isnan(data)
+    return mask
+
+
+def _time_labels(nc: netCDF4.Dataset, time_name: str) -> List[str]:
+    time_var = nc.variables[time_name]
+    try:
+        calendar = time_var.calendar if "calendar" in time_var.ncattrs() else "standard"
+        dates = netCDF4.num2date(time_var[:], time_var.units, calendar, only_use_cftime_datetimes=False)
+        return [pd.Timestamp(d.isoformat()).isoformat() for d in np.atleast_1d(dates)]
+    except (AttributeError, ValueError, TypeError):
+        return [str(t) for t in np.atleast_1d(time_var[:])]
+
+
+def _time_block(nc: netCDF4.Dataset, variables: List[str]) -> int:
+    # Read whole on-disk chunks along time, so every chunk is decompressed once
+    blocks = []
+    for name in variables:
+        chunking = nc.variables[name].chunking()
+        if isinstance(chunking, list) and chunking[0] > 1:
+            blocks.append(chunking[0])
+    return max(blocks) if blocks else DEFAULT_TIME_BLOCK
+
+
+def census(nc_path: str) -> Dict:
+    """
+    Count the missing values of every variable of nc_path.
+
+    Returns:
+        Report dictionary, plus the per-cell counts of the variables with time and two
+        spatial dimensions under the "_cells" key (numpy arrays, not serialized to JSON)
+    """
+    with netCDF4.Dataset(nc_path) as nc:
+        time_name = next((name for name in TIME_NAMES if name in nc.dimensions), None)
+        variables = [name for name, var in nc.variables.items() if name not in nc.dimensions]
+        timed = [name for name in variables if time_name and nc.variables[name].dimensions[:1] == (time_name,)]
+        n_time = len(nc.dimensions[time_name]) if time_name else 0
+
+        stats = {}
+        per_time = {name: np.zeros(n_time, dtype=np.int64) for name in timed}
+        per_cell = {name: np.zeros(nc.variables[name].shape[1:], dtype=np.int32)
+                    for name in timed if nc.variables[name].ndim == 3}
+        for name in variables:
+            if name not in timed:
+                stats[name] = int(_missing(nc.variables[name][:]).sum())
+
+        block = _time_block(nc, timed)
+        for start in range(0, n_time, block):
+            stop = min(start + block, n_time)
+            for name in timed:
+                missing = _missing(nc.variables[name][start:stop])
+                per_time[name][start:stop] = missing.reshape(stop - start, -1).sum(axis=1)
+                if name in per_cell:
+                    per_cell[name] += missing.sum(axis=0, dtype=np.int32)
+
+        times = _time_labels(nc, time_name) if time_name else []
+        report = {
+            "file": os.path.abspath(nc_path),
+            "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+            "time_steps": n_time,
+            "variables": {},
+            "_cells": per_cell,
+            "_coords": {dim: nc.variables[dim][:] for dim in nc.dimensions
+                        if dim in nc.variables and dim != time_name},
+            "_dims": {name: nc.variables[name].dimensions[1:] for name in per_cell},
+        }
+        for name in variables:
+            var = nc.variables[name]
+            n_values = int(np.prod(var.shape))
+            missing = int(per_time[name].sum()) if name in per_time else stats[name]
+            entry = {
+                "dims": list(var.dimensions),
+                "shape": list(var.shape),
+                "values": n_values,
+                "missing": missing,
+                "missing_fraction": missing / n_values if n_values else 0.0,
+            }
+            if name in per_time:
+                values_per_step = n_values // n_time if n_time else 0
+                entry["missing_per_time"] = per_time[name].tolist()
+                entry["empty_times"] = [times[i] for i in np.flatnonzero(per_time[name] == values_per_step)]
+            if name in per_cell:
+                entry["cells"] = int(per_cell[name].size)
+                entry["cells_never_missing"] = int((per_cell[name] == 0).sum())
+                entry["cells_always_missing"] = int((per_cell[name] == n_time).sum())
+            report["variables"][name] = entry
+    return report
+
+
+def write_report(report: Dict, json_path: str, nc_path: str) -> None:
+    """Write the JSON report and the NetCDF of per-cell counts, each through a .part file."""
+    os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+    tmp_path = f"{json_path}.part"
+    with open(tmp_path, "w") as f:
+        json.dump({k: v for k, v in report.items() if not k.startswith("_")}, f, indent=2)
+    os.replace(tmp_path, json_path)
+
+    tmp_path = f"{nc_path}.part"
+    with netCDF4.Dataset(tmp_path, "w", format="NETCDF4") as out:
+        out.setncatts({"title": "Missing value census", "source_file": report["file"],
+                       "time_steps": report["time_steps"], "history": f"Created on {report['created']}"})
+        for dim in sorted({d for dims in report["_dims"].values() for d in dims}):
+            values = report["_coords"].get(dim)
+            out.createDimension(dim, None if values is None else len(values))
+            if values is not None:
+                out.createVariable(dim, np.asarray(values).dtype, (dim,))[:] = values
+        for name, counts in report["_cells"].items():
+            var = out.createVariable(f"{name}_missing", "i4", report["_dims"][name], zlib=True, complevel=4)
+            var.setncatts({"long_name": f"Number of missing time steps of {name}", "units": "1"})
+            var[:] = counts
+    os.replace(tmp_path, nc_path)
+
+
+def check_file(nc_path: str, qc_dir: str = DEFAULT_QC_DIR, max_missing_fraction: Optional[float] = None) -> bool:
+    """
+    Run the census of nc_path, write its QC report and print a summary.
+
+    Returns:
+        False when a variable exceeds max_missing_fraction
+    """
+    report = census(nc_path)
+    json_path, cells_path = qc_paths(nc_path, qc_dir)
+    write_report(report, json_path, cells_path)
+
+    passed = True
+    for name, entry in report["variables"].items():
+        line = f"Missing values in {name}: {entry['missing']} of {entry['values']} ({entry['missing_fraction']:.2%})"
+        if entry.get("empty_times"):
+            line += f", {len(entry['empty_times'])} empty time steps"
+        if max_missing_fraction is not None and entry["missing_fraction"] > max_missing_fraction:
+            line += f" > {max_missing_fraction:.2%}"
+            passed = False
+        print(line)
+    print(f"QC report saved to: {json_path}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the missing values of NetCDF files and write QC reports.')
+    parser.add_argument('files', nargs='+', help='NetCDF files to check')
+    parser.add_argument('--qc-dir', default=DEFAULT_QC_DIR, help=f'Directory of the QC reports (default: {DEFAULT_QC_DIR})')
+    parser.add_argument('--max-missing-fraction', type=float, default=None,
+                        help='Fail when a variable has a larger fraction of missing values')
+    args = parser.parse_args()
+
+    failed = []
+    for path in args.files:
+        try:
+            if not check_file(path, args.qc_dir, args.max_missing_fraction):
+                failed.append(path)
+        except Exception as e:
+            print(f"Error checking missing values in {path}: {str(e)}")
+            failed.append(path)
+    if failed:
+        print(f"QC failed for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Correlation-weighted reference series for SNHT.
+
+By default the SNHT reference of a cell is the plain mean of its ERA5 neighbours (see
+common/neighbor_index.py). With SMICRAB_REFERENCE=correlation it is built as in the
+classic SNHT instead: each neighbour is weighted by the squared correlation of its
+first-differenced series with the first-differenced candidate series, and only the
+k best-correlated neighbours (with a positive correlation) are kept.
+
+The correlations of all cells with all their neighbours are computed with matrix
+products over blocks of cells, and the references of all cells are formed at once as the
+product of the neighbour series with a sparse weight matrix, so nothing is computed cell
+by cell in Python but the top-k selection.
+"""
+import os
+import numpy as np
+from scipy import sparse
+
+from common.neighbor_index import NeighborLists
+
+REFERENCE_ENV_VAR = "SMICRAB_REFERENCE"
+REFERENCE_METHODS = ("mean", "correlation")
+# Neighbours kept per cell in correlation-weighted references
+DEFAULT_TOP_K = 10
+# Candidate cells whose correlations are computed in one matrix product
+CELL_BLOCK = 256
+
+
+def reference_method() -> str:
+    """Reference method selected by SMICRAB_REFERENCE (mean by default)."""
+    method = os.environ.get(REFERENCE_ENV_VAR, "").strip().lower() or "mean"
+    if method not in REFERENCE_METHODS:
+        raise ValueError(f"Unknown {REFERENCE_ENV_VAR} '{method}'. Available: {', '.join(REFERENCE_METHODS)}")
+    return method
+
+
+def standardized_differences(data_2d: np.ndarray) -> np.ndarray:
+    """
+    First differences of the columns of a (time, cells) array, standardized per column.
+
+    Missing differences are set to 0 after standardizing, so that products of two columns
+    sum over the time steps where both are valid; constant or nearly empty columns are all 0.
+    """
+    diffs = np.diff(np.asarray(data_2d, dtype=np.float64), axis=0)
+    valid = ~np.isnan(diffs)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.nansum(diffs, axis=0) / counts
+        diffs -= means
+        stds = np.sqrt(np.nansum(diffs ** 2, axis=0) / (counts - 1))
+        diffs /= stds
+    diffs[~valid] = 0.0
+    diffs[:, ~((counts > 2) & (stds > 0))] = 0.0
+    return diffs
+
+
+def neighbor_correlations(candidates: np.ndarray, pool: np.ndarray, lists: NeighborLists) -> np.ndarray:
+    """
+    Correlation of the first differences of every cell of candidates with each of its
+    neighbours in pool, aligned with lists.indices.
+
+    Args:
+        candidates: (time, cells) series of the cells being homogenized
+        pool: (time, cells) series of the neighbours, on the same grid
+        lists: Neighbour lists of the grid
+
+    Returns:
+        Array of correlations, one per entry of lists.indices
+    """
+    cand_z = standardized_differences(candidates)
+    pool_z = standardized_differences(pool)
+    scale = 1.0 / max(cand_z.shape[0] - 1, 1)
+    n_cells = len(lists.indptr) - 1
+    correlations = np.zeros(len(lists.indices), dtype=np.float64)
+    for start in range(0, n_cells, CELL_BLOCK):
+        stop = min(start + CELL_BLOCK, n_cells)
+        span = slice(lists.indptr[start], lists.indptr[stop])
+        neighbors = lists.indices[span]
+        if len(neighbors) == 0:
+            continue
+        # Cells of a block are neighbours in the grid, so their neighbourhoods largely overlap
+        union, columns = np.unique(neighbors, return_inverse=True)
+        products = cand_z[:, start:stop].T @ pool_z[:, union]
+        rows = np.repeat(np.arange(stop - start), np.diff(lists.indptr[start:stop + 1]))
+        correlations[span] = products[rows, columns] * scale
+    return np.clip(correlations, -1.0, 1.0)
+
+
+def correlation_weights(lists: NeighborLists, correlations: np.ndarray, k: int = DEFAULT_TOP_K) -> sparse.csr_matrix:
+    """
+    Sparse (cells, cells) matrix of reference weights: the squared correlations of the k
+    best-correlated neighbours of each cell with a positive correlation, or equal weights
+    on all its neighbours when none has one.
+    """
+    n_cells = len(lists.indptr) - 1
+    rows, cols, weights = [], [], []
+    for c in range(n_cells):
+        span = slice(lists.indptr[c], lists.indptr[c + 1])
+        neighbors, rho = lists.indices[span], correlations[span]
+        positive = np.flatnonzero(rho > 0)
+        if len(positive) == 0:
+            chosen, w = neighbors, np.ones(len(neighbors))
+        else:
+            if len(positive) > k:
+                positive = positive[np.argpartition(-rho[positive], k - 1)[:k]]
+            chosen, w = neighbors[positive], rho[positive] ** 2
+        rows.append(np.full(len(chosen), c))
+        cols.append(chosen)
+        weights.append(w)
+    return sparse.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n_cells, n_cells))
+
+
+def weighted_references(pool: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    """
+    References of all cells, as a (time, cells) array: the weighted means of their
+    neighbours' series at every time step, over the neighbours with a value.
+    """
+    valid = ~np.isnan(pool)
+    sums = weights @ np.where(valid, pool, 0.0).T
+    totals = weights @ valid.T.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(totals > 0, sums / totals, np.nan).T
+
+
+def correlation_references(candidates: np.ndarray, pool: np.ndarray, lists: NeighborLists,
+                           k: int = DEFAULT_TOP_K) -> np.ndarray:
+    """
+    Correlation-weighted references of all cells.
+
+    Args:
+        candidates: (time, lat, lon) series of the cells being homogenized
+        pool: (time, lat, lon) series of the neighbours, on the same grid
+        lists: Neighbour lists of the grid
+        k: Number of best-correlated neighbours kept per cell
+
+    Returns:
+        (time, lat, lon) array of references
+    """
+    n_time = pool.shape[0]
+    candidates_2d = np.asarray(candidates).reshape(n_time, -1)
+    pool_2d = np.asarray(pool).reshape(n_time, -1)
+    correlations = neighbor_correlations(candidates_2d, pool_2d, lists)
+    weights = correlation_weights(lists, correlations, k)
+    return weighted_references(pool_2d, weights).reshape(pool.shape)
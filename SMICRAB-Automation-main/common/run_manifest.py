@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Run manifests: a machine-readable record of every pipeline run.
+
+Each run of a pipeline, by run_all.py or by its run_*.sh script, writes
+<pipeline>/data/run_manifest.json next to its outputs. The manifest holds:
+
+    - when the run started and finished, its status and exit code
+    - the commit of the code, the host, the Python version and the versions of the libraries
+      the processing depends on
+    - the parameters of the run and the SMICRAB_* settings in effect
+    - every stage: its command, status (ok, cached, failed, blocked), wall and CPU time,
+      peak memory, the counters it reported (e.g. cell cache hits), and the size and sha256
+      of each file or directory it read and wrote
+
+File paths are relative to the pipeline directory, so a manifest stays valid when the
+directory is moved or copied. The sha256 of a directory covers the names and hashes of the
+files under it, as in the stage cache (common/stage_cache.py), whose memo of file hashes
+is shared so that unchanged files are not hashed again. The manifest is replaced
+atomically; the one of the previous run is kept as run_manifest.previous.json.
+
+load_manifest() reads a manifest into a RunManifest for the code ingesting the products.
+Its outputs() are the files of the run with their hashes: changed_outputs() lists those
+that no longer match (so unchanged ones can be reused without recomputing them) and
+compare() reports the differences with another run (changed outputs, slower stages,
+higher peak memory, different library versions).
+
+Usage (from the project root):
+    PYTHONPATH=. python3 -m common.run_manifest show relative_humidity/data/run_manifest.json
+    PYTHONPATH=. python3 -m common.run_manifest verify relative_humidity/data/run_manifest.json
+    PYTHONPATH=. python3 -m common.run_manifest compare relative_humidity/data/run_manifest.json [OLD_MANIFEST]
+
+and from the run scripts (run_stage passes --manifest to common/stage_cache.py):
+    python3 -m common.run_manifest begin data/run_manifest.json --pipeline relative_humidity
+    python3 -m common.run_manifest finish data/run_manifest.json --exit-code 0
+"""
+import os
+import sys
+import json
+import fcntl
+import socket
+import argparse
+import platform
+import subprocess
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from importlib import metadata
+from typing import Dict, List, Optional, Sequence
+
+from common.stage_cache import ProcessUsage, StageCache, PROJECT_ROOT, STEP_STATS_ENV_VAR, _parse_params
+
+MANIFEST_NAME = "run_manifest.json"
+PREVIOUS_MANIFEST_NAME = "run_manifest.previous.json"
+# Version of the manifest layout, raised when a field changes meaning
+SCHEMA_VERSION = 1
+# Distributions whose versions can change the products
+LIBRARIES = ("numpy", "pandas", "xarray", "scipy", "netCDF4", "h5netcdf", "zarr", "dask", "distributed", "cdsapi")
+# Slowdown and memory growth of a stage, against another run, reported by compare()
+REGRESSION_THRESHOLD = 0.2
+
+
+def now() -> str:
+    return datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+def manifest_path(pipeline_dir: str) -> str:
+    """Manifest of the pipeline in pipeline_dir (the variable directory)."""
+    return os.path.join(pipeline_dir, "data", MANIFEST_NAME)
+
+
+def manifest_root(path: str) -> str:
+    """Pipeline directory of a manifest in <pipeline>/data/, which its file paths are relative to."""
+    return os.path.dirname(os.path.dirname(os.path.abspath(path)))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True,
+                                text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def library_versions() -> Dict[str, Optional[str]]:
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def smicrab_settings() -> Dict[str, str]:
+    """The SMICRAB_* environment variables, except the ones set per step by the orchestrator."""
+    return {k: v for k, v in sorted(os.environ.items()) if k.startswith("SMICRAB_") and k != STEP_STATS_ENV_VAR}
+
+
+def _size(path: str) -> Optional[int]:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return None
+
+
+@dataclass
+class FileRecord:
+    """
+    A file or directory read or written by a stage.
+
+    Attributes:
+        path: Path relative to the pipeline directory (absolute if outside it)
+        size: Size in bytes, of all the files under a directory; None if the path is missing
+        sha256: Content hash; for a missing input that the stage moved away, the hash it had
+    """
+    path: str
+    size: Optional[int]
+    sha256: Optional[str]
+
+    @classmethod
+    def of(cls, path: str, root: str, cache: StageCache) -> "FileRecord":
+        path = os.path.abspath(path)
+        relative = os.path.relpath(path, root)
+        if relative.startswith(os.pardir):
+            relative = path
+        return cls(relative, _size(path), cache.file_hash(path))
+
+
+@dataclass
+class StageRecord:
+    """
+    One stage of a run.
+
+    Attributes:
+        name: Stage name, as in the stage cache
+        status: "ok", "cached", "failed" or "blocked" (an upstream stage failed)
+        command: Command line of the stage
+        seconds: Wall time, including the cache check
+        cpu_seconds, peak_memory_gb: CPU time and peak resident memory of the command and the
+            processes it waited for; None when it did not run
+        inputs, outputs: Files and directories read and written
+        params: Parameters of the stage
+        stats: Counters reported by the stage, by section
+        message: Why the stage failed
+        finished: When the stage finished
+    """
+    name: str
+    status: str
+    command: List[str]
+    seconds: float = 0.0
+    cpu_seconds: Optional[float] = None
+    peak_memory_gb: Optional[float] = None
+    inputs: List[FileRecord] = field(default_factory=list)
+    outputs: List[FileRecord] = field(default_factory=list)
+    params: Dict[str, str] = field(default_factory=dict)
+    stats: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    message: str = ""
+    finished: str = ""
+
+    @classmethod
+    def build(cls, name: str, status: str, command: Sequence[str], inputs: Sequence[str], outputs: Sequence[str],
+              root: str, cache: StageCache, seconds: float = 0.0, usage: Optional[ProcessUsage] = None,
+              params: Optional[Dict[str, str]] = None, stats: Optional[dict] = None,
+              message: str = "") -> "StageRecord":
+        """Record of a stage, hashing its files with the memo of cache."""
+        return cls(name, status, list(command), round(seconds, 2),
+                   None if usage is None else round(usage.cpu_seconds, 2),
+                   None if usage is None else round(usage.peak_memory_gb, 3),
+                   [FileRecord.of(p, root, cache) for p in inputs],
+                   [FileRecord.of(p, root, cache) for p in outputs],
+                   dict(params or {}), dict(stats or {}), message, now())
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StageRecord":
+        data = dict(data)
+        data["inputs"] = [FileRecord(**f) for f in data.get("inputs", [])]
+        data["outputs"] = [FileRecord(**f) for f in data.get("outputs", [])]
+        return cls(**data)
+
+
+@dataclass
+class RunManifest:
+    """
+    Provenance and results of one run of a pipeline.
+
+    Attributes:
+        pipeline: Pipeline (variable directory) that ran
+        started, finished: ISO timestamps; finished is None while the run is going on
+        status: "running", "ok" or "failed"
+        exit_code: Exit code of the run script, when known
+        wall_seconds: Duration of the run
+        commit: Git commit of the code, if known
+        host: Host name, cores, machine and Python version
+        libraries: Versions of the libraries in LIBRARIES (None when not installed)
+        parameters: Options the run was started with
+        environment: SMICRAB_* settings
+        stages: Stages in the order they finished
+        schema: Version of the manifest layout
+    """
+    pipeline: str
+    started: str
+    finished: Optional[str] = None
+    status: str = "running"
+    exit_code: Optional[int] = None
+    wall_seconds: Optional[float] = None
+    commit: Optional[str] = None
+    host: Dict[str, object] = field(default_factory=dict)
+    libraries: Dict[str, Optional[str]] = field(default_factory=dict)
+    parameters: Dict[str, object] = field(default_factory=dict)
+    environment: Dict[str, str] = field(default_factory=dict)
+    stages: List[StageRecord] = field(default_factory=list)
+    schema: int = SCHEMA_VERSION
+
+    @classmethod
+    def new(cls, pipeline: str, parameters: Optional[Dict[str, object]] = None) -> "RunManifest":
+        """Manifest of a run starting now, with the provenance of this process."""
+        return cls(pipeline, now(), commit=git_commit(),
+                   host={"name": socket.gethostname(), "cpus": os.cpu_count(), "machine": platform.machine(),
+                         "python": platform.python_version()},
+                   libraries=library_versions(), parameters=dict(parameters or {}),
+                   environment=smicrab_settings())
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunManifest":
+        if data.get("schema", SCHEMA_VERSION) > SCHEMA_VERSION:
+            raise ValueError(f"Manifest schema {data['schema']} is newer than the supported {SCHEMA_VERSION}")
+        data = dict(data)
+        data["stages"] = [StageRecord.from_dict(s) for s in data.get("stages", [])]
+        return cls(**data)
+
+    def add_stage(self, stage: StageRecord) -> None:
+        """Add a stage, replacing an earlier record of the same stage (e.g. a rerun)."""
+        self.stages = [s for s in self.stages if s.name != stage.name] + [stage]
+
+    def stage(self, name: str) -> Optional[StageRecord]:
+        return next((s for s in self.stages if s.name == name), None)
+
+    def outputs(self) -> Dict[str, FileRecord]:
+        """The files written by the successful stages of the run, by path."""
+        return {f.path: f for s in self.stages if s.status in ("ok", "cached") for f in s.outputs}
+
+    def finish(self, exit_code: int) -> None:
+        self.finished = now()
+        self.exit_code = exit_code
+        failed = any(s.status in ("failed", "blocked") for s in self.stages)
+        self.status = "failed" if exit_code or failed else "ok"
+        self.wall_seconds = round((datetime.fromisoformat(self.finished)
+                                   - datetime.fromisoformat(self.started)).total_seconds(), 1)
+
+    def write(self, path: str) -> None:
+        """Write the manifest to path atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def load_manifest(path: str) -> RunManifest:
+    """Read the manifest at path."""
+    with open(path) as f:
+        return RunManifest.from_dict(json.load(f))
+
+
+@contextmanager
+def _locked(path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def publish_manifest(path: str, manifest: RunManifest) -> None:
+    """Write the manifest of a new run to path, keeping the one there as the previous run."""
+    with _locked(path):
+        if os.path.exists(path):
+            os.replace(path, os.path.join(os.path.dirname(path), PREVIOUS_MANIFEST_NAME))
+        manifest.write(path)
+
+
+def record_stage(path: str, stage: StageRecord) -> None:
+    """Add a stage to the manifest at path, starting one if the run did not (a stage run on its own)."""
+    with _locked(path):
+        if os.path.exists(path):
+            manifest = load_manifest(path)
+        else:
+            manifest = RunManifest.new(os.path.basename(manifest_root(path)))
+        manifest.add_stage(stage)
+        manifest.write(path)
+
+
+def finish_run(path: str, exit_code: int) -> RunManifest:
+    with _locked(path):
+        manifest = load_manifest(path)
+        manifest.finish(exit_code)
+        manifest.write(path)
+    return manifest
+
+
+def changed_outputs(manifest: RunManifest, root: str) -> List[str]:
+    """Outputs of the run whose content is no longer the one recorded (or that are missing)."""
+    cache = StageCache(os.path.join(root, "data", "stage_cache.json"))
+    return [path for path, record in manifest.outputs().items()
+            if FileRecord.of(os.path.join(root, path), root, cache).sha256 != record.sha256]
+
+
+def compare(old: RunManifest, new: RunManifest) -> List[str]:
+    """Differences of new from old: outputs, stage regressions, library versions and settings."""
+    lines = []
+    old_outputs, new_outputs = old.outputs(), new.outputs()
+    for path, record in new_outputs.items():
+        if path in old_outputs and old_outputs[path].sha256 != record.sha256:
+            lines.append(f"output changed: {path}")
+    lines.extend(f"output missing: {path}" for path in old_outputs if path not in new_outputs)
+
+    for stage in new.stages:
+        before = old.stage(stage.name)
+        if before is None or before.status != "ok" or stage.status != "ok":
+            continue
+        if before.seconds > 0 and stage.seconds > before.seconds * (1 + REGRESSION_THRESHOLD):
+            lines.append(f"slower: {stage.name} {before.seconds:.1f} s -> {stage.seconds:.1f} s "
+                         f"({stage.seconds / before.seconds - 1:+.0%})")
+        if (before.peak_memory_gb and stage.peak_memory_gb
+                and stage.peak_memory_gb > before.peak_memory_gb * (1 + REGRESSION_THRESHOLD)):
+            lines.append(f"more memory: {stage.name} {before.peak_memory_gb:.2f} GB -> "
+                         f"{stage.peak_memory_gb:.2f} GB ({stage.peak_memory_gb / before.peak_memory_gb - 1:+.0%})")
+
+    for name in sorted(set(old.libraries) | set(new.libraries)):
+        if old.libraries.get(name) != new.libraries.get(name):
+            lines.append(f"library: {name} {old.libraries.get(name)} -> {new.libraries.get(name)}")
+    for name in sorted(set(old.environment) | set(new.environment)):
+        if old.environment.get(name) != new.environment.get(name):
+            lines.append(f"setting: {name} {old.environment.get(name)} -> {new.environment.get(name)}")
+    if old.commit != new.commit:
+        lines.append(f"commit: {old.commit} -> {new.commit}")
+    return lines
+
+
+def _print_manifest(manifest: RunManifest) -> None:
+    wall = "-" if manifest.wall_seconds is None else f"{manifest.wall_seconds:.1f} s"
+    print(f"{manifest.pipeline}: {manifest.status}, started {manifest.started}, wall {wall}, "
+          f"commit {manifest.commit or '-'}")
+    print(f"{'stage':<20} {'status':<8} {'seconds':>9} {'cpu s':>9} {'peak GB':>8} {'written MB':>11}")
+    for s in manifest.stages:
+        written = sum(f.size or 0 for f in s.outputs) / 1e6
+        cpu = "-" if s.cpu_seconds is None else f"{s.cpu_seconds:.1f}"
+        peak = "-" if s.peak_memory_gb is None else f"{s.peak_memory_gb:.2f}"
+        print(f"{s.name:<20} {s.status:<8} {s.seconds:9.1f} {cpu:>9} {peak:>8} {written:11.1f}"
+              + (f"  ({s.message})" if s.message else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write, show, verify and compare the run manifests of the '
+                                                 'pipelines.')
+    parser.add_argument('action', choices=['begin', 'finish', 'show', 'verify', 'compare'], help='What to do')
+    parser.add_argument('manifest', help='Run manifest')
+    parser.add_argument('old_manifest', nargs='?', default=None,
+                        help='Manifest to compare with (default: the previous run of the pipeline)')
+    parser.add_argument('--pipeline', default=None, help='Pipeline name (begin; default: the directory name)')
+    parser.add_argument('--param', action='append', default=[], help='KEY=VALUE parameter of the run (begin)')
+    parser.add_argument('--exit-code', type=int, default=0, help='Exit code of the run (finish)')
+    args = parser.parse_args()
+
+    path = args.manifest
+    try:
+        if args.action == 'begin':
+            pipeline = args.pipeline or os.path.basename(manifest_root(path))
+            publish_manifest(path, RunManifest.new(pipeline, _parse_params(args.param)))
+        elif args.action == 'finish':
+            manifest = finish_run(path, args.exit_code)
+            print(f"Run manifest written to {path} ({manifest.status}, {len(manifest.stages)} stages)")
+        elif args.action == 'show':
+            _print_manifest(load_manifest(path))
+        elif args.action == 'verify':
+            changed = changed_outputs(load_manifest(path), manifest_root(path))
+            for output in changed:
+                print(f"changed: {output}")
+            print(f"{len(changed)} outputs changed since the run" if changed else "All outputs match the manifest")
+            sys.exit(1 if changed else 0)
+        else:
+            old_path = args.old_manifest or os.path.join(os.path.dirname(path), PREVIOUS_MANIFEST_NAME)
+            differences = compare(load_manifest(old_path), load_manifest(path))
+            print("\n".join(differences) if differences else "No differences")
+    except (OSError, ValueError, argparse.ArgumentTypeError) as e:
+        print(f"Error processing run manifest {path}: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Runtime and memory planner for homogenization runs.
+
+Predicts the wall time and the peak memory of a homogenization from the shape of its
+E-OBS input, the number of valid cells, the neighbourhood of the method and the way it is
+run (whole grid, tiles in a local process pool, or tiles on a dask cluster), and
+recommends the tile size and number of workers that finish soonest within the memory
+available. The model is linear in a few per-cell cost terms:
+
+    seconds = setup + per_tile * tiles / workers
+              + (per_value * n + per_value_step * n * t + per_neighbor_value * n * k) / workers
+    memory_gb per process = base_gb + gb_per_value * t * window cells
+
+with n the valid cells homogenized (tile halos included), t the time steps and k the
+neighbours per cell. Every homogenization run (whole grid or tiled) appends its features,
+the prediction and the measured wall time and peak memory to a JSON-lines history,
+./data/run_history.jsonl of the variable directory by default (SMICRAB_RUN_HISTORY selects
+another file, or "off" disables it). Once a method has MIN_CALIBRATION_RUNS runs recorded,
+its coefficients are fitted to them (non-negative least squares) instead of the defaults
+below, so the predictions follow the machines and data they are used on. The defaults are
+fitted the same way to the runs of the pipeline benchmark (benchmarks/pipeline_benchmark.py),
+which records them to logs/pipeline_benchmark_runs.jsonl.
+
+Usage (from the variable directory):
+    PYTHONPATH=.. python3 -m common.run_planner data/E_OBS_hu_Monthly/hu_..._CF-1.8.nc --method snht
+    PYTHONPATH=.. python3 -m common.run_planner data/E_OBS_ws_Monthly/fg_..._CF-1.8.nc --method pairwise --cpus 16 --memory-gb 64
+    PYTHONPATH=.. python3 -m common.run_planner --history
+"""
+import os
+import sys
+import json
+import argparse
+import resource
+import numpy as np
+import pandas as pd
+import xarray as xr
+from dataclasses import asdict, dataclass
+from scipy.optimize import nnls
+from typing import Dict, List, Optional
+
+from common.neighbor_index import KM_PER_DEGREE, radius_cells
+from common.orchestrator import available_memory_gb
+
+RUN_HISTORY_ENV_VAR = "SMICRAB_RUN_HISTORY"
+DEFAULT_HISTORY_PATH = "./data/run_history.jsonl"
+ENGINES = ("whole", "pool", "dask")
+# Time steps read to count the valid cells of an input
+SAMPLE_STEPS = 12
+# Recorded runs of a method needed before its coefficients are fitted
+MIN_CALIBRATION_RUNS = 5
+# Share of the memory budget a plan may use
+MEMORY_HEADROOM = 0.8
+TILE_SIZES = (16, 32, 64, 128, 256, 512)
+
+
+@dataclass
+class RunFeatures:
+    """What the cost of a homogenization depends on, known before running it."""
+    method: str
+    n_time: int
+    n_lat: int
+    n_lon: int
+    valid_cells: int
+    neighbors: float
+    halo: int
+
+
+@dataclass
+class CostModel:
+    """
+    Coefficients of the time and memory model of a method.
+
+    Attributes:
+        time: setup, per_tile, per_value, per_value_step and per_neighbor_value seconds
+        memory: base_gb and gb_per_value
+        runs: Recorded runs the coefficients were fitted to (0 for the defaults)
+    """
+    time: Dict[str, float]
+    memory: Dict[str, float]
+    runs: int = 0
+
+
+TIME_TERMS = ("setup", "per_tile", "per_value", "per_value_step", "per_neighbor_value")
+MEMORY_TERMS = ("base_gb", "gb_per_value")
+
+# Fitted to the homogenization runs of benchmarks/pipeline_benchmark.py (1 core): grids of
+# 24x20 to 60x50 cells over 2-6 years, whole and in tiles of 12, 16 and 24 cells, 36 runs in all.
+# Refit them from its run history with
+# SMICRAB_RUN_HISTORY=logs/pipeline_benchmark_runs.jsonl python3 -m common.run_planner --history
+DEFAULT_MODELS = {
+    "snht": CostModel(time={"setup": 0.0, "per_tile": 0.0, "per_value": 0.0, "per_value_step": 0.0,
+                            "per_neighbor_value": 1.1e-7},
+                      memory={"base_gb": 0.2, "gb_per_value": 6.3e-7}),
+    "pairwise": CostModel(time={"setup": 0.0, "per_tile": 0.0, "per_value": 0.0, "per_value_step": 0.0,
+                                "per_neighbor_value": 9.3e-7},
+                          memory={"base_gb": 0.18, "gb_per_value": 6.1e-7}),
+    "adjustment": CostModel(time={"setup": 0.0, "per_tile": 0.1, "per_value": 4.1e-5, "per_value_step": 7.9e-8,
+                                  "per_neighbor_value": 0.0},
+                            memory={"base_gb": 0.21, "gb_per_value": 3.0e-7}),
+}
+
+
+@dataclass
+class RunPlan:
+    """A way of running a homogenization and its predicted cost."""
+    engine: str
+    tile_size: Optional[int]
+    workers: int
+    seconds: float
+    memory_gb: float
+    total_memory_gb: float
+
+    def describe(self) -> str:
+        layout = "whole grid" if self.tile_size is None else f"tiles of {self.tile_size}, {self.workers} workers"
+        return (f"{self.engine:<6} {layout:<28} {self.seconds / 60:9.1f} min  "
+                f"{self.memory_gb:6.2f} GB per process, {self.total_memory_gb:6.2f} GB in total")
+
+
+def history_path() -> Optional[str]:
+    """Run history selected by SMICRAB_RUN_HISTORY, or None when recording is off."""
+    value = os.environ.get(RUN_HISTORY_ENV_VAR, "").strip()
+    if value.lower() in ("0", "off", "no", "false"):
+        return None
+    if value.lower() in ("", "1", "on", "yes", "true"):
+        return DEFAULT_HISTORY_PATH
+    return value
+
+
+def features_from_data(method: str, lats: np.ndarray, lons: np.ndarray, data: np.ndarray, n_time: int,
+                       radius_km: Optional[float] = None, neighbor_count: Optional[int] = None,
+                       halo: Optional[int] = None) -> RunFeatures:
+    """
+    Features of a run on a (time, lat, lon) input; data may be a sample of its time steps.
+
+    The neighbours per cell are estimated from the share of valid cells and the area of the
+    neighbourhood, without building the neighbour lists.
+    """
+    valid = ~np.isnan(np.asarray(data, dtype=np.float64)).all(axis=0)
+    valid_cells = int(valid.sum())
+    neighbors = 0.0
+    if radius_km is not None and len(lats) > 1 and len(lons) > 1:
+        cell_km2 = (np.abs(np.diff(lats)).mean() * KM_PER_DEGREE
+                    * np.abs(np.diff(lons)).mean() * KM_PER_DEGREE * np.cos(np.radians(np.mean(lats))))
+        neighbors = valid_cells / valid.size * np.pi * radius_km ** 2 / cell_km2
+    if neighbor_count is not None:
+        neighbors = min(neighbors, neighbor_count) if radius_km is not None else float(neighbor_count)
+    if halo is None:
+        halo = radius_cells(radius_km, lats, lons) if radius_km is not None else 0
+    return RunFeatures(method, int(n_time), len(lats), len(lons), valid_cells,
+                       round(float(min(neighbors, max(valid_cells - 1, 0))), 1), int(halo))
+
+
+def inspect_input(eobs_file: str, method: str = "snht", radius_km: Optional[float] = None,
+                  neighbor_count: Optional[int] = None, halo: Optional[int] = None,
+                  variable: Optional[str] = None) -> RunFeatures:
+    """Features of a run on eobs_file, reading its first SAMPLE_STEPS time steps."""
+    with xr.open_dataset(eobs_file, decode_times=False) as ds:
+        name = variable or next(n for n, v in ds.data_vars.items() if v.ndim == 3)
+        var = ds[name].transpose("time", "latitude", "longitude")
+        sample = var.isel(time=slice(0, SAMPLE_STEPS)).values
+        return features_from_data(method, ds["latitude"].values, ds["longitude"].values, sample,
+                                  var.sizes["time"], radius_km, neighbor_count, halo)
+
+
+def inspect_homogenization(homogenization_cls, eobs_file: str) -> RunFeatures:
+    """Features of a run of a BaseHomogenization subclass on eobs_file."""
+    with xr.open_dataset(eobs_file, decode_times=False) as ds:
+        halo = homogenization_cls.halo_cells(ds["latitude"].values, ds["longitude"].values)
+    return inspect_input(eobs_file, homogenization_cls.cost_model, homogenization_cls.neighbor_radius_km,
+                         homogenization_cls.neighbor_count, halo)
+
+
+def _window_sizes(n: int, tile_size: Optional[int], halo: int) -> List[int]:
+    # Halo-extended extents of the tiles along one axis, as in tiling.make_tiles()
+    if tile_size is None:
+        return [n]
+    return [min(n, start + tile_size + halo) - max(0, start - halo) for start in range(0, n, tile_size)]
+
+
+def time_terms(features: RunFeatures, tile_size: Optional[int], workers: int) -> np.ndarray:
+    """Values multiplying the time coefficients (in TIME_TERMS order) for a run layout."""
+    lat_sizes = _window_sizes(features.n_lat, tile_size, features.halo)
+    lon_sizes = _window_sizes(features.n_lon, tile_size, features.halo)
+    n_tiles = len(lat_sizes) * len(lon_sizes)
+    # Halo cells are homogenized with their tile and dropped, so they count as work
+    window_cells = sum(lat_sizes) * sum(lon_sizes)
+    cells = features.valid_cells * window_cells / (features.n_lat * features.n_lon)
+    parallel = max(1, min(workers, n_tiles))
+    t = features.n_time
+    return np.array([1.0, n_tiles / parallel, cells * t / parallel, cells * t * t / parallel,
+                     cells * t * features.neighbors / parallel])
+
+
+def memory_terms(features: RunFeatures, tile_size: Optional[int]) -> np.ndarray:
+    """Values multiplying the memory coefficients (in MEMORY_TERMS order): one process, largest window."""
+    window_cells = (max(_window_sizes(features.n_lat, tile_size, features.halo))
+                    * max(_window_sizes(features.n_lon, tile_size, features.halo)))
+    return np.array([1.0, features.n_time * window_cells])
+
+
+def predict(model: CostModel, features: RunFeatures, engine: str = "whole", tile_size: Optional[int] = None,
+            workers: int = 1) -> RunPlan:
+    """Predicted wall time and peak memory of a run layout."""
+    if engine == "whole":
+        tile_size, workers = None, 1
+    seconds = float(time_terms(features, tile_size, workers) @ [model.time[k] for k in TIME_TERMS])
+    memory_gb = float(memory_terms(features, tile_size) @ [model.memory[k] for k in MEMORY_TERMS])
+    n_tiles = len(_window_sizes(features.n_lat, tile_size, features.halo)) * \
+        len(_window_sizes(features.n_lon, tile_size, features.halo))
+    processes = 1 if engine == "whole" else min(workers, n_tiles)
+    return RunPlan(engine, tile_size, workers, seconds, memory_gb, memory_gb * processes)
+
+
+def recommend(model: CostModel, features: RunFeatures, cpus: int, memory_gb: float,
+              engine: str = "pool") -> List[RunPlan]:
+    """
+    Run layouts that fit in memory_gb, fastest first: the whole grid, and every tile size of
+    TILE_SIZES smaller than the grid with 1 to cpus workers (the fewest workers reaching the
+    best time of each tile size).
+    """
+    budget = memory_gb * MEMORY_HEADROOM
+    plans = [predict(model, features)]
+    for tile_size in TILE_SIZES:
+        if tile_size >= max(features.n_lat, features.n_lon):
+            break
+        options = [predict(model, features, engine, tile_size, w) for w in range(1, max(cpus, 1) + 1)]
+        options = [p for p in options if p.total_memory_gb <= budget]
+        if options:
+            plans.append(min(options, key=lambda p: (round(p.seconds, 1), p.workers)))
+    fitting = [p for p in plans if p.total_memory_gb <= budget]
+    return sorted(fitting or plans, key=lambda p: p.seconds)
+
+
+def read_history(path: Optional[str] = None) -> List[dict]:
+    """Recorded runs, oldest first; empty when there are none."""
+    path = path or history_path() or DEFAULT_HISTORY_PATH
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def calibrate(method: str, records: List[dict]) -> CostModel:
+    """
+    Coefficients of method fitted to its recorded runs, or the defaults while fewer than
+    MIN_CALIBRATION_RUNS are recorded. Time and memory are fitted separately, each to the
+    runs that measured it.
+    """
+    model = DEFAULT_MODELS[method]
+    runs = [r for r in records if r["features"]["method"] == method]
+    if len(runs) < MIN_CALIBRATION_RUNS:
+        return model
+    rows, seconds = [], []
+    for r in runs:
+        features = RunFeatures(**r["features"])
+        rows.append(time_terms(features, r["tile_size"], r["workers"]))
+        seconds.append(r["actual"]["seconds"])
+    time_coefs = dict(zip(TIME_TERMS, nnls(np.array(rows), np.array(seconds))[0].tolist()))
+
+    memory_coefs = model.memory
+    measured = [r for r in runs if r["actual"].get("memory_gb") is not None]
+    if len(measured) >= MIN_CALIBRATION_RUNS:
+        rows = [memory_terms(RunFeatures(**r["features"]), r["tile_size"]) for r in measured]
+        coefs = nnls(np.array(rows), np.array([r["actual"]["memory_gb"] for r in measured]))[0]
+        memory_coefs = dict(zip(MEMORY_TERMS, coefs.tolist()))
+    return CostModel(time_coefs, memory_coefs, runs=len(runs))
+
+
+def current_model(method: str) -> CostModel:
+    """The model of method calibrated on the run history."""
+    return calibrate(method, read_history())
+
+
+def peak_memory_gb(children: bool = False) -> float:
+    """Peak resident memory of this process, or of its largest finished child process."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kB on Linux
+    return usage.ru_maxrss / 1024 ** 2
+
+
+def record_run(features: RunFeatures, engine: str, tile_size: Optional[int], workers: int, seconds: float,
+               memory_gb: Optional[float]) -> None:
+    """Append a finished run, with what the current model predicted for it, to the run history."""
+    path = history_path()
+    if path is None:
+        return
+    prediction = predict(current_model(features.method), features, engine, tile_size, workers)
+    record = {
+        "finished": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "features": asdict(features),
+        "engine": engine,
+        "tile_size": tile_size,
+        "workers": workers,
+        "predicted": {"seconds": round(prediction.seconds, 1), "memory_gb": round(prediction.memory_gb, 3)},
+        "actual": {"seconds": round(seconds, 1),
+                   "memory_gb": None if memory_gb is None else round(memory_gb, 3)},
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Run took {seconds:.1f} s (predicted {prediction.seconds:.1f} s), recorded in {path}")
+
+
+def _print_history(records: List[dict]) -> None:
+    print(f"{'finished':<20} {'method':<10} {'engine':<6} {'tile':>5} {'wrk':>4} "
+          f"{'pred s':>9} {'actual s':>9} {'pred GB':>8} {'actual GB':>9}")
+    for r in records:
+        actual_gb = r["actual"]["memory_gb"]
+        print(f"{r['finished']:<20} {r['features']['method']:<10} {r['engine']:<6} {str(r['tile_size'] or '-'):>5} "
+              f"{r['workers']:>4} {r['predicted']['seconds']:9.1f} {r['actual']['seconds']:9.1f} "
+              f"{r['predicted']['memory_gb']:8.2f} {'-' if actual_gb is None else f'{actual_gb:.2f}':>9}")
+    for method in DEFAULT_MODELS:
+        model = calibrate(method, records)
+        source = f"fitted to {model.runs} runs" if model.runs else "defaults"
+        print(f"{method}: {source}; " + ", ".join(f"{k}={v:.3g}" for k, v in {**model.time, **model.memory}.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict the run time and memory of a homogenization.')
+    parser.add_argument('eobs_file', nargs='?', help='E-OBS input of the homogenization')
+    parser.add_argument('--method', choices=list(DEFAULT_MODELS), default='snht', help='Homogenization method')
+    parser.add_argument('--radius-km', type=float, default=165.0, help='Neighbourhood radius in km (default: 165)')
+    parser.add_argument('--engine', choices=ENGINES[1:], default='pool', help='How tiles are run (default: pool)')
+    parser.add_argument('--cpus', type=int, default=os.cpu_count() or 1, help='Cores available (default: all)')
+    parser.add_argument('--memory-gb', type=float, default=None, help='Memory available (default: available now)')
+    parser.add_argument('--tile-size', type=int, default=None, help='Only predict this tile size')
+    parser.add_argument('--workers', type=int, default=None, help='Workers for --tile-size (default: --cpus)')
+    parser.add_argument('--history', action='store_true', help='Show the recorded runs and fitted coefficients')
+    args = parser.parse_args()
+
+    if args.history:
+        _print_history(read_history())
+        return
+    if not args.eobs_file:
+        parser.error("give an E-OBS file, or --history")
+    try:
+        features = inspect_input(args.eobs_file, args.method, args.radius_km)
+    except Exception as e:
+        print(f"Error inspecting {args.eobs_file}: {str(e)}")
+        sys.exit(1)
+
+    model = current_model(args.method)
+    print(f"{features.n_time} time steps, {features.n_lat}x{features.n_lon} grid, {features.valid_cells} valid cells, "
+          f"~{features.neighbors:.0f} neighbours per cell, {features.halo}-cell halo; "
+          + (f"model fitted to {model.runs} runs" if model.runs else "default model"))
+    if args.tile_size:
+        print(predict(model, features, args.engine, args.tile_size, args.workers or args.cpus).describe())
+        return
+    memory_gb = args.memory_gb or available_memory_gb()
+    plans = recommend(model, features, args.cpus, memory_gb, args.engine)
+    for plan in plans:
+        print(plan.describe())
+    best = plans[0]
+    option = "" if best.tile_size is None else f" --tile-size {best.tile_size} --workers {best.workers}"
+    print(f"Recommended ({args.cpus} cores, {memory_gb:.1f} GB):{option or ' the whole grid at once'}")
+
+
+if __name__ == "__main__":
+    main()
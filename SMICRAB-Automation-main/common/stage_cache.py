@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of pipeline stages.
+
+A stage is a command with declared input and output paths. Its fingerprint combines the
+content hashes of its inputs, the source of the script it runs and of every local module
+that script imports, its command line, its parameters and the environment variables that
+change what the scripts produce. After a stage runs, the cache records its fingerprint and
+the state of its outputs; the next time, the stage is skipped when the fingerprint is the
+same and its outputs are still the ones it wrote.
+
+Stages are chained through their files: a stage that reruns and produces different outputs
+changes the fingerprint of the stages that read them, so only the affected downstream stages
+rebuild, while identical outputs leave them cached.
+
+Usage from the run scripts:
+
+    python3 -m common.stage_cache --cache data/stage_cache.json --name homogenization \\
+        --input data/E_OBS_rr_Monthly/rr_..._CF-1.8.nc --output data/rr_.../rr_..._corrected.nc \\
+        -- python3 processing/rr_homogenization.py
+
+With --manifest, the stage is also recorded in the run manifest of the pipeline
+(common/run_manifest.py), with its timings, peak memory and the hashes of its files.
+"""
+import os
+import ast
+import sys
+import json
+import fcntl
+import time
+import hashlib
+import argparse
+import subprocess
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+CACHE_ENV_VAR = "SMICRAB_STAGE_CACHE"
+# Set by the orchestrator to the file collecting the statistics of the running step
+STEP_STATS_ENV_VAR = "SMICRAB_STEP_STATS"
+# Environment variables that change the outputs of the processing scripts
+FINGERPRINT_ENV_VARS = ("SMICRAB_DOMAIN", "SMICRAB_OUTPUT_PROFILE", "SMICRAB_DERIVED_DIGITS", "SMICRAB_ZARR_FORMAT",
+                        "SMICRAB_PYRAMID", "SMICRAB_REFERENCE")
+# Sidecar files derived from the files next to them, left out of directory hashes
+IGNORED_SUFFIXES = (".chunkindex.json",)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_SIZE = 1 << 20
+
+
+def failure_message(returncode: int, outputs: Sequence[str]) -> str:
+    """Why a stage that exited with returncode failed: its exit code or missing outputs; "" if it did not."""
+    if returncode != 0:
+        return f"exit code {returncode}"
+    missing = [p for p in outputs if not os.path.exists(p)]
+    return f"missing outputs: {', '.join(missing)}" if missing else ""
+
+
+def command_code(command: Sequence[str], cwd: Optional[str] = None) -> List[str]:
+    """Scripts a command runs: its .py arguments (relative to cwd) and the project module of -m."""
+    paths = [os.path.join(cwd or "", arg) for arg in command if arg.endswith(".py")]
+    for flag, module in zip(command, command[1:]):
+        if flag == "-m":
+            paths.append(os.path.join(PROJECT_ROOT, *module.split(".")) + ".py")
+    return [path for path in paths if os.path.isfile(path)]
+
+
+def cache_disabled() -> bool:
+    return os.environ.get(CACHE_ENV_VAR, "").lower() in ("0", "off", "false", "no")
+
+
+def add_step_stats(section: str, counts: Dict[str, int]) -> None:
+    """
+    Add counts to the statistics of the running step (the JSON file named by
+    SMICRAB_STEP_STATS), summed over all the processes of the step. Does nothing when the
+    step is not run by the orchestrator.
+    """
+    path = os.environ.get(STEP_STATS_ENV_VAR)
+    if not path:
+        return
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            stats = read_step_stats(path)
+            entry = stats.setdefault(section, {})
+            for name, count in counts.items():
+                entry[name] = entry.get(name, 0) + count
+            tmp_path = f"{path}.{os.getpid()}.part"
+            with open(tmp_path, "w") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_step_stats(path: str) -> Dict[str, Dict[str, int]]:
+    """Statistics collected by add_step_stats() in path; empty if none were."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@dataclass
+class ProcessUsage:
+    """Exit code and resources of a finished command, including the processes it waited for."""
+    returncode: int
+    cpu_seconds: float
+    peak_memory_gb: float
+
+
+def run_measured(command: Sequence[str], **kwargs) -> ProcessUsage:
+    """Run command (with subprocess.Popen arguments) and measure its CPU time and peak memory."""
+    process = subprocess.Popen(list(command), **kwargs)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kB on Linux
+    return ProcessUsage(process.returncode, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024 ** 2)
+
+
+def _file_state(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _local_imports(path: str) -> List[str]:
+    """Source files of the modules imported by path that live in the project or next to path."""
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return []
+
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+            modules.extend(f"{node.module}.{alias.name}" for alias in node.names)
+
+    files = []
+    for module in modules:
+        relative = module.replace(".", os.sep)
+        for root in (os.path.dirname(os.path.abspath(path)), PROJECT_ROOT):
+            candidate = os.path.join(root, relative + ".py")
+            if os.path.isfile(candidate):
+                files.append(candidate)
+                break
+    return files
+
+
+def code_files(scripts: Sequence[str]) -> List[str]:
+    """The given scripts plus every local module they import, transitively, in a stable order."""
+    seen, pending = set(), [os.path.abspath(s) for s in scripts]
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        pending.extend(p for p in _local_imports(path) if p not in seen)
+    return sorted(seen)
+
+
+class StageCache:
+    """
+    JSON record of the stages of one pipeline and of the hashes of the files they touch.
+
+    File hashes are memoized by path, size and modification time, so a large input is only
+    rehashed after it changes. The cache file is locked while it is updated, so stages of the
+    same pipeline can run concurrently.
+
+    Args:
+        path: Cache file, usually <data dir>/stage_cache.json
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.stages: Dict[str, dict] = {}
+        self.hashes: Dict[str, dict] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.stages = data.get("stages", {})
+            self.hashes = data.get("hashes", {})
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.part"
+        with open(tmp_path, "w") as f:
+            json.dump({"stages": self.stages, "hashes": self.hashes}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def file_hash(self, path: str) -> Optional[str]:
+        """sha256 of a file, or of the names and hashes of the files under a directory; None if missing."""
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(f for f in files if not f.endswith(IGNORED_SUFFIXES)):
+                    file_path = os.path.join(root, name)
+                    digest.update(f"{os.path.relpath(file_path, path)}\0{self.file_hash(file_path)}\n".encode())
+            return digest.hexdigest()
+        if not os.path.isfile(path):
+            return None
+
+        state = _file_state(path)
+        memo = self.hashes.get(path)
+        if memo and memo["size"] == state["size"] and memo["mtime_ns"] == state["mtime_ns"]:
+            return memo["sha256"]
+        sha = _sha256(path)
+        self.hashes[path] = dict(state, sha256=sha)
+        return sha
+
+    def fingerprint(self, command: Sequence[str], inputs: Sequence[str], code: Sequence[str] = (),
+                    params: Optional[Dict[str, str]] = None) -> str:
+        record = {
+            "command": list(command),
+            "inputs": {os.path.abspath(p): self.file_hash(p) for p in inputs},
+            "code": {os.path.relpath(p, PROJECT_ROOT): self.file_hash(p) for p in code_files(code)},
+            "params": dict(params or {}),
+            "env": {name: os.environ.get(name) for name in FINGERPRINT_ENV_VARS},
+        }
+        return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+    def is_fresh(self, name: str, fingerprint: str) -> bool:
+        """True when the stage last ran with this fingerprint and its outputs are unchanged since."""
+        entry = self.stages.get(name)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        return all(os.path.exists(path) and self.file_hash(path) == sha for path, sha in entry["outputs"].items())
+
+    def record(self, name: str, fingerprint: str, outputs: Sequence[str]) -> None:
+        with self._locked():
+            hashes = self.hashes
+            self._load()
+            self.hashes.update(hashes)
+            self.stages[name] = {"fingerprint": fingerprint,
+                                 "outputs": {os.path.abspath(p): self.file_hash(p) for p in outputs}}
+            self._save()
+
+    def remember_hashes(self) -> None:
+        """Save the file hashes computed so far, so the next run does not hash the same files again."""
+        with self._locked():
+            hashes = self.hashes
+            self._load()
+            self.hashes.update(hashes)
+            self._save()
+
+    def invalidate(self, name: str) -> None:
+        with self._locked():
+            self._load()
+            self.stages.pop(name, None)
+            self._save()
+
+    def begin(self, name: str, command: Sequence[str], inputs: Sequence[str] = (),
+              params: Optional[Dict[str, str]] = None, code: Optional[Sequence[str]] = None,
+              force: bool = False, cwd: Optional[str] = None) -> Optional[str]:
+        """
+        Fingerprint of the stage when it has to run, with its cache entry dropped until
+        finish() records it; None when it is up to date. code defaults to command_code(command, cwd).
+        """
+        if code is None:
+            code = command_code(command, cwd)
+        fingerprint = self.fingerprint(command, inputs, code, params)
+        if not force and not cache_disabled() and self.is_fresh(name, fingerprint):
+            return None
+        self.invalidate(name)
+        return fingerprint
+
+    def finish(self, name: str, fingerprint: str, returncode: int, outputs: Sequence[str]) -> str:
+        """
+        Record a stage that ran with the fingerprint begin() returned, if it succeeded and wrote
+        all its outputs. Returns why it failed (exit code or missing outputs), "" on success.
+        """
+        message = failure_message(returncode, outputs)
+        if not message:
+            self.record(name, fingerprint, outputs)
+        return message
+
+    def run(self, name: str, command: Sequence[str], inputs: Sequence[str] = (), outputs: Sequence[str] = (),
+            params: Optional[Dict[str, str]] = None, code: Optional[Sequence[str]] = None,
+            force: bool = False, manifest: Optional[str] = None) -> int:
+        """
+        Run command unless the stage is up to date.
+
+        Args:
+            name: Stage name, unique within the cache
+            command: Command line to run
+            inputs: Files or directories the stage reads
+            outputs: Files or directories the stage writes; all must exist after a successful run
+            params: Extra parameters that change the outputs
+            code: Scripts whose source (and local imports) is part of the fingerprint; defaults
+                to the .py files on the command line
+            force: Run even if the stage is up to date
+            manifest: Run manifest (common/run_manifest.py) the stage is recorded in, if any
+
+        Returns:
+            Exit code of the command, 0 when skipped
+        """
+        start = time.perf_counter()
+        fingerprint = self.begin(name, command, inputs, params, code, force)
+        if fingerprint is None:
+            print(f"Stage {name} is up to date, skipping")
+            if manifest:
+                self._add_to_manifest(manifest, name, "cached", command, inputs, outputs, params,
+                                      time.perf_counter() - start)
+            return 0
+
+        env = None
+        stats_path = f"{manifest}.{name}.stats.json" if manifest else None
+        if stats_path and not os.environ.get(STEP_STATS_ENV_VAR):
+            env = dict(os.environ, **{STEP_STATS_ENV_VAR: stats_path})
+        usage = run_measured(command, env=env)
+        stats = {}
+        if env is not None:
+            stats = read_step_stats(stats_path)
+            for path in (stats_path, f"{stats_path}.lock"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        returncode = usage.returncode
+        message = self.finish(name, fingerprint, returncode, outputs)
+        if message and returncode == 0:
+            print(f"Error: stage {name} failed: {message}")
+            returncode = 1
+        if manifest:
+            self._add_to_manifest(manifest, name, "failed" if returncode else "ok", command, inputs, outputs,
+                                  params, time.perf_counter() - start, usage, stats, message)
+        return returncode
+
+    def _add_to_manifest(self, manifest: str, name: str, status: str, command: Sequence[str],
+                         inputs: Sequence[str], outputs: Sequence[str], params: Optional[Dict[str, str]],
+                         seconds: float, usage: Optional[ProcessUsage] = None, stats: Optional[dict] = None,
+                         message: str = "") -> None:
+        # Imported here: run_manifest builds on this module
+        from common.run_manifest import StageRecord, manifest_root, record_stage
+        try:
+            root = manifest_root(manifest)
+            record_stage(manifest, StageRecord.build(name, status, command, inputs, outputs, root, self, seconds,
+                                                     usage, params, stats, message))
+            self.remember_hashes()
+        except (OSError, ValueError) as e:
+            # The manifest is a record of the run; failing to write it does not fail the stage
+            print(f"Warning: could not record stage {name} in {manifest}: {str(e)}")
+
+
+def _parse_params(values: List[str]) -> Dict[str, str]:
+    params = {}
+    for value in values:
+        key, sep, val = value.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Parameter '{value}' is not KEY=VALUE")
+        params[key] = val
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a pipeline stage unless its inputs, code and '
+                                                 'parameters are unchanged since its outputs were written.')
+    parser.add_argument('--cache', required=True, help='Stage cache file of the pipeline')
+    parser.add_argument('--name', required=True, help='Stage name')
+    parser.add_argument('--input', action='append', default=[], help='File or directory read by the stage')
+    parser.add_argument('--output', action='append', default=[], help='File or directory written by the stage')
+    parser.add_argument('--param', action='append', default=[], help='KEY=VALUE parameter of the stage')
+    parser.add_argument('--code', action='append', default=None,
+                        help='Script that is part of the fingerprint (default: the .py files of the command)')
+    parser.add_argument('--force', action='store_true', help='Run the stage even if it is up to date')
+    parser.add_argument('--manifest', default=None,
+                        help='Run manifest to record the stage in (see common/run_manifest.py)')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Command to run, after --')
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("no command given")
+    cache = StageCache(args.cache)
+    sys.exit(cache.run(args.name, command, args.input, args.output, _parse_params(args.param), args.code,
+                       args.force, args.manifest))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,32 @@
 import numpy as np
 
+from common.neighbor_index import NeighborIndex
+
 class PairwiseStrategy:
-    def __init__(self, radius=15, threshold_factor=3, window_size=24):
+    def __init__(self, radius_km=165.0, threshold_factor=3, window_size=24, k=None):
         """
         Initialize the PairwiseStrategy with desired parameters.
 
         Parameters:
-            radius (int): The search radius (in grid cells) for valid neighbors.
+            radius_km (float): The search radius (in km) for valid neighbors.
             threshold_factor (float): Factor to multiply the standard deviation
                                       of differences for thresholding.
             window_size (int): Number of time steps to consider on each side for
                                computing local means.
+            k (int): If set, use only the k nearest valid neighbors within radius_km.
         """
-        self.radius = radius
+        self.radius_km = radius_km
+        self.k = k
         self.threshold_factor = threshold_factor
         self.window_size = window_size
+        self._neighbor_lists = {}
 
     def find_valid_neighbors(self, data_e, i, j, lon, lat, expected_length):
         """
-        Find neighbor time series within a given radius (grid cells).
+        Find neighbor time series within a given radius (km).
+
+        The neighbor lists of all cells are built once per data array, with a KD-tree over
+        the cells that have at least one value (see common/neighbor_index.py).
 
         Parameters:
             data_e (np.array): The reference data array with shape (lon, lat, time).
@@ -29,20 +37,22 @@ class PairwiseStrategy:
             expected_length (int): Expected length of the time series.
 
         Returns:
-            list: A list of neighbor time series arrays.
+            list: A list of neighbor time series arrays, nearest first.
         """
-        lon_len = len(lon)
-        lat_len = len(lat)
-        lon_indices = range(max(0, i - self.radius), min(lon_len, i + self.radius + 1))
-        lat_indices = range(max(0, j - self.radius), min(lat_len, j + self.radius + 1))
+        key = id(data_e)
+        if key not in self._neighbor_lists:
+            valid = ~np.isnan(data_e).all(axis=2).T
+            lists = NeighborIndex(lat, lon, valid).neighbors(self.radius_km, self.k)
+            self._neighbor_lists = {key: (data_e, lists)}
+        lists = self._neighbor_lists[key][1]
+        indices, _ = lists.cell(j, i)
+        lat_indices, lon_indices = np.divmod(indices, len(lon))
 
         neighbors = []
-        for ii in lon_indices:
-            for jj in lat_indices:
-                if not (ii == i and jj == j):
-                    neighbor_series = data_e[ii, jj, :]
-                    if not np.isnan(neighbor_series).all() and len(neighbor_series) == expected_length:
-                        neighbors.append(neighbor_series)
+        for ii, jj in zip(lon_indices, lat_indices):
+            neighbor_series = data_e[ii, jj, :]
+            if len(neighbor_series) == expected_length:
+                neighbors.append(neighbor_series)
         return neighbors
 
     def compute_pairwise_correction(self, series, neighbors):
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def month_hour_bin(timestamp: pd.Timestamp) -> np.datetime64:
+    """Bin label for monthly-per-hour aggregation: first day of the month at the original hour."""
+    return np.datetime64(pd.Timestamp(timestamp.year, timestamp.month, 1, timestamp.hour, 0, 0), 'ns')
+
+
+def month_bin(timestamp: pd.Timestamp) -> np.datetime64:
+    """Bin label for monthly aggregation: first day of the month at midnight."""
+    return np.datetime64(pd.Timestamp(timestamp.year, timestamp.month, 1), 'ns')
+
+
+class TimeBinAccumulator:
+    """
+    Folds gridded time slices into running NaN-aware sum and count grids keyed by a time bin.
+
+    Each call to add() consumes one dataset (typically one input file) and releases it,
+    so peak memory is O(grid x number of bins) instead of O(all input time steps).
+
+    Args:
+        variables: Names of the data variables to aggregate
+        bin_func: Maps a pd.Timestamp to the label of the bin it belongs to
+        spatial_dims: Names of the (y, x) dimensions of every aggregated variable
+    """
+
+    def __init__(self, variables: List[str], bin_func: Callable[[pd.Timestamp], np.datetime64],
+                 spatial_dims: Tuple[str, str] = ('lat', 'lon')):
+        self.variables = variables
+        self.bin_func = bin_func
+        self.spatial_dims = spatial_dims
+        self.coords: Optional[Dict[str, np.ndarray]] = None
+        self.attrs: Dict[str, dict] = {}
+        self.dtypes: Dict[str, np.dtype] = {}
+        self.sums: Dict[np.datetime64, Dict[str, np.ndarray]] = {}
+        self.counts: Dict[np.datetime64, Dict[str, np.ndarray]] = {}
+        self.n_slices = 0
+
+    def add(self, ds: xr.Dataset) -> None:
+        """Accumulate every time slice of ds into its bin."""
+        if self.coords is None:
+            self.coords = {dim: ds[dim].values for dim in self.spatial_dims}
+            self.attrs = {var: ds[var].attrs.copy() for var in self.variables}
+            self.dtypes = {var: ds[var].dtype for var in self.variables}
+
+        times = pd.to_datetime(ds['time'].values)
+        for var in self.variables:
+            values = ds[var].transpose('time', *self.spatial_dims).values
+            for t_idx, timestamp in enumerate(times):
+                self._add_slice(self.bin_func(timestamp), var, values[t_idx])
+        self.n_slices += len(times)
+
+    def _add_slice(self, label: np.datetime64, var: str, slice_2d: np.ndarray) -> None:
+        if label not in self.sums:
+            shape = slice_2d.shape
+            self.sums[label] = {v: np.zeros(shape, dtype=np.float64) for v in self.variables}
+            self.counts[label] = {v: np.zeros(shape, dtype=np.int32) for v in self.variables}
+
+        valid = np.isfinite(slice_2d)
+        self.sums[label][var] += np.where(valid, slice_2d, 0.0)
+        self.counts[label][var] += valid
+
+    def labels(self) -> List[np.datetime64]:
+        return sorted(self.sums)
+
+    def to_dataset(self, labels: Optional[List[np.datetime64]] = None) -> xr.Dataset:
+        """
+        Build the mean dataset from the accumulators.
+
+        Cells that never received a valid value are NaN, matching groupby(...).mean(skipna=True).
+        """
+        labels = self.labels() if labels is None else labels
+        y_dim, x_dim = self.spatial_dims
+        data_vars = {}
+        for var in self.variables:
+            means = np.full((len(labels), len(self.coords[y_dim]), len(self.coords[x_dim])), np.nan)
+            for i, label in enumerate(labels):
+                count = self.counts[label][var]
+                np.divide(self.sums[label][var], count, out=means[i], where=count > 0)
+            data_vars[var] = (('time', y_dim, x_dim), means.astype(self.dtypes[var]), self.attrs.get(var, {}))
+
+        coords = {'time': np.array(labels, dtype='datetime64[ns]'), **self.coords}
+        return xr.Dataset(data_vars, coords=coords)
+
+    def pop(self, labels: List[np.datetime64]) -> xr.Dataset:
+        """Build the mean dataset for the given bins and release their accumulators."""
+        ds = self.to_dataset(labels)
+        for label in labels:
+            del self.sums[label]
+            del self.counts[label]
+        return ds
@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import xarray as xr
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Optional
+
+from common.breakpoint_catalog import catalog_path, merge_catalogs
+from common.cell_cache import code_fingerprint
+from common.cube_store import CubeStore, cube_store_dir
+from common.dask_backend import dask_scheduler, run_tiles_dask
+from common.derived_reference import ensure_reference
+from common.output_layout import OutputProfile, get_output_profile
+from common.zarr_store import tiles_to_zarr, zarr_format, zarr_path
+from common.pyramid import build_pyramid, pyramid_levels
+from common.run_planner import inspect_homogenization, peak_memory_gb, record_run
+from common.stage_cache import FINGERPRINT_ENV_VARS
+
+# Layout and inputs the tiles in a tile directory were computed from
+TILE_MANIFEST = "tiles.json"
+
+
+@dataclass(frozen=True)
+class GridWindow:
+    """
+    Index window on the E-OBS grid (latitude ascending): a tile core plus its halo.
+
+    Attributes:
+        lat, lon: Halo-extended window, as index slices of the full grid
+        core_lat, core_lon: The tile core, as index slices of the window
+    """
+    lat: slice
+    lon: slice
+    core_lat: slice
+    core_lon: slice
+
+    def select(self, ds: xr.Dataset, lat_name: str = "latitude", lon_name: str = "longitude") -> xr.Dataset:
+        """Select the window from ds; datasets stored north to south (ERA5) get the mirrored latitude slice."""
+        lat = self.lat
+        lats = ds[lat_name].values
+        if len(lats) > 1 and lats[0] > lats[-1]:
+            n_lat = len(lats)
+            lat = slice(n_lat - self.lat.stop, n_lat - self.lat.start)
+        return ds.isel({lat_name: lat, lon_name: self.lon})
+
+    def crop(self, data: np.ndarray) -> np.ndarray:
+        """Drop the halo from a (..., lat, lon) array covering the window."""
+        return data[..., self.core_lat, self.core_lon]
+
+    def crop_coordinates(self, coordinates: dict) -> dict:
+        """Drop the halo from coordinates as returned by BaseHomogenization.get_cf_coordinates()."""
+        cropped = dict(coordinates)
+        for name, core in (("latitude", self.core_lat), ("longitude", self.core_lon)):
+            dim, values, attrs = coordinates[name]
+            cropped[name] = (dim, np.asarray(values)[core], attrs)
+        return cropped
+
+
+@dataclass(frozen=True)
+class Tile:
+    """One tile of a grid: its position in the tile layout and its window."""
+    row: int
+    col: int
+    window: GridWindow
+
+    @property
+    def name(self) -> str:
+        return f"tile_{self.row:03d}_{self.col:03d}"
+
+
+def _split(n: int, tile_size: int, halo: int):
+    for start in range(0, n, tile_size):
+        stop = min(start + tile_size, n)
+        halo_start, halo_stop = max(0, start - halo), min(n, stop + halo)
+        yield slice(halo_start, halo_stop), slice(start - halo_start, stop - halo_start)
+
+
+def make_tiles(n_lat: int, n_lon: int, tile_size: int, halo: int) -> List[Tile]:
+    """
+    Split an n_lat x n_lon grid into tiles of at most tile_size x tile_size cells.
+
+    Each tile is extended by halo cells on every side (clipped at the grid edges), so that
+    neighbour-based methods see the same neighbours at the tile core as on the full grid.
+    """
+    tiles = []
+    for row, (lat, core_lat) in enumerate(_split(n_lat, tile_size, halo)):
+        for col, (lon, core_lon) in enumerate(_split(n_lon, tile_size, halo)):
+            tiles.append(Tile(row=row, col=col, window=GridWindow(lat, lon, core_lat, core_lon)))
+    return tiles
+
+
+def tile_dir_for(output_path: str) -> str:
+    return f"{os.path.splitext(output_path)[0]}_tiles"
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tile_manifest(homogenization_cls, init_kwargs: dict, execute_kwargs: dict, tile_size: int, halo: int,
+                  n_lat: int, n_lon: int) -> dict:
+    """
+    What the tiles of a run depend on: the tile layout, the content of the input files, the
+    execute() arguments, the source of the homogenization classes and the SMICRAB_* settings
+    that change the outputs. Tiles written under a different manifest are not reused.
+    """
+    classes = [cls for cls in homogenization_cls.__mro__ if cls.__module__ not in ("builtins", "abc")]
+    return {
+        "tile_size": tile_size,
+        "halo": halo,
+        "grid": [n_lat, n_lon],
+        "inputs": {name: _file_sha256(path) for name, path in sorted(init_kwargs.items())
+                   if isinstance(path, str) and os.path.isfile(path)},
+        "execute": json.loads(json.dumps(execute_kwargs, sort_keys=True, default=str)),
+        "code": code_fingerprint(classes + list(getattr(homogenization_cls, "cell_cache_code", ()))),
+        "env": {name: os.environ.get(name) for name in FINGERPRINT_ENV_VARS},
+    }
+
+
+def prepare_tile_dir(tile_dir: str, manifest: dict) -> None:
+    """
+    Create tile_dir for a run with manifest, discarding the tiles of an earlier run with a
+    different layout, inputs, parameters or code.
+    """
+    manifest_file = os.path.join(tile_dir, TILE_MANIFEST)
+    if os.path.isdir(tile_dir):
+        previous = None
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as f:
+                previous = json.load(f)
+        if previous != manifest:
+            print(f"Discarding the tiles in {tile_dir}: they were computed with another layout, inputs or code")
+            shutil.rmtree(tile_dir)
+    os.makedirs(tile_dir, exist_ok=True)
+    tmp_path = f"{manifest_file}.part"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_file)
+
+
+def _run_tile(homogenization_cls, init_kwargs: dict, execute_kwargs: dict, tile: Tile, tile_path: str) -> str:
+    tmp_path = f"{tile_path}.part"
+    homogenization = homogenization_cls(**init_kwargs, window=tile.window)
+    homogenization.execute(output_path=tmp_path, **execute_kwargs)
+    if os.path.exists(catalog_path(tmp_path)):
+        os.replace(catalog_path(tmp_path), catalog_path(tile_path))
+    # Only complete tiles get their final name, so an existing tile file marks the tile as done
+    os.replace(tmp_path, tile_path)
+    return tile.name
+
+
+def stitch_tiles(tile_paths: List[str], output_path: str, profile: Optional[OutputProfile] = None) -> None:
+    """
+    Write the tile files into one NetCDF covering their union.
+
+    Tiles hold disjoint cores of the same grid, so every cell is copied from exactly one
+    tile; variables are copied tile by tile and the full grid is never held in memory.
+    The output is chunked and compressed with profile (default: SMICRAB_OUTPUT_PROFILE);
+    values already quantized in the tiles stay quantized.
+    """
+    profile = profile or get_output_profile()
+    lats, lons = [], []
+    for path in tile_paths:
+        with netCDF4.Dataset(path) as nc:
+            lats.append(nc.variables["latitude"][:])
+            lons.append(nc.variables["longitude"][:])
+    all_lats, all_lons = np.unique(np.concatenate(lats)), np.unique(np.concatenate(lons))
+
+    tmp_path = f"{output_path}.part"
+    with netCDF4.Dataset(tile_paths[0]) as first, netCDF4.Dataset(tmp_path, "w", format="NETCDF4") as out:
+        out.setncatts({k: first.getncattr(k) for k in first.ncattrs()})
+        sizes = {"time": len(first.dimensions["time"]), "latitude": len(all_lats), "longitude": len(all_lons)}
+        for dim, size in sizes.items():
+            out.createDimension(dim, size)
+
+        for name, var in first.variables.items():
+            attrs = {k: var.getncattr(k) for k in var.ncattrs() if k != "_FillValue"}
+            if var.dimensions == (name,):
+                out_var = out.createVariable(name, var.dtype, var.dimensions)
+                out_var[:] = {"latitude": all_lats, "longitude": all_lons}.get(name, var[:])
+            else:
+                fill_value = var.getncattr("_FillValue") if "_FillValue" in var.ncattrs() else None
+                chunks = profile.chunk_shape([sizes[d] for d in var.dimensions]) if var.ndim == 3 else None
+                out_var = out.createVariable(name, var.dtype, var.dimensions, zlib=profile.complevel > 0,
+                                             complevel=profile.complevel, shuffle=profile.shuffle,
+                                             chunksizes=chunks, fill_value=fill_value)
+            out_var.setncatts(attrs)
+
+        for path, tile_lats, tile_lons in zip(tile_paths, lats, lons):
+            i0 = int(np.searchsorted(all_lats, tile_lats[0]))
+            j0 = int(np.searchsorted(all_lons, tile_lons[0]))
+            with netCDF4.Dataset(path) as nc:
+                for name, var in nc.variables.items():
+                    if var.dimensions == ("time", "latitude", "longitude"):
+                        out.variables[name][:, i0:i0 + len(tile_lats), j0:j0 + len(tile_lons)] = var[:]
+    os.replace(tmp_path, output_path)
+
+
+def run_tiled(homogenization_cls, init_kwargs: dict, execute_kwargs: dict, output_path: str, tile_size: int,
+              halo: Optional[int] = None, workers: int = 1, tiles: Optional[List[str]] = None) -> List[str]:
+    """
+    Run a homogenization tile by tile and stitch the tiles into output_path.
+
+    Each tile is homogenized independently (in parallel when workers > 1, or on the dask
+    cluster named by SMICRAB_DASK_SCHEDULER, see common/dask_backend.py) from a window of
+    the input files extended by a halo of the homogenization's neighbour radius, and only its
+    core is written, to <output>_tiles/tile_RRR_CCC.nc. Tiles whose file already exists are
+    skipped, so a failed run can be resumed or a single tile rerun by name; the output is
+    stitched, and the breakpoint catalogs of the tiles merged, once every tile is present.
+    When SMICRAB_ZARR_FORMAT is set, the tiles are also written in parallel into
+    <output>.zarr; when SMICRAB_PYRAMID is set, the coarse overviews of the stitched file
+    are built. The tile directory is removed once the output is complete.
+
+    The tile directory holds a manifest of the tile layout, inputs, parameters and code of
+    its tiles (tile_manifest()); when any of them changes, the existing tiles are discarded
+    rather than stitched with the new ones.
+
+    Args:
+        homogenization_cls: BaseHomogenization subclass to run
+        init_kwargs: Constructor arguments (without window)
+        execute_kwargs: Arguments of execute() (without output_path)
+        output_path: Path of the stitched output file
+        tile_size: Tile core size in grid cells
+        halo: Halo in grid cells; defaults to homogenization_cls.halo_cells() of the grid
+        workers: Number of tiles processed in parallel (worker processes of a local dask cluster)
+        tiles: Names of the tiles to (re)run; default all
+
+    Returns:
+        Names of the tiles that failed
+    """
+    started = time.perf_counter()
+    with xr.open_dataset(init_kwargs["eobs_file"]) as ds:
+        n_lat, n_lon = ds.sizes["latitude"], ds.sizes["longitude"]
+        if halo is None:
+            halo = homogenization_cls.halo_cells(ds["latitude"].values, ds["longitude"].values)
+    all_tiles = make_tiles(n_lat, n_lon, tile_size, halo)
+
+    store_dir = cube_store_dir()
+    if store_dir:
+        # Decode the inputs once up front rather than in every tile process at the same time
+        store = CubeStore(store_dir)
+        for path in (init_kwargs["eobs_file"], init_kwargs["era5_file"]):
+            if store.header(path) is None:
+                store.build(path)
+    if homogenization_cls.derived_reference:
+        # Likewise derive the ERA5 reference before the tiles read it
+        ensure_reference(init_kwargs["era5_file"], homogenization_cls.derived_reference)
+
+    tile_dir = tile_dir_for(output_path)
+    prepare_tile_dir(tile_dir, tile_manifest(homogenization_cls, init_kwargs, execute_kwargs, tile_size, halo,
+                                             n_lat, n_lon))
+    tile_paths = {tile.name: os.path.join(tile_dir, f"{tile.name}.nc") for tile in all_tiles}
+
+    if tiles:
+        unknown = set(tiles) - set(tile_paths)
+        if unknown:
+            raise ValueError(f"Unknown tiles: {', '.join(sorted(unknown))}")
+        selected = [tile for tile in all_tiles if tile.name in tiles]
+    else:
+        selected = [tile for tile in all_tiles if not os.path.exists(tile_paths[tile.name])]
+
+    print(f"Grid {n_lat}x{n_lon}: {len(all_tiles)} tiles of {tile_size} cells with a {halo}-cell halo, "
+          f"{len(selected)} to process")
+
+    failed = []
+    scheduler = dask_scheduler()
+    if scheduler:
+        failed = run_tiles_dask(_run_tile, homogenization_cls, init_kwargs, execute_kwargs, selected, tile_paths,
+                                scheduler, workers=workers)
+    elif workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_run_tile, homogenization_cls, init_kwargs, execute_kwargs,
+                                       tile, tile_paths[tile.name]): tile.name for tile in selected}
+            for future in as_completed(futures):
+                try:
+                    print(f"Tile {future.result()} completed")
+                except Exception as e:
+                    print(f"Error processing tile {futures[future]}: {str(e)}")
+                    failed.append(futures[future])
+    else:
+        for tile in selected:
+            try:
+                _run_tile(homogenization_cls, init_kwargs, execute_kwargs, tile, tile_paths[tile.name])
+                print(f"Tile {tile.name} completed")
+            except Exception as e:
+                print(f"Error processing tile {tile.name}: {str(e)}")
+                failed.append(tile.name)
+
+    missing = [name for name, path in tile_paths.items() if not os.path.exists(path)]
+    if missing:
+        print(f"{len(missing)} tiles missing, not stitching. Rerun them with: "
+              f"{' '.join('--tile ' + name for name in missing)}")
+    else:
+        stitch_tiles([tile_paths[tile.name] for tile in all_tiles], output_path)
+        print(f"Stitched {len(all_tiles)} tiles into {output_path}")
+        if merge_catalogs([catalog_path(tile_paths[tile.name]) for tile in all_tiles], catalog_path(output_path)):
+            print(f"Merged the breakpoint catalogs of the tiles into {catalog_path(output_path)}")
+        if zarr_format():
+            tiles_to_zarr([tile_paths[tile.name] for tile in all_tiles], zarr_path(output_path), workers=workers)
+        if pyramid_levels():
+            build_pyramid(output_path)
+        # The tiles are in the output now; a rerun starts from the inputs
+        shutil.rmtree(tile_dir)
+        if len(selected) == len(all_tiles) and not failed:
+            # A complete run: record its wall time and peak memory for the run planner
+            engine = "dask" if scheduler else "pool"
+            memory_gb = None if scheduler else peak_memory_gb(children=workers > 1)
+            record_run(inspect_homogenization(homogenization_cls, init_kwargs["eobs_file"]), engine, tile_size,
+                       workers, time.perf_counter() - started, memory_gb)
+    return failed
+
+
+def add_tiling_arguments(parser: argparse.ArgumentParser) -> None:
+    """Command-line options shared by the homogenization scripts."""
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help='Process the grid in tiles of this many cells per side (default: whole grid at once)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of tiles processed in parallel')
+    parser.add_argument('--tile', action='append', default=None,
+                        help='Only (re)run this tile, e.g. tile_002_003; can be repeated')
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Optional Zarr copies of the NetCDF products.
+
+When SMICRAB_ZARR_FORMAT is set to 2 or 3, every product written through this module also
+gets a Zarr store of that format next to it (<name>.zarr beside <name>.nc), chunked like the
+NetCDF file (see common/output_layout.py) and with consolidated metadata, so that services
+can read single pixels or single months chunk by chunk without opening the whole file.
+The NetCDF files are written as before and stay the primary output.
+
+Requires the zarr package (pip install zarr); nothing here is imported unless Zarr output
+is enabled.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.zarr_store data/SAL_Monthly_2011-2023_CF_Compliant/SAL_..._Reinterpolated.nc --format 3
+"""
+import os
+import sys
+import shutil
+import argparse
+import numpy as np
+import xarray as xr
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from common.output_layout import OutputProfile, get_output_profile
+
+ZARR_FORMAT_ENV_VAR = "SMICRAB_ZARR_FORMAT"
+ZARR_FORMATS = (2, 3)
+CUBE_DIMS = ("time", "latitude", "longitude")
+# Encoding carried over from the NetCDF variables; chunking and compression are Zarr's own
+_KEPT_ENCODING = ("dtype", "_FillValue", "scale_factor", "add_offset")
+
+
+def zarr_format() -> Optional[int]:
+    """Zarr format selected by SMICRAB_ZARR_FORMAT (2 or 3), or None when Zarr output is off."""
+    value = os.environ.get(ZARR_FORMAT_ENV_VAR, "").strip().lower()
+    if value in ("", "0", "off", "none"):
+        return None
+    if value not in [str(fmt) for fmt in ZARR_FORMATS]:
+        raise ValueError(f"{ZARR_FORMAT_ENV_VAR} must be 2 or 3, got '{value}'")
+    return int(value)
+
+
+def zarr_path(nc_path: str) -> str:
+    """Path of the Zarr store kept next to a NetCDF product."""
+    return f"{os.path.splitext(nc_path)[0]}.zarr"
+
+
+def _cube_chunks(ds: xr.Dataset, profile: OutputProfile, space_chunk: Optional[int] = None) -> Tuple[int, int, int]:
+    shape = [ds.sizes[dim] for dim in CUBE_DIMS]
+    chunks = profile.chunk_shape(shape)
+    if space_chunk is not None:
+        chunks = (chunks[0], min(space_chunk, shape[1]), min(space_chunk, shape[2]))
+    return chunks
+
+
+def _zarr_encoding(ds: xr.Dataset, chunks: Optional[Tuple[int, int, int]]) -> Dict[str, dict]:
+    encoding = {}
+    for name, var in ds.variables.items():
+        encoding[name] = {k: v for k, v in var.encoding.items() if k in _KEPT_ENCODING}
+        if chunks and var.dims == CUBE_DIMS:
+            encoding[name]["chunks"] = chunks
+    return encoding
+
+
+def _strip_encoding(ds: xr.Dataset) -> xr.Dataset:
+    # NetCDF-only settings (zlib, chunksizes, ...) would be rejected by the Zarr backend
+    for var in ds.variables.values():
+        var.encoding = {}
+    return ds
+
+
+def _replace_store(tmp_path: str, path: str) -> None:
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def write_zarr(ds: xr.Dataset, path: str, fmt: Optional[int] = None, profile: Optional[OutputProfile] = None) -> str:
+    """
+    Write ds to a Zarr store with consolidated metadata.
+
+    The (time, latitude, longitude) variables are chunked with profile (default:
+    SMICRAB_OUTPUT_PROFILE). The store is written to <path>.part and moved into place when
+    complete, so readers never see a partial store.
+
+    Args:
+        ds: Dataset to write; dask-backed variables are streamed chunk by chunk
+        path: Path of the store
+        fmt: Zarr format, 2 or 3 (default: SMICRAB_ZARR_FORMAT, or 3 when unset)
+        profile: Output profile giving the chunk layout
+    """
+    fmt = fmt or zarr_format() or 3
+    profile = profile or get_output_profile()
+    chunks = _cube_chunks(ds, profile) if all(dim in ds.dims for dim in CUBE_DIMS) else None
+    encoding = _zarr_encoding(ds, chunks)
+    ds = _strip_encoding(ds.copy())
+    if chunks and ds.chunks:
+        # Align the dask chunks with the store chunks so that no two tasks write the same chunk
+        ds = ds.chunk(dict(zip(CUBE_DIMS, chunks)))
+
+    tmp_path = f"{path}.part"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    ds.to_zarr(tmp_path, mode="w", encoding=encoding, consolidated=True, zarr_format=fmt)
+    _replace_store(tmp_path, path)
+    return path
+
+
+def export_zarr(nc_path: str, fmt: Optional[int] = None, profile: Optional[OutputProfile] = None) -> Optional[str]:
+    """
+    Copy a NetCDF product to <name>.zarr when Zarr output is enabled.
+
+    The file is read with dask and written chunk by chunk, so it is never held in memory as
+    a whole. Values are copied as stored: quantized variables stay quantized and times keep
+    the encoding of the NetCDF file.
+
+    Returns:
+        Path of the store, or None when Zarr output is off
+    """
+    fmt = fmt or zarr_format()
+    if fmt is None:
+        return None
+    profile = profile or get_output_profile()
+    with xr.open_dataset(nc_path, decode_times=False, chunks={}) as ds:
+        path = write_zarr(ds, zarr_path(nc_path), fmt, profile)
+    print(f"Saved Zarr copy to: {path}")
+    return path
+
+
+def _tile_space_chunk(tile_size: int, profile: OutputProfile) -> int:
+    # The largest chunk no wider than the profile's that divides the tile size, so every tile
+    # covers whole chunks and parallel region writes never touch the same chunk
+    limit = min(profile.space_chunk or tile_size, tile_size)
+    return max(size for size in range(1, limit + 1) if tile_size % size == 0)
+
+
+def _write_tile_region(tile_path: str, store_path: str, region: dict) -> str:
+    with xr.open_dataset(tile_path, decode_times=False) as ds:
+        cubes = ds[[name for name, var in ds.data_vars.items() if var.dims == CUBE_DIMS]]
+        _strip_encoding(cubes.drop_vars(list(ds.coords))).to_zarr(store_path, region=region, consolidated=False)
+    return os.path.basename(tile_path)
+
+
+def tiles_to_zarr(tile_paths: List[str], path: str, fmt: Optional[int] = None,
+                  profile: Optional[OutputProfile] = None, workers: int = 1) -> str:
+    """
+    Write the tile files of a tiled homogenization into one Zarr store, in parallel.
+
+    The store is created from the first tile with empty (time, latitude, longitude)
+    variables on the full grid, each tile then writes its own region (in workers processes),
+    and the metadata is consolidated at the end. Spatial chunks are chosen to divide the
+    tile size so that no two tiles write to the same chunk.
+    """
+    import dask.array as da
+    import zarr
+
+    fmt = fmt or zarr_format() or 3
+    profile = profile or get_output_profile()
+    lats, lons = [], []
+    for tile_path in tile_paths:
+        with netCDF4.Dataset(tile_path) as nc:
+            lats.append(nc.variables["latitude"][:])
+            lons.append(nc.variables["longitude"][:])
+    all_lats, all_lons = np.unique(np.concatenate(lats)), np.unique(np.concatenate(lons))
+    tile_size = max(max(len(values) for values in lats), max(len(values) for values in lons))
+
+    with xr.open_dataset(tile_paths[0], decode_times=False) as first:
+        template = xr.Dataset(
+            coords={"time": first["time"], "latitude": ("latitude", all_lats, first["latitude"].attrs),
+                    "longitude": ("longitude", all_lons, first["longitude"].attrs)},
+            attrs=first.attrs)
+        chunks = _cube_chunks(template, profile, _tile_space_chunk(tile_size, profile))
+        for name, var in first.data_vars.items():
+            if var.dims == CUBE_DIMS:
+                shape = tuple(template.sizes[dim] for dim in CUBE_DIMS)
+                template[name] = (CUBE_DIMS, da.full(shape, np.nan, dtype=var.dtype, chunks=chunks), var.attrs)
+                template[name].encoding = {k: v for k, v in var.encoding.items() if k in _KEPT_ENCODING}
+        encoding = _zarr_encoding(template, chunks)
+
+    tmp_path = f"{path}.part"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    _strip_encoding(template).to_zarr(tmp_path, mode="w", compute=False, encoding=encoding,
+                                      consolidated=False, zarr_format=fmt)
+
+    regions = []
+    for tile_path, tile_lats, tile_lons in zip(tile_paths, lats, lons):
+        i0 = int(np.searchsorted(all_lats, tile_lats[0]))
+        j0 = int(np.searchsorted(all_lons, tile_lons[0]))
+        regions.append((tile_path, {"time": slice(None), "latitude": slice(i0, i0 + len(tile_lats)),
+                                    "longitude": slice(j0, j0 + len(tile_lons))}))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_write_tile_region, tile_path, tmp_path, region)
+                       for tile_path, region in regions]
+            for future in as_completed(futures):
+                future.result()
+    else:
+        for tile_path, region in regions:
+            _write_tile_region(tile_path, tmp_path, region)
+
+    zarr.consolidate_metadata(tmp_path)
+    _replace_store(tmp_path, path)
+    print(f"Saved Zarr store of {len(tile_paths)} tiles to: {path}")
+    return path
+
+
+def open_store(path: str) -> xr.Dataset:
+    """Open a Zarr product lazily; only the chunks of the selected cells or months are read."""
+    return xr.open_zarr(path, consolidated=True)
+
+
+def read_series(path: str, variable: str, latitude: float, longitude: float) -> xr.DataArray:
+    """Full time series of the grid cell nearest to (latitude, longitude)."""
+    with open_store(path) as ds:
+        return ds[variable].sel(latitude=latitude, longitude=longitude, method="nearest").load()
+
+
+def read_map(path: str, variable: str, time) -> xr.DataArray:
+    """Map of the time step nearest to time (e.g. "2020-06")."""
+    with open_store(path) as ds:
+        return ds[variable].sel(time=np.datetime64(time, "ns"), method="nearest").load()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy a NetCDF product to a Zarr store next to it.')
+    parser.add_argument('nc_file', help='NetCDF file to copy')
+    parser.add_argument('--format', type=int, choices=ZARR_FORMATS, default=None,
+                        help=f'Zarr format (default: {ZARR_FORMAT_ENV_VAR}, or 3)')
+    args = parser.parse_args()
+
+    try:
+        export_zarr(args.nc_file, args.format or zarr_format() or 3)
+    except Exception as e:
+        print(f"Error writing the Zarr store: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Selective, parallel extraction of the members of a zip archive.
+
+Only members matching a pattern are considered, and of those only the ones that are missing
+or whose size or CRC-32 differ from the copy on disk are written; unchanged members are left
+untouched, so rerunning on the same archive writes nothing. Members are extracted in
+parallel, each streamed to <name>.part and renamed once complete.
+
+Usage:
+    PYTHONPATH=.. python3 -m common.zip_extract data/rr_2011_2023_Daily_E_OBS.zip data/E_OBS_rr_Daily --pattern "*.nc"
+"""
+import os
+import sys
+import json
+import zlib
+import shutil
+import fnmatch
+import zipfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+MANIFEST_NAME = ".zip_members.json"
+CHUNK_SIZE = 1 << 20
+
+
+def crc32_of_file(path: str) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class MemberManifest:
+    """
+    Size and CRC-32 of the extracted members, with the size and mtime of the files written
+    for them, so an unchanged file is recognised without reading it back.
+    """
+
+    def __init__(self, target_dir: str):
+        self.path = os.path.join(target_dir, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        self.dirty = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def is_current(self, info: zipfile.ZipInfo, file_path: str) -> bool:
+        if not os.path.isfile(file_path):
+            return False
+        stat = os.stat(file_path)
+        if stat.st_size != info.file_size:
+            return False
+        entry = self.entries.get(info.filename)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["crc"] == info.CRC
+        # Extracted by another tool or touched since: compare the CRC of the file itself
+        if crc32_of_file(file_path) != info.CRC:
+            return False
+        self.record(info, file_path)
+        return True
+
+    def record(self, info: zipfile.ZipInfo, file_path: str) -> None:
+        with self.lock:
+            self.entries[info.filename] = {"size": info.file_size, "crc": info.CRC,
+                                           "mtime_ns": os.stat(file_path).st_mtime_ns}
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        tmp_path = f"{self.path}.part"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _member_path(target_dir: str, name: str) -> str:
+    path = os.path.realpath(os.path.join(target_dir, name))
+    if not path.startswith(os.path.realpath(target_dir) + os.sep):
+        raise ValueError(f"Member {name} would be extracted outside {target_dir}")
+    return path
+
+
+def _extract_member(zip_path: str, info: zipfile.ZipInfo, file_path: str) -> None:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.part"
+    # Each thread reads through its own handle; ZipExtFile checks the CRC at the end of the stream
+    with zipfile.ZipFile(zip_path) as zf, zf.open(info) as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.replace(tmp_path, file_path)
+
+
+def sync_zip(zip_path: str, target_dir: str, patterns: List[str] = ("*.nc",), workers: int = 4) -> List[str]:
+    """
+    Bring target_dir up to date with the members of zip_path matching patterns.
+
+    Args:
+        zip_path: Zip archive
+        target_dir: Extraction directory
+        patterns: fnmatch patterns of the member names to extract
+        workers: Members extracted in parallel
+
+    Returns:
+        Names of the members that were (re)written
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    manifest = MemberManifest(target_dir)
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [info for info in zf.infolist() if not info.is_dir()
+                   and any(fnmatch.fnmatch(os.path.basename(info.filename), p) for p in patterns)]
+    if not members:
+        raise ValueError(f"No members of {zip_path} match {', '.join(patterns)}")
+
+    stale = [info for info in members if not manifest.is_current(info, _member_path(target_dir, info.filename))]
+    print(f"{len(members)} matching members in {os.path.basename(zip_path)}, "
+          f"{len(members) - len(stale)} unchanged, {len(stale)} to extract")
+
+    written, failed = [], []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(_extract_member, zip_path, info, _member_path(target_dir, info.filename)): info
+                   for info in stale}
+        for future in as_completed(futures):
+            info = futures[future]
+            try:
+                future.result()
+                manifest.record(info, _member_path(target_dir, info.filename))
+                written.append(info.filename)
+                print(f"  Extracted {info.filename} ({info.file_size / 1e6:.1f} MB)")
+            except Exception as e:
+                print(f"  Error extracting {info.filename}: {str(e)}")
+                failed.append(info.filename)
+    manifest.save()
+    if failed:
+        raise RuntimeError(f"Failed to extract {len(failed)} members: {', '.join(failed)}")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract the members of a zip archive that are missing or changed.')
+    parser.add_argument('zip_file', help='Zip archive')
+    parser.add_argument('target_dir', help='Extraction directory')
+    parser.add_argument('--pattern', action='append', default=None,
+                        help='Member name pattern to extract; can be repeated (default: *.nc)')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='Members extracted in parallel')
+    args = parser.parse_args()
+
+    try:
+        sync_zip(args.zip_file, args.target_dir, args.pattern or ["*.nc"], args.workers)
+    except Exception as e:
+        print(f"Error extracting {args.zip_file}: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,25 @@ import xarray as xr
 import numpy as np
 import pandas as pd
 from common.dataset_dto import DatasetDTO
-from common.base_homogenization import BaseHomogenization
+from common.base_homogenization import BaseHomogenization, CellCacheHomogenization
+from common.tiling import GridWindow
 from common.homogenization_result import SNHTHomogenizationResult
 from common.homogenizer_snht import SnhtHomogenizer
 from statsmodels.tsa.stattools import acf
 from typing import List, Optional
 
 
-class HumidityHomogenization(BaseHomogenization):
+class HumidityHomogenization(CellCacheHomogenization, BaseHomogenization):
 
-    def __init__(self, eobs_file: str, era5_file: str, variable_name: str = "mean_relative_humidity"):
-        super().__init__(eobs_file, era5_file)
+    neighbor_radius = 15
+    neighbor_radius_km = 165.0
+    cell_cache_parameters = ("acf_lag_max", "sd_factor", "window_size", "mv_window", "len_times")
+    cell_cache_code = (SnhtHomogenizer,)
+    derived_reference = "relative_humidity"
+
+    def __init__(self, eobs_file: str, era5_file: str, variable_name: str = "mean_relative_humidity",
+                 window: Optional[GridWindow] = None):
+        super().__init__(eobs_file, era5_file, window)
         self.variable_name = variable_name
         self.eobs_data = self.load_eobs(self.eobs_ds, variable_name)
         self.era5_data = self.load_era5(self.era5_ds)
@@ -21,7 +29,7 @@ class HumidityHomogenization(BaseHomogenization):
         self.len_lon = len(self.eobs_data.lons)
         self.len_lat = len(self.eobs_data.lats)
         self.acf_lag_max = 12
-        self.window_size = 15
+        self.window_size = self.neighbor_radius
         # self.mv_window = 156
         self.mv_window = 12
         self.sd_factor = 1
@@ -31,9 +39,8 @@ class HumidityHomogenization(BaseHomogenization):
         lats = era5_ds['latitude'].values
         time = era5_ds['time'].values
 
-        t2m = era5_ds['t2m'].values
-        d2m = era5_ds['d2m'].values
-        relative_humidity = self._calc_rh_wexler(d2m, t2m)
+        # Wexler relative humidity from d2m and t2m, derived once and cached
+        relative_humidity = self.load_derived_reference()
 
         return DatasetDTO(
             lons=lons,
@@ -58,6 +65,8 @@ class HumidityHomogenization(BaseHomogenization):
         print('Results saved successfully.')
 
     def homogenize(self):
+        self.prepare_references(self.eobs_data, self.era5_data)
+        cell_cache = self.open_cell_cache()
         grid_results = []
         for lon_idx in range(self.len_lon):
             lat_results = []
@@ -67,34 +76,45 @@ class HumidityHomogenization(BaseHomogenization):
                 era5_ts = self.era5_data.data[:, self.len_lat - 1 - lat_idx, lon_idx]  # Flip latitude index
                 filled_eobs = self.fill_missing_values(eobs_ts=eobs_ts, era5_ts=era5_ts)
 
-                refrence_avarage_series = self.get_neighbor_average_series(
-                    data_3d=self.era5_data.data,
-                    lat_idx=lat_idx,
-                    lon_idx=lon_idx,
-                    window_size=self.window_size
+                refrence_avarage_series = self.get_reference_series(
+                    data=self.era5_data,
+                    lat_idx=self.len_lat - 1 - lat_idx,  # Same flipped latitude index as era5_ts
+                    lon_idx=lon_idx
                 )
 
-                homogenizer = SnhtHomogenizer(min_segment_length=self.acf_lag_max)
-                homo_result = homogenizer.homogenize(filled_eobs, refrence_avarage_series, sd_factor=self.sd_factor)
-
-                moving_variance = self.calculate_moving_variance(homo_result.corrected, homo_result.original)
-
-                acf_original = self.calculate_acf(homo_result.original)
-                acf_corrected = self.calculate_acf(homo_result.corrected)
-
-                processed_point = {
-                    "corrected_data": homo_result.corrected[:self.len_times],
-                    "original_data": homo_result.original[:self.len_times],
-                    "moving_variance": moving_variance[:self.len_times],
-                    "acf_original": acf_original,
-                    "acf_corrected": acf_corrected
-                }
+                processed_point = self.homogenize_cell_cached(cell_cache, filled_eobs, refrence_avarage_series)
 
                 lat_results.append(processed_point)
             grid_results.append(lat_results)
+        if cell_cache is not None:
+            cell_cache.close()
 
+        self.collect_breakpoints((lat_idx, lon_idx, point["breakpoints"], point["innovations"])
+                                 for lon_idx, lat_results in enumerate(grid_results)
+                                 for lat_idx, point in enumerate(lat_results))
         self.results = self.combine_results_to_arrays(grid_results=grid_results)
 
+    def homogenize_cell(self, filled_eobs: np.ndarray, refrence_avarage_series: np.ndarray) -> dict:
+        """SNHT homogenization of one cell's filled E-OBS series against its reference, with diagnostics."""
+        homogenizer = SnhtHomogenizer(min_segment_length=self.acf_lag_max)
+        homo_result = homogenizer.homogenize(filled_eobs, refrence_avarage_series, sd_factor=self.sd_factor)
+
+        moving_variance = self.calculate_moving_variance(homo_result.corrected, homo_result.original)
+
+        acf_original = self.calculate_acf(homo_result.original)
+        acf_corrected = self.calculate_acf(homo_result.corrected)
+
+        processed_point = {
+            "corrected_data": homo_result.corrected[:self.len_times],
+            "original_data": homo_result.original[:self.len_times],
+            "moving_variance": moving_variance[:self.len_times],
+            "acf_original": acf_original,
+            "acf_corrected": acf_corrected,
+            "breakpoints": homo_result.breakpoints,
+            "innovations": homo_result.innovations
+        }
+        return processed_point
+
     def save_results(self, output_path: str):
         print('original result shape: ', self.results.original.shape)
         print('adjusted result shape: ', self.results.corrected.shape)
@@ -118,14 +138,6 @@ class HumidityHomogenization(BaseHomogenization):
             compress=True
         )
 
-    def _calc_rh_wexler(self, d2m_values, t2m_values):
-        e_d2m = self._e_wexler(d2m_values)
-        e_t2m = self._e_wexler(t2m_values)
-        return 100 * (e_d2m / e_t2m)
-
-    def _e_wexler(self, T):
-        return 610.78 * np.exp((17.27 * T) / (T + 237.3))
-
     def set_acf_lag_max(self, acf_lag_max: int):
         self.acf_lag_max = acf_lag_max
 
@@ -135,39 +147,6 @@ class HumidityHomogenization(BaseHomogenization):
     def set_sd_factor(self, sd_factor: int):
         self.sd_factor = sd_factor
 
-    def get_neighbor_average_series(self, data_3d: np.ndarray, lon_idx: int, lat_idx: int,
-                                    window_size: int) -> np.ndarray:
-        """
-        Calculate neighbor-averaged time series from a 3D array (time, lat, lon).
-
-        Args:
-            data_3d (np.ndarray): 3D array of shape (time, lat, lon)
-            lon_idx (int): Longitude index (0-based)
-            lat_idx (int): Latitude index (0-based)
-            window_size (int): Number of neighboring grid points in each direction
-
-        Returns:
-            np.ndarray: 1D time series of neighbor averages
-        """
-        # Get valid neighbor ranges
-        lon_min = max(0, lon_idx - window_size)
-        lon_max = min(data_3d.shape[2], lon_idx + window_size + 1)
-        lat_min = max(0, lat_idx - window_size)
-        lat_max = min(data_3d.shape[1], lat_idx + window_size + 1)
-
-        # Extract neighbor series (excluding target cell)
-        neighbor_series = [
-            data_3d[:, lat, lon]
-            for lon in range(lon_min, lon_max)
-            for lat in range(lat_min, lat_max)
-            if not (lon == lon_idx and lat == lat_idx)
-        ]
-
-        if not neighbor_series:
-            return np.full(data_3d.shape[0], np.nan)
-
-        return np.nanmean(np.column_stack(neighbor_series), axis=1)
-
     def calculate_moving_variance(self, time_series: np.ndarray, time_series1: np.ndarray) -> np.ndarray:
         """
         Computes the difference in rolling variance between two time series.
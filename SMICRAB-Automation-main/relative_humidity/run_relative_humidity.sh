@@ -4,8 +4,10 @@
 SKIP_E_OBS_DOWNLOAD=false
 SKIP_ERA5_DOWNLOAD=false
 SKIP_UNZIP=false
+APPEND=false
 GENERATE_CSV=false # Default: do not generate CSV
 PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"  # Get project root
+RUN_OPTIONS="$*"  # Options of the run, recorded in the run manifest
 RH_DIR="$PROJECT_ROOT/relative_humidity"
 DATA_DIR="$RH_DIR/data"    # Data directory under relative_humidity
 LOG_DIR="$RH_DIR/logs"     # Log directory under relative_humidity
@@ -33,6 +35,10 @@ while [[ "$#" -gt 0 ]]; do
       GENERATE_CSV=true
       shift
       ;;
+    --append)
+      APPEND=true
+      shift
+      ;;
     -h|--help)
       echo "Usage: $0 [OPTIONS]"
       echo "Options:"
@@ -40,6 +46,7 @@ while [[ "$#" -gt 0 ]]; do
       echo "  --skip-era5-download    Skip the ERA5 download step"
       echo "  --skip-unzip            Skip the extraction of E-OBS zip file"
       echo "  --generate-csv          Generate CSV files from processed data" # Help text for CSV option
+      echo "  --append                Only add the months newer than the existing monthly files"
       echo "  -h, --help              Show this help message"
       exit 0
       ;;
@@ -76,11 +83,39 @@ check_file() {
     fi
 }
 
+# Run a step through the stage cache (common/stage_cache.py), which skips it when its inputs,
+# code and parameters are unchanged since it wrote its outputs; SMICRAB_STAGE_CACHE=off always runs
+# Usage: run_stage <name> [--input PATH]... [--output PATH]... -- <command>
+run_stage() {
+    local name="$1"
+    shift
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.stage_cache \
+        --cache "$DATA_DIR/stage_cache.json" --name "$name" \
+        --manifest "$DATA_DIR/run_manifest.json" "$@"
+}
+
+# Start the run manifest, data/run_manifest.json (common/run_manifest.py): the stages run through
+# run_stage add their timings, peak memory and file hashes to it, and it is closed with the exit
+# status of the script
+start_run_manifest() {
+    if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest begin "$DATA_DIR/run_manifest.json" \
+            --pipeline relative_humidity --param "options=$RUN_OPTIONS"; then
+        log "WARNING: Could not start the run manifest"
+    fi
+    trap 'finish_run_manifest $?' EXIT
+}
+
+finish_run_manifest() {
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest finish "$DATA_DIR/run_manifest.json" \
+        --exit-code "$1" | tee -a "$LOG_DIR/relative_humidity_processing.log"
+}
+
 # Main processing script
 main() {
     # Create (or touch) the log file
     touch "$LOG_DIR/relative_humidity_processing.log"
     log "Starting Relative_Humidity Data Processing Workflow"
+    start_run_manifest
 
     # Step 1: CDSAPI Configuration Check
     log "Checking CDSAPI configuration in \$HOME/.cdsapirc"
@@ -100,10 +135,21 @@ main() {
     fi
 
     # Step 2: Download ERA5 dataset (if not skipped)
-    if [ "$SKIP_ERA5_DOWNLOAD" = false ]; then
+    if [ "$SKIP_ERA5_DOWNLOAD" = false ] && [ "$APPEND" = true ]; then
+        # Download only the months after the last one in the ERA5 file and append them to it
+        log "Starting ERA5 Download of the new months"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+        if ! python3 "$RH_DIR/processing/hu_era5_download.py" --append; then
+            log "ERROR: ERA5 Download failed"
+            exit 1
+        fi
+        log "ERA5 Download completed successfully"
+    elif [ "$SKIP_ERA5_DOWNLOAD" = false ]; then
         log "Starting ERA5 Download"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$RH_DIR/processing/hu_era5_download.py"; then
+        if ! run_stage era5_download \
+                --output "$DATA_DIR/ERA5_hu_Monthly/hu_IT_2011_2023_Monthly_ERA5.nc" \
+                -- python3 "$RH_DIR/processing/hu_era5_download.py"; then
             log "ERROR: ERA5 Download failed"
             exit 1
         fi
@@ -117,7 +163,9 @@ main() {
     if [ "$SKIP_E_OBS_DOWNLOAD" = false ]; then
         log "Starting Relative_Humidity (E‑OBS) Download"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$RH_DIR/processing/hu_e_obs_download.py"; then
+        if ! run_stage eobs_download \
+                --output "$DATA_DIR/hu_2011_2023_Daily_E_OBS.zip" \
+                -- python3 "$RH_DIR/processing/hu_e_obs_download.py"; then
             log "ERROR: Relative_Humidity (E‑OBS) Download failed"
             exit 1
         fi
@@ -145,40 +193,65 @@ main() {
             mkdir -p "$TARGET_FOLDER"
         fi
 
-        # Extract the zip file with progress
+        # Extract the NetCDF members that are missing or changed
         log "Starting extraction..."
-        if ! unzip -o "$ZIP_FILE" -d "$TARGET_FOLDER" | awk 'BEGIN {ORS=" "} {if(NR%10==0)print "."}'; then
+        if ! run_stage unzip --input "$ZIP_FILE" --output "$TARGET_FOLDER" \
+                -- python3 -m common.zip_extract "$ZIP_FILE" "$TARGET_FOLDER"; then
             log "ERROR: Extraction failed for $ZIP_FILE"
             exit 1
         fi
-        echo ""  # Add newline after progress dots
         log "Extraction of Relative_Humidity dataset completed successfully"
     else
         log "Extraction step skipped"
     fi
 
     # Step 5: Run Aggregation Script for E-OBS Relative_Humidity
-    log "Starting Relative_Humidity E-OBS Dataset Aggregation"
-    if ! python3 "$RH_DIR/processing/hu_e_obs_processing.py"; then
-        log "ERROR: Relative_Humidity Aggregation failed"
-        exit 1
-    fi
-    log "Relative_Humidity Aggregation completed successfully"
-    check_file "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc"
+    if [ "$APPEND" = true ]; then
+        # Only the complete months newer than the CF-1.8 monthly file are aggregated and appended
+        # to it; the steps below that read it then rerun on the extended file
+        log "Appending new months to the Relative_Humidity E-OBS CF-1.8 monthly file"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+        if ! python3 "$RH_DIR/processing/hu_e_obs_processing.py" --append; then
+            log "ERROR: Relative_Humidity Append failed"
+            exit 1
+        fi
+        log "Relative_Humidity Append completed successfully"
+    else
+        log "Starting Relative_Humidity E-OBS Dataset Aggregation"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+        if ! run_stage aggregation \
+                --input "$DATA_DIR/E_OBS_hu_Daily" \
+                --output "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                -- python3 "$RH_DIR/processing/hu_e_obs_processing.py"; then
+            log "ERROR: Relative_Humidity Aggregation failed"
+            exit 1
+        fi
+        log "Relative_Humidity Aggregation completed successfully"
+        # No check_file of the monthly file: run_stage fails a step that did not write its outputs,
+        # and data directories from older runs may only have its CF-1.8 copy
 
-    # Step 6: Make Relative_Humidity E-OBS CF-Compliant
-    log "Starting Relative_Humidity E-OBS Dataset CF Compliance Conversion"
-    if ! python3 "$RH_DIR/processing/hu_make_cf_compliant.py"; then
-        log "ERROR: Relative_Humidity CF Compliance Conversion failed"
-        exit 1
+        # Step 6: Make Relative_Humidity E-OBS CF-Compliant
+        log "Starting Relative_Humidity E-OBS Dataset CF Compliance Conversion"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+        if ! run_stage cf_compliance \
+                --input "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --output "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+                -- python3 "$RH_DIR/processing/hu_make_cf_compliant.py"; then
+            log "ERROR: Relative_Humidity CF Compliance Conversion failed"
+            exit 1
+        fi
+        log "Relative_Humidity CF Compliance Conversion completed successfully"
+        check_file "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
     fi
-    log "Relative_Humidity CF Compliance Conversion completed successfully"
-    check_file "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
 
     # Step 7: Run Homogenization Script for Aggregated Relative_Humidity
     log "Starting Relative_Humidity Homogenization"
     export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
-    if ! python3 "$RH_DIR/processing/hu_homogenization.py"; then
+    if ! run_stage homogenization \
+            --input "$DATA_DIR/E_OBS_hu_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+            --input "$DATA_DIR/ERA5_hu_Monthly/hu_IT_2011_2023_Monthly_ERA5.nc" \
+            --output "$DATA_DIR/hu_IT_2011_2023_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+            -- python3 "$RH_DIR/processing/hu_homogenization.py"; then
         log "ERROR: Relative_Humidity Homogenization failed"
         exit 1
     fi
@@ -189,7 +262,10 @@ main() {
     if [ "$GENERATE_CSV" = true ]; then
         log "Starting CSV Generation from processed data"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$RH_DIR/processing/hu_generate_csv.py"; then
+        if ! run_stage csv \
+                --input "$DATA_DIR/hu_IT_2011_2023_Monthly/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.nc" \
+                --output "$DATA_DIR/hu_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.csv" \
+                -- python3 "$RH_DIR/processing/hu_generate_csv.py"; then
             log "ERROR: CSV Generation failed"
             exit 1
         fi
@@ -1,31 +1,14 @@
 #!/bin/bash
 
-# Directory-to-script mapping
-declare -A dir_scripts=(
-    ["accumulated_precipitation"]="run_precipitation.sh"
-    ["air_temperature"]="run_air_temperature.sh"
-    ["Albedo"]="run_SAL.sh"
-    ["Land_Surface_Temperature"]="run_LST.sh"
-    ["relative_humidity"]="run_relative_humidity.sh"
-    ["sea_level_pressure"]="run_pressure.sh"
-    ["solar_irradiance"]="run_solar_irradiance.sh"
-    ["wind_speed"]="run_wind_speed.sh"
-)
-
-# Loop through each directory and execute the corresponding script
-for dir in "${!dir_scripts[@]}"; do
-    script="${dir_scripts[$dir]}"
-
-    echo "Entering directory: $dir"
-    cd "$dir" || { echo "❌ Error: Failed to enter directory $dir"; exit 1; }
-
-    echo "Running script: $script"
-    bash "$script" || { echo "❌ Error: Failed to run $script"; exit 1; }
-
-    echo "Returning to parent directory"
-    cd .. || { echo "❌ Error: Failed to return to parent directory"; exit 1; }
-
-    echo "----------------------------------------"
-done
-
-echo "✅ All scripts executed successfully!"
\ No newline at end of file
+# Run all variable pipelines as one DAG (see run_all.py): independent pipelines and steps run
+# concurrently, per-step logs go to logs/<variable>/ and a report is printed at the end.
+# Options are passed through, e.g. --skip-downloads, --generate-csv, --cpus 8, --dry-run
+PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+if ! python3 "$PROJECT_ROOT/run_all.py" "$@"; then
+    echo "❌ Error: Some pipeline steps failed, see the report above"
+    exit 1
+fi
+
+echo "✅ All scripts executed successfully!"
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from common.orchestrator import Orchestrator, Budget, resolve_dependencies
+from common.pipelines import PIPELINES, build_steps
+from common.stage_cache import PROJECT_ROOT
+
+
+def ensure_cdsapirc():
+    """Generate $HOME/.cdsapirc from .env if missing, as the run_*.sh scripts do."""
+    if os.path.exists(os.path.expanduser("~/.cdsapirc")):
+        return
+    print("CDSAPI configuration not found, generating new one")
+    subprocess.run([os.path.join(PROJECT_ROOT, "common", "scripts", "generate_cdsapirc.sh")], check=True)
+
+
+def print_plan(steps, dependencies):
+    for step in steps:
+        deps = ", ".join(dependencies[step.full_name]) or "-"
+        print(f"{step.full_name:<45} cpus={step.cpus:<4} mem={step.memory_gb:<4} "
+              f"{'net ' if step.network else ''}after: {deps}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the variable pipelines as one DAG, running independent steps '
+                                                 'concurrently within CPU, memory and network budgets.')
+    parser.add_argument('pipelines', nargs='*', help=f'Pipelines to run (default: all): {", ".join(PIPELINES)}')
+    parser.add_argument('--skip-downloads', action='store_true', help='Skip all download steps')
+    parser.add_argument('--skip-unzip', action='store_true', help='Skip the extraction of the downloaded archives')
+    parser.add_argument('--generate-csv', action='store_true', help='Generate CSV files from processed data')
+    parser.add_argument('--append', action='store_true',
+                        help='Append the months newer than the existing monthly files instead of rebuilding them '
+                             '(E-OBS variables)')
+    parser.add_argument('--cpus', type=float, default=None, help='CPU budget (default: number of cores)')
+    parser.add_argument('--memory-gb', type=float, default=None, help='Memory budget (default: available memory)')
+    parser.add_argument('--network', type=int, default=2, help='Maximum concurrent download steps (default: 2)')
+    parser.add_argument('--dry-run', action='store_true', help='Print the steps and their dependencies only')
+    args = parser.parse_args()
+
+    steps = build_steps(args.pipelines, generate_csv=args.generate_csv, downloads=not args.skip_downloads,
+                        extract=not args.skip_unzip, append=args.append)
+    if args.dry_run:
+        print_plan(steps, resolve_dependencies(steps))
+        return
+
+    budget = Budget.from_system(network=args.network)
+    if args.cpus:
+        budget.cpus = args.cpus
+    if args.memory_gb:
+        budget.memory_gb = args.memory_gb
+
+    if not args.skip_downloads:
+        ensure_cdsapirc()
+    orchestrator = Orchestrator(steps, budget)
+    print(f"Running {len(steps)} steps with {budget.cpus:g} CPUs, {budget.memory_gb:.1f} GB and "
+          f"{budget.network} concurrent downloads; logs in {orchestrator.log_dir}")
+    start = time.perf_counter()
+    results = orchestrator.run()
+    print()
+    print(orchestrator.report(time.perf_counter() - start))
+    parameters = {k: v for k, v in vars(args).items() if k != 'dry_run'}
+    for path in orchestrator.write_manifests(parameters):
+        print(f"Run manifest written to {path}")
+    sys.exit(0 if all(r.status in ("ok", "cached") for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
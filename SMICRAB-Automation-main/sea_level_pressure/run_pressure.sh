@@ -3,7 +3,9 @@
 # Default configuration
 SKIP_E_OBS_DOWNLOAD=false
 SKIP_UNZIP=false
+APPEND=false
 PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"  # Get project root
+RUN_OPTIONS="$*"  # Options of the run, recorded in the run manifest
 AP_DIR="$PROJECT_ROOT/sea_level_pressure"
 DATA_DIR="$AP_DIR/data"    # Data directory under sea_level_pressure
 LOG_DIR="$AP_DIR/logs"     # Log directory under sea_level_pressure
@@ -23,11 +25,16 @@ while [[ "$#" -gt 0 ]]; do
       SKIP_UNZIP=true
       shift
       ;;
+    --append)
+      APPEND=true
+      shift
+      ;;
     -h|--help)
       echo "Usage: $0 [OPTIONS]"
       echo "Options:"
       echo "  --skip-eobs-download    Skip the Sea_Level_Pressure (E‑OBS) download step"
       echo "  --skip-unzip            Skip the extraction of E-OBS zip file"
+      echo "  --append                Only add the months newer than the existing monthly files"
       echo "  -h, --help              Show this help message"
       exit 0
       ;;
@@ -64,11 +71,39 @@ check_file() {
     fi
 }
 
+# Run a step through the stage cache (common/stage_cache.py), which skips it when its inputs,
+# code and parameters are unchanged since it wrote its outputs; SMICRAB_STAGE_CACHE=off always runs
+# Usage: run_stage <name> [--input PATH]... [--output PATH]... -- <command>
+run_stage() {
+    local name="$1"
+    shift
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.stage_cache \
+        --cache "$DATA_DIR/stage_cache.json" --name "$name" \
+        --manifest "$DATA_DIR/run_manifest.json" "$@"
+}
+
+# Start the run manifest, data/run_manifest.json (common/run_manifest.py): the stages run through
+# run_stage add their timings, peak memory and file hashes to it, and it is closed with the exit
+# status of the script
+start_run_manifest() {
+    if ! PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest begin "$DATA_DIR/run_manifest.json" \
+            --pipeline sea_level_pressure --param "options=$RUN_OPTIONS"; then
+        log "WARNING: Could not start the run manifest"
+    fi
+    trap 'finish_run_manifest $?' EXIT
+}
+
+finish_run_manifest() {
+    PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH" python3 -m common.run_manifest finish "$DATA_DIR/run_manifest.json" \
+        --exit-code "$1" | tee -a "$LOG_DIR/sea_level_pressure_processing.log"
+}
+
 # Main processing script
 main() {
     # Create (or touch) the log file
     touch "$LOG_DIR/sea_level_pressure_processing.log"
     log "Starting Sea_Level_Pressure Data Processing Workflow"
+    start_run_manifest
 
     # Step 1: CDSAPI Configuration Check
     log "Checking CDSAPI configuration in \$HOME/.cdsapirc"
@@ -91,7 +126,9 @@ main() {
     if [ "$SKIP_E_OBS_DOWNLOAD" = false ]; then
         log "Starting Sea_Level_Pressure (E‑OBS) Download"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$AP_DIR/processing/pp_e_obs_download.py"; then
+        if ! run_stage eobs_download \
+                --output "$DATA_DIR/pp_2011_2023_Daily_E_OBS.zip" \
+                -- python3 "$AP_DIR/processing/pp_e_obs_download.py"; then
             log "ERROR: Sea_Level_Pressure (E‑OBS) Download failed"
             exit 1
         fi
@@ -119,46 +156,70 @@ main() {
             mkdir -p "$TARGET_FOLDER"
         fi
 
-        # Extract the zip file with progress
+        # Extract the NetCDF members that are missing or changed
         log "Starting extraction..."
-        if ! unzip -o "$ZIP_FILE" -d "$TARGET_FOLDER" | awk 'BEGIN {ORS=" "} {if(NR%10==0)print "."}'; then
+        if ! run_stage unzip --input "$ZIP_FILE" --output "$TARGET_FOLDER" \
+                -- python3 -m common.zip_extract "$ZIP_FILE" "$TARGET_FOLDER"; then
             log "ERROR: Extraction failed for $ZIP_FILE"
             exit 1
         fi
-        echo ""  # Add newline after progress dots
         log "Extraction of Sea_Level_Pressure dataset completed successfully"
     else
         log "Extraction step skipped"
     fi
 
     # Step 4: Run Aggregation Script for E-OBS Sea_Level_Pressure
-    log "Starting Sea_Level_Pressure E-OBS Dataset Aggregation"
-    if ! python3 "$AP_DIR/processing/pp_e_obs_processing.py"; then
-        log "ERROR: Sea_Level_Pressure Aggregation failed"
-        exit 1
-    fi
-    log "Sea_Level_Pressure Aggregation completed successfully"
-    check_file "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc"
-
-    # Step 5: Make Sea_Level_Pressure E-OBS CF-Compliant
-    log "Starting Sea_Level_Pressure E-OBS Dataset CF Compliance Conversion"
-    if ! python3 "$AP_DIR/processing/pp_make_cf_compliant.py"; then
-        log "ERROR: Sea_Level_Pressure CF Compliance Conversion failed"
-        exit 1
+    if [ "$APPEND" = true ]; then
+        # Only the complete months newer than the CF-1.8 monthly file are aggregated and appended
+        # to it; the steps below that read it then rerun on the extended file
+        log "Appending new months to the Sea_Level_Pressure E-OBS CF-1.8 monthly file"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
+        if ! python3 "$AP_DIR/processing/pp_e_obs_processing.py" --append; then
+            log "ERROR: Sea_Level_Pressure Append failed"
+            exit 1
+        fi
+        log "Sea_Level_Pressure Append completed successfully"
+    else
+        log "Starting Sea_Level_Pressure E-OBS Dataset Aggregation"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+        if ! run_stage aggregation \
+                --input "$DATA_DIR/E_OBS_pp_Daily" \
+                --output "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                -- python3 "$AP_DIR/processing/pp_e_obs_processing.py"; then
+            log "ERROR: Sea_Level_Pressure Aggregation failed"
+            exit 1
+        fi
+        log "Sea_Level_Pressure Aggregation completed successfully"
+        # No check_file of the monthly file: run_stage fails a step that did not write its outputs,
+        # and data directories from older runs may only have its CF-1.8 copy
+
+        # Step 5: Make Sea_Level_Pressure E-OBS CF-Compliant
+        log "Starting Sea_Level_Pressure E-OBS Dataset CF Compliance Conversion"
+        export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"  # Ensure PYTHONPATH is set
+        if ! run_stage cf_compliance \
+                --input "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly.nc" \
+                --output "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+                -- python3 "$AP_DIR/processing/pp_make_cf_compliant.py"; then
+            log "ERROR: Sea_Level_Pressure CF Compliance Conversion failed"
+            exit 1
+        fi
+        log "Sea_Level_Pressure CF Compliance Conversion completed successfully"
+        check_file "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
     fi
-    log "Sea_Level_Pressure CF Compliance Conversion completed successfully"
-    check_file "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc"
 
     # Step 6: Generate CSV files if requested
     if [ "$GENERATE_CSV" = true ]; then
         log "Starting CSV Generation from processed data"
         export PYTHONPATH="$PROJECT_ROOT:$PYTHONPATH"
-        if ! python3 "$AP_DIR/processing/pp_generate_csv.py"; then
+        if ! run_stage csv \
+                --input "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.nc" \
+                --output "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.csv" \
+                -- python3 "$AP_DIR/processing/pp_generate_csv.py"; then
             log "ERROR: CSV Generation failed"
             exit 1
         fi
         log "CSV Generation completed successfully"
-        check_file "$DATA_DIR/pp_IT_2011_2023_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8_corrected.csv"
+        check_file "$DATA_DIR/E_OBS_pp_Monthly/pp_ens_mean_0.1deg_reg_2011-2023_v29.0e_monthly_CF-1.8.csv"
 
     else
         log "CSV Generation step skipped"
@@ -1,20 +1,29 @@
 #!/usr/bin/env python3
 import os
+import sys
 import glob
+import argparse
 import numpy as np
 import xarray as xr
 import pandas as pd  # Import pandas
 import warnings
 
+from common.chunk_index import open_subset
+from common.domain import get_domain
+from common.incremental import append_new_months
+
 # Constants
-LON_MIN, LON_MAX = 6, 20
-LAT_MIN, LAT_MAX = 32, 49
+DOMAIN = get_domain()
+LON_MIN, LON_MAX = DOMAIN.lon_min, DOMAIN.lon_max
+LAT_MIN, LAT_MAX = DOMAIN.lat_min, DOMAIN.lat_max
 NEW_RESOLUTION_LAT = 0.1
 NEW_RESOLUTION_LON = 0.1
 DATA_DIR = "./data/E_OBS_fg_Daily"  # Input data directory
 SUBSET_DIR = "./data/E_OBS_fg_Daily_subset"  # Directory for subsetted files
 OUTPUT_DIR = "./data/E_OBS_fg_Monthly"  # Directory for aggregated monthly files
 VARS_TO_KEEP = ['time', 'longitude', 'latitude', 'fg']  # Variables to retain (using 'fg')
+# Monthly file after the CF-1.8 step, extended in place by --append
+CF_FILE = os.path.join(OUTPUT_DIR, "fg_ens_mean_0.1deg_reg_2011-2024_v30.0e_monthly_CF-1.8.nc")
 
 def convert_time_units(ds):
     """
@@ -43,24 +52,11 @@ def convert_time_units(ds):
     return ds
 
 
-def find_nearest_index(coord_array, value):
-    """Finds the index of the element in coord_array closest to value."""
-    return int(np.abs(coord_array - value).argmin())
-
-def subset_dataset(ds, input_file):
-    """Subsets the dataset to Italy region."""
+def subset_dataset(input_file):
+    """Subsets the dataset to Italy region, reading only the chunks that intersect it."""
     print("  Subsetting to Italy region...")
-    lats = ds['latitude'].values
-    lons = ds['longitude'].values
-    lat_start = find_nearest_index(lats, LAT_MIN)
-    lat_end = find_nearest_index(lats, LAT_MAX)
-    lon_start = find_nearest_index(lons, LON_MIN)
-    lon_end = find_nearest_index(lons, LON_MAX)
-    lat_start, lat_end = min(lat_start, lat_end), max(lat_start, lat_end)
-    lon_start, lon_end = min(lon_start, lon_end), max(lon_start, lon_end)
-    ds_subset = ds.isel(latitude=slice(lat_start, lat_end + 1),
-                        longitude=slice(lon_start, lon_end + 1))
-    ds_subset = ds_subset[VARS_TO_KEEP]
+    ds_subset = open_subset(os.path.join(DATA_DIR, input_file), VARS_TO_KEEP,
+                            lat_bounds=(LAT_MIN, LAT_MAX), lon_bounds=(LON_MIN, LON_MAX))
     subset_filename = os.path.basename(input_file).replace(".nc", "_subset.nc")
     subset_filepath = os.path.join(SUBSET_DIR, subset_filename)
     ds_subset.to_netcdf(subset_filepath)
@@ -95,14 +91,12 @@ def process_file(input_file):
         output_filename = os.path.basename(input_file).replace(".nc", "_monthly.nc")
         output_file = os.path.join(OUTPUT_DIR, output_filename)
 
-        ds = xr.open_dataset(os.path.join(DATA_DIR, input_file))
-
-        ds_subset = subset_dataset(ds, input_file)
+        ds_subset = subset_dataset(input_file)
         # ds_interp = interpolate_dataset(ds_subset, input_file)
         ds_aggregated = aggregate_to_monthly(ds_subset)
 
         converted_ds = convert_time_units(ds_aggregated)
-        converted_ds.to_netcdf(output_file)
+        converted_ds.to_netcdf(output_file, unlimited_dims=["time"])
 
         print(f"  Saved monthly data to {output_file}")
 
@@ -111,11 +105,36 @@ def process_file(input_file):
         print(f"Error processing {input_file}: {str(e)}")
         return None
 
+def append_file(input_file):
+    """Aggregates the complete months of input_file newer than CF_FILE and appends them to it."""
+    print(f"\nAppending new months of {input_file}...")
+    try:
+        return append_new_months(CF_FILE, os.path.join(DATA_DIR, input_file), VARS_TO_KEEP,
+                                 lat_bounds=(LAT_MIN, LAT_MAX), lon_bounds=(LON_MIN, LON_MAX),
+                                 aggregate=lambda ds: convert_time_units(aggregate_to_monthly(ds)))
+    except Exception as e:
+        print(f"Error appending {input_file}: {str(e)}")
+        return None
+
 def main():
     """Main processing function."""
+    parser = argparse.ArgumentParser(description='Aggregate daily E-OBS wind speed to monthly.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only append the complete months newer than the CF-1.8 monthly file to it')
+    args = parser.parse_args()
+
     os.makedirs(SUBSET_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    input_files = glob.glob(os.path.join(DATA_DIR, "*.nc"))
+    input_files = sorted(glob.glob(os.path.join(DATA_DIR, "*.nc")))
+    if args.append:
+        if not os.path.exists(CF_FILE):
+            print(f"Error: {CF_FILE} does not exist, run a full aggregation first")
+            sys.exit(1)
+        results = [append_file(os.path.basename(input_file)) for input_file in input_files]
+        if None in results:
+            sys.exit(1)
+        print(f"\n=== Appended {sum(results)} months ===")
+        return
     for input_file in input_files:
         input_file = os.path.basename(input_file)
         aggregated_ds = process_file(input_file)
@@ -1,5 +1,9 @@
 import  os
-import cdsapi
+import argparse
+
+from common.domain import get_domain
+from common.download_manager import download_split, merge_netcdf_parts
+from common.incremental import append_era5_months
 
 
 #
@@ -8,21 +12,16 @@ ERA5_END_YEAR = 2024
 ERA5_MONTHS = ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12']
 ERA5_ID = "reanalysis-era5-land-monthly-means"
 
-LON_MIN = 6
-LON_MAX = 20
-LAT_MIN = 32
-LAT_MAX =49
+DOMAIN = get_domain()
+LON_MIN = DOMAIN.lon_min
+LON_MAX = DOMAIN.lon_max
+LAT_MIN = DOMAIN.lat_min
+LAT_MAX = DOMAIN.lat_max
 
 OUTPUT_DIR = "./data/ERA5_fg_Monthly"
 OUTPUT_FILE = "fg_IT_2011_2023_Monthly_ERA5.nc"
 
-def get_cdsapi_client():
-    client = cdsapi.Client()
-    return client
-
-def download_era5(target_file: str):
-    client = get_cdsapi_client()
-
+def download_era5(target_file: str, append: bool = False):
     request = {
         'product_type': 'monthly_averaged_reanalysis',
         'variable': ['10m_u_component_of_wind', '10m_v_component_of_wind'],
@@ -33,9 +32,19 @@ def download_era5(target_file: str):
         "data_format": "netcdf",
         "download_format": "unarchived",
     }
-    client.retrieve(ERA5_ID, request, target_file)
+    if append:
+        # Only the months after the last one in target_file, appended to it
+        append_era5_months(ERA5_ID, request, target_file)
+        return
+    # One request per variable and year, submitted concurrently and merged back into one file
+    download_split(ERA5_ID, request, target_file, merge=merge_netcdf_parts)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download ERA5-Land monthly means.')
+    parser.add_argument('--append', action='store_true',
+                        help='Only download the months after the last one in the existing file and append them')
+    args = parser.parse_args()
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     output_file = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
-    download_era5(output_file)
+    download_era5(output_file, append=args.append)
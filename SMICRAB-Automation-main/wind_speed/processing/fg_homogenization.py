@@ -1,8 +1,16 @@
 from wind_speed_homogenizer import WindSpeedHomogenization
 import os
+import sys
+import argparse
 import warnings
 
+from common.tiling import add_tiling_arguments, run_tiled
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Homogenize E-OBS wind speed against ERA5.')
+    add_tiling_arguments(parser)
+    args = parser.parse_args()
+
     with warnings.catch_warnings():
         warnings.simplefilter("ignore", category=RuntimeWarning)
         eobs_file = "./data/E_OBS_fg_Monthly/fg_ens_mean_0.1deg_reg_2011-2024_v30.0e_monthly_CF-1.8.nc"
@@ -15,6 +23,14 @@ if __name__ == "__main__":
 
         monthly_span = [0.5, 0.45, 0.5, 0.5, 0.45, 0.4, 0.4, 0.4, 0.4, 0.5, 0.45, 0.45]
 
+        if args.tile_size:
+            failed = run_tiled(WindSpeedHomogenization,
+                               init_kwargs=dict(eobs_file=eobs_file, era5_file=era5_file),
+                               execute_kwargs=dict(monthly_span=monthly_span),
+                               output_path=output_file, tile_size=args.tile_size,
+                               workers=args.workers, tiles=args.tile)
+            sys.exit(1 if failed else 0)
+
         wind_speed_homogenization = WindSpeedHomogenization(eobs_file, era5_file)
 
         wind_speed_homogenization.execute(
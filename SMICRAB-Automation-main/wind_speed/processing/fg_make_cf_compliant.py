@@ -2,13 +2,17 @@
 import os
 import xarray as xr
 
+from common.cf_update import CFUpdatePlan, apply_cf_update
+from common.domain import get_domain
+
 # Constants
 INPUT_FILE = "./data/E_OBS_fg_Monthly/fg_ens_mean_0.1deg_reg_2011-2024_v30.0e_monthly.nc"
 OUTPUT_DIR = "./data/E_OBS_fg_Monthly"
 OUTPUT_FILE = "fg_ens_mean_0.1deg_reg_2011-2024_v30.0e_monthly_CF-1.8.nc"
 
-LON_MIN = 6
-LAT_MIN = 32
+DOMAIN = get_domain()
+LON_MIN = DOMAIN.lon_min
+LAT_MIN = DOMAIN.lat_min
 
 def fix_shift_coords(ds):
     lon0 = float(ds["longitude"].min())  # e.g. 32.04986
@@ -16,13 +20,10 @@ def fix_shift_coords(ds):
     lon_shift = lon0 - LON_MIN
     lat_shift = lat0 - LAT_MIN
 
+    # Only the coordinate values move: every grid value stays on the same index, so the
+    # data variables never have to be read or rewritten
     ds = ds.assign_coords(longitude=ds.longitude - lon_shift)
     ds = ds.assign_coords(latitude=ds.latitude - lat_shift)
-    ds = ds.interp(
-        longitude=ds.longitude,
-        latitude= ds.latitude,
-        method='nearest'
-    )
     return ds
 
 def make_cf_compliant(ds, mean_var = "mean_wind_speed", std_var="std_wind_speed"):
@@ -70,6 +71,8 @@ def make_cf_compliant(ds, mean_var = "mean_wind_speed", std_var="std_wind_speed"
 def main():
     """Main function for making monthly files CF-compliant."""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_file = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
+
     ds = xr.open_dataset(INPUT_FILE)
 
     print(f"\nProcessing for CF compliance: {INPUT_FILE}...")
@@ -77,10 +80,14 @@ def main():
     try:
         shifted_ds = fix_shift_coords(ds)
         ds_cf_compliant = make_cf_compliant(shifted_ds)
-        output_file = os.path.join(OUTPUT_DIR, OUTPUT_FILE)
 
-        encoding = {"time": {"dtype": "float64"}}  # Keep time encoding consistent
-        ds_cf_compliant.to_netcdf(output_file, encoding=encoding)
+        plan = CFUpdatePlan.from_dataset(
+            ds_cf_compliant,
+            time_encoding={"dtype": "float64"},  # Keep time encoding consistent
+        )
+        ds.close()
+        report = apply_cf_update(INPUT_FILE, output_file, plan)
+        print(f"  {report}")
 
         print(f"  Saved CF-compliant file to {output_file}")
 
@@ -4,14 +4,23 @@ from typing import List, Optional
 import warnings
 
 from common.dataset_dto import DatasetDTO
-from common.base_homogenization import BaseHomogenization
-from common.homogenizer_pairwise import PairwiseHomogenizer, PairwiseResult
+from common.base_homogenization import BaseHomogenization, CellCacheHomogenization
+from common.tiling import GridWindow
+from common.homogenizer_pairwise import PairwiseHomogenizer
 from common.homogenization_result import PairwiseHomogenizationResult
 
-class WindSpeedHomogenization(BaseHomogenization):
+class WindSpeedHomogenization(CellCacheHomogenization, BaseHomogenization):
 
-    def __init__(self, eobs_file: str, era5_file: str, variable_name: str = "mean_wind_speed"):
-        super().__init__(eobs_file, era5_file)
+    neighbor_radius = 15
+    neighbor_radius_km = 165.0
+    cell_cache_parameters = ("threshold_factor", "window_size")
+    cell_cache_code = (PairwiseHomogenizer,)
+    derived_reference = "wind_speed"
+    cost_model = "pairwise"
+
+    def __init__(self, eobs_file: str, era5_file: str, variable_name: str = "mean_wind_speed",
+                 window: Optional[GridWindow] = None):
+        super().__init__(eobs_file, era5_file, window)
         self.variable_name = variable_name
         self.eobs_data = self.load_eobs(self.eobs_ds, variable_name)
         self.era5_data = self.load_era5(self.era5_ds)
@@ -20,7 +29,6 @@ class WindSpeedHomogenization(BaseHomogenization):
         self.len_times = len(self.common_times)
         self.len_lon = len(self.eobs_data.lons)
         self.len_lat = len(self.eobs_data.lats)
-        self.radius = 15
         self.window_size = 24
         self.threshold_factor = 3
 
@@ -29,9 +37,8 @@ class WindSpeedHomogenization(BaseHomogenization):
         lats = era5_ds['latitude'].values
         time = era5_ds['time'].values
 
-        u10 = era5_ds['u10'].values
-        v10 = era5_ds['v10'].values
-        wind_speed = np.sqrt(np.square(u10) + np.square(v10))
+        # Wind speed from u10 and v10, derived once and cached
+        wind_speed = self.load_derived_reference()
         
         return DatasetDTO(
             lons=lons,
@@ -61,6 +68,8 @@ class WindSpeedHomogenization(BaseHomogenization):
         self.eobs_data.data = self.fill_missing_values(self.eobs_data.data, self.era5_data.data)
                 
         homogenized_data = self.eobs_data.data.copy()
+        cell_cache = self.open_cell_cache()
+        breakpoint_cells = []
 
         for lon_idx in range(self.len_lon):
             self.print_homo_progress(lon_idx, self.len_lon)
@@ -71,30 +80,35 @@ class WindSpeedHomogenization(BaseHomogenization):
                     warnings.warn(f"Non-numeric series at position ({lon_idx},{lat_idx})")
                     continue
 
-                neighbors = self.find_valid_neighbors(self.era5_data.data, lon_idx, lat_idx)
+                neighbors = self.find_valid_neighbors(self.era5_data, lon_idx, lat_idx)
 
 
                 if len(neighbors) > 0:
-                    homogenizer = PairwiseHomogenizer(threshold_factor=self.threshold_factor, window_size=self.window_size)
-                    correction_result = homogenizer.homogenize(current_series, neighbors)
-
-                    if isinstance(correction_result, PairwiseResult):
-                        correction = correction_result.corrections  # Access as attribute, not dict key
-                    else:
-                        warnings.warn(f"Correzione non valida per posizione ({lon_idx}, {lat_idx})")
-                        continue
+                    cell_result = self.homogenize_cell_cached(cell_cache, current_series, neighbors)
+                    correction = cell_result["corrections"]
+                    # The corrections are subtracted below, so the applied adjustments are the negated innovations
+                    breakpoint_cells.append((lat_idx, lon_idx, cell_result["breakpoints"],
+                                             0.0 - np.asarray(cell_result["innovations"], dtype=float)))
 
                     if len(correction) == len(current_series) and isinstance(correction, np.ndarray):
                         homogenized_data[:, lat_idx, lon_idx] = current_series - correction
                     else:
                         warnings.warn(f"Correzione incompatibile con la serie per posizione ({lon_idx}, {lat_idx})")
+        if cell_cache is not None:
+            cell_cache.close()
 
-
-
+        self.collect_breakpoints(breakpoint_cells)
         self.results = PairwiseHomogenizationResult(
             original=self.eobs_data.data,
             corrected=homogenized_data
         )
+
+    def homogenize_cell(self, current_series: np.ndarray, neighbors: np.ndarray) -> dict:
+        """Pairwise homogenization of one cell's series against its neighbours' series."""
+        homogenizer = PairwiseHomogenizer(threshold_factor=self.threshold_factor, window_size=self.window_size)
+        correction_result = homogenizer.homogenize(current_series, neighbors)
+        return {"corrections": correction_result.corrections, "breakpoints": correction_result.breakpoints,
+                "innovations": correction_result.innovations}
                 
                 
 
@@ -159,37 +173,24 @@ class WindSpeedHomogenization(BaseHomogenization):
     def set_window_size(self, window_size: int):
         self.window_size = window_size
     
-    def set_radius(self, radius: int):
-        self.radius = radius
+    def set_radius_km(self, radius_km: float):
+        self.neighbor_radius_km = radius_km
+        self._neighbor_lists.clear()
         
     def set_threshold_factor(self, threshold_factor: int):
         self.threshold_factor = threshold_factor
 
     def find_valid_neighbors(self, data, i, j):
         """
-        Finds valid neighboring time series around a given grid cell (i, j) within a specified radius.
+        Finds the time series of the valid cells within neighbor_radius_km of grid cell (i, j).
 
         Parameters:
-        - data: 3D numpy array (lon × lat × time)
+        - data: DatasetDTO with (time × lat × lon) data
         - i, j: Target grid cell indices (longitude, latitude)
 
         Returns:
-        - List of valid neighboring time series (non-NA entries)
+        - (neighbours × time) array of valid neighbouring time series, nearest first
         """
-
-        # Define search window (handling grid edges)
-        lon_indices = range(max(0, i - self.radius), min(self.len_lon, i + self.radius + 1))
-        lat_indices = range(max(0, j - self.radius), min(self.len_lat, j + self.radius + 1))
-
-        neighbors = []
-        for ii in lon_indices:
-            for jj in lat_indices:
-                if not (ii == i and jj == j):  # Exclude the center cell
-                    neighbor_series = data[ii, jj, :]
-                    if np.any(~np.isnan(neighbor_series)):  # Check for non-NA values
-                        neighbors.append(neighbor_series)
-        return neighbors
-
-
-    
-
+        lists, columns = self.get_neighbor_lists(data)
+        indices, _ = lists.cell(j, i)
+        return columns[:, indices].T